@@ -50,6 +50,7 @@ setup(
         # httplib2 removed since Dependabot was generatting
         # "Known security vulnerabilities detected"
         # "httplib2==0.10.3",
+        "futures==3.1.1",
         "jsonschema==2.6.0",
         "python-keyczar==0.716",
         "requests==2.18.1",
@@ -0,0 +1,220 @@
+"""This module contains the routing table the auth service uses to
+decide which app services an authenticated request is forwarded to.
+A routing table is a JSON document like:
+
+    {
+        "upstreams": {
+            "orders": ["10.0.0.1:8080", "10.0.0.2:8080"],
+            "admin": ["/var/run/admin_app_service.sock"]
+        },
+        "routes": [
+            {"prefix": "/v1.0/orders/", "upstreams": "orders"},
+            {"prefix": "/v1.0/", "principals": ["ops@example.com"], "upstreams": "admin"}
+        ]
+    }
+
+A request is routed using the longest prefix of its path which has a
+route for the request's principal - a route without ```principals```
+applies to every principal. Requests which match no route are forwarded
+to ```async_app_service_forwarder.app_service```. Routes are compiled
+into a prefix trie so the cost of a lookup is proportional to the
+length of the path rather than the number of routes."""
+
+import json
+import logging
+import signal
+
+import jsonschema
+import tornado.ioloop
+
+from yar.util import metrics
+
+_logger = logging.getLogger("AUTHSERVICE.%s" % __name__)
+
+"""```routing_table``` is the ```RoutingTable``` consulted for
+each request or None if requests aren't routed."""
+routing_table = None
+
+"""```routing_table_schema``` is the JSON schema used to validate
+routing tables."""
+routing_table_schema = {
+    "$schema": "http://json-schema.org/draft-04/schema#",
+    "type": "object",
+    "properties": {
+        "upstreams": {
+            "type": "object",
+            "additionalProperties": {
+                "type": "array",
+                "items": {
+                    "type": "string",
+                    "minLength": 1,
+                },
+                "minItems": 1,
+            },
+        },
+        "routes": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "prefix": {
+                        "type": "string",
+                        "pattern": "^/",
+                    },
+                    "principals": {
+                        "type": "array",
+                        "items": {
+                            "type": "string",
+                            "minLength": 1,
+                        },
+                        "minItems": 1,
+                    },
+                    "upstreams": {
+                        "type": "string",
+                    },
+                },
+                "required": [
+                    "prefix",
+                    "upstreams",
+                ],
+                "additionalProperties": False,
+            },
+        },
+    },
+    "required": [
+        "upstreams",
+        "routes",
+    ],
+    "additionalProperties": False,
+}
+
+
+class _TrieNode(object):
+
+    __slots__ = (
+        "children",
+        "upstreams",
+        "upstreams_by_principal",
+    )
+
+    def __init__(self):
+        object.__init__(self)
+
+        self.children = {}
+        self.upstreams = None
+        self.upstreams_by_principal = None
+
+    def upstreams_for(self, principal):
+        if self.upstreams_by_principal is not None:
+            upstreams = self.upstreams_by_principal.get(principal, None)
+            if upstreams is not None:
+                return upstreams
+        return self.upstreams
+
+
+class RoutingTable(object):
+    """A routing table compiled from ```table``` - a dict in the form
+    described by ```routing_table_schema```. Raises ValueError if
+    ```table``` isn't a valid routing table."""
+
+    def __init__(self, table):
+        object.__init__(self)
+
+        try:
+            jsonschema.validate(table, routing_table_schema)
+        except jsonschema.ValidationError as ex:
+            raise ValueError("Invalid routing table - %s" % ex.message)
+
+        # each upstream group is a tuple so it can be shared by every
+        # route that uses it and used as a dict key by the forwarder
+        upstreams = {name: tuple(addresses) for (name, addresses) in table["upstreams"].iteritems()}
+
+        self.number_routes = 0
+        self._root = _TrieNode()
+
+        for route in table["routes"]:
+            prefix = route["prefix"]
+            if route["upstreams"] not in upstreams:
+                fmt = "Route for '%s' uses unknown upstreams '%s'"
+                raise ValueError(fmt % (prefix, route["upstreams"]))
+
+            node = self._root
+            for c in prefix:
+                node = node.children.setdefault(c, _TrieNode())
+
+            principals = route.get("principals", None)
+            if principals is None:
+                if node.upstreams is not None:
+                    raise ValueError("Duplicate route for '%s'" % prefix)
+                node.upstreams = upstreams[route["upstreams"]]
+            else:
+                if node.upstreams_by_principal is None:
+                    node.upstreams_by_principal = {}
+                for principal in principals:
+                    if principal in node.upstreams_by_principal:
+                        raise ValueError("Duplicate route for '%s' and '%s'" % (prefix, principal))
+                    node.upstreams_by_principal[principal] = upstreams[route["upstreams"]]
+
+            self.number_routes += 1
+
+    @classmethod
+    def load(cls, filename):
+        """Read and compile the routing table in ```filename```.
+        Raises ValueError if the file isn't a valid routing table."""
+        try:
+            with open(filename, "r") as f:
+                table = json.load(f)
+        except (IOError, ValueError) as ex:
+            raise ValueError("Error reading routing table '%s' - %s" % (filename, ex))
+        return cls(table)
+
+    def lookup(self, path, principal=None):
+        """Returns the addresses of the app services requests for
+        ```path``` from ```principal``` should be forwarded to or None
+        if no route matches."""
+        node = self._root
+        rv = node.upstreams_for(principal)
+        for c in path:
+            node = node.children.get(c, None)
+            if node is None:
+                break
+            upstreams = node.upstreams_for(principal)
+            if upstreams is not None:
+                rv = upstreams
+        return rv
+
+
+def load(filename):
+    """Replace ```routing_table``` with the routing table in
+    ```filename```. If the routing table can't be loaded an error
+    is logged, ```routing_table``` is left unchanged and False is
+    returned. Otherwise True is returned."""
+    global routing_table
+
+    try:
+        new_routing_table = RoutingTable.load(filename)
+    except ValueError as ex:
+        _logger.error("%s", ex)
+        metrics.increment("app_service_router.load_errors")
+        return False
+
+    routing_table = new_routing_table
+
+    _logger.info(
+        "Loaded routing table '%s' with %d routes",
+        filename,
+        routing_table.number_routes)
+    metrics.increment("app_service_router.loads")
+    metrics.gauge("app_service_router.routes", routing_table.number_routes)
+    return True
+
+
+def install_reload_handler(filename):
+    """Install a SIGHUP handler that reloads the routing table from
+    ```filename``` - this is how routes are changed without restarting
+    the auth service."""
+    def on_sighup(signal_number, frame):
+        io_loop = tornado.ioloop.IOLoop.instance()
+        io_loop.add_callback_from_signal(load, filename)
+
+    signal.signal(signal.SIGHUP, on_sighup)
@@ -0,0 +1,145 @@
+"""This module is a benchmark which measures the # of route lookups
+per second ```app_service_router.RoutingTable``` does for routing
+tables with thousands of routes. For comparison the same lookups are
+also done by a linear scan of the routes ordered from longest to
+shortest prefix - the obvious implementation whose cost grows with
+the number of routes rather than the length of the path. The time to
+compile each routing table is also reported since that's the cost of
+reloading routes. Run it using something like:
+
+    python -m yar.auth_service.app_service_router_benchmark --routes=1000,10000
+"""
+
+import optparse
+import random
+import time
+
+from yar.auth_service import app_service_router
+
+
+def _routing_table(number_routes):
+    """Returns a routing table (as a dict) with ```number_routes```
+    routes spread across 10 upstream groups. Every 10th route
+    is restricted to a single principal."""
+    table = {
+        "upstreams": {"group%d" % i: ["127.0.0.1:%d" % (8080 + i)] for i in range(10)},
+        "routes": [],
+    }
+    for i in range(number_routes):
+        route = {
+            "prefix": "/v1.0/service%d/resource%d/" % (i % 100, i),
+            "upstreams": "group%d" % (i % 10),
+        }
+        if i % 10 == 0:
+            route["principals"] = ["principal%d@example.com" % i]
+        table["routes"].append(route)
+    return table
+
+
+class _LinearScan(object):
+    """Looks up routes by scanning every route from
+    the longest prefix to the shortest prefix."""
+
+    def __init__(self, table):
+        object.__init__(self)
+        self._routes = []
+        for route in table["routes"]:
+            self._routes.append((
+                route["prefix"],
+                frozenset(route.get("principals", [])),
+                tuple(table["upstreams"][route["upstreams"]])))
+        self._routes.sort(key=lambda route: len(route[0]), reverse=True)
+
+    def lookup(self, path, principal=None):
+        for (prefix, principals, upstreams) in self._routes:
+            if path.startswith(prefix) and (not principals or principal in principals):
+                return upstreams
+        return None
+
+
+def _corpus(number_routes, corpus_size):
+    """Returns a list of (path, principal) tuples - most
+    match a route and some don't match any route."""
+    rv = []
+    for i in range(corpus_size):
+        route_number = random.randint(0, number_routes * 11 / 10)
+        path = "/v1.0/service%d/resource%d/%d" % (route_number % 100, route_number, i)
+        rv.append((path, "principal%d@example.com" % random.randint(0, number_routes)))
+    return rv
+
+
+def _lookups_per_second(routing_table, corpus, number_iterations):
+    start_time = time.time()
+    for i in xrange(number_iterations):
+        for (path, principal) in corpus:
+            routing_table.lookup(path, principal)
+    return number_iterations * len(corpus) / (time.time() - start_time)
+
+
+class _CommandLineParser(optparse.OptionParser):
+
+    def __init__(self):
+        optparse.OptionParser.__init__(self, "usage: %prog [options]")
+
+        default = "100,1000,5000,10000"
+        help = "comma separated # of routes - default = %s" % default
+        self.add_option(
+            "--routes",
+            action="store",
+            dest="number_routes",
+            default=default,
+            type="string",
+            help=help)
+
+        default = 1000
+        help = "# of paths looked up per pass - default = %d" % default
+        self.add_option(
+            "--paths",
+            action="store",
+            dest="corpus_size",
+            default=default,
+            type=int,
+            help=help)
+
+        default = 10
+        help = "# of passes over the paths - default = %d" % default
+        self.add_option(
+            "--iterations",
+            action="store",
+            dest="number_iterations",
+            default=default,
+            type=int,
+            help=help)
+
+
+if __name__ == "__main__":
+    clp = _CommandLineParser()
+    (clo, cla) = clp.parse_args()
+
+    print "%8s %12s %16s %16s %8s" % (
+        "routes",
+        "compile ms",
+        "scan lookups/sec",
+        "trie lookups/sec",
+        "speedup")
+
+    for number_routes in [int(n) for n in clo.number_routes.split(",")]:
+        table = _routing_table(number_routes)
+        corpus = _corpus(number_routes, clo.corpus_size)
+
+        start_time = time.time()
+        routing_table = app_service_router.RoutingTable(table)
+        compile_ms = (time.time() - start_time) * 1000
+
+        linear_scan = _LinearScan(table)
+        for (path, principal) in corpus:
+            assert linear_scan.lookup(path, principal) == routing_table.lookup(path, principal)
+
+        scan_lookups_per_second = _lookups_per_second(linear_scan, corpus, clo.number_iterations)
+        trie_lookups_per_second = _lookups_per_second(routing_table, corpus, clo.number_iterations)
+        print "%8d %12.1f %16.0f %16.0f %7.1fx" % (
+            number_routes,
+            compile_ms,
+            scan_lookups_per_second,
+            trie_lookups_per_second,
+            trie_lookups_per_second / scan_lookups_per_second)
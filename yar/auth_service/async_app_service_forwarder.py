@@ -2,18 +2,51 @@
 of requests to the app service."""
 
 import logging
+import time
 
-import tornado.httputil
+import tornado.gen
+import tornado.http1connection
 import tornado.httpclient
+import tornado.httputil
+import tornado.ioloop
+import tornado.iostream
 
-from yar.util.trhutil import get_request_body_if_exists
+import app_service_router
+import request_body
+from yar.util import deadline
+from yar.util import load_balancer
+from yar.util import metrics
+from yar.util import pooled_http_client
+from yar.util import trhutil
 
 _logger = logging.getLogger("AUTHSERVICE.%s" % __name__)
 
 """Once a request has been authenticated, the request is forwarded
-to the app service as defined by this host:port combination."""
+to one of the app services in this list of addresses - each either
+host:port or, when the app service is on the same host, the path of
+a unix domain socket. A single address is also accepted. If
+```app_service_router.routing_table``` isn't None, requests are only
+forwarded to ```app_service``` when they don't match a route."""
 app_service = None
 
+"""How requests are spread across ```app_service``` - one of
+```yar.util.load_balancer.POLICIES```."""
+app_service_balancing_policy = load_balancer.POLICY_P2C
+
+"""An app service is ejected for ```app_service_ejection_time```
+seconds after ```max_app_service_failures``` consecutive requests
+to it fail or, if ```app_service_slow_threshold``` isn't 0, its
+exponentially weighted latency exceeds ```app_service_slow_threshold```
+seconds. A request fails if there's no response or the response's
+status code is 5xx."""
+max_app_service_failures = 3
+app_service_ejection_time = 30
+app_service_slow_threshold = 0
+
+"""```_load_balancers``` maps a tuple of app service addresses
+to the ```load_balancer.LoadBalancer``` for those addresses."""
+_load_balancers = {}
+
 """Once the auth service has verified the sender's identity the request
 is forwarded to the app service. The forward to the app service does not
 contain the original request's HTTP Authorization header but instead
@@ -21,32 +54,129 @@ uses the authorization method described by ```app_service_auth_method```
 and the the credential's principal."""
 app_service_auth_method = "YAR"
 
+"""When ```stream_responses``` is True the app service's response
+headers and body chunks are passed back to the client as they arrive
+rather than the entire response being read into memory first."""
+stream_responses = False
+
+"""When streaming responses, the auth service stops reading the app
+service's response once more than ```max_buffer_size``` bytes have
+been written to, but not yet accepted by, the client. This is how
+backpressure from a slow client is applied to the app service."""
+max_buffer_size = 256 * 1024
+
+"""When streaming responses, the app service's response body is read
+```chunk_size``` bytes at a time."""
+chunk_size = 64 * 1024
+
+"""When streaming responses, # of seconds to wait for a connection
+to the app service (either from the connection pool or a new one)
+and then for the app service's response headers. If a request has a
+```yar.util.deadline.Deadline``` that's sooner, the deadline is used
+instead - the same goes for ```yar.util.pooled_http_client.request_timeout```
+when responses aren't streamed."""
+timeout = 20
+
+
+def _get_load_balancer(addresses):
+    addresses = tuple([addresses] if isinstance(addresses, basestring) else addresses)
+    rv = _load_balancers.get(addresses, None)
+    if rv is None:
+        rv = load_balancer.LoadBalancer(
+            "app_service",
+            addresses,
+            policy=app_service_balancing_policy,
+            max_failures=max_app_service_failures,
+            ejection_time=app_service_ejection_time,
+            slow_threshold=app_service_slow_threshold)
+        _load_balancers[addresses] = rv
+    return rv
+
+
+def _is_upstream_ok(http_status_code):
+    """Returns True if an app service which responded with
+    ```http_status_code``` should be considered healthy."""
+    return http_status_code is not None and http_status_code < 500
+
 
 class AsyncAppServiceForwarder(object):
 
-    def __init__(self, method, uri, headers, body, principal):
+    def __init__(self, method, uri, headers, body, principal, deadline=None):
+        """```body``` is either None, a string or a
+        ```request_body.RequestBody``` which is streamed to the
+        app service rather than being read into memory. If not None,
+        ```deadline``` is the request's ```yar.util.deadline.Deadline```
+        and it's passed along to the app service."""
         object.__init__(self)
         self._method = method
         self._uri = uri
         self._headers = headers
         self._body = body
         self._principal = principal
+        self._deadline = deadline
 
-    def forward(self, callback):
-
-        self._callback = callback
+    def _app_service(self):
+        """Returns the addresses of the app services this
+        request should be forwarded to."""
+        routing_table = app_service_router.routing_table
+        if routing_table is not None:
+            path = self._uri.split("?", 1)[0]
+            addresses = routing_table.lookup(path, self._principal)
+            if addresses is not None:
+                return addresses
+        return app_service
 
-        headers = tornado.httputil.HTTPHeaders(self._headers)
+    def _forward_headers(self):
+        """Returns the headers to send to the app service."""
+        headers = trhutil.remove_hop_by_hop_headers(self._headers)
         headers["Authorization"] = "%s %s" % (
             app_service_auth_method,
             self._principal)
+        # only the auth service gets to say what the deadline is
+        headers.pop(deadline.header_name, None)
+        if self._deadline is not None:
+            headers[deadline.header_name] = self._deadline.header_value()
+        if isinstance(self._body, request_body.RequestBody):
+            # the body's size is known so there's no need
+            # to chunk it on the way to the app service
+            headers["Content-Length"] = str(self._body.size)
+        return headers
+
+    def forward(self, callback):
+
+        self._callback = callback
+        if self._is_out_of_time():
+            self._deadline.exceeded("app_service")
+            self._callback(False)
+            return
+        self._load_balancer = _get_load_balancer(self._app_service())
+        self._tried_upstreams = []
+        self._forward()
+
+    def _forward(self):
+        self._upstream = self._load_balancer.acquire(exclude=self._tried_upstreams)
+        self._tried_upstreams.append(self._upstream)
+
+        headers = self._forward_headers()
+
+        body = self._body
+        body_producer = None
+        if isinstance(body, request_body.RequestBody):
+            body_producer = body.body_producer
+            body = None
+
+        request_timeout = None
+        if self._deadline is not None:
+            request_timeout = self._deadline.timeout(pooled_http_client.request_timeout)
 
         http_request = tornado.httpclient.HTTPRequest(
-            url="http://%s%s" % (app_service, self._uri),
+            url=pooled_http_client.url(self._upstream.address, self._uri),
             method=self._method,
-            body=self._body,
+            body=body,
+            body_producer=body_producer,
             headers=headers,
-            follow_redirects=False)
+            follow_redirects=False,
+            request_timeout=request_timeout)
 
         http_client = tornado.httpclient.AsyncHTTPClient()
         http_client.fetch(http_request, self._on_forward_done)
@@ -59,11 +189,208 @@ class AsyncAppServiceForwarder(object):
             response.request.method,
             int(response.request_time * 1000))
 
-        if response.error:
+        # 599 = no response from the app service
+        is_no_response = response.code == 599
+        self._load_balancer.release(
+            self._upstream,
+            not is_no_response and _is_upstream_ok(response.code),
+            response.request_time)
+
+        if is_no_response and self._is_out_of_time():
+            self._deadline.exceeded("app_service")
+            self._callback(False)
+            return
+
+        if is_no_response and self._is_retry_ok():
+            metrics.increment("app_service.retries")
+            self._forward()
+            return
+
+        # tornado flags every non-2xx response as an error but, like
+        # when responses are streamed, only not getting a response is
+        # a failure - 3xx, 4xx and 5xx responses are passed along
+        if is_no_response:
             self._callback(False)
             return
 
-        content_length = response.headers.get("Content-Length", -1)
-        body = response.body if 0 <= content_length else None
+        self._callback(True, response.code, response.headers, response.body or None)
+
+    def _timeout(self):
+        if self._deadline is None:
+            return timeout
+        return self._deadline.timeout(timeout)
+
+    def _is_out_of_time(self):
+        return self._deadline is not None and self._deadline.is_expired()
+
+    def _is_retry_ok(self):
+        """Returns True if, having not received a response, it's
+        ok to retry the request on another app service."""
+        if not pooled_http_client.is_idempotent(self._method):
+            return False
+        return len(self._tried_upstreams) < len(self._load_balancer.upstreams)
+
+    def stream(self, on_headers, on_chunk, callback):
+        """Forward the request to the app service and stream the
+        response back. ```on_headers``` is called with the response's
+        status code, reason and headers. ```on_chunk``` is then called
+        with each chunk of the response's body as it arrives and can
+        return a ```tornado.concurrent.Future``` to stop reading the
+        response until the future is done. Finally ```callback``` is
+        called with a single boolean argument indicating if the entire
+        response was streamed successfully."""
+        self._on_headers = on_headers
+        self._on_chunk = on_chunk
+        self._callback = callback
+        self._connection = None
+        self._is_cancelled = False
+        if self._is_out_of_time():
+            self._deadline.exceeded("app_service")
+            self._callback(False)
+            return
+        self._start_time = time.time()
+        self._load_balancer = _get_load_balancer(self._app_service())
+        self._tried_upstreams = []
+        self._stream().add_done_callback(self._on_stream_done)
+
+    def cancel(self):
+        """Stop streaming the response - typically because the
+        client has gone away."""
+        self._is_cancelled = True
+        if self._connection is not None:
+            self._connection.close()
+
+    @tornado.gen.coroutine
+    def _stream(self):
+        deadline = tornado.ioloop.IOLoop.current().time() + self._timeout()
+
+        while True:
+            upstream = self._load_balancer.acquire(exclude=self._tried_upstreams)
+            self._tried_upstreams.append(upstream)
+            self._http_status_code = None
+            self._headers_received_time = None
+            start_time = time.time()
+            try:
+                yield self._stream_from(upstream.address, deadline)
+            except Exception:
+                # a client going away says nothing about the app service's health
+                self._load_balancer.release(upstream, self._is_cancelled, time.time() - start_time)
+                # if the app service never responded and there's still
+                # time, idempotent requests can go to another app service
+                is_retry_ok = \
+                    self._http_status_code is None and \
+                    not self._is_cancelled and \
+                    tornado.ioloop.IOLoop.current().time() < deadline and \
+                    self._is_retry_ok()
+                if is_retry_ok:
+                    metrics.increment("app_service.retries")
+                    continue
+                raise
+
+            duration = (self._headers_received_time or time.time()) - start_time
+            self._load_balancer.release(upstream, _is_upstream_ok(self._http_status_code), duration)
+            return
+
+    @tornado.gen.coroutine
+    def _stream_from(self, address, deadline):
+        """Stream the response from the app service at ```address```."""
+        connection_pool = pooled_http_client.get_connection_pool(address)
+
+        headers = self._forward_headers()
+        if isinstance(self._body, basestring):
+            headers["Content-Length"] = str(len(self._body))
+        start_line = tornado.httputil.RequestStartLine(self._method, self._uri, "HTTP/1.1")
+
+        body = self._body
+        body_producer = None
+        if isinstance(body, request_body.RequestBody):
+            body_producer = body.body_producer
+            body = None
+
+        while True:
+            # a header timeout of 0 means no timeout at all
+            remaining = deadline - tornado.ioloop.IOLoop.current().time()
+            if remaining <= 0:
+                raise tornado.gen.TimeoutError("Timeout")
+            params = tornado.http1connection.HTTP1ConnectionParameters(
+                chunk_size=chunk_size,
+                header_timeout=remaining)
+            (stream, is_reused) = yield connection_pool.acquire(remaining, deadline)
+            if self._is_cancelled:
+                connection_pool.release(stream, True)
+                raise tornado.iostream.StreamClosedError()
+
+            self._connection = tornado.http1connection.HTTP1Connection(stream, True, params)
+            delegate = pooled_http_client.ResponseDelegate(_ResponseDelegate(self))
+            try:
+                is_reusable = yield pooled_http_client.exchange(
+                    self._connection,
+                    start_line,
+                    headers,
+                    body,
+                    body_producer,
+                    delegate)
+            except tornado.iostream.StreamClosedError:
+                connection_pool.release(stream, False)
+                # a kept alive connection can be closed by the app service
+                # just as it's reused - if that's what happened it's safe
+                # to try again for idempotent requests
+                is_retry_ok = \
+                    is_reused and \
+                    not self._is_cancelled and \
+                    delegate.start_line is None and \
+                    pooled_http_client.is_idempotent(self._method)
+                if is_retry_ok:
+                    continue
+                raise
+            except Exception:
+                self._connection.close()
+                connection_pool.release(stream, False)
+                raise
+
+            self._connection = None
+            connection_pool.release(stream, is_reusable)
+            return
+
+    def _on_stream_headers(self, http_status_code, reason, headers):
+        self._http_status_code = http_status_code
+        self._headers_received_time = time.time()
+        _logger.info(
+            "App Service (%s - %s) responded in %d ms",
+            self._uri,
+            self._method,
+            int((time.time() - self._start_time) * 1000))
+        self._on_headers(http_status_code, reason, headers)
+
+    def _on_stream_done(self, future):
+        try:
+            future.result()
+            is_ok = True
+        except Exception as ex:
+            _logger.info(
+                "Error streaming response from App Service (%s - %s) - %s",
+                self._uri,
+                self._method,
+                ex)
+            is_ok = False
+            if self._http_status_code is None and not self._is_cancelled and self._is_out_of_time():
+                self._deadline.exceeded("app_service")
+
+        self.cancel()
+        self._callback(is_ok)
+
+
+class _ResponseDelegate(tornado.httputil.HTTPMessageDelegate):
+    """Passes the app service's response headers and body
+    chunks from ```tornado.http1connection.HTTP1Connection```
+    to an ```AsyncAppServiceForwarder```."""
+
+    def __init__(self, forwarder):
+        tornado.httputil.HTTPMessageDelegate.__init__(self)
+        self._forwarder = forwarder
+
+    def headers_received(self, start_line, headers):
+        self._forwarder._on_stream_headers(start_line.code, start_line.reason, headers)
 
-        self._callback(True, response.code, response.headers, body)
+    def data_received(self, chunk):
+        return self._forwarder._on_chunk(chunk)
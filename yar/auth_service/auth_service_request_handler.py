@@ -1,14 +1,22 @@
 """This module contains the core logic for the auth service."""
 
+import functools
 import httplib
 import logging
 import re
+import time
 
+import tornado.concurrent
+import tornado.ioloop
 import tornado.web
 
 import mac.async_mac_auth
 import basic.async_auth
 import async_app_service_forwarder
+import request_body
+import worker_pool
+from yar.util import deadline
+from yar.util import metrics
 from yar.util import strutil
 from yar.util import trhutil
 
@@ -38,9 +46,11 @@ AUTH_FAILURE_DETAIL_FOR_TESTING = 0x0000 + 0x00ff
 """When the auth service first recieves a request it extracts the
 authentication scheme from the value associated with the request's
 HTTP authorization header. ```_auth_scheme_reg_ex``` is the regular
-expression used to parse and extract the authentication scheme."""
+expression used to parse and extract the authentication scheme. Only
+the scheme and the whitespace which follows it are matched - the rest
+of the header is parsed by the authentication scheme's implementation."""
 _auth_scheme_reg_ex = re.compile(
-    "^\s*(?P<auth_scheme>(MAC|BASIC))\s+.*",
+    r"^\s*(?P<auth_scheme>(MAC|BASIC))\s",
     re.IGNORECASE)
 
 """The auth service supports a number of authentication mechanisms.
@@ -51,19 +61,175 @@ _auth_scheme_to_auth_class = {
     "BASIC": basic.async_auth.Authenticator,
 }
 
+"""Each request is given a ```yar.util.deadline.Deadline``` which
+is ```deadline_budget``` seconds after the request arrives. Requests
+which aren't answered by their deadline get a 504 (gateway timeout)
+response. The time spent receiving the request's body depends on the
+client rather than the auth service or its upstreams so it doesn't
+count against the budget. A ```deadline_budget``` of 0 means requests
+have no deadline."""
+deadline_budget = 30
+
+"""If not None, ```auth_concurrency_limiter``` is a
+```yar.util.concurrency_limiter.ConcurrencyLimiter``` which limits the
+# of requests being authenticated and ```app_service_concurrency_limiter```
+is one which limits the # of requests being forwarded to app services.
+Requests shed by either get a 503 (service unavailable) response with
+a Retry-After header of ```retry_after``` seconds. This is how the auth
+service stays responsive, rather than queuing work until everything
+times out, when it's overloaded."""
+auth_concurrency_limiter = None
+app_service_concurrency_limiter = None
+retry_after = 1
+
 """The auth service's mainline should use this URL spec
 to describe the URLs that ```RequestHandler``` can
 correctly service."""
 url_spec = r".*"
 
 
+@tornado.web.stream_request_body
 class RequestHandler(trhutil.RequestHandler):
+    """Request bodies are accepted incrementally - see ```prepare()```
+    and ```data_received()``` - so the auth service never needs to
+    hold an entire request body in memory. Authentication starts in
+    ```prepare()```, before any of the body has been received, and
+    everything that doesn't need the body is checked before tornado
+    starts reading the body. This is what allows the auth service to
+    reject a request that includes an "Expect: 100-continue" header
+    without the client ever sending the request's body. The request
+    methods below are called once the entire body has been received."""
 
     #
     # :TODO: what happens to "custom" HTTP methods outside of the
     # 7 method listed below?
     #
 
+    # ```prepare()``` isn't called when a request is rejected
+    # before its headers have been fully processed
+    _request_body = None
+
+    # only set while a response is being streamed from the app service
+    _app_service_forwarder = None
+
+    _deadline = None
+
+    # only set while the request's body is being received
+    _request_body_start_time = None
+
+    # only set while the request is counted by a concurrency limiter
+    _auth_start_time = None
+    _app_service_start_time = None
+    _app_service_headers_time = None
+
+    def prepare(self):
+        """Called once the request's headers have been received
+        and before any of the request's body. Returns a future which
+        is done once authentication either fails or needs the request's
+        body. tornado doesn't read the body, or send "100 Continue",
+        until the future is done."""
+        self._request_body = request_body.RequestBody(
+            self.request,
+            self._on_waiting_for_request_body)
+
+        if self._request_body.is_too_large(self._request_body.expected_size):
+            self._on_request_body_too_large()
+            return None
+
+        # the deadline covers authentication and forwarding to the
+        # app service but not receiving the request's body
+        if 0 < deadline_budget:
+            self._deadline = deadline.Deadline(deadline_budget)
+
+        self._is_auth_ok = False
+        self._is_forwarded = False
+        self._ready_for_request_body = tornado.concurrent.Future()
+        if auth_concurrency_limiter is None:
+            self._authenticate()
+        else:
+            auth_concurrency_limiter.acquire(self._on_auth_admitted)
+        return self._ready_for_request_body
+
+    def _on_waiting_for_request_body(self):
+        """Called when authentication has done everything it can
+        without the request's body. The request stops counting against
+        ```auth_concurrency_limiter``` now, rather than when authentication
+        completes, so a slow upload doesn't hold on to the limit."""
+        self._release_auth_concurrency()
+        self._on_ready_for_request_body()
+
+    def _on_ready_for_request_body(self):
+        """tornado only starts reading the request's body once
+        ```_ready_for_request_body``` is done."""
+        if not self._ready_for_request_body.done():
+            self._request_body_start_time = time.time()
+            self._ready_for_request_body.set_result(None)
+
+    def data_received(self, chunk):
+        """Called as each chunk of the request's body is received.
+        Large bodies are hashed and spooled on ```worker_pool```'s
+        threads. When that happens a future is returned and tornado
+        doesn't deliver the next chunk until the future is done which
+        keeps a body's chunks in order."""
+        if self._finished:
+            return None
+
+        if not self._request_body.is_offloaded(chunk):
+            if not self._request_body.append(chunk):
+                self._on_request_body_rejected()
+            return None
+
+        future = worker_pool.submit(self._request_body.append, chunk)
+        tornado.ioloop.IOLoop.current().add_future(future, self._on_offloaded_append_done)
+        return future
+
+    def _on_offloaded_append_done(self, future):
+        if self._finished:
+            return
+        if future.exception() is not None:
+            # tornado also sees the exception and drops the connection
+            _logger.error(
+                "Error accepting request body for '%s' - %s",
+                self.request.full_url(),
+                future.exception())
+            return
+        if not future.result():
+            self._on_request_body_rejected()
+
+    def _on_request_body_rejected(self):
+        """Called when ```request_body``` refuses a chunk of the request's
+        body. A body which would take the request bodies spilled to disk
+        over their budget is rejected like a request shed by a concurrency
+        limiter - the request is fine, the auth service is just too busy."""
+        if not self._request_body.is_spill_budget_exceeded:
+            self._on_request_body_too_large()
+            return
+        _logger.info(
+            "No room to spill request body for '%s' to disk",
+            self.request.full_url())
+        self._finish_shed()
+
+    def _on_request_body_too_large(self):
+        _logger.info(
+            "Request body for '%s' larger than %d bytes",
+            self.request.full_url(),
+            request_body.max_size)
+        self.set_status(httplib.REQUEST_ENTITY_TOO_LARGE)
+        self.finish()
+
+    def _close_request_body(self):
+        if self._request_body is not None:
+            self._request_body.close()
+
+    def on_finish(self):
+        self._close_request_body()
+
+    def on_connection_close(self):
+        trhutil.RequestHandler.on_connection_close(self)
+        self._close_request_body()
+        if self._app_service_forwarder is not None:
+            self._app_service_forwarder.cancel()
+
     @tornado.web.asynchronous
     def get(self):
         self._handle_request()
@@ -93,6 +259,42 @@ class RequestHandler(trhutil.RequestHandler):
         self._handle_request()
 
     def _handle_request(self):
+        """Called once the entire request body has been received."""
+        if self._deadline is not None and self._request_body_start_time is not None:
+            self._deadline.postpone(time.time() - self._request_body_start_time)
+            self._request_body_start_time = None
+        self._request_body.complete()
+        self._forward_if_ready()
+
+    def _on_auth_admitted(self, is_admitted):
+        """Called by ```auth_concurrency_limiter``` once the request
+        has either been admitted or shed."""
+        if self._finished:
+            if is_admitted:
+                auth_concurrency_limiter.release(True)
+            return
+
+        if not is_admitted:
+            self._finish_shed()
+            return
+
+        self._auth_start_time = time.time()
+        self._authenticate()
+
+    def _release_auth_concurrency(self):
+        if self._auth_start_time is None:
+            return
+        duration = time.time() - self._auth_start_time
+        self._auth_start_time = None
+        auth_concurrency_limiter.release(not self._is_deadline_exceeded(), duration)
+
+    def _finish_shed(self):
+        self.set_status(httplib.SERVICE_UNAVAILABLE)
+        self.set_header("Retry-After", str(retry_after))
+        self.finish()
+        self._on_ready_for_request_body()
+
+    def _authenticate(self):
         auth_hdr_val = self.request.headers.get("Authorization", None)
         if auth_hdr_val is None:
             self._on_auth_done(
@@ -113,7 +315,7 @@ class RequestHandler(trhutil.RequestHandler):
         # weeds out unsupported authentication types
         assert auth_class is not None
 
-        aha = auth_class(self.request)
+        aha = auth_class(self.request, self._request_body, self._deadline)
         aha.authenticate(self._on_auth_done)
 
     def _on_auth_done(self,
@@ -122,11 +324,25 @@ class RequestHandler(trhutil.RequestHandler):
                       auth_failure_debug_details=None,
                       principal=None):
 
+        self._release_auth_concurrency()
+
+        # authentication can finish after the request has already
+        # been rejected for some other reason - request body too large
+        if self._finished:
+            return
+
         # :TODO: how to differentiate between an authentication failure
         # and a failure with the authentication infrastructure
 
         if not is_auth_ok:
 
+            if self._is_deadline_exceeded():
+                self._finish_deadline_exceeded()
+                self._on_ready_for_request_body()
+                return
+
+            metrics.increment("auth_failure.0x{:04x}".format(auth_failure_detail or 0))
+
             self.set_status(httplib.UNAUTHORIZED)
 
             if _include_auth_failure_debug_details():
@@ -136,26 +352,112 @@ class RequestHandler(trhutil.RequestHandler):
                         auth_failure_detail_header_name,
                         "0x{:04x}".format(auth_failure_detail))
 
-                if auth_failure_debug_details:
-                    for (name, value) in auth_failure_debug_details.items():
-                        name = "%s%s" % (debug_header_prefix, name)
-                        value = strutil.make_http_header_value_friendly(value)
-                        self.set_header(name, value)
+                # authenticators can supply debug details as either a
+                # dict or, when generating the details is expensive, a
+                # function which async'ly generates the dict so the cost
+                # is only paid when the details are going to be used
+                if callable(auth_failure_debug_details):
+                    auth_failure_debug_details(self._on_auth_failure_debug_details_done)
+                    return
 
-            self.finish()
+                self._set_auth_failure_debug_details_headers(auth_failure_debug_details)
+
+            self._finish_auth_failure()
 
             return
 
         # the request has been successfully authenticated:-)
         # all that's left now is to asyc'y forward the request
-        # to the app service
+        # to the app service once the entire body has been received
+        self._is_auth_ok = True
+        self._principal = principal
+        self._on_ready_for_request_body()
+        self._forward_if_ready()
+
+    def _on_auth_failure_debug_details_done(self, auth_failure_debug_details):
+        if self._finished:
+            return
+
+        self._set_auth_failure_debug_details_headers(auth_failure_debug_details)
+        self._finish_auth_failure()
+
+    def _set_auth_failure_debug_details_headers(self, auth_failure_debug_details):
+        if auth_failure_debug_details:
+            for (name, value) in auth_failure_debug_details.items():
+                name = "%s%s" % (debug_header_prefix, name)
+                value = strutil.make_http_header_value_friendly(value)
+                self.set_header(name, value)
+
+    def _finish_auth_failure(self):
+        self.finish()
+        self._on_ready_for_request_body()
+
+    def _is_deadline_exceeded(self):
+        return self._deadline is not None and self._deadline.exceeded_stage is not None
+
+    def _finish_deadline_exceeded(self):
+        self.clear()
+        self.set_status(httplib.GATEWAY_TIMEOUT)
+        self.finish()
+
+    def _forward_if_ready(self):
+        if not self._is_auth_ok or not self._request_body.is_complete:
+            return
+        if self._is_forwarded:
+            return
+        self._is_forwarded = True
+
+        if app_service_concurrency_limiter is None:
+            self._forward()
+        else:
+            app_service_concurrency_limiter.acquire(self._on_app_service_admitted)
+
+    def _on_app_service_admitted(self, is_admitted):
+        """Called by ```app_service_concurrency_limiter``` once the
+        request has either been admitted or shed."""
+        if self._finished:
+            if is_admitted:
+                app_service_concurrency_limiter.release(True)
+            return
+
+        if not is_admitted:
+            self._finish_shed()
+            return
+
+        self._app_service_start_time = time.time()
+        self._forward()
+
+    def _release_app_service_concurrency(self):
+        """When streaming, the app service's latency is the time to
+        its response's headers - the time to stream the body depends
+        as much on the client as the app service."""
+        if self._app_service_start_time is None:
+            return
+        end_time = self._app_service_headers_time or time.time()
+        duration = end_time - self._app_service_start_time
+        self._app_service_start_time = None
+        app_service_concurrency_limiter.release(not self._is_deadline_exceeded(), duration)
+
+    def _forward(self):
         aasf = async_app_service_forwarder.AsyncAppServiceForwarder(
             self.request.method,
             self.request.uri,
             self.request.headers,
-            self.get_request_body_if_exists(),
-            principal)
-        aasf.forward(self._on_app_service_done)
+            self._request_body if self._request_body.is_present else None,
+            self._principal,
+            self._deadline)
+        if async_app_service_forwarder.stream_responses:
+            self._app_service_forwarder = aasf
+            self._response_buffer_size = 0
+            self._peak_response_buffer_size = 0
+            self._response_size = 0
+            self._last_flush_future = None
+            aasf.stream(
+                self._on_app_service_headers,
+                self._on_app_service_chunk,
+                self._on_app_service_streamed)
+        else:
+            aasf.forward(self._on_app_service_done)
 
     def _on_app_service_done(self,
                              is_ok,
@@ -163,13 +465,96 @@ class RequestHandler(trhutil.RequestHandler):
                              headers=None,
                              body=None):
 
+        self._release_app_service_concurrency()
+
         if is_ok:
             self.set_status(http_status_code)
+            headers = trhutil.remove_hop_by_hop_headers(headers)
             for (name, value) in headers.items():
                 self.set_header(name, value)
             if body is not None:
                 self.write(body)
         else:
+            if self._is_deadline_exceeded():
+                self._finish_deadline_exceeded()
+                return
+            self.set_status(httplib.INTERNAL_SERVER_ERROR)
+
+        self.finish()
+
+    def _on_app_service_headers(self, http_status_code, reason, headers):
+        """Called when streaming the app service's response
+        and the response's headers have been received."""
+        self._app_service_headers_time = time.time()
+        self.set_status(http_status_code, reason)
+        headers = trhutil.remove_hop_by_hop_headers(headers)
+        for name in headers:
+            values = headers.get_list(name)
+            self.set_header(name, values[0])
+            for value in values[1:]:
+                self.add_header(name, value)
+
+    def _on_app_service_chunk(self, chunk):
+        """Called when streaming the app service's response and
+        a chunk of the response's body has been received. The chunk
+        is passed along to the client. If the client isn't accepting
+        the response quickly enough a future is returned which stops
+        the app service's response being read until the client
+        catches up."""
+        self.write(chunk)
+        self._response_size += len(chunk)
+        self._response_buffer_size += len(chunk)
+        self._peak_response_buffer_size = max(
+            self._peak_response_buffer_size,
+            self._response_buffer_size)
+
+        # :TRICKY: only the most recent flush's future is
+        # guaranteed to be done - see tornado.web.RequestHandler.flush()
+        future = self._last_flush_future = self.flush()
+        future.add_done_callback(functools.partial(self._on_flushed, future))
+
+        if self._response_buffer_size < async_app_service_forwarder.max_buffer_size:
+            return None
+        return future
+
+    def _on_flushed(self, future, ignore_this_future):
+        # retrieving the exception stops tornado logging it as unhandled
+        future.exception()
+        if future is self._last_flush_future:
+            self._response_buffer_size = 0
+
+    def _on_app_service_streamed(self, is_ok):
+        """Called when streaming the app service's response is done."""
+        self._app_service_forwarder = None
+        self._release_app_service_concurrency()
+
+        _logger.info(
+            "Streamed %d bytes from app service for '%s' with peak buffer of %d bytes",
+            self._response_size,
+            self.request.full_url(),
+            self._peak_response_buffer_size)
+        metrics.gauge(
+            "app_service_response.peak_buffer_bytes",
+            self._peak_response_buffer_size)
+        metrics.gauge(
+            "app_service_response.max_peak_buffer_bytes",
+            max(
+                metrics.get_gauge("app_service_response.max_peak_buffer_bytes", 0),
+                self._peak_response_buffer_size))
+
+        if self._finished:
+            return
+
+        if not is_ok:
+            if self._headers_written:
+                # too late to tell the client something went wrong
+                # so all that can be done is truncate the response
+                self.request.connection.close()
+                return
+            if self._is_deadline_exceeded():
+                self._finish_deadline_exceeded()
+                return
+            self.clear()
             self.set_status(httplib.INTERNAL_SERVER_ERROR)
 
         self.finish()
@@ -5,6 +5,8 @@ import base64
 import logging
 import re
 
+from yar.util import basic
+
 from async_creds_retriever import AsyncCredsRetriever
 
 _logger = logging.getLogger("AUTHSERVICE.%s" % __name__)
@@ -16,11 +18,12 @@ AUTH_FAILURE_DETAIL_INVALID_AUTH_HEADER_BAD_ENCODING = 0x0200 + 0x0003
 AUTH_FAILURE_DETAIL_INVALID_AUTH_HEADER_FORMAT_POST_DECODING = 0x0200 + 0x0004
 AUTH_FAILURE_DETAIL_ERROR_GETTING_CREDS = 0x0200 + 0x0004
 AUTH_FAILURE_DETAIL_CREDS_NOT_FOUND = 0x0200 + 0x0005
+AUTH_FAILURE_DETAIL_INVALID_API_KEY = 0x0200 + 0x0006
 
 """```_auth_hdr_val_reg_ex``` is used to parse the value of
 the Authorization HTTP header."""
 _auth_hdr_val_reg_ex = re.compile(
-    "^\s*BASIC\s+(?P<api_key_colon>[^\s]+)\s*$",
+    r"^\s*BASIC\s+(?P<api_key_colon>[^\s]+)\s*$",
     re.IGNORECASE)
 
 """Once the authorization header's value is base64 decoded,
@@ -39,9 +42,14 @@ class Authenticator(object):
     (ii) asking the key store for credentials matching values
     extracted from the authorization header"""
 
-    def __init__(self, request):
+    def __init__(self, request, request_body=None, deadline=None):
+        """```request_body``` is accepted so all authenticators can be
+        created the same way - the basic authentication scheme doesn't
+        cover the request's body. If not None, ```deadline``` is the
+        request's ```yar.util.deadline.Deadline```."""
         object.__init__(self)
         self._request = request
+        self._deadline = deadline
 
     def authenticate(self, on_auth_done):
         self._on_auth_done = on_auth_done
@@ -77,7 +85,13 @@ class Authenticator(object):
 
         self._api_key = match.group("api_key")
 
-        acr = AsyncCredsRetriever(self._api_key)
+        # credentials only exist for api keys generated by the key
+        # service so anything else is rejected before doing any I/O
+        if not basic.APIKey.is_well_formed(self._api_key):
+            self._on_auth_done(False, AUTH_FAILURE_DETAIL_INVALID_API_KEY)
+            return
+
+        acr = AsyncCredsRetriever(self._api_key, self._deadline)
         acr.fetch(self._on_creds_fetch_done)
 
     def _on_creds_fetch_done(self, is_ok, principal=None):
@@ -2,19 +2,32 @@
 with the key service to retrieve credentials for the basic
 authentication scheme."""
 
+import functools
 import httplib
 import logging
 
-import tornado.httpclient
-
+from yar.auth_service import key_service_client
+from yar.auth_service import single_flight
 from yar.key_service import jsonschemas
 from yar.util import mac
+from yar.util import metrics
 from yar.util import trhutil
 
 _logger = logging.getLogger("AUTHSERVICE.%s" % __name__)
 
-"""This host:port combination define the location of the key service."""
-key_service = "127.0.0.1:8070"
+"""This address - either host:port or the path of a unix domain
+socket - defines the location of the key service. A list of addresses
+is also accepted - see ```yar.auth_service.key_service_client```."""
+key_service_address = "127.0.0.1:8070"
+
+"""If not None, ```creds_cache``` is a ```yar.auth_service.creds_cache.CredsCache```
+used to avoid a round trip to the key service for recently
+retrieved credentials."""
+creds_cache = None
+
+"""```_single_flight``` coalesces concurrent requests to the key service
+for the same credentials."""
+_single_flight = single_flight.SingleFlight("basic_creds_retriever")
 
 
 class AsyncCredsRetriever(object):
@@ -22,25 +35,68 @@ class AsyncCredsRetriever(object):
     the key service to retrieve credentials for use with basic
     authentication scheme."""
 
-    def __init__(self, api_key):
+    def __init__(self, api_key, deadline=None):
+        """If not None, ```deadline``` is the request's
+        ```yar.util.deadline.Deadline```."""
         object.__init__(self)
         self._api_key = api_key
+        self._deadline = deadline
 
     def fetch(self, callback):
         """Retrieve the credentials for ```self._api_key```
-        and when done call ```callback```."""
+        and when done call ```callback```. If the credentials
+        haven't been retrieved by the deadline ```callback``` is
+        called as though the retrieval failed."""
+
+        if creds_cache is not None:
+            cached_callback_args = creds_cache.get(self._api_key)
+            if cached_callback_args is not None:
+                callback(*cached_callback_args)
+                return
+
+        # the deadline is applied to each caller's callback because
+        # callers sharing a single flight can have different deadlines
+        self._caller_callback = callback
+        if self._deadline is not None:
+            self._caller_callback = self._deadline.guard("creds_retrieval", callback, False)
+
+        # if a request for the same credentials is already in flight
+        # just wait for its answer rather than asking the key service again
+        if not _single_flight.join(self._api_key, self._on_shared_fetch_done, self._deadline):
+            return
 
-        self._callback = callback
+        self._callback = functools.partial(_single_flight.done, self._api_key)
 
-        url = "http://%s/v1.0/creds/%s" % (
+        self._fetch()
+
+    def _fetch(self):
+        # the request to the key service is shared by every caller in
+        # the single flight so it's sent with the latest of their deadlines
+        self._fetch_deadline = _single_flight.deadline(self._api_key)
+        self._fetch_expires_at = None
+        if self._fetch_deadline is not None:
+            self._fetch_expires_at = self._fetch_deadline.expires_at
+        key_service_client.fetch(
             key_service_address,
-            self._api_key)
-        http_request = tornado.httpclient.HTTPRequest(
-            url=url,
-            method="GET",
-            follow_redirects=False)
-        http_client = tornado.httpclient.AsyncHTTPClient()
-        http_client.fetch(http_request, self._on_fetch_done)
+            "/v1.0/creds/%s" % self._api_key,
+            self._on_fetch_done,
+            self._fetch_deadline)
+
+    def _is_refetch_ok(self):
+        """Returns True if, having run out of time, the request to the
+        key service should be sent again because callers with later
+        deadlines have joined the single flight since it was sent."""
+        if self._fetch_deadline is None or self._fetch_deadline.is_expired():
+            return False
+        return self._fetch_expires_at < self._fetch_deadline.expires_at
+
+    def _on_shared_fetch_done(self, is_timeout, callback_args):
+        """Called for each caller in the single flight when the shared
+        request to the key service completes. If the key service didn't
+        answer in time the caller's deadline is marked as exceeded."""
+        if is_timeout and self._deadline is not None:
+            self._deadline.exceeded("creds_retrieval")
+        self._caller_callback(*callback_args)
 
     def _on_fetch_done(self, response):
         """Called when request to the key service returns."""
@@ -50,16 +106,22 @@ class AsyncCredsRetriever(object):
             response.request.method,
             int(response.request_time * 1000))
 
-        expected_response_codes = [
-            httplib.OK,
-            httplib.NOT_FOUND,
-        ]
-        if response.error or response.code not in expected_response_codes:
-            self._callback(False)
+        # tornado sets a 404 response's error so check for
+        # NOT_FOUND before checking for errors
+        if response.code == httplib.NOT_FOUND:
+            callback_args = (True, None)
+            if creds_cache is not None:
+                creds_cache.put_not_found(self._api_key, callback_args)
+            self._callback(False, callback_args)
             return
 
-        if response.code == httplib.NOT_FOUND:
-            self._callback(True, None)
+        if response.error or response.code != httplib.OK:
+            is_timeout = key_service_client.is_timeout(response)
+            if is_timeout and self._is_refetch_ok():
+                metrics.increment("%s.refetches" % _single_flight.name)
+                self._fetch()
+                return
+            self._callback(is_timeout, (False,))
             return
 
         body = trhutil.get_json_body_from_response(
@@ -67,11 +129,14 @@ class AsyncCredsRetriever(object):
             None,
             jsonschemas.get_creds_response)
         if body is None:
-            self._callback(False)
+            self._callback(False, (False,))
             return
 
         _logger.info(
             "Successfully retrieved basic auth credentials for api key '%s'",
             self._api_key)
 
-        self._callback(True, body["principal"])
+        callback_args = (True, body["principal"])
+        if creds_cache is not None:
+            creds_cache.put(self._api_key, callback_args)
+        self._callback(False, callback_args)
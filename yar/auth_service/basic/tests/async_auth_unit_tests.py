@@ -168,6 +168,39 @@ class TestAsyncAuth(yar_test_util.TestCase):
         aha = async_auth.Authenticator(request)
         aha.authenticate(on_auth_done)
 
+    def test_malformed_api_key(self):
+        """When a request contains an api key that can't possibly have
+        been generated by the key service, confirm that
+        ```async_auth.Authenticator``` tags this as an authorization
+        failure with ```async_auth.AUTH_FAILURE_DETAIL_INVALID_API_KEY```
+        without ever asking the key service for credentials."""
+
+        on_auth_done = mock.Mock()
+
+        name_of_method_to_patch = (
+            "yar.auth_service.basic.async_creds_retriever."
+            "AsyncCredsRetriever.fetch"
+        )
+        with mock.patch(name_of_method_to_patch) as fetch_patch:
+            for the_api_key in ["dave", basic.APIKey.generate().upper(), basic.APIKey.generate() + "0"]:
+                on_auth_done.reset_mock()
+
+                api_key_colon = "%s:" % the_api_key
+                auth_hdr_value = "BASIC %s" % base64.b64encode(api_key_colon)
+                request = mock.Mock()
+                request.headers = tornado.httputil.HTTPHeaders({
+                    "Authorization": auth_hdr_value,
+                })
+
+                aha = async_auth.Authenticator(request)
+                aha.authenticate(on_auth_done)
+
+                on_auth_done.assert_called_once_with(
+                    False,
+                    async_auth.AUTH_FAILURE_DETAIL_INVALID_API_KEY)
+
+            self.assertFalse(fetch_patch.called)
+
     def test_error_getting_creds(self):
         the_api_key = basic.APIKey.generate()
         the_principal = str(uuid.uuid4()).replace("-", "")
@@ -12,6 +12,7 @@ import tornado.httpclient
 import tornado.httputil
 
 from yar.util import basic
+from yar.auth_service import creds_cache
 from yar.auth_service.basic import async_creds_retriever
 from yar import key_service
 from yar.key_service import jsonschemas
@@ -122,6 +123,68 @@ class TestAsyncCredsRetriever(yar_test_util.TestCase):
             acr = async_creds_retriever.AsyncCredsRetriever(the_api_key)
             acr.fetch(on_async_creds_retriever_done)
 
+    def test_creds_not_found_is_cached(self):
+        """Confirm that when ```async_creds_retriever.creds_cache```
+        is configured a NOT_FOUND response from the key service is
+        cached and subsequent fetches don't ask the key service."""
+        the_api_key = basic.APIKey.generate()
+
+        self._number_key_service_requests = 0
+
+        def async_http_client_fetch_patch(http_client, request, callback):
+            self.assertKeyServerRequestOk(request, the_api_key)
+            self._number_key_service_requests += 1
+
+            # a real response since tornado sets a 404 response's error
+            response = tornado.httpclient.HTTPResponse(request, httplib.NOT_FOUND, request_time=24)
+            self.assertIsNotNone(response.error)
+            callback(response)
+
+        def on_async_creds_retriever_done(is_ok, principal=None):
+            self.assertTrue(is_ok)
+            self.assertIsNone(principal)
+
+        the_creds_cache = creds_cache.CredsCache("cc")
+        name_of_method_to_patch = "tornado.httpclient.AsyncHTTPClient.fetch"
+        with mock.patch(name_of_method_to_patch, async_http_client_fetch_patch):
+            with mock.patch.object(async_creds_retriever, "creds_cache", the_creds_cache):
+                for i in range(3):
+                    acr = async_creds_retriever.AsyncCredsRetriever(the_api_key)
+                    acr.fetch(on_async_creds_retriever_done)
+
+        self.assertEqual(self._number_key_service_requests, 1)
+
+    def test_concurrent_fetches_are_collapsed(self):
+        """Confirm that concurrent fetches for the same api key result
+        in a single request to the key service and that all callers
+        are told about the result."""
+        the_api_key = basic.APIKey.generate()
+
+        in_flight_callbacks = []
+
+        def async_http_client_fetch_patch(http_client, request, callback):
+            self.assertKeyServerRequestOk(request, the_api_key)
+            in_flight_callbacks.append((request, callback))
+
+        answers = []
+
+        def on_async_creds_retriever_done(is_ok, principal=None):
+            answers.append((is_ok, principal))
+
+        name_of_method_to_patch = "tornado.httpclient.AsyncHTTPClient.fetch"
+        with mock.patch(name_of_method_to_patch, async_http_client_fetch_patch):
+            for i in range(5):
+                acr = async_creds_retriever.AsyncCredsRetriever(the_api_key)
+                acr.fetch(on_async_creds_retriever_done)
+
+        self.assertEqual(len(in_flight_callbacks), 1)
+        self.assertEqual(answers, [])
+
+        (request, callback) = in_flight_callbacks[0]
+        callback(tornado.httpclient.HTTPResponse(request, httplib.NOT_FOUND, request_time=24))
+
+        self.assertEqual(answers, [(True, None)] * 5)
+
     def test_key_service_returns_zero_length_response(self):
         """Confirm that when the key service returns a zero length
         response this is flagged as an error to the callback the
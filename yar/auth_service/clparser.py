@@ -32,13 +32,13 @@ class CommandLineParser(optparse.OptionParser):
             help=help)
 
         default = "127.0.0.1:8000"
-        help = "address:port to listen on - default = %s" % default
+        help = "address:port or unix domain socket to listen on - default = %s" % default
         self.add_option(
             "--lon",
             action="store",
             dest="listen_on",
             default=default,
-            type="hostcolonportparsed",
+            type="addressparsed",
             help=help)
 
         default = "YAR"
@@ -51,24 +51,444 @@ class CommandLineParser(optparse.OptionParser):
             type="string",
             help=help)
 
-        default = "127.0.0.1:8070"
-        help = "key service - default = %s" % default
+        default = ["127.0.0.1:8070"]
+        help = "key service(s) - default = %s" % default
         self.add_option(
             "--keyservice",
             action="store",
             dest="key_service",
             default=default,
-            type="hostcolonport",
+            type="addresses",
             help=help)
 
-        default = "127.0.0.1:8080"
-        help = "app service - default = %s" % default
+        default = 5.0
+        help = "# of seconds to wait for a key service - default = %.1f" % default
+        self.add_option(
+            "--keyservicetimeout",
+            action="store",
+            dest="key_service_timeout",
+            default=default,
+            type=float,
+            help=help)
+
+        default = 0
+        help = (
+            "hedge requests to --keyservice's key services after this "
+            "percentile of recent latencies - 0 = never - default = %d"
+        )
+        help = help % default
+        self.add_option(
+            "--keyservicehedgepercentile",
+            action="store",
+            dest="key_service_hedge_percentile",
+            default=default,
+            type=int,
+            help=help)
+
+        default = 5
+        help = (
+            "# of consecutive failed requests after which a key "
+            "service's circuit breaker opens - default = %d"
+        )
+        help = help % default
+        self.add_option(
+            "--keyservicebreakerthreshold",
+            action="store",
+            dest="key_service_breaker_threshold",
+            default=default,
+            type=int,
+            help=help)
+
+        default = 10
+        help = (
+            "# of seconds before an open key service circuit "
+            "breaker allows a trial request - default = %d"
+        )
+        help = help % default
+        self.add_option(
+            "--keyservicebreakerresettimeout",
+            action="store",
+            dest="key_service_breaker_reset_timeout",
+            default=default,
+            type=int,
+            help=help)
+
+        default = 1000
+        help = (
+            "max # of creds in key service response cache "
+            "(0 disables cache) - default = %d"
+        )
+        help = help % default
+        self.add_option(
+            "--credscachesize",
+            action="store",
+            dest="creds_cache_size",
+            default=default,
+            type=int,
+            help=help)
+
+        default = 30
+        help = "seconds creds are cached - default = %d" % default
+        self.add_option(
+            "--credscachettl",
+            action="store",
+            dest="creds_cache_ttl",
+            default=default,
+            type=int,
+            help=help)
+
+        default = 5
+        help = (
+            "seconds key service's 'not found' responses "
+            "are cached - default = %d"
+        )
+        help = help % default
+        self.add_option(
+            "--credscachenotfoundttl",
+            action="store",
+            dest="creds_cache_not_found_ttl",
+            default=default,
+            type=int,
+            help=help)
+
+        default = ["127.0.0.1:8080"]
+        help = "app service(s) - default = %s" % default
         self.add_option(
             "--appserver",
             action="store",
             dest="app_service",
             default=default,
-            type="hostcolonport",
+            type="addresses",
+            help=help)
+
+        default = None
+        help = (
+            "JSON routing table mapping path prefixes and principals "
+            "to app services - reloaded on SIGHUP - default = %s"
+        )
+        help = help % default
+        self.add_option(
+            "--appserverroutes",
+            action="store",
+            dest="app_service_routes",
+            default=default,
+            type="string",
+            help=help)
+
+        # choices mirror yar.util.load_balancer.POLICIES
+        choices = ["p2c", "leastoutstanding"]
+        default = "p2c"
+        help = (
+            "how requests are spread across --appserver's app services - "
+            "p2c = power of two choices, "
+            "leastoutstanding = fewest outstanding requests - default = %s"
+        )
+        help = help % default
+        self.add_option(
+            "--appserverpolicy",
+            action="store",
+            dest="app_service_balancing_policy",
+            default=default,
+            type="choice",
+            choices=choices,
+            help=help)
+
+        default = 3
+        help = (
+            "# of consecutive failed requests after which an app "
+            "service is ejected - default = %d"
+        )
+        help = help % default
+        self.add_option(
+            "--appservermaxfailures",
+            action="store",
+            dest="max_app_service_failures",
+            default=default,
+            type=int,
+            help=help)
+
+        default = 30
+        help = "# of seconds an app service is ejected for - default = %d" % default
+        self.add_option(
+            "--appserverejectiontime",
+            action="store",
+            dest="app_service_ejection_time",
+            default=default,
+            type=int,
+            help=help)
+
+        default = 0.0
+        help = (
+            "eject an app service when its average latency (in seconds) "
+            "exceeds this - 0 = never - default = %.1f"
+        )
+        help = help % default
+        self.add_option(
+            "--appserverslowthreshold",
+            action="store",
+            dest="app_service_slow_threshold",
+            default=default,
+            type=float,
+            help=help)
+
+        default = 100 * 1024 * 1024
+        help = (
+            "max size (in bytes) of a request body - larger "
+            "requests are rejected - default = %d"
+        )
+        help = help % default
+        self.add_option(
+            "--maxrequestbodysize",
+            action="store",
+            dest="max_request_body_size",
+            default=default,
+            type=int,
+            help=help)
+
+        default = 64 * 1024
+        help = (
+            "max size (in bytes) of a request body held in memory "
+            "while waiting for authentication - larger bodies spill "
+            "to disk - default = %d"
+        )
+        help = help % default
+        self.add_option(
+            "--maxinmemoryrequestbodysize",
+            action="store",
+            dest="max_in_memory_request_body_size",
+            default=default,
+            type=int,
+            help=help)
+
+        default = 1024 * 1024 * 1024
+        help = (
+            "max total size (in bytes) of request bodies spilled "
+            "to disk - requests which would exceed it are rejected "
+            "- 0 = no limit - default = %d"
+        )
+        help = help % default
+        self.add_option(
+            "--maxspilledrequestbodysize",
+            action="store",
+            dest="max_spilled_request_body_size",
+            default=default,
+            type=int,
+            help=help)
+
+        default = 1024 * 1024
+        help = (
+            "request bodies larger than this many bytes are hashed "
+            "on worker threads rather than the main thread - "
+            "0 disables - default = %d"
+        )
+        help = help % default
+        self.add_option(
+            "--offloadthreshold",
+            action="store",
+            dest="offload_threshold",
+            default=default,
+            type=int,
+            help=help)
+
+        default = 4
+        help = "# of worker threads - default = %d" % default
+        self.add_option(
+            "--workerthreads",
+            action="store",
+            dest="worker_threads",
+            default=default,
+            type=int,
+            help=help)
+
+        default = False
+        help = (
+            "stream app service responses to clients as they "
+            "arrive rather than reading entire responses into "
+            "memory first - default = %s"
+        )
+        help = help % default
+        self.add_option(
+            "--streamappserviceresponses",
+            action="store",
+            dest="stream_app_service_responses",
+            default=default,
+            type="boolean",
+            help=help)
+
+        default = 256 * 1024
+        help = (
+            "max bytes of a streamed app service response waiting "
+            "to be sent to a client before reading more of the "
+            "response - default = %d"
+        )
+        help = help % default
+        self.add_option(
+            "--maxresponsebuffersize",
+            action="store",
+            dest="max_response_buffer_size",
+            default=default,
+            type=int,
+            help=help)
+
+        default = 10
+        help = (
+            "max # of concurrent connections to each upstream "
+            "server - default = %d"
+        )
+        help = help % default
+        self.add_option(
+            "--maxupstreamconnections",
+            action="store",
+            dest="max_upstream_connections",
+            default=default,
+            type=int,
+            help=help)
+
+        default = 20.0
+        help = (
+            "timeout (in seconds) for establishing connections "
+            "to upstream servers - default = %.2f"
+        )
+        help = help % default
+        self.add_option(
+            "--upstreamconnecttimeout",
+            action="store",
+            dest="upstream_connect_timeout",
+            default=default,
+            type="float",
+            help=help)
+
+        default = 20.0
+        help = (
+            "timeout (in seconds) for requests to upstream "
+            "servers - default = %.2f"
+        )
+        help = help % default
+        self.add_option(
+            "--upstreamrequesttimeout",
+            action="store",
+            dest="upstream_request_timeout",
+            default=default,
+            type="float",
+            help=help)
+
+        default = 30
+        help = (
+            "seconds connections to upstream servers are kept "
+            "alive while idle - default = %d"
+        )
+        help = help % default
+        self.add_option(
+            "--upstreamidletimeout",
+            action="store",
+            dest="upstream_idle_timeout",
+            default=default,
+            type=int,
+            help=help)
+
+        default = 30.0
+        help = (
+            "seconds the auth service has to respond to a request, "
+            "not counting receiving the request's body "
+            "- 0 = no deadline - default = %.2f"
+        )
+        help = help % default
+        self.add_option(
+            "--deadline",
+            action="store",
+            dest="deadline_budget",
+            default=default,
+            type="float",
+            help=help)
+
+        # choices mirror yar.util.concurrency_limiter.POLICIES plus "none"
+        choices = ["gradient", "aimd", "none"]
+        default = "none"
+        help = (
+            "how the # of in flight authentications and app service "
+            "requests is limited - gradient = by latency gradient, "
+            "aimd = additive increase/multiplicative decrease, "
+            "none = no limit - default = %s"
+        )
+        help = help % default
+        self.add_option(
+            "--concurrencypolicy",
+            action="store",
+            dest="concurrency_policy",
+            default=default,
+            type="choice",
+            choices=choices,
+            help=help)
+
+        default = 1000
+        help = (
+            "max # of in flight authentications and app service "
+            "requests - default = %d"
+        )
+        help = help % default
+        self.add_option(
+            "--maxconcurrency",
+            action="store",
+            dest="max_concurrency",
+            default=default,
+            type=int,
+            help=help)
+
+        default = 50
+        help = (
+            "# of requests which can wait when the concurrency "
+            "limit is reached - default = %d"
+        )
+        help = help % default
+        self.add_option(
+            "--concurrencyqueuesize",
+            action="store",
+            dest="concurrency_queue_size",
+            default=default,
+            type=int,
+            help=help)
+
+        default = 0.05
+        help = (
+            "seconds a request can wait when the concurrency "
+            "limit is reached - default = %.2f"
+        )
+        help = help % default
+        self.add_option(
+            "--concurrencyqueuetime",
+            action="store",
+            dest="concurrency_queue_time",
+            default=default,
+            type="float",
+            help=help)
+
+        default = 0.0
+        help = (
+            "with the aimd policy, requests slower than this many "
+            "seconds shrink the concurrency limit - 0 = only timeouts "
+            "do - default = %.2f"
+        )
+        help = help % default
+        self.add_option(
+            "--concurrencylatencythreshold",
+            action="store",
+            dest="concurrency_latency_threshold",
+            default=default,
+            type="float",
+            help=help)
+
+        default = 1
+        help = (
+            "Retry-After seconds sent with 503 responses to "
+            "requests shed by the concurrency limit - default = %d"
+        )
+        help = help % default
+        self.add_option(
+            "--retryafter",
+            action="store",
+            dest="retry_after",
+            default=default,
+            type=int,
             help=help)
 
         default = 30
@@ -88,7 +508,112 @@ class CommandLineParser(optparse.OptionParser):
             action="store",
             dest="nonce_store",
             default=default,
-            type="hostcolonports",
+            type="addresses",
+            help=help)
+
+        default = 0.25
+        help = (
+            "timeout (in seconds) for requests to --noncestore's "
+            "memcached servers - default = %.2f"
+        )
+        help = help % default
+        self.add_option(
+            "--noncestoretimeout",
+            action="store",
+            dest="nonce_store_timeout",
+            default=default,
+            type="float",
+            help=help)
+
+        # choices mirror yar.auth_service.mac.nonce_store.UNAVAILABLE_POLICIES
+        choices = ["reject", "local", "accept"]
+        default = "reject"
+        help = (
+            "how to check nonces when none of --noncestore's "
+            "memcached servers are available - "
+            "reject = reject all requests, "
+            "local = check nonces in process, "
+            "accept = accept all nonces - default = %s"
+        )
+        help = help % default
+        self.add_option(
+            "--noncestoreunavailablepolicy",
+            action="store",
+            dest="nonce_store_unavailable_policy",
+            default=default,
+            type="choice",
+            choices=choices,
+            help=help)
+
+        default = False
+        help = (
+            "pipeline requests to --noncestore's memcached "
+            "servers - default = %s"
+        )
+        help = help % default
+        self.add_option(
+            "--pipelinednoncestore",
+            action="store",
+            dest="pipelined_nonce_store",
+            default=default,
+            type="boolean",
+            help=help)
+
+        default = False
+        help = (
+            "reject replays of nonces this process is still reserving "
+            "in --noncestore's memcached servers without waiting for "
+            "memcached - default = %s"
+        )
+        help = help % default
+        self.add_option(
+            "--rejectinflightnonces",
+            action="store",
+            dest="reject_in_flight_nonces",
+            default=default,
+            type="boolean",
+            help=help)
+
+        default = False
+        help = (
+            "use an in process nonce store instead of "
+            "--noncestore's memcached servers - default = %s"
+        )
+        help = help % default
+        self.add_option(
+            "--inprocessnoncestore",
+            action="store",
+            dest="in_process_nonce_store",
+            default=default,
+            type="boolean",
+            help=help)
+
+        default = 1000000
+        help = (
+            "max # of nonces remembered by in process "
+            "nonce store - default = %d"
+        )
+        help = help % default
+        self.add_option(
+            "--inprocessnoncestoresize",
+            action="store",
+            dest="in_process_nonce_store_size",
+            default=default,
+            type=int,
+            help=help)
+
+        default = 60
+        help = (
+            "seconds between writing metrics to log "
+            "(0 disables) - default = %d"
+        )
+        help = help % default
+        self.add_option(
+            "--metricsinterval",
+            action="store",
+            dest="metrics_interval",
+            default=default,
+            type=int,
             help=help)
 
         default = None
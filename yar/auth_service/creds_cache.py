@@ -0,0 +1,85 @@
+"""This module implements an in-process cache of credentials
+retrieved from the key service. Without this cache every authenticated
+request requires a round trip to the key service."""
+
+import collections
+import logging
+import time
+
+from yar.util import metrics
+
+_logger = logging.getLogger("AUTHSERVICE.%s" % __name__)
+
+
+class CredsCache(object):
+    """A bounded, LRU, time-to-live (TTL) cache of credentials.
+
+    Entries are keyed by a mac key identifier or an api key. Values are
+    opaque to the cache - retrievers typically cache the arguments that
+    would be passed to their callback. In addition to regular entries
+    the cache supports "not found" entries which record the key service
+    reporting that it doesn't know about a key. Not found entries
+    typically have a much shorter TTL than regular entries so newly
+    created credentials become usable quickly.
+
+    Hit, miss, eviction and expiration counters are maintained in
+    ```yar.util.metrics``` with names prefixed by ```name```."""
+
+    def __init__(self, name, max_entries=1000, ttl=30, not_found_ttl=5):
+        object.__init__(self)
+
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.not_found_ttl = not_found_ttl
+
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Return the value associated with ```key``` or None if
+        ```key``` is not in the cache or its entry has expired."""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            self._increment("misses")
+            return None
+
+        (expires_at, value) = entry
+        if expires_at <= time.time():
+            self._increment("expirations")
+            self._increment("misses")
+            return None
+
+        # reinserting moves the entry to the most recently used
+        # end of self._entries
+        self._entries[key] = entry
+        self._increment("hits")
+        return value
+
+    def put(self, key, value):
+        """Associate ```value``` with ```key```."""
+        self._put(key, value, self.ttl)
+
+    def put_not_found(self, key, value):
+        """Record that the key service doesn't know about ```key```.
+        ```value``` will be returned by ```get()``` until the not
+        found entry expires."""
+        self._put(key, value, self.not_found_ttl)
+
+    def _put(self, key, value, ttl):
+        if self.max_entries <= 0 or ttl <= 0:
+            return
+
+        self._entries.pop(key, None)
+        while self.max_entries <= len(self._entries):
+            # least recently used entries are at the front of self._entries
+            self._entries.popitem(last=False)
+            self._increment("evictions")
+        self._entries[key] = (time.time() + ttl, value)
+
+        metrics.gauge("%s.entries" % self.name, len(self._entries))
+
+    def _increment(self, counter_name):
+        metrics.increment("%s.%s" % (self.name, counter_name))
@@ -0,0 +1,288 @@
+"""This module contains the client the auth service's creds retrievers
+use to send requests to the key service. The key service can be several
+endpoints (addresses). Each endpoint has a circuit breaker so a failing
+endpoint is skipped, rather than waited on, until it has had a chance
+to recover. A request that fails is sent to another endpoint. If every
+endpoint's breaker is open, requests fail immediately.
+
+Optionally requests are hedged. If there's no answer after the
+```hedge_percentile``` percentile of recent key service latencies, a
+second request is sent to another endpoint and whichever answers first
+wins. This keeps a single slow key service endpoint out of the auth
+service's tail latency at the cost of a few % more key service requests.
+The # of hedged requests (```key_service.hedges```), the # of those won
+by the hedged request (```key_service.hedge_wins```) and the resulting
+win rate (```key_service.hedge_win_rate```) are reported in
+```yar.util.metrics```.
+
+If a request has a ```yar.util.deadline.Deadline``` each request to a
+key service endpoint times out at the deadline, if that's sooner than
+```timeout```, and the deadline is passed to the key service."""
+
+import collections
+import httplib
+import functools
+import logging
+import random
+import time
+
+import tornado.httpclient
+import tornado.ioloop
+
+from yar.util import circuit_breaker
+from yar.util import deadline
+from yar.util import metrics
+from yar.util import pooled_http_client
+
+_logger = logging.getLogger("AUTHSERVICE.%s" % __name__)
+
+"""# of seconds to wait for each request to a key service endpoint."""
+timeout = 5
+
+"""If not 0, requests are hedged after the ```hedge_percentile```
+percentile of recent key service latencies."""
+hedge_percentile = 0
+
+"""An endpoint's circuit breaker opens after ```breaker_failure_threshold```
+consecutive failed requests and allows a trial request after
+```breaker_reset_timeout``` seconds. A request fails if there's
+no response or the response's status code is 5xx."""
+breaker_failure_threshold = 5
+breaker_reset_timeout = 10
+
+"""Hedge delays are calculated from the latencies of the most recent
+```_number_latency_samples``` successful requests and requests are only
+hedged once there are at least ```_min_latency_samples``` latencies."""
+_number_latency_samples = 1000
+_min_latency_samples = 20
+
+"""Requests which aren't sent because their deadline has already
+passed fail with this message."""
+_deadline_exceeded_message = "Deadline exceeded"
+
+"""```_clusters``` maps a tuple of key service addresses to the
+```_Cluster``` for those addresses."""
+_clusters = {}
+
+
+def fetch(key_service_address, path, callback, deadline=None):
+    """Async'ly GET ```path``` from the key service and call ```callback```
+    with a ```tornado.httpclient.HTTPResponse```. ```key_service_address```
+    is either a single address or a list of addresses. If not None,
+    ```deadline``` is the request's ```yar.util.deadline.Deadline```."""
+    addresses = key_service_address
+    addresses = tuple([addresses] if isinstance(addresses, basestring) else addresses)
+    cluster = _clusters.get(addresses, None)
+    if cluster is None:
+        cluster = _Cluster(addresses)
+        _clusters[addresses] = cluster
+    _Fetch(cluster, path, callback, deadline).start()
+
+
+def _is_ok(response):
+    return response.code != 599 and response.code < 500
+
+
+def _is_deadline_exceeded(response):
+    """A key service drops requests whose deadline has passed. That
+    says nothing about the key service's health and there's no point
+    asking another key service."""
+    return response.code == httplib.GATEWAY_TIMEOUT
+
+
+def is_timeout(response):
+    """Returns True if ```response``` says the key service didn't answer
+    in time - either the request timed out or a key service dropped it
+    because its deadline had passed - rather than that the key service
+    answered and failed."""
+    if _is_deadline_exceeded(response):
+        return True
+    error = response.error
+    if response.code != 599 or not isinstance(error, tornado.httpclient.HTTPError):
+        return False
+    message = error.message or ""
+    return message.startswith("Timeout") or message == _deadline_exceeded_message
+
+
+class _Endpoint(object):
+
+    def __init__(self, address):
+        object.__init__(self)
+
+        self.address = address
+        self.number_outstanding = 0
+        self.breaker = circuit_breaker.CircuitBreaker(
+            "key_service.%s" % address,
+            breaker_failure_threshold,
+            breaker_reset_timeout)
+
+
+class _Cluster(object):
+    """The key service endpoints at a collection of addresses."""
+
+    def __init__(self, addresses):
+        object.__init__(self)
+
+        self.endpoints = [_Endpoint(address) for address in addresses]
+
+        self._latencies = collections.deque(maxlen=_number_latency_samples)
+        self._number_latencies_since_hedge_delay = 0
+        self._hedge_delay = None
+
+    def choose(self, exclude):
+        """Returns the endpoint, not in ```exclude```, whose breaker
+        allows a request and which has the fewest outstanding requests.
+        Returns None if there's no such endpoint."""
+        candidates = [endpoint for endpoint in self.endpoints if endpoint not in exclude]
+        # shuffle so ties don't always go to the same endpoint
+        random.shuffle(candidates)
+        candidates.sort(key=lambda endpoint: endpoint.number_outstanding)
+        for endpoint in candidates:
+            if endpoint.breaker.allow_request():
+                return endpoint
+        return None
+
+    def record_latency(self, latency):
+        self._latencies.append(latency)
+        self._number_latencies_since_hedge_delay += 1
+
+    def hedge_delay(self):
+        """Returns the # of seconds after which a request should be
+        hedged or None if requests shouldn't be hedged. Sorting the
+        latencies is expensive so the delay is only recalculated
+        every 100 requests."""
+        if not hedge_percentile or len(self.endpoints) < 2:
+            return None
+        if len(self._latencies) < _min_latency_samples:
+            return None
+        if self._hedge_delay is None or 100 <= self._number_latencies_since_hedge_delay:
+            latencies = sorted(self._latencies)
+            index = min(len(latencies) - 1, int(len(latencies) * hedge_percentile / 100.0))
+            self._hedge_delay = latencies[index]
+            self._number_latencies_since_hedge_delay = 0
+            metrics.gauge("key_service.hedge_delay_ms", int(self._hedge_delay * 1000))
+        return self._hedge_delay
+
+
+class _Fetch(object):
+    """A single request to the key service which may be sent to
+    several endpoints - after a failure or when hedging."""
+
+    def __init__(self, cluster, path, callback, deadline):
+        object.__init__(self)
+
+        self._cluster = cluster
+        self._path = path
+        self._callback = callback
+        self._deadline = deadline
+
+        self._tried_endpoints = []
+        self._number_outstanding = 0
+        self._is_done = False
+        self._hedge_timeout = None
+
+    def start(self):
+        if not self._send(False):
+            if self._is_out_of_time():
+                message = _deadline_exceeded_message
+            else:
+                metrics.increment("key_service.fast_failures")
+                message = "All key service circuit breakers open"
+            url = pooled_http_client.url(self._cluster.endpoints[0].address, self._path)
+            response = tornado.httpclient.HTTPResponse(
+                tornado.httpclient.HTTPRequest(url, method="GET"),
+                599,
+                error=tornado.httpclient.HTTPError(599, message),
+                request_time=0)
+            self._callback(response)
+            return
+
+        hedge_delay = self._cluster.hedge_delay()
+        if hedge_delay is not None:
+            io_loop = tornado.ioloop.IOLoop.current()
+            self._hedge_timeout = io_loop.add_timeout(io_loop.time() + hedge_delay, self._on_hedge_timeout)
+
+    def _send(self, is_hedge):
+        """Send the request to an endpoint that hasn't already been
+        tried. Returns False if there's no endpoint to send to or
+        no time left before the deadline."""
+        if self._is_out_of_time():
+            return False
+        endpoint = self._cluster.choose(self._tried_endpoints)
+        if endpoint is None:
+            return False
+        self._tried_endpoints.append(endpoint)
+        self._number_outstanding += 1
+        endpoint.number_outstanding += 1
+
+        request_timeout = timeout
+        headers = {}
+        if self._deadline is not None:
+            request_timeout = self._deadline.timeout(timeout)
+            headers[deadline.header_name] = self._deadline.header_value()
+
+        http_request = tornado.httpclient.HTTPRequest(
+            url=pooled_http_client.url(endpoint.address, self._path),
+            method="GET",
+            headers=headers,
+            follow_redirects=False,
+            request_timeout=request_timeout)
+        http_client = tornado.httpclient.AsyncHTTPClient()
+        http_client.fetch(
+            http_request,
+            functools.partial(self._on_fetch_done, endpoint, is_hedge, time.time()))
+        return True
+
+    def _is_out_of_time(self):
+        return self._deadline is not None and self._deadline.is_expired()
+
+    def _on_hedge_timeout(self):
+        self._hedge_timeout = None
+        if self._is_done:
+            return
+        if self._send(True):
+            metrics.increment("key_service.hedges")
+            self._report_hedge_win_rate()
+
+    def _on_fetch_done(self, endpoint, is_hedge, start_time, response):
+        self._number_outstanding -= 1
+        endpoint.number_outstanding -= 1
+
+        if _is_deadline_exceeded(response):
+            if not self._is_done and self._number_outstanding == 0:
+                self._done(response)
+            return
+
+        if not _is_ok(response):
+            endpoint.breaker.on_failure()
+            if self._is_done or 0 < self._number_outstanding:
+                # another request is still in flight and might succeed
+                return
+            if self._send(False):
+                metrics.increment("key_service.failovers")
+                return
+            self._done(response)
+            return
+
+        endpoint.breaker.on_success()
+        self._cluster.record_latency(time.time() - start_time)
+        if self._is_done:
+            return
+        if is_hedge:
+            metrics.increment("key_service.hedge_wins")
+            self._report_hedge_win_rate()
+        self._done(response)
+
+    def _done(self, response):
+        self._is_done = True
+        if self._hedge_timeout is not None:
+            tornado.ioloop.IOLoop.current().remove_timeout(self._hedge_timeout)
+            self._hedge_timeout = None
+        self._callback(response)
+
+    def _report_hedge_win_rate(self):
+        number_hedges = metrics.counter("key_service.hedges")
+        if number_hedges:
+            metrics.gauge(
+                "key_service.hedge_win_rate",
+                float(metrics.counter("key_service.hedge_wins")) / number_hedges)
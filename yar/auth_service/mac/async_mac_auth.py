@@ -1,9 +1,13 @@
 """This module contains the core logic for implemenation
 an async MAC validation."""
 
+import functools
 import hashlib
 import logging
 
+import tornado.ioloop
+
+from yar.auth_service import worker_pool
 from yar.util import mac
 from yar.util.trhutil import get_request_host_and_port
 from yar.util.trhutil import get_request_body_if_exists
@@ -25,13 +29,21 @@ AUTH_FAILURE_DETAIL_INVALID_AUTH_HEADER = 0x0100 + 0x0004
 AUTH_FAILURE_DETAIL_CREDS_NOT_FOUND = 0x0100 + 0x0005
 AUTH_FAILURE_DETAIL_NONCE_REUSED = 0x0100 + 0x0006
 AUTH_FAILURE_DETAIL_MACS_DO_NOT_MATCH = 0x0100 + 0x0007
+AUTH_FAILURE_DETAIL_INVALID_MAC_KEY_IDENTIFIER = 0x0100 + 0x0008
 
 
 class AsyncMACAuth(object):
 
-    def __init__(self, request):
+    def __init__(self, request, request_body=None, deadline=None):
+        """If the request's body has been accepted incrementally
+        ```request_body``` is the ```yar.auth_service.request_body.RequestBody```
+        that has been accumulating it otherwise the body is read
+        from ```request```. If not None, ```deadline``` is the
+        request's ```yar.util.deadline.Deadline```."""
         object.__init__(self)
         self._request = request
+        self._request_body = request_body
+        self._deadline = deadline
 
     def _on_async_mac_creds_retriever_done(
         self,
@@ -40,21 +52,93 @@ class AsyncMACAuth(object):
         mac_algorithm=None,
         mac_key=None,
         principal=None):
+        """this callback is invoked when AsyncMACCredsRetriever has
+        finished. since the nonce check and the credentials retrieval
+        run concurrently, all this method does is record the result
+        and then see if the nonce check is also done."""
+        self._creds = (
+            is_ok,
+            mac_key_identifier,
+            mac_algorithm,
+            mac_key,
+            principal,
+        )
+        self._on_nonce_check_and_creds_retrieval_done()
+
+    def _on_async_nonce_checker_done(self, is_ok):
+        """this callback is invoked when AsyncNonceChecker has finished.
+        ```is_ok``` will be ```True`` AsyncNonceChecker has confirmed that
+         the curent request's nonce+mac_key_identifier pair hasn't been
+        seen before."""
+        self._is_nonce_ok = is_ok
+        self._on_nonce_check_and_creds_retrieval_done()
 
-        if not is_ok:
+    def _on_nonce_check_and_creds_retrieval_done(self):
+        """Called each time either the nonce check or the credentials
+        retrieval completes. Once both have completed, authentication
+        can continue."""
+        if self._is_nonce_ok is None or self._creds is None:
+            return
+
+        # the nonce check or credentials retrieval ran out of time
+        # so there's no point going any further. a nonce reserved in
+        # time is released so the client can retry with the same nonce
+        # (a nonce reserved too late is released by the nonce checker)
+        if self._deadline is not None and self._deadline.exceeded_stage is not None:
+            if self._is_nonce_ok:
+                self._anc.release()
+            self._on_auth_done(False)
+            return
+
+        if not self._is_nonce_ok:
+            _logger.info("Nonce '%s' reused", self._auth_hdr_val.nonce)
+            self._on_auth_done(False, AUTH_FAILURE_DETAIL_NONCE_REUSED)
+            return
+
+        is_creds_ok = self._creds[0]
+        if not is_creds_ok:
             _logger.info(
                 "No MAC credentials found for '%s'",
                 self._request.full_url())
+            self._anc.release()
             self._on_auth_done(False, AUTH_FAILURE_DETAIL_CREDS_NOT_FOUND)
             return
 
+        # basic request looks good
+        #
+        # 1/ authentication header found and format is valid
+        # 2/ timestamp is recent
+        # 3/ nonce has not previous been used by the mac key identifier
+        # 4/ credentials exist for the mac key identifier
+        #
+        # next steps is to use the credentials associated with
+        # the request's mac key identifier and confirm the request's
+        # MAC is valid ie. final step in confirming the sender's identity.
+        # the MAC covers the request's body so if the body is still
+        # arriving wait for it.
+        if self._request_body is None:
+            self._authenticate_with_creds(*self._creds)
+        else:
+            self._request_body.when_complete(
+                functools.partial(self._authenticate_with_creds, *self._creds))
+
+    def _authenticate_with_creds(self,
+                                 is_ok,
+                                 mac_key_identifier,
+                                 mac_algorithm,
+                                 mac_key,
+                                 principal):
+
         (host, port) = get_request_host_and_port(
             self._request,
             "127.0.0.1",
             80)
         content_type = self._request.headers.get("Content-type", None)
-        body = get_request_body_if_exists(self._request, None)
-        ext = mac.Ext.generate(content_type, body)
+        if self._request_body is None:
+            body = get_request_body_if_exists(self._request, None)
+            ext = mac.Ext.generate(content_type, body)
+        else:
+            ext = self._request_body.ext()
         normalized_request_string = mac.NormalizedRequestString.generate(
             self._auth_hdr_val.ts,
             self._auth_hdr_val.nonce,
@@ -79,41 +163,32 @@ class AsyncMACAuth(object):
                 mac_key_identifier,
                 self._auth_hdr_val.mac)
 
-            # When an authentication failure occurs it can be super hard
-            # to figure out the root cause of the error. This method is called
-            # on authentication failure and, if logging is set to at least
-            # debug, a whole series of HTTP headers are set to return the
-            # core elements that are used to generate the MAC.
-            auth_failure_debug_details = {}
-
-            if body:
-                sha1_of_body = hashlib.sha1(body).hexdigest()
-                auth_failure_debug_details["BODY-SHA1"] = sha1_of_body
-                auth_failure_debug_details["BODY-LEN"] = len(body)
+            # the nonce reservation is released straight away rather
+            # than after the debug details have been generated - they
+            # may never be
+            self._anc.release()
 
-            auth_failure_debug_details["MAC-KEY-IDENTIFIER"] = mac_key_identifier
-            auth_failure_debug_details["MAC-KEY"] = mac_key
-            auth_failure_debug_details["MAC-ALGORITHM"] = mac_algorithm
-            auth_failure_debug_details["HOST"] = host
-            auth_failure_debug_details["PORT"] = port
-            auth_failure_debug_details["CONTENT-TYPE"] = content_type
-            auth_failure_debug_details["REQUEST-METHOD"] = self._request.method
-            auth_failure_debug_details["URI"] = self._request.uri
-            auth_failure_debug_details["TIMESTAMP"] = self._auth_hdr_val.ts
-            auth_failure_debug_details["NONCE"] = self._auth_hdr_val.nonce
-            auth_failure_debug_details["EXT"] = ext
-            auth_failure_debug_details["MAC"] = mac.MAC.generate(
-                mac_key,
+            # When an authentication failure occurs it can be super hard
+            # to figure out the root cause of the error. The request handler
+            # calls _generate_auth_failure_debug_details() only if a whole
+            # series of HTTP headers are going to be set to return the core
+            # elements that are used to generate the MAC. failed requests
+            # are the hot path when the auth service is under attack so
+            # none of this work is done unless it's going to be used.
+            generate_auth_failure_debug_details = functools.partial(
+                self._generate_auth_failure_debug_details,
+                mac_key_identifier,
                 mac_algorithm,
+                mac_key,
+                host,
+                port,
+                content_type,
+                ext,
                 normalized_request_string)
-            sha1_of_nrs = hashlib.sha1(normalized_request_string).hexdigest()
-            auth_failure_debug_details["NRS-SHA1"] = sha1_of_nrs
-
-            # end of pumping out debug headers - returning to regular headers
             self._on_auth_done(
                 False,
                 auth_failure_detail=AUTH_FAILURE_DETAIL_MACS_DO_NOT_MATCH,
-                auth_failure_debug_details=auth_failure_debug_details)
+                auth_failure_debug_details=generate_auth_failure_debug_details)
             return
 
         _logger.info(
@@ -123,27 +198,67 @@ class AsyncMACAuth(object):
 
         self._on_auth_done(True, principal=principal)
 
-    def _on_async_nonce_checker_done(self, is_ok):
-        """this callback is invoked when AsyncNonceChecker has finished.
-        ```is_ok``` will be ```True`` AsyncNonceChecker has confirmed that
-         the curent request's nonce+mac_key_identifier pair hasn't been
-        seen before."""
-        if not is_ok:
-            _logger.info("Nonce '%s' reused", self._auth_hdr_val.nonce)
-            self._on_auth_done(False, AUTH_FAILURE_DETAIL_NONCE_REUSED)
-            return
+    def _generate_auth_failure_debug_details(self,
+                                             mac_key_identifier,
+                                             mac_algorithm,
+                                             mac_key,
+                                             host,
+                                             port,
+                                             content_type,
+                                             ext,
+                                             normalized_request_string,
+                                             callback):
+        """Generate the details of a MAC mismatch and pass them, as
+        a dict, to ```callback```."""
+        auth_failure_debug_details = {}
 
-        # basic request looks good
-        #
-        # 1/ authentication header found and format is valid
-        # 2/ timestamp is recent
-        # 3/ nonce has not previous been used by the mac key identifier
-        #
-        # next steps is to retrieve the credentials associated with
-        # the request's mac key identifier and confirm the request's
-        # MAC is valid ie. final step in confirming the sender's identity
-        acr = AsyncMACCredsRetriever(self._auth_hdr_val.mac_key_identifier)
-        acr.fetch(self._on_async_mac_creds_retriever_done)
+        if self._request_body is None:
+            body = get_request_body_if_exists(self._request, None)
+            if body:
+                sha1_of_body = hashlib.sha1(body).hexdigest()
+                auth_failure_debug_details["BODY-SHA1"] = sha1_of_body
+                auth_failure_debug_details["BODY-LEN"] = len(body)
+
+        auth_failure_debug_details["MAC-KEY-IDENTIFIER"] = mac_key_identifier
+        auth_failure_debug_details["MAC-KEY"] = mac_key
+        auth_failure_debug_details["MAC-ALGORITHM"] = mac_algorithm
+        auth_failure_debug_details["HOST"] = host
+        auth_failure_debug_details["PORT"] = port
+        auth_failure_debug_details["CONTENT-TYPE"] = content_type
+        auth_failure_debug_details["REQUEST-METHOD"] = self._request.method
+        auth_failure_debug_details["URI"] = self._request.uri
+        auth_failure_debug_details["TIMESTAMP"] = self._auth_hdr_val.ts
+        auth_failure_debug_details["NONCE"] = self._auth_hdr_val.nonce
+        auth_failure_debug_details["EXT"] = ext
+        if mac_algorithm in mac.MAC.digestmods:
+            auth_failure_debug_details["MAC"] = mac.MAC.generate(
+                mac_key,
+                mac_algorithm,
+                normalized_request_string)
+        sha1_of_nrs = hashlib.sha1(normalized_request_string).hexdigest()
+        auth_failure_debug_details["NRS-SHA1"] = sha1_of_nrs
+
+        if self._request_body is not None and self._request_body.size:
+            auth_failure_debug_details["BODY-LEN"] = self._request_body.size
+            # hashing a large body would stall the IOLoop
+            # so it's done on one of worker_pool's threads
+            if self._request_body.is_large:
+                future = worker_pool.submit(self._request_body.sha1)
+                tornado.ioloop.IOLoop.current().add_future(
+                    future,
+                    functools.partial(self._on_body_sha1_done, auth_failure_debug_details, callback))
+                return
+            auth_failure_debug_details["BODY-SHA1"] = self._request_body.sha1()
+
+        callback(auth_failure_debug_details)
+
+    def _on_body_sha1_done(self, auth_failure_debug_details, callback, future):
+        """Called when the SHA-1 of a large body, which is only used
+        for authentication failure debug details, has been computed
+        on one of ```worker_pool```'s threads."""
+        if future.exception() is None:
+            auth_failure_debug_details["BODY-SHA1"] = future.result()
+        callback(auth_failure_debug_details)
 
     def authenticate(self, on_auth_done):
         self._on_auth_done = on_auth_done
@@ -158,6 +273,13 @@ class AsyncMACAuth(object):
             self._on_auth_done(False, AUTH_FAILURE_DETAIL_INVALID_AUTH_HEADER)
             return
 
+        # credentials only exist for mac key identifiers generated by
+        # the key service so anything else is rejected before doing
+        # any I/O - it's pointless asking the key service
+        if not mac.MACKeyIdentifier.is_well_formed(self._auth_hdr_val.mac_key_identifier):
+            self._on_auth_done(False, AUTH_FAILURE_DETAIL_INVALID_MAC_KEY_IDENTIFIER)
+            return
+
         # confirm the request isn't old which is important in protecting
         # against reply attacks - also requests with timestamps in the
         # future are also
@@ -173,11 +295,23 @@ class AsyncMACAuth(object):
             self._on_auth_done(False, AUTH_FAILURE_DETAIL_TS_OLD)
             return
 
-        # time to confirm if the nonce in the request has been used
-        # before. this means async'ly calling out to the memcached
-        # cluster which stores previously used nonce+mac_key_identifer
-        # combinations
-        anc = AsyncNonceChecker(
+        # time to (i) confirm if the nonce in the request has been used
+        # before (ii) retrieve the credentials associated with the
+        # request's mac key identifier. (i) means async'ly calling out to
+        # the memcached cluster which stores previously used
+        # nonce+mac_key_identifer combinations and (ii) means async'ly
+        # calling out to the key service. (i) and (ii) are independent
+        # so they're done concurrently and _on_nonce_check_and_creds_retrieval_done()
+        # joins the results. the nonce checker reserves the nonce and if
+        # the request turns out to be invalid the reservation is released.
+        self._is_nonce_ok = None
+        self._creds = None
+
+        self._anc = AsyncNonceChecker(
             self._auth_hdr_val.mac_key_identifier,
-            self._auth_hdr_val.nonce)
-        anc.fetch(self._on_async_nonce_checker_done)
+            self._auth_hdr_val.nonce,
+            self._deadline)
+        self._anc.fetch(self._on_async_nonce_checker_done)
+
+        acr = AsyncMACCredsRetriever(self._auth_hdr_val.mac_key_identifier, self._deadline)
+        acr.fetch(self._on_async_mac_creds_retriever_done)
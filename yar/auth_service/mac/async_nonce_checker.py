@@ -2,10 +2,14 @@
 with the nonce store to determine if a mac key identifier plus
 nonce combination has been previously used."""
 
+import base64
 import datetime
+import hashlib
 import logging
 
-import tornadoasyncmemcache
+from nonce_store import MemcachedNonceStore
+from nonce_store import InFlightNonceStore
+from nonce_store import UNAVAILABLE_POLICY_REJECT
 
 _logger = logging.getLogger("AUTHSERVICE.%s" % __name__)
 
@@ -14,67 +18,127 @@ that point to the memcached cluster that implements the
 nonce store."""
 nonce_store = ["127.0.0.1:11211"]
 
+"""If ```is_nonce_store_pipelined``` is True requests to the memcached
+cluster described by ```nonce_store``` are batched and pipelined."""
+is_nonce_store_pipelined = False
+
+"""Operations on the memcached cluster described by ```nonce_store```
+must complete in ```nonce_store_timeout``` seconds."""
+nonce_store_timeout = 0.25
+
+"""```nonce_store_unavailable_policy``` is one of
+```yar.auth_service.mac.nonce_store.UNAVAILABLE_POLICIES``` and determines
+how nonces are checked when the memcached cluster described by
+```nonce_store``` is unavailable."""
+nonce_store_unavailable_policy = UNAVAILABLE_POLICY_REJECT
+
+"""If ```reject_in_flight_nonces``` is True nonce reservations to the
+memcached cluster described by ```nonce_store``` go through a
+```yar.auth_service.mac.nonce_store.InFlightNonceStore```."""
+reject_in_flight_nonces = False
+
+"""Requests with timestamps more than ```maxage``` seconds old are
+rejected by ```async_mac_auth``` so nonces only need to be remembered
+by the nonce store for ```maxage``` seconds. The auth service's mainline
+should set this to the same value as ```async_mac_auth.maxage```."""
+maxage = 30
+
+"""Entries in the memcached nonce store expire ```maxage``` plus
+```expiry_skew``` seconds after they're written. The skew margin allows
+for clock differences between the auth service and memcached as well as
+memcached's one second expiry granularity."""
+expiry_skew = 5
+
+"""```nonce_store_backend``` is the ```yar.auth_service.mac.nonce_store.NonceStore```
+used to reserve nonces. If ```nonce_store_backend``` is None when the
+first nonce is checked a ```MemcachedNonceStore``` for the memcached
+cluster described by ```nonce_store``` is created."""
+nonce_store_backend = None
+
+
+def nonce_key(mac_key_identifier, nonce):
+    """Generate the key used to store ```mac_key_identifier```
+    and ```nonce``` in the nonce store. Rather than using the long
+    concatenation of ```mac_key_identifier``` and ```nonce``` keys
+    are a compact, fixed length (22 character), memcached friendly
+    encoding of the first 128 bits of the SHA1 of the concatenation."""
+    digest = hashlib.sha1("%s-%s" % (mac_key_identifier, nonce)).digest()
+    return base64.urlsafe_b64encode(digest[:16]).rstrip("=")
+
 
 class AsyncNonceChecker(object):
     """Wraps the gory details of async'ing confirming that a
     nonce + mac_key_identifer pair isn't known to the nonce
-    store (which is a memcached cluster)."""
-
-    _ccs = None
+    store (which by default is a memcached cluster)."""
 
-    def __init__(self, mac_key_identifier, nonce):
+    def __init__(self, mac_key_identifier, nonce, deadline=None):
+        """If not None, ```deadline``` is the request's
+        ```yar.util.deadline.Deadline```."""
         object.__init__(self)
 
         self._mac_key_identifier = mac_key_identifier
         self._nonce = nonce
+        self._deadline = deadline
 
     def fetch(self, callback):
-        """Make an async request to the nonce store to
+        """Make an async request to the nonce store to atomically
         determine if ```nonce``` has been used for
-        ```mac_key_identifier```. If ```nonce``` has **not**
-        been used for ```mac_key_identifier``` then
-        asyc'ly ask the monce store to record that ```nonce```
-        should now be considered used for ```mac_key_identifier```.
+        ```mac_key_identifier``` and, if ```nonce``` has **not**
+        been used for ```mac_key_identifier```, record that ```nonce```
+        should now be considered used for ```mac_key_identifier```
+        (see ```release()``` for how to undo this reservation).
         Once all this is done, call ```callback``` with the
         results. ```callback``` is assumed to be a callable that
         takes a single boolean argument that is True if
         ```nonce``` has not been used by ```mac_key_identifier```
-        and otherwise False."""
-        self._callback = callback
+        and otherwise False. If the nonce store hasn't answered by
+        the deadline ```callback``` is called with False."""
+        self._answer = None
+        self._callback = self._on_answer
+        self._caller_callback = callback
+        if self._deadline is not None:
+            self._callback = self._deadline.guard("nonce_check", self._on_answer, False)
 
-        self._key = "%s-%s" % (self._mac_key_identifier, self._nonce)
+        self._key = nonce_key(self._mac_key_identifier, self._nonce)
 
-        _logger.info("Asking for nonce key '%s'", self._key)
+        _logger.info("Reserving nonce key '%s'", self._key)
 
         self._start_timestamp = datetime.datetime.now()
 
-        type(self).ccs().get(
+        type(self).backend().reserve(
             self._key,
-            callback=self._on_async_get_done)
+            self._on_reserve_done)
 
-    def _on_async_get_done(self, data):
+    def _on_reserve_done(self, is_fresh):
 
-        self._log_duration("get")
+        self._log_duration("reserve")
 
         _logger.info(
-            "Answer from asking for nonce key '%s' = '%s'",
+            "Answer from reserving nonce key '%s' = '%s'",
             self._key,
-            data)
+            is_fresh)
+
+        self._callback(is_fresh)
 
-        if data is not None:
-            self._callback(False)
-        else:
-            self._start_timestamp = datetime.datetime.now()
-            type(self).ccs().set(
-                self._key,
-                1,
-                callback=self._on_async_set_done)
+        # the nonce was reserved after the deadline so the caller
+        # was told it wasn't ok and will never release it
+        if is_fresh and not self._answer:
+            self.release()
 
-    def _on_async_set_done(self, data):
+    def _on_answer(self, is_fresh):
+        self._answer = is_fresh
+        self._caller_callback(is_fresh)
 
-        self._log_duration("set")
+    def release(self):
+        """```fetch()``` reserves the nonce + mac_key_identifier pair
+        before the rest of the request has been authenticated. Callers
+        should call this method if the request turns out to be invalid
+        so that the nonce is only recorded as used by valid requests.
+        The release is fire and forget - nobody waits for the nonce
+        store to respond."""
+        _logger.info("Releasing nonce key '%s'", self._key)
 
-        self._callback(True)
+        type(self).backend().release(self._key)
 
     def _log_duration(self, operation):
         stop_timestamp = datetime.datetime.now()
@@ -86,12 +150,15 @@ class AsyncNonceChecker(object):
             duration.microseconds)
 
     @classmethod
-    def ccs(cls):
-        if cls._ccs is None:
-            _logger.info(
-                "Creating 'tornadoasyncmemcache.ClientPool()' for cluster '%s'",
-                nonce_store)
-            cls._ccs = tornadoasyncmemcache.ClientPool(
+    def backend(cls):
+        global nonce_store_backend
+        if nonce_store_backend is None:
+            nonce_store_backend = MemcachedNonceStore(
                 nonce_store,
-                maxclients=100)
-        return cls._ccs
+                maxage + expiry_skew,
+                timeout=nonce_store_timeout,
+                pipelined=is_nonce_store_pipelined,
+                unavailable_policy=nonce_store_unavailable_policy)
+            if reject_in_flight_nonces:
+                nonce_store_backend = InFlightNonceStore(nonce_store_backend)
+        return nonce_store_backend
@@ -0,0 +1,575 @@
+"""This module contains the nonce store backends used by
+```AsyncNonceChecker``` to record which mac key identifier + nonce
+pairs have been used."""
+
+import bisect
+import collections
+import hashlib
+import logging
+import struct
+import sys
+import time
+
+import tornado.ioloop
+import tornadoasyncmemcache
+
+from pipelined_memcached import PipelinedClient
+from pipelined_memcached import PipelinedClientError
+from yar.util import metrics
+from yar.util import transport
+
+_logger = logging.getLogger("AUTHSERVICE.%s" % __name__)
+
+
+class NonceStore(object):
+    """Abstract base class for all nonce store backends. A nonce store
+    backend supports two async operations: (i) atomically reserve a key
+    if it hasn't been seen before (ii) release a previously reserved key."""
+
+    def reserve(self, key, callback):
+        """Atomically record ```key``` as used if it hasn't previously been
+        recorded. When done call ```callback``` with a single boolean
+        argument that is True if ```key``` was fresh (and is now reserved)
+        or False if ```key``` had already been used."""
+        raise NotImplementedError()
+
+    def release(self, key):
+        """Forget about the reservation of ```key```. Releasing is
+        fire and forget - there's no callback."""
+        raise NotImplementedError()
+
+
+"""When none of the memcached nonce store's nodes are available
+```MemcachedNonceStore```'s unavailable policy determines how nonces
+are reserved - ```UNAVAILABLE_POLICY_REJECT``` means all reservations
+fail, ```UNAVAILABLE_POLICY_LOCAL``` means nonces are reserved in a
+local ```InProcessNonceStore``` and ```UNAVAILABLE_POLICY_ACCEPT```
+means all reservations succeed without any replay protection."""
+UNAVAILABLE_POLICY_REJECT = "reject"
+UNAVAILABLE_POLICY_LOCAL = "local"
+UNAVAILABLE_POLICY_ACCEPT = "accept"
+UNAVAILABLE_POLICIES = [
+    UNAVAILABLE_POLICY_REJECT,
+    UNAVAILABLE_POLICY_LOCAL,
+    UNAVAILABLE_POLICY_ACCEPT,
+]
+
+
+class HashRing(object):
+    """Consistent hash ring used to spread keys across a cluster of
+    nodes. Each node is placed on the ring at ```points_per_node```
+    pseudo random points. A key belongs to the node owning the first
+    point on the ring at or after the key's hash. Adding or removing a
+    node therefore only moves the keys adjacent to that node's points
+    rather than reshuffling almost every key as would happen with
+    hash(key) modulo # of nodes."""
+
+    def __init__(self, nodes, points_per_node=160):
+        object.__init__(self)
+
+        self.nodes = []
+        for node in nodes:
+            if node not in self.nodes:
+                self.nodes.append(node)
+
+        ring = []
+        for node in self.nodes:
+            for i in range(points_per_node):
+                ring.append((self._hash("%s-%d" % (node, i)), node))
+        ring.sort()
+
+        self._points = [point for (point, node) in ring]
+        self._nodes = [node for (point, node) in ring]
+
+    @classmethod
+    def _hash(cls, value):
+        return struct.unpack(">I", hashlib.md5(value).digest()[:4])[0]
+
+    def nodes_for(self, key):
+        """Return a list of all nodes in the order they should be used
+        for ```key```. The first node is the node that owns ```key```
+        and the remaining nodes are the failover order."""
+        if not self._points:
+            return []
+
+        start = bisect.bisect_left(self._points, self._hash(key))
+
+        rv = []
+        for i in range(len(self._points)):
+            node = self._nodes[(start + i) % len(self._points)]
+            if node not in rv:
+                rv.append(node)
+                if len(rv) == len(self.nodes):
+                    break
+        return rv
+
+
+class _MemcachedNode(object):
+    """Tracks the health of a single memcached node."""
+
+    def __init__(self, address, is_pipelined=False):
+        object.__init__(self)
+
+        self.address = address
+        self.is_pipelined = is_pipelined
+        self.is_ejected = False
+        self.consecutive_failures = 0
+
+        self._ccs = None
+
+    def _is_pipelined_client(self):
+        # :TRICKY: tornadoasyncmemcache only speaks TCP so nodes
+        # listening on a unix domain socket are always pipelined
+        return self.is_pipelined or transport.is_unix_domain_socket(self.address)
+
+    def ccs(self):
+        if self._ccs is None and self._is_pipelined_client():
+            self._ccs = PipelinedClient(self.address)
+        if self._ccs is None:
+            _logger.info(
+                "Creating 'tornadoasyncmemcache.ClientPool()' for node '%s'",
+                self.address)
+            self._ccs = tornadoasyncmemcache.ClientPool(
+                [self.address],
+                maxclients=100)
+        return self._ccs
+
+    def is_stored(self, data):
+        """Returns True if ```data```, the result of an ```add```, says
+        the add stored its value. ```PipelinedClient``` answers with a
+        boolean but ```tornadoasyncmemcache``` answers with memcached's
+        response line - "STORED" or "NOT_STORED"."""
+        if self._is_pipelined_client():
+            return data is True
+        return data == "STORED"
+
+    def metric_name(self, name):
+        return "memcached_nonce_store.%s.%s" % (self.address, name)
+
+
+class MemcachedNonceStore(NonceStore):
+    """A nonce store backed by a memcached cluster. Reservations are a
+    single memcached ```add``` which only succeeds if the key doesn't
+    already exist. This takes a single round trip to memcached and,
+    unlike a ```get``` followed by a ```set```, it's impossible for two
+    concurrent requests with the same nonce to both succeed.
+
+    Keys are spread across the cluster's nodes using a ```HashRing```.
+    Each memcached operation must complete within ```timeout``` seconds.
+    A node that fails to answer ```max_failures``` consecutive operations
+    is ejected from the cluster and its keys fail over to the next node on
+    the ring. A reservation which times out on a node that hasn't (yet)
+    been ejected is answered by ```unavailable_policy``` rather than
+    failing over - the node might still hold the key. Every ```probe_interval``` seconds an ejected node is probed
+    in the background and, if it answers, the node is returned to service.
+    Per node latency (```memcached_nonce_store.<node>.latency_ms```),
+    error (```memcached_nonce_store.<node>.errors```) and ejection
+    (```memcached_nonce_store.<node>.ejections```) metrics are maintained
+    in ```yar.util.metrics```.
+
+    If ```pipelined``` is True each node is accessed through a
+    ```yar.auth_service.mac.pipelined_memcached.PipelinedClient```
+    rather than a ```tornadoasyncmemcache.ClientPool```.
+
+    Once no nodes are available reservations no longer wait on memcached
+    and ```unavailable_policy``` (one of ```UNAVAILABLE_POLICIES```)
+    decides the answer. Each such reservation increments the
+    ```memcached_nonce_store.unavailable``` counter and while the local
+    fallback is in use the ```memcached_nonce_store.is_degraded``` gauge
+    is 1. Note the local fallback only protects against replays seen by
+    this process.
+
+    Entries are written with an expiry of ```expiry``` seconds so
+    memcached's memory use is bounded by the write rate rather than
+    growing until memcached starts evicting entries. To help size the
+    memcached cluster, the rate at which this process writes entries and
+    an estimate of the memcached memory those entries occupy are reported
+    as the ```memcached_nonce_store.writes_per_second``` and
+    ```memcached_nonce_store.estimated_bytes``` gauges in
+    ```yar.util.metrics```."""
+
+    """Each item stored in memcached has a fixed overhead in addition
+    to its key and value. 56 bytes is the size of memcached's item header
+    on a 64 bit machine with CAS enabled plus a few bytes of suffix."""
+    _memcached_item_overhead_in_bytes = 56
+
+    _value = 1
+
+    """Key used when probing an ejected node."""
+    _probe_key = "yar-nonce-store-probe"
+
+    """Most keys remembered as having been reserved on a node other
+    than their home node. Releases happen while a request is being
+    authenticated so only recent reservations need to be remembered."""
+    _max_failed_over_keys = 10000
+
+    def __init__(self,
+                 servers,
+                 expiry=0,
+                 timeout=0.25,
+                 max_failures=2,
+                 probe_interval=5,
+                 pipelined=False,
+                 unavailable_policy=UNAVAILABLE_POLICY_REJECT,
+                 max_local_fingerprints=1000000):
+        """```servers``` is a collection of addresses (host:port strings
+        or unix domain socket paths) that point to the memcached cluster. ```expiry``` is the
+        number of seconds after which memcached should forget about
+        a nonce (0 = never forget). ```max_local_fingerprints``` sizes
+        the local fallback used by ```UNAVAILABLE_POLICY_LOCAL```."""
+        NonceStore.__init__(self)
+
+        self.servers = servers
+        self.expiry = expiry
+        self.timeout = timeout
+        self.max_failures = max_failures
+        self.probe_interval = probe_interval
+        self.unavailable_policy = unavailable_policy
+
+        self._local = None
+        if unavailable_policy == UNAVAILABLE_POLICY_LOCAL:
+            self._local = InProcessNonceStore(expiry or 60, max_local_fingerprints)
+        self._is_degraded = False
+
+        self._ring = HashRing(servers)
+        self._nodes = {address: _MemcachedNode(address, pipelined) for address in self._ring.nodes}
+
+        # key -> address of the node that accepted the key's reservation
+        # for keys reserved somewhere other than their home node
+        self._failed_over_keys = collections.OrderedDict()
+
+        # ```self._writes``` is a collection of [second, # of writes, # of bytes]
+        # for each of the last ```expiry``` seconds
+        self._writes = collections.deque()
+        self._resident_items = 0
+        self._resident_bytes = 0
+
+    def _healthy_nodes_for(self, key):
+        nodes = [self._nodes[address] for address in self._ring.nodes_for(key)]
+        return [node for node in nodes if not node.is_ejected]
+
+    def reserve(self, key, callback):
+        self._reserve(key, self._healthy_nodes_for(key), callback)
+
+    def _reserve(self, key, nodes, callback):
+        if not nodes:
+            self._on_unavailable(key, callback)
+            return
+
+        def on_add_done(is_ok, data):
+            if not is_ok:
+                # only fail over once the node has been ejected. until
+                # then the node may still hold the key, or come back and
+                # accept a replay of it, so the node's keys can't move
+                if nodes[0].is_ejected:
+                    self._reserve(key, nodes[1:], callback)
+                else:
+                    self._on_unavailable(key, callback)
+                return
+
+            is_fresh = nodes[0].is_stored(data)
+            if is_fresh:
+                self._on_write(key)
+                if nodes[0].address != self._ring.nodes_for(key)[0]:
+                    self._on_failed_over(key, nodes[0])
+            self._set_degraded(False)
+            callback(is_fresh)
+
+        self._execute(
+            nodes[0],
+            "add",
+            (key, self._value, self.expiry),
+            on_add_done)
+
+    def _on_unavailable(self, key, callback):
+        metrics.increment("memcached_nonce_store.unavailable")
+
+        if self.unavailable_policy == UNAVAILABLE_POLICY_LOCAL:
+            _logger.error(
+                "Memcached unavailable - reserving '%s' in local nonce store",
+                key)
+            self._set_degraded(True)
+            self._local.reserve(key, callback)
+            return
+
+        if self.unavailable_policy == UNAVAILABLE_POLICY_ACCEPT:
+            _logger.critical(
+                "Memcached unavailable - accepting '%s' without replay check",
+                key)
+            callback(True)
+            return
+
+        _logger.error("Memcached unavailable to reserve '%s'", key)
+        callback(False)
+
+    def _set_degraded(self, is_degraded):
+        if self._is_degraded == is_degraded:
+            return
+        self._is_degraded = is_degraded
+
+        if is_degraded:
+            _logger.critical("Memcached nonce store degraded to local nonce store")
+        else:
+            _logger.info("Memcached nonce store no longer degraded")
+        metrics.gauge("memcached_nonce_store.is_degraded", 1 if is_degraded else 0)
+
+    def release(self, key):
+        if self._local is not None:
+            self._local.release(key)
+
+        # the delete must go to the node that accepted the reservation
+        # which isn't necessarily the first node healthy right now
+        address = self._failed_over_keys.pop(key, None)
+        if address is None:
+            addresses = self._ring.nodes_for(key)
+            if not addresses:
+                return
+            address = addresses[0]
+        node = self._nodes[address]
+        if not node.is_ejected:
+            self._execute(node, "delete", (key,), lambda is_ok, data: None)
+
+    def _on_failed_over(self, key, node):
+        self._failed_over_keys[key] = node.address
+        while self._max_failed_over_keys < len(self._failed_over_keys):
+            self._failed_over_keys.popitem(last=False)
+
+    def _execute(self, node, operation, args, callback):
+        """Async'ly execute the memcached ```operation``` on ```node```.
+        When done call ```callback``` with two arguments: (i) a boolean
+        that's False if ```node``` didn't respond within ```self.timeout```
+        seconds or couldn't be reached (ii) the operation's result."""
+        io_loop = tornado.ioloop.IOLoop.current()
+        start_time = io_loop.time()
+        context = {"is_done": False}
+
+        def on_timeout():
+            if context["is_done"]:
+                return
+            context["is_done"] = True
+            self._on_node_failure(node)
+            callback(False, None)
+
+        def on_done(data):
+            if context["is_done"]:
+                # answer arrived after the operation timed out
+                return
+            if isinstance(data, PipelinedClientError):
+                # no point waiting for the timeout
+                io_loop.remove_timeout(timeout)
+                on_timeout()
+                return
+            context["is_done"] = True
+            io_loop.remove_timeout(timeout)
+            self._on_node_success(node, io_loop.time() - start_time)
+            callback(True, data)
+
+        timeout = io_loop.add_timeout(start_time + self.timeout, on_timeout)
+
+        getattr(node.ccs(), operation)(*args, callback=on_done)
+
+    def _on_node_success(self, node, duration):
+        node.consecutive_failures = 0
+        metrics.gauge(node.metric_name("latency_ms"), int(duration * 1000))
+
+    def _on_node_failure(self, node):
+        _logger.error("Memcached node '%s' timed out or is unreachable", node.address)
+        metrics.increment(node.metric_name("errors"))
+
+        node.consecutive_failures += 1
+        if node.is_ejected or node.consecutive_failures < self.max_failures:
+            return
+
+        _logger.error("Ejecting memcached node '%s'", node.address)
+        metrics.increment(node.metric_name("ejections"))
+        node.is_ejected = True
+        metrics.gauge(node.metric_name("is_ejected"), 1)
+        self._schedule_probe(node)
+
+    def _schedule_probe(self, node):
+        io_loop = tornado.ioloop.IOLoop.current()
+        io_loop.add_timeout(
+            io_loop.time() + self.probe_interval,
+            lambda: self._probe(node))
+
+    def _probe(self, node):
+        """Ask an ejected node for a key to see if it's healthy again."""
+        def on_probe_done(is_ok, data):
+            if not is_ok:
+                self._schedule_probe(node)
+                return
+            _logger.info("Returning memcached node '%s' to service", node.address)
+            node.is_ejected = False
+            metrics.gauge(node.metric_name("is_ejected"), 0)
+
+        self._execute(node, "get", (self._probe_key,), on_probe_done)
+
+    def _item_size(self, key):
+        """Estimated # of bytes memcached uses to store ```key```."""
+        return self._memcached_item_overhead_in_bytes + len(key) + len(str(self._value)) + 2
+
+    def _on_write(self, key):
+        metrics.increment("memcached_nonce_store.writes")
+
+        now = int(time.time())
+        if not self._writes or self._writes[-1][0] < now:
+            self._writes.append([now, 0, 0])
+        self._writes[-1][1] += 1
+        self._writes[-1][2] += self._item_size(key)
+        self._resident_items += 1
+        self._resident_bytes += self._item_size(key)
+
+        # entries written more than ```expiry``` seconds ago have been
+        # expired by memcached and no longer occupy memory
+        window = self.expiry if 0 < self.expiry else 60
+        while self._writes[0][0] <= now - window:
+            (second, items, bytes) = self._writes.popleft()
+            self._resident_items -= items
+            self._resident_bytes -= bytes
+
+        metrics.gauge(
+            "memcached_nonce_store.writes_per_second",
+            float(self._resident_items) / window)
+        if 0 < self.expiry:
+            metrics.gauge(
+                "memcached_nonce_store.estimated_bytes",
+                self._resident_bytes)
+
+
+class InProcessNonceStore(NonceStore):
+    """A nonce store that lives entirely inside the auth service's process
+    and is intended for single node and edge deployments where running a
+    memcached cluster isn't justified. Requests older than ```maxage```
+    seconds are rejected so a nonce only needs to be remembered for
+    ```maxage``` seconds after it's first seen.
+
+    Nonces are remembered as compact fingerprints (the first 8 bytes
+    of the SHA1 of the key). Fingerprints are grouped into a ring of
+    per-second buckets and whole buckets are dropped once they're older
+    than ```maxage```. A dict from fingerprint to bucket provides
+    O(1) reserve and release operations.
+
+    No more than ```max_fingerprints``` fingerprints are remembered.
+    When the store is full reservations fail (ie. fail closed) and the
+    ```inprocess_nonce_store.full``` counter is incremented.
+
+    The number of remembered fingerprints, the number of occupied
+    buckets, the most fingerprints in a single bucket and the estimated
+    memory used by the store are reported as gauges in
+    ```yar.util.metrics``` once per second."""
+
+    _fingerprint_size_in_bytes = 8
+
+    def __init__(self, maxage, max_fingerprints=1000000):
+        NonceStore.__init__(self)
+
+        self.maxage = maxage
+        self.max_fingerprints = max_fingerprints
+
+        # ```self._buckets``` is ordered from oldest to newest bucket.
+        # each bucket is a (second, set of fingerprints) tuple.
+        self._buckets = collections.deque()
+        self._fingerprints = {}
+
+    def __len__(self):
+        return len(self._fingerprints)
+
+    def reserve(self, key, callback):
+        now = int(time.time())
+        self._expire(now)
+
+        fingerprint = self._fingerprint(key)
+        if fingerprint in self._fingerprints:
+            callback(False)
+            return
+
+        if self.max_fingerprints <= len(self._fingerprints):
+            _logger.error(
+                "In process nonce store full (%d fingerprints)",
+                len(self._fingerprints))
+            metrics.increment("inprocess_nonce_store.full")
+            callback(False)
+            return
+
+        # :TRICKY: if the clock goes backwards the newest bucket
+        # is reused rather than breaking the ordering of self._buckets
+        if not self._buckets or self._buckets[-1][0] < now:
+            self._buckets.append((now, set()))
+        (second, bucket) = self._buckets[-1]
+        bucket.add(fingerprint)
+        self._fingerprints[fingerprint] = bucket
+
+        callback(True)
+
+    def release(self, key):
+        fingerprint = self._fingerprint(key)
+        bucket = self._fingerprints.pop(fingerprint, None)
+        if bucket is not None:
+            bucket.discard(fingerprint)
+
+    def _fingerprint(self, key):
+        return hashlib.sha1(key).digest()[:self._fingerprint_size_in_bytes]
+
+    def _expire(self, now):
+        """Drop all buckets that are more than ```maxage``` seconds old."""
+        if not self._buckets or now <= self._buckets[-1][0]:
+            return
+
+        oldest_second_to_keep = now - self.maxage
+        while self._buckets and self._buckets[0][0] < oldest_second_to_keep:
+            (second, bucket) = self._buckets.popleft()
+            for fingerprint in bucket:
+                del self._fingerprints[fingerprint]
+
+        self._report_metrics()
+
+    def memory_used(self):
+        """Return an estimate of the # of bytes used by this store."""
+        rv = sys.getsizeof(self._fingerprints)
+        rv += sys.getsizeof(self._buckets)
+        for (second, bucket) in self._buckets:
+            rv += sys.getsizeof(bucket)
+        rv += len(self._fingerprints) * sys.getsizeof(" " * self._fingerprint_size_in_bytes)
+        return rv
+
+    def _report_metrics(self):
+        metrics.gauge("inprocess_nonce_store.fingerprints", len(self._fingerprints))
+        metrics.gauge("inprocess_nonce_store.buckets", len(self._buckets))
+        max_bucket_size = max([len(bucket) for (second, bucket) in self._buckets] or [0])
+        metrics.gauge("inprocess_nonce_store.max_bucket_fingerprints", max_bucket_size)
+        metrics.gauge("inprocess_nonce_store.bytes", self.memory_used())
+
+
+class InFlightNonceStore(NonceStore):
+    """Sits in front of another nonce store (typically a
+    ```MemcachedNonceStore```) and rejects a reservation for a key whose
+    reservation by this process is still in flight to ```nonce_store```.
+    The key has definitely been seen so the replay is rejected without
+    another round trip. Every other reservation waits for ```nonce_store```'s
+    answer so ```nonce_store```'s replay protection and unavailable policy
+    are unchanged. Rejected in flight replays are counted by the
+    ```nonce_store.in_flight_replays``` counter in ```yar.util.metrics```."""
+
+    def __init__(self, nonce_store):
+        NonceStore.__init__(self)
+
+        self.nonce_store = nonce_store
+
+        # keys with a reservation in flight to ```self.nonce_store```
+        self._in_flight = set()
+
+    def reserve(self, key, callback):
+        if key in self._in_flight:
+            metrics.increment("nonce_store.in_flight_replays")
+            callback(False)
+            return
+
+        def on_reserve_done(is_fresh):
+            self._in_flight.discard(key)
+            callback(is_fresh)
+
+        self._in_flight.add(key)
+        self.nonce_store.reserve(key, on_reserve_done)
+
+    def release(self, key):
+        self.nonce_store.release(key)
@@ -0,0 +1,147 @@
+"""This module is a benchmark which compares the throughput
+and latency of nonce reservations made through a
+```tornadoasyncmemcache.ClientPool``` with reservations
+made through a ```pipelined_memcached.PipelinedClient```.
+The benchmark needs a running memcached - run it using
+something like:
+
+    python -m yar.auth_service.mac.nonce_store_benchmark --noncestore=127.0.0.1:11211
+
+For each concurrency level the benchmark keeps that many
+reservations outstanding until ```--requests``` reservations
+have completed and then reports reservations per second and
+latency percentiles."""
+
+import logging
+import optparse
+import time
+import uuid
+
+import tornado.ioloop
+
+from yar.auth_service.mac import nonce_store
+from yar.util import clparserutil
+
+
+class _Benchmark(object):
+
+    def __init__(self, ns, concurrency, number_requests):
+        object.__init__(self)
+
+        self._ns = ns
+        self._concurrency = concurrency
+        self._number_requests = number_requests
+
+        self._number_started = 0
+        self._latencies = []
+        self._number_not_fresh = 0
+
+    def run(self):
+        io_loop = tornado.ioloop.IOLoop.current()
+
+        start_time = time.time()
+        for i in range(self._concurrency):
+            self._reserve()
+        io_loop.start()
+        duration = time.time() - start_time
+
+        self._latencies.sort()
+
+        def percentile(p):
+            return self._latencies[int(len(self._latencies) * p / 100.0)] * 1000.0
+
+        return (
+            len(self._latencies) / duration,
+            percentile(50),
+            percentile(99),
+            self._number_not_fresh,
+        )
+
+    def _reserve(self):
+        if self._number_requests <= self._number_started:
+            return
+        self._number_started += 1
+
+        start_time = time.time()
+
+        def on_reserve_done(is_fresh):
+            self._latencies.append(time.time() - start_time)
+            if not is_fresh:
+                self._number_not_fresh += 1
+            if len(self._latencies) == self._number_requests:
+                tornado.ioloop.IOLoop.current().stop()
+                return
+            self._reserve()
+
+        self._ns.reserve(uuid.uuid4().hex, on_reserve_done)
+
+
+class _CommandLineParser(optparse.OptionParser):
+
+    def __init__(self):
+        optparse.OptionParser.__init__(
+            self,
+            "usage: %prog [options]",
+            option_class=clparserutil.Option)
+
+        default = ["127.0.0.1:11211"]
+        help = "memcached servers for nonce store - default = %s" % default
+        self.add_option(
+            "--noncestore",
+            action="store",
+            dest="nonce_store",
+            default=default,
+            type="addresses",
+            help=help)
+
+        default = 10000
+        help = "reservations per concurrency level - default = %d" % default
+        self.add_option(
+            "--requests",
+            action="store",
+            dest="number_requests",
+            default=default,
+            type=int,
+            help=help)
+
+        default = "10,100,1000"
+        help = "comma separated concurrency levels - default = %s" % default
+        self.add_option(
+            "--concurrency",
+            action="store",
+            dest="concurrency",
+            default=default,
+            type="string",
+            help=help)
+
+
+if __name__ == "__main__":
+    clp = _CommandLineParser()
+    (clo, cla) = clp.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+
+    print "%-10s %11s %10s %10s %10s %10s" % (
+        "client",
+        "concurrency",
+        "ops/sec",
+        "p50 ms",
+        "p99 ms",
+        "not fresh")
+
+    for concurrency in [int(c) for c in clo.concurrency.split(",")]:
+        for (name, pipelined) in [("pool", False), ("pipelined", True)]:
+            ns = nonce_store.MemcachedNonceStore(
+                clo.nonce_store,
+                expiry=60,
+                timeout=10,
+                pipelined=pipelined)
+            benchmark = _Benchmark(ns, concurrency, clo.number_requests)
+            (ops_per_second, p50, p99, number_not_fresh) = benchmark.run()
+            print "%-10s %11d %10.0f %10.2f %10.2f %10d" % (
+                name,
+                concurrency,
+                ops_per_second,
+                p50,
+                p99,
+                number_not_fresh)
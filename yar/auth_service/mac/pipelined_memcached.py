@@ -0,0 +1,240 @@
+"""This module implements a memcached client which batches and
+pipelines operations. All operations issued during a single
+iteration of the IOLoop are written to memcached as a single
+network write, with consecutive gets coalesced into a single
+multi-key get, and memcached's responses, which arrive in the
+same order as the operations, are routed back to each operation's
+callback. Compared to ```tornadoasyncmemcache.ClientPool```, which
+issues each operation on its own pooled connection and waits for
+the response before the connection can be reused, this removes most
+of the per operation overhead when the auth service is handling
+thousands of requests per second."""
+
+import collections
+import logging
+
+import tornado.ioloop
+import tornado.iostream
+
+from yar.util import metrics
+from yar.util import transport
+
+_logger = logging.getLogger("AUTHSERVICE.%s" % __name__)
+
+
+class PipelinedClientError(Exception):
+    """Passed to the callbacks of operations which failed because
+    the connection to memcached couldn't be opened or was lost."""
+    pass
+
+
+class PipelinedClient(object):
+    """A pipelining client for a single memcached node. The client
+    implements the subset of ```tornadoasyncmemcache.ClientPool```'s
+    interface used by the nonce store (```add()```, ```delete()```
+    and ```get()```) so the two can be used interchangeably.
+
+    memcached's text protocol only has a multi-key form of ```get```
+    so ```add``` and ```delete``` are pipelined as individual commands.
+
+    The client doesn't time out operations and the caller is expected
+    to enforce a timeout (see
+    ```yar.auth_service.mac.nonce_store.MemcachedNonceStore```). If the
+    connection to memcached can't be opened or is lost the callbacks of
+    all outstanding operations are called straight away with a
+    ```PipelinedClientError```. The size of each batch is reported as
+    the ```pipelined_memcached.batch_size``` gauge in
+    ```yar.util.metrics```."""
+
+    """Most keys in a single multi-key get."""
+    _max_keys_per_get = 100
+
+    def __init__(self, address):
+        """```address``` is either a host:port string or the path
+        of a unix domain socket identifying the memcached node."""
+        object.__init__(self)
+
+        self.address = address
+
+        self._stream = None
+        self._is_connecting = False
+        self._is_flush_scheduled = False
+        self._is_reading = False
+
+        # operations which have not yet been written to memcached - each
+        # operation is a (command, key, callback) tuple where command is
+        # None for a get so consecutive gets can be coalesced
+        self._pending = []
+
+        # operations that have been written to memcached in the order
+        # memcached will respond to them - each is a [command, keys,
+        # callbacks] list where keys is None for anything but a get
+        self._in_flight = collections.deque()
+
+        # values returned so far by the multi-key get being read
+        self._values = {}
+
+    def add(self, key, value, time, callback):
+        """Store ```value``` for ```key``` only if ```key``` isn't
+        already stored. ```callback``` is called with True if
+        ```value``` was stored and otherwise False."""
+        value = str(value)
+        command = "add %s 0 %d %d\r\n%s\r\n" % (key, time, len(value), value)
+        self._execute(command, key, callback)
+
+    def delete(self, key, callback):
+        """Delete ```key```. ```callback``` is called with True
+        if ```key``` was deleted and otherwise False."""
+        self._execute("delete %s\r\n" % key, key, callback)
+
+    def get(self, key, callback):
+        """Get the value stored for ```key```. ```callback``` is called
+        with the value or None if ```key``` isn't stored."""
+        self._execute(None, key, callback)
+
+    def _execute(self, command, key, callback):
+        self._pending.append((command, key, callback))
+
+        if not self._is_flush_scheduled:
+            self._is_flush_scheduled = True
+            tornado.ioloop.IOLoop.current().add_callback(self._flush)
+
+    def _flush(self):
+        self._is_flush_scheduled = False
+
+        if not self._pending:
+            return
+
+        if self._stream is None:
+            self._connect()
+            return
+
+        pending = self._pending
+        self._pending = []
+
+        metrics.gauge("pipelined_memcached.batch_size", len(pending))
+
+        operations = []
+        for (command, key, callback) in pending:
+            if command is not None:
+                operations.append([command, None, [callback]])
+                continue
+
+            if operations and operations[-1][0] is None and len(operations[-1][1]) < self._max_keys_per_get:
+                operations[-1][1].append(key)
+                operations[-1][2].append(callback)
+            else:
+                operations.append([None, [key], [callback]])
+
+        for operation in operations:
+            if operation[0] is None:
+                operation[0] = "get %s\r\n" % " ".join(operation[1])
+
+        try:
+            self._stream.write("".join([command for (command, keys, callbacks) in operations]))
+        except tornado.iostream.StreamClosedError:
+            self._fail(operations)
+            self._on_close()
+            return
+
+        self._in_flight.extend(operations)
+
+        if not self._is_reading:
+            self._is_reading = True
+            self._read_response()
+
+    def _connect(self):
+        if self._is_connecting:
+            return
+        self._is_connecting = True
+
+        _logger.info("Connecting to memcached node '%s'", self.address)
+
+        future = transport.connect(self.address)
+        tornado.ioloop.IOLoop.current().add_future(future, self._on_connect)
+
+    def _on_connect(self, future):
+        self._is_connecting = False
+
+        try:
+            self._stream = future.result()
+        except Exception as ex:
+            _logger.error(
+                "Error connecting to memcached node '%s' - %s",
+                self.address,
+                ex)
+            pending = self._pending
+            self._pending = []
+            self._fail([[command, [key], [callback]] for (command, key, callback) in pending])
+            return
+
+        self._stream.set_close_callback(self._on_close)
+        self._flush()
+
+    def _on_close(self):
+        _logger.error("Lost connection to memcached node '%s'", self.address)
+
+        self._stream = None
+        self._is_reading = False
+        self._values = {}
+
+        in_flight = list(self._in_flight)
+        self._in_flight.clear()
+        self._fail(in_flight)
+
+    def _fail(self, operations):
+        error = PipelinedClientError("No connection to memcached node '%s'" % self.address)
+        for (command, keys, callbacks) in operations:
+            for callback in callbacks:
+                callback(error)
+
+    def _read_line(self, callback):
+        try:
+            self._stream.read_until("\r\n", lambda line: callback(line[:-2]))
+        except tornado.iostream.StreamClosedError:
+            self._on_close()
+
+    def _read_response(self):
+        if not self._in_flight or self._stream is None:
+            self._is_reading = False
+            return
+
+        self._read_line(self._on_response_line)
+
+    def _on_response_line(self, line):
+        if line.startswith("VALUE "):
+            # VALUE <key> <flags> <bytes>\r\n<data>\r\n ... END\r\n
+            (key, number_bytes) = (line.split(" ")[1], int(line.split(" ")[3]))
+            try:
+                self._stream.read_bytes(number_bytes + 2, lambda data: self._on_value(key, data))
+            except tornado.iostream.StreamClosedError:
+                self._on_close()
+            return
+
+        if line in ["STORED", "DELETED"]:
+            self._on_response(True)
+        elif line in ["NOT_STORED", "NOT_FOUND", "EXISTS"]:
+            self._on_response(False)
+        elif line == "END":
+            self._on_response(None)
+        else:
+            _logger.error(
+                "Error response from memcached node '%s' - '%s'",
+                self.address,
+                line)
+            self._on_response(None)
+
+    def _on_value(self, key, data):
+        self._values[key] = data[:-2]
+        self._read_line(self._on_response_line)
+
+    def _on_response(self, data):
+        (command, keys, callbacks) = self._in_flight.popleft()
+        if keys is None:
+            callbacks[0](data)
+        else:
+            values = self._values
+            self._values = {}
+            for (key, callback) in zip(keys, callbacks):
+                callback(values.get(key, None))
+        self._read_response()
@@ -1,18 +1,69 @@
 """This module implements the unit tests for the auth service's
 async_mac_auth module."""
 
+import hashlib
 import httplib
 import os
 import sys
 
 import mock
 import tornado.httputil
+import tornado.testing
 
+from yar.auth_service import request_body
 from yar.auth_service.mac import async_mac_auth
 from yar.util import mac
 from yar.tests import yar_test_util
 
 
+class AsyncNonceCheckerPatch(object):
+    """A helper class that patches ```AsyncNonceChecker.fetch``` with
+    ```fetch_patch``` and ```AsyncNonceChecker.release``` with a mock.
+    Returns the release mock on entry so callers can confirm if
+    the nonce reservation was released."""
+
+    def __init__(self, fetch_patch):
+        name = (
+            "yar.auth_service.mac."
+            "async_nonce_checker.AsyncNonceChecker.fetch"
+        )
+        self._fetch_patcher = mock.patch(name, fetch_patch)
+
+        self.release = mock.Mock()
+        name = (
+            "yar.auth_service.mac."
+            "async_nonce_checker.AsyncNonceChecker.release"
+        )
+        self._release_patcher = mock.patch(name, self.release)
+
+    def __enter__(self):
+        self._fetch_patcher.start()
+        self._release_patcher.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._release_patcher.stop()
+        self._fetch_patcher.stop()
+
+
+class AsyncMACCredsRetrieverPatch(object):
+    """A helper class that patches ```AsyncMACCredsRetriever.fetch```
+    with ```fetch_patch```."""
+
+    def __init__(self, fetch_patch):
+        name = (
+            "yar.auth_service.mac."
+            "async_mac_creds_retriever.AsyncMACCredsRetriever.fetch"
+        )
+        self._patcher = mock.patch(name, fetch_patch)
+
+    def __enter__(self):
+        self._patcher.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._patcher.stop()
+
+
 class TestAsyncMACAuth(yar_test_util.TestCase):
 
     _maxage = 30
@@ -145,25 +196,75 @@ class TestAsyncMACAuth(yar_test_util.TestCase):
         def async_nonce_checker_fetch_patch(anc, callback):
             callback(False)
 
-        name_of_method_to_patch = (
-            "yar.auth_service.mac."
-            "async_nonce_checker.AsyncNonceChecker.fetch"
-        )
-        with mock.patch(name_of_method_to_patch, async_nonce_checker_fetch_patch):
-            auth_header_value = mac.AuthHeaderValue(
-                mac_key_identifier=mac.MACKeyIdentifier.generate(),
-                ts=mac.Timestamp.generate(),
-                nonce=mac.Nonce.generate(),
-                ext=mac.Ext.generate(content_type=None, body=None),
-                mac=mac.MAC("0123456789"))
+        def async_creds_retriever_fetch_patch(acr, callback):
+            callback(False, the_mac_key_identifier)
 
-            request = mock.Mock()
-            request.headers = tornado.httputil.HTTPHeaders({
-                "Authorization": str(auth_header_value),
-            })
+        the_mac_key_identifier = mac.MACKeyIdentifier.generate()
 
-            aha = async_mac_auth.AsyncMACAuth(request)
-            aha.authenticate(on_auth_done)
+        with AsyncNonceCheckerPatch(async_nonce_checker_fetch_patch) as ancp:
+            with AsyncMACCredsRetrieverPatch(async_creds_retriever_fetch_patch):
+                auth_header_value = mac.AuthHeaderValue(
+                    mac_key_identifier=the_mac_key_identifier,
+                    ts=mac.Timestamp.generate(),
+                    nonce=mac.Nonce.generate(),
+                    ext=mac.Ext.generate(content_type=None, body=None),
+                    mac=mac.MAC("0123456789"))
+
+                request = mock.Mock()
+                request.headers = tornado.httputil.HTTPHeaders({
+                    "Authorization": str(auth_header_value),
+                })
+
+                aha = async_mac_auth.AsyncMACAuth(request)
+                aha.authenticate(on_auth_done)
+
+            # a nonce that wasn't reserved should never be released
+            self.assertEqual(ancp.release.call_count, 0)
+
+    def test_malformed_mac_key_identifier(self):
+        """When a request contains a mac key identifier that can't possibly
+        have been generated by the key service, confirm that
+        ```async_mac_auth.AsyncMACAuth``` tags this as an authentication
+        failure with
+        ```async_mac_auth.AUTH_FAILURE_DETAIL_INVALID_MAC_KEY_IDENTIFIER```
+        detailed error code without checking the nonce or asking the key
+        service for credentials."""
+
+        on_auth_done = mock.Mock()
+        async_nonce_checker_fetch_patch = mock.Mock()
+        async_creds_retriever_fetch_patch = mock.Mock()
+
+        with AsyncNonceCheckerPatch(async_nonce_checker_fetch_patch):
+            with AsyncMACCredsRetrieverPatch(async_creds_retriever_fetch_patch):
+                the_mac_key_identifiers = [
+                    "dave",
+                    mac.MACKeyIdentifier.generate().upper(),
+                    mac.MACKeyIdentifier.generate() + "0",
+                ]
+                for the_mac_key_identifier in the_mac_key_identifiers:
+                    on_auth_done.reset_mock()
+
+                    auth_header_value = mac.AuthHeaderValue(
+                        mac_key_identifier=the_mac_key_identifier,
+                        ts=mac.Timestamp.generate(),
+                        nonce=mac.Nonce.generate(),
+                        ext=mac.Ext.generate(content_type=None, body=None),
+                        mac=mac.MAC("0123456789"))
+
+                    request = mock.Mock()
+                    request.headers = tornado.httputil.HTTPHeaders({
+                        "Authorization": str(auth_header_value),
+                    })
+
+                    aha = async_mac_auth.AsyncMACAuth(request)
+                    aha.authenticate(on_auth_done)
+
+                    on_auth_done.assert_called_once_with(
+                        False,
+                        async_mac_auth.AUTH_FAILURE_DETAIL_INVALID_MAC_KEY_IDENTIFIER)
+
+        self.assertFalse(async_nonce_checker_fetch_patch.called)
+        self.assertFalse(async_creds_retriever_fetch_patch.called)
 
     def test_creds_not_found(self):
         """When a request contains Authorization HTTP header with a
@@ -188,20 +289,12 @@ class TestAsyncMACAuth(yar_test_util.TestCase):
         def async_nonce_checker_fetch_patch(anc, callback):
             callback(True)
 
-        name_of_method_to_patch = (
-            "yar.auth_service.mac."
-            "async_nonce_checker.AsyncNonceChecker.fetch"
-        )
-        with mock.patch(name_of_method_to_patch, async_nonce_checker_fetch_patch):
+        with AsyncNonceCheckerPatch(async_nonce_checker_fetch_patch) as ancp:
 
             def async_creds_retriever_fetch_patch(acr, callback):
                 callback(False, the_mac_key_identifier)
 
-            name_of_method_to_patch = (
-                "yar.auth_service.mac."
-                "async_mac_creds_retriever.AsyncMACCredsRetriever.fetch"
-            )
-            with mock.patch(name_of_method_to_patch, async_creds_retriever_fetch_patch):
+            with AsyncMACCredsRetrieverPatch(async_creds_retriever_fetch_patch):
 
                 auth_header_value = mac.AuthHeaderValue(
                     mac_key_identifier=the_mac_key_identifier,
@@ -218,6 +311,9 @@ class TestAsyncMACAuth(yar_test_util.TestCase):
                 aha = async_mac_auth.AsyncMACAuth(request)
                 aha.authenticate(on_auth_done)
 
+            # request wasn't valid so the nonce reservation is released
+            self.assertEqual(ancp.release.call_count, 1)
+
     def _test_mac_good_or_bad(self, the_method, the_bad_mac):
         """When a request contains an Authorization HTTP header that
         correctly authenticates a caller."""
@@ -257,11 +353,7 @@ class TestAsyncMACAuth(yar_test_util.TestCase):
         def async_nonce_checker_fetch_patch(anc, callback):
             callback(True)
 
-        name_of_method_to_patch = (
-            "yar.auth_service.mac."
-            "async_nonce_checker.AsyncNonceChecker.fetch"
-        )
-        with mock.patch(name_of_method_to_patch, async_nonce_checker_fetch_patch):
+        with AsyncNonceCheckerPatch(async_nonce_checker_fetch_patch) as ancp:
 
             def async_creds_retriever_fetch_patch(acr, callback):
                 self.assertIsNotNone(acr)
@@ -273,11 +365,7 @@ class TestAsyncMACAuth(yar_test_util.TestCase):
                     the_mac_key,
                     the_principal)
 
-            name_of_method_to_patch = (
-                "yar.auth_service.mac."
-                "async_mac_creds_retriever.AsyncMACCredsRetriever.fetch"
-            )
-            with mock.patch(name_of_method_to_patch, async_creds_retriever_fetch_patch):
+            with AsyncMACCredsRetrieverPatch(async_creds_retriever_fetch_patch):
 
                 auth_header_value = mac.AuthHeaderValue(
                     the_mac_key_identifier,
@@ -327,6 +415,10 @@ class TestAsyncMACAuth(yar_test_util.TestCase):
                 aha = async_mac_auth.AsyncMACAuth(request)
                 aha.authenticate(on_auth_done)
 
+            # the nonce should only be recorded as used by valid requests
+            expected_release_call_count = 0 if the_bad_mac is None else 1
+            self.assertEqual(ancp.release.call_count, expected_release_call_count)
+
     def test_mac_bad_on_get(self):
         self._test_mac_good_or_bad(
             the_method="GET",
@@ -341,3 +433,232 @@ class TestAsyncMACAuth(yar_test_util.TestCase):
         self._test_mac_good_or_bad(
             the_method="GET",
             the_bad_mac=None)
+
+    def test_nonce_check_and_creds_retrieval_are_concurrent(self):
+        """Confirm that ```async_mac_auth.AsyncMACAuth``` starts the nonce
+        check and the credentials retrieval before either has completed
+        and only completes authentication once both have completed."""
+
+        the_mac_key_identifier = mac.MACKeyIdentifier.generate()
+
+        pending_callbacks = {}
+
+        def async_nonce_checker_fetch_patch(anc, callback):
+            pending_callbacks["nonce"] = callback
+
+        def async_creds_retriever_fetch_patch(acr, callback):
+            pending_callbacks["creds"] = callback
+
+        on_auth_done = mock.Mock()
+
+        with AsyncNonceCheckerPatch(async_nonce_checker_fetch_patch) as ancp:
+            with AsyncMACCredsRetrieverPatch(async_creds_retriever_fetch_patch):
+                auth_header_value = mac.AuthHeaderValue(
+                    mac_key_identifier=the_mac_key_identifier,
+                    ts=mac.Timestamp.generate(),
+                    nonce=mac.Nonce.generate(),
+                    ext=mac.Ext.generate(content_type=None, body=None),
+                    mac=mac.MAC("0123456789"))
+
+                request = mock.Mock()
+                request.headers = tornado.httputil.HTTPHeaders({
+                    "Authorization": str(auth_header_value),
+                })
+
+                aha = async_mac_auth.AsyncMACAuth(request)
+                aha.authenticate(on_auth_done)
+
+                self.assertEqual(set(pending_callbacks.keys()), set(["nonce", "creds"]))
+
+                pending_callbacks["creds"](False, the_mac_key_identifier)
+                self.assertEqual(on_auth_done.call_count, 0)
+
+                pending_callbacks["nonce"](True)
+                on_auth_done.assert_called_once_with(
+                    False,
+                    async_mac_auth.AUTH_FAILURE_DETAIL_CREDS_NOT_FOUND)
+
+            self.assertEqual(ancp.release.call_count, 1)
+
+    def _test_deadline_exceeded(self, is_nonce_ok, expected_release_call_count):
+        """Confirm that when the deadline is exceeded during the nonce check
+        or the credentials retrieval ```async_mac_auth.AsyncMACAuth``` fails
+        authentication and releases the nonce if it was reserved."""
+
+        the_mac_key_identifier = mac.MACKeyIdentifier.generate()
+
+        def async_nonce_checker_fetch_patch(anc, callback):
+            callback(is_nonce_ok)
+
+        def async_creds_retriever_fetch_patch(acr, callback):
+            callback(False, the_mac_key_identifier)
+
+        on_auth_done = mock.Mock()
+
+        with AsyncNonceCheckerPatch(async_nonce_checker_fetch_patch) as ancp:
+            with AsyncMACCredsRetrieverPatch(async_creds_retriever_fetch_patch):
+                auth_header_value = mac.AuthHeaderValue(
+                    mac_key_identifier=the_mac_key_identifier,
+                    ts=mac.Timestamp.generate(),
+                    nonce=mac.Nonce.generate(),
+                    ext=mac.Ext.generate(content_type=None, body=None),
+                    mac=mac.MAC("0123456789"))
+
+                request = mock.Mock()
+                request.headers = tornado.httputil.HTTPHeaders({
+                    "Authorization": str(auth_header_value),
+                })
+
+                deadline = mock.Mock()
+                deadline.exceeded_stage = "creds_retrieval"
+
+                aha = async_mac_auth.AsyncMACAuth(request, deadline=deadline)
+                aha.authenticate(on_auth_done)
+
+                on_auth_done.assert_called_once_with(False)
+
+            self.assertEqual(ancp.release.call_count, expected_release_call_count)
+
+    def test_deadline_exceeded_releases_reserved_nonce(self):
+        self._test_deadline_exceeded(True, 1)
+
+    def test_deadline_exceeded_with_unreserved_nonce(self):
+        self._test_deadline_exceeded(False, 0)
+
+
+class TestAsyncMACAuthWithRequestBody(tornado.testing.AsyncTestCase):
+
+    def _test_macs_do_not_match(self, offload_threshold):
+        """Verify authentication failure debug details include the
+        SHA-1 of a request body supplied as a ```RequestBody``` whether
+        or not the SHA-1 is computed on ```worker_pool```'s threads."""
+        the_body = "bindle berry" * 1000
+        the_content_type = "text/plain"
+
+        auth_header_value = mac.AuthHeaderValue(
+            mac_key_identifier=mac.MACKeyIdentifier.generate(),
+            ts=mac.Timestamp.generate(),
+            nonce=mac.Nonce.generate(),
+            ext=mac.Ext.generate(the_content_type, the_body),
+            mac=mac.MAC("0123456789"))
+
+        request = mock.Mock()
+        request.method = "POST"
+        request.uri = "/dave.html"
+        request.headers = tornado.httputil.HTTPHeaders({
+            "Authorization": str(auth_header_value),
+            "Content-Type": the_content_type,
+            "Content-Length": str(len(the_body)),
+        })
+
+        with mock.patch.object(request_body, "offload_threshold", offload_threshold):
+            the_request_body = request_body.RequestBody(request)
+            the_request_body.append(the_body)
+            the_request_body.complete()
+
+            def async_nonce_checker_fetch_patch(anc, callback):
+                callback(True)
+
+            def async_creds_retriever_fetch_patch(acr, callback):
+                callback(
+                    True,
+                    auth_header_value.mac_key_identifier,
+                    mac.MAC.algorithm,
+                    mac.MACKey.generate(),
+                    "das@example.com")
+
+            with AsyncNonceCheckerPatch(async_nonce_checker_fetch_patch) as ancp:
+                with AsyncMACCredsRetrieverPatch(async_creds_retriever_fetch_patch):
+                    def on_auth_done(*args, **kwargs):
+                        self.stop((args, kwargs))
+
+                    aha = async_mac_auth.AsyncMACAuth(request, the_request_body)
+                    aha.authenticate(on_auth_done)
+                    (args, kwargs) = self.wait()
+
+                self.assertEqual(ancp.release.call_count, 1)
+
+            self.assertEqual(args, (False,))
+            self.assertEqual(
+                kwargs["auth_failure_detail"],
+                async_mac_auth.AUTH_FAILURE_DETAIL_MACS_DO_NOT_MATCH)
+
+            # debug details are only generated on demand
+            generate_auth_failure_debug_details = kwargs["auth_failure_debug_details"]
+            self.assertTrue(callable(generate_auth_failure_debug_details))
+            generate_auth_failure_debug_details(self.stop)
+            auth_failure_debug_details = self.wait()
+
+            the_request_body.close()
+
+        self.assertEqual(auth_failure_debug_details["BODY-LEN"], len(the_body))
+        self.assertEqual(
+            auth_failure_debug_details["BODY-SHA1"],
+            hashlib.sha1(the_body).hexdigest())
+
+    def test_macs_do_not_match(self):
+        self._test_macs_do_not_match(offload_threshold=0)
+
+    def test_macs_do_not_match_offloaded(self):
+        self._test_macs_do_not_match(offload_threshold=1024)
+
+    def test_body_less_checks_done_before_body_received(self):
+        """Verify a request whose credentials don't exist is rejected
+        before its body has been received and a request whose
+        credentials do exist waits for the body before its MAC is
+        verified."""
+        for is_creds_ok in [False, True]:
+            auth_header_value = mac.AuthHeaderValue(
+                mac_key_identifier=mac.MACKeyIdentifier.generate(),
+                ts=mac.Timestamp.generate(),
+                nonce=mac.Nonce.generate(),
+                ext=mac.Ext(""),
+                mac=mac.MAC("0123456789"))
+
+            request = mock.Mock()
+            request.method = "POST"
+            request.uri = "/dave.html"
+            request.headers = tornado.httputil.HTTPHeaders({
+                "Authorization": str(auth_header_value),
+                "Content-Length": "4",
+            })
+
+            on_waiting = mock.Mock()
+            the_request_body = request_body.RequestBody(request, on_waiting)
+
+            def async_nonce_checker_fetch_patch(anc, callback):
+                callback(True)
+
+            def async_creds_retriever_fetch_patch(acr, callback):
+                callback(
+                    is_creds_ok,
+                    auth_header_value.mac_key_identifier,
+                    mac.MAC.algorithm,
+                    mac.MACKey.generate(),
+                    "das@example.com")
+
+            on_auth_done = mock.Mock()
+
+            with AsyncNonceCheckerPatch(async_nonce_checker_fetch_patch):
+                with AsyncMACCredsRetrieverPatch(async_creds_retriever_fetch_patch):
+                    aha = async_mac_auth.AsyncMACAuth(request, the_request_body)
+                    aha.authenticate(on_auth_done)
+
+                    if is_creds_ok:
+                        self.assertEqual(on_auth_done.call_count, 0)
+                        on_waiting.assert_called_once_with()
+
+                        the_request_body.append("dave")
+                        the_request_body.complete()
+
+                        self.assertEqual(on_auth_done.call_count, 1)
+                        self.assertEqual(
+                            on_auth_done.call_args[1]["auth_failure_detail"],
+                            async_mac_auth.AUTH_FAILURE_DETAIL_MACS_DO_NOT_MATCH)
+                    else:
+                        on_auth_done.assert_called_once_with(
+                            False,
+                            async_mac_auth.AUTH_FAILURE_DETAIL_CREDS_NOT_FOUND)
+                        self.assertFalse(on_waiting.called)
+
+            the_request_body.close()
@@ -10,10 +10,14 @@ import mock
 import tornado.httpclient
 import tornado.httputil
 
+from yar.auth_service import creds_cache
+from yar.auth_service import key_service_client
 from yar.auth_service.mac import async_mac_creds_retriever
 from yar import key_service
 from yar.key_service import jsonschemas
+from yar.util import deadline
 from yar.util import mac
+from yar.util import metrics
 from yar.tests import yar_test_util
 
 
@@ -255,3 +259,268 @@ class TestAsyncMACCredsRetriever(yar_test_util.TestCase):
         with mock.patch(name_of_method_to_patch, async_http_client_fetch_patch):
             acr = async_mac_creds_retriever.AsyncMACCredsRetriever(the_mac_key_identifier)
             acr.fetch(on_async_mac_creds_retriever_done)
+
+    def test_creds_cache(self):
+        """Confirm that when ```async_mac_creds_retriever.creds_cache```
+        is configured, successfully retrieved credentials and not found
+        responses are served from the cache rather than the key service."""
+        the_mac_key_identifier = mac.MACKeyIdentifier.generate()
+        the_unknown_mac_key_identifier = mac.MACKeyIdentifier.generate()
+        the_mac_algorithm = "hmac-sha-1"
+        the_mac_key = mac.MACKey.generate()
+        the_principal = "das@example.com"
+
+        self._number_key_service_requests = 0
+
+        def async_http_client_fetch_patch(http_client, request, callback):
+            self._number_key_service_requests += 1
+
+            response = mock.Mock()
+            response.request_time = 24
+            if request.url.endswith(the_unknown_mac_key_identifier):
+                response.error = "something"
+                response.code = httplib.NOT_FOUND
+                callback(response)
+                return
+
+            response.error = None
+            response.code = httplib.OK
+            response.body = json.dumps({
+                "mac": {
+                    "mac_algorithm": the_mac_algorithm,
+                    "mac_key": the_mac_key,
+                    "mac_key_identifier": the_mac_key_identifier,
+                },
+                "principal": the_principal,
+                "links": {
+                    "self": {
+                        "href": "abc",
+                    }
+                }
+            })
+            response.headers = tornado.httputil.HTTPHeaders({
+                "Content-type": "application/json; charset=utf8",
+                "Content-length": str(len(response.body)),
+            })
+            callback(response)
+
+        def on_found_done(is_ok, mac_key_identifier, mac_algorithm, mac_key, principal):
+            self.assertTrue(is_ok)
+            self.assertEqual(mac_key_identifier, the_mac_key_identifier)
+            self.assertEqual(mac_algorithm, the_mac_algorithm)
+            self.assertEqual(mac_key, the_mac_key)
+            self.assertEqual(principal, the_principal)
+
+        def on_not_found_done(is_ok, mac_key_identifier):
+            self.assertFalse(is_ok)
+            self.assertEqual(mac_key_identifier, the_unknown_mac_key_identifier)
+
+        the_creds_cache = creds_cache.CredsCache("cc")
+        name_of_method_to_patch = "tornado.httpclient.AsyncHTTPClient.fetch"
+        with mock.patch(name_of_method_to_patch, async_http_client_fetch_patch):
+            with mock.patch.object(async_mac_creds_retriever, "creds_cache", the_creds_cache):
+                for i in range(3):
+                    acr = async_mac_creds_retriever.AsyncMACCredsRetriever(the_mac_key_identifier)
+                    acr.fetch(on_found_done)
+
+                    acr = async_mac_creds_retriever.AsyncMACCredsRetriever(the_unknown_mac_key_identifier)
+                    acr.fetch(on_not_found_done)
+
+        self.assertEqual(self._number_key_service_requests, 2)
+
+    def test_concurrent_fetches_are_collapsed(self):
+        """Confirm that concurrent fetches for the same mac key identifier
+        result in a single request to the key service and that all callers
+        are told about the result."""
+        the_mac_key_identifier = mac.MACKeyIdentifier.generate()
+
+        in_flight_callbacks = []
+
+        def async_http_client_fetch_patch(http_client, request, callback):
+            self.assertKeyServerRequestOk(request, the_mac_key_identifier)
+            in_flight_callbacks.append(callback)
+
+        answers = []
+
+        def on_async_mac_creds_retriever_done(is_ok, mac_key_identifier):
+            answers.append(is_ok)
+            self.assertEqual(mac_key_identifier, the_mac_key_identifier)
+
+        name_of_method_to_patch = "tornado.httpclient.AsyncHTTPClient.fetch"
+        with mock.patch(name_of_method_to_patch, async_http_client_fetch_patch):
+            for i in range(5):
+                acr = async_mac_creds_retriever.AsyncMACCredsRetriever(the_mac_key_identifier)
+                acr.fetch(on_async_mac_creds_retriever_done)
+
+        self.assertEqual(len(in_flight_callbacks), 1)
+        self.assertEqual(answers, [])
+
+        response = mock.Mock()
+        response.error = "something"
+        response.code = 599
+        response.request_time = 24
+        in_flight_callbacks[0](response)
+
+        self.assertEqual(answers, [False] * 5)
+
+    def test_shared_fetch_isnt_bound_by_leaders_deadline(self):
+        """Confirm that a caller whose deadline has passed doesn't cause
+        the other callers sharing a single flight, which have time left,
+        to fail."""
+        the_mac_key_identifier = mac.MACKeyIdentifier.generate()
+
+        in_flight_callbacks = []
+
+        def async_http_client_fetch_patch(http_client, request, callback):
+            self.assertKeyServerRequestOk(request, the_mac_key_identifier)
+            self.assertEqual(request.headers[deadline.header_name], "1000")
+            self.assertEqual(request.request_timeout, 1)
+            in_flight_callbacks.append(callback)
+
+        answers = []
+
+        def on_async_mac_creds_retriever_done(is_ok, mac_key_identifier, *args):
+            answers.append(is_ok)
+
+        name_of_method_to_patch = "tornado.httpclient.AsyncHTTPClient.fetch"
+        with mock.patch("time.time", return_value=100.0) as time_patch:
+            leaders_deadline = deadline.Deadline(1)
+            followers_deadline = deadline.Deadline(10)
+            with mock.patch(name_of_method_to_patch, async_http_client_fetch_patch):
+                for the_deadline in [leaders_deadline, followers_deadline]:
+                    acr = async_mac_creds_retriever.AsyncMACCredsRetriever(
+                        the_mac_key_identifier,
+                        the_deadline)
+                    acr.fetch(on_async_mac_creds_retriever_done)
+
+            self.assertEqual(len(in_flight_callbacks), 1)
+
+            time_patch.return_value = 102.0
+
+            response = mock.Mock()
+            response.error = None
+            response.code = httplib.OK
+            response.body = json.dumps({
+                "mac": {
+                    "mac_algorithm": "hmac-sha-1",
+                    "mac_key": mac.MACKey.generate(),
+                    "mac_key_identifier": the_mac_key_identifier,
+                },
+                "principal": "das@example.com",
+                "links": {
+                    "self": {
+                        "href": "abc",
+                    }
+                }
+            })
+            response.headers = tornado.httputil.HTTPHeaders({
+                "Content-type": "application/json; charset=utf8",
+                "Content-length": str(len(response.body)),
+            })
+            response.request_time = 2
+            in_flight_callbacks[0](response)
+
+        self.assertEqual(answers, [False, True])
+        self.assertEqual(leaders_deadline.exceeded_stage, "creds_retrieval")
+        self.assertIsNone(followers_deadline.exceeded_stage)
+
+    def _test_shared_fetch_fails(self, error, code, is_timeout):
+        the_mac_key_identifier = mac.MACKeyIdentifier.generate()
+
+        in_flight_callbacks = []
+
+        def async_http_client_fetch_patch(http_client, request, callback):
+            in_flight_callbacks.append(callback)
+
+        answers = []
+
+        def on_async_mac_creds_retriever_done(is_ok, mac_key_identifier):
+            answers.append(is_ok)
+
+        name_of_method_to_patch = "tornado.httpclient.AsyncHTTPClient.fetch"
+        with mock.patch("time.time", return_value=100.0):
+            deadlines = [deadline.Deadline(60), deadline.Deadline(60)]
+
+            with mock.patch(name_of_method_to_patch, async_http_client_fetch_patch):
+                for the_deadline in deadlines:
+                    acr = async_mac_creds_retriever.AsyncMACCredsRetriever(
+                        the_mac_key_identifier,
+                        the_deadline)
+                    acr.fetch(on_async_mac_creds_retriever_done)
+
+            response = mock.Mock()
+            response.error = error
+            response.code = code
+            response.request_time = 24
+            in_flight_callbacks[0](response)
+
+        # no caller has a later deadline than the request was sent with
+        self.assertEqual(len(in_flight_callbacks), 1)
+
+        self.assertEqual(answers, [False, False])
+        for the_deadline in deadlines:
+            if is_timeout:
+                self.assertEqual(the_deadline.exceeded_stage, "creds_retrieval")
+            else:
+                self.assertIsNone(the_deadline.exceeded_stage)
+
+    def test_shared_fetch_times_out(self):
+        """Confirm that every caller waiting on a shared request to the
+        key service that times out is told its deadline was exceeded
+        rather than that the credentials weren't found."""
+        error = tornado.httpclient.HTTPError(599, "Timeout")
+        self._test_shared_fetch_fails(error, 599, True)
+
+    def test_shared_fetch_dropped_by_key_service(self):
+        error = tornado.httpclient.HTTPError(httplib.GATEWAY_TIMEOUT)
+        self._test_shared_fetch_fails(error, httplib.GATEWAY_TIMEOUT, True)
+
+    def test_shared_fetch_fails(self):
+        error = tornado.httpclient.HTTPError(httplib.INTERNAL_SERVER_ERROR)
+        self._test_shared_fetch_fails(error, httplib.INTERNAL_SERVER_ERROR, False)
+
+    def test_shared_fetch_resent_for_later_deadline(self):
+        """Confirm that when the request to the key service runs out of
+        time it's sent again, with the later deadline, if a caller with
+        a later deadline joined the single flight after it was sent."""
+        the_mac_key_identifier = mac.MACKeyIdentifier.generate()
+
+        requests = []
+
+        def async_http_client_fetch_patch(http_client, request, callback):
+            requests.append((request, callback))
+
+        answers = []
+
+        def on_async_mac_creds_retriever_done(is_ok, mac_key_identifier):
+            answers.append(is_ok)
+
+        name_of_method_to_patch = "tornado.httpclient.AsyncHTTPClient.fetch"
+        with mock.patch("time.time", return_value=100.0) as time_patch:
+            leaders_deadline = deadline.Deadline(1)
+            followers_deadline = deadline.Deadline(10)
+            with mock.patch(name_of_method_to_patch, async_http_client_fetch_patch):
+                for the_deadline in [leaders_deadline, followers_deadline]:
+                    acr = async_mac_creds_retriever.AsyncMACCredsRetriever(
+                        the_mac_key_identifier,
+                        the_deadline)
+                    acr.fetch(on_async_mac_creds_retriever_done)
+
+                self.assertEqual(len(requests), 1)
+                self.assertEqual(requests[0][0].headers[deadline.header_name], "1000")
+
+                # the key service drops the request at the leader's deadline
+                time_patch.return_value = 101.0
+                (request, callback) = requests[0]
+                callback(tornado.httpclient.HTTPResponse(request, httplib.GATEWAY_TIMEOUT, request_time=1))
+
+                self.assertEqual(len(requests), 2)
+                self.assertEqual(requests[1][0].headers[deadline.header_name], "9000")
+                self.assertEqual(metrics.counter("mac_creds_retriever.refetches"), 1)
+
+                (request, callback) = requests[1]
+                callback(tornado.httpclient.HTTPResponse(request, httplib.NOT_FOUND, request_time=0))
+
+        self.assertEqual(answers, [False, False])
+        self.assertEqual(leaders_deadline.exceeded_stage, "creds_retrieval")
+        self.assertIsNone(followers_deadline.exceeded_stage)
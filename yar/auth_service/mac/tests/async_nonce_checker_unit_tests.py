@@ -2,11 +2,13 @@
 vi async_nonce_checker  module."""
 
 import os
+import re
 import sys
 
 import mock
 
 from yar.auth_service.mac import async_nonce_checker
+from yar.util import deadline
 from yar.util import mac
 from yar.tests import yar_test_util
 
@@ -26,55 +28,174 @@ class TestAsyncNonceChecker(yar_test_util.TestCase):
         ```nonce```."""
         self.assertIsNotNone(mac_key_identifier)
         self.assertIsNotNone(nonce)
-        expected_key = "%s-%s" % (mac_key_identifier, nonce)
+        expected_key = async_nonce_checker.nonce_key(mac_key_identifier, nonce)
         self.assertEqual(key, expected_key)
+        self.assertEqual(len(key), 22)
+
+    def _client_pool_class_patch(self, nonce_store, maxclients):
+        """Used to patch ```tornadoasyncmemcache.ClientPool```. Returns
+        a mock which implements memcached's add and delete operations
+        using ```self._memcached``` as the "memcached cluster"."""
+        self.assertIsNotNone(nonce_store)
+        for node in nonce_store:
+            self.assertIn(node, self.__class__._nonce_store)
+        self.assertIsNotNone(maxclients)
+
+        def patched_add(key, value, time, callback):
+            self._assertKey(self._mac_key_identifier, self._nonce, key)
+            self.assertIsNotNone(value)
+            self.assertEqual(time, async_nonce_checker.maxage + async_nonce_checker.expiry_skew)
+            if key in self._memcached:
+                callback("NOT_STORED")
+                return
+            self._memcached[key] = value
+            callback("STORED")
+
+        def patched_delete(key, callback):
+            self._assertKey(self._mac_key_identifier, self._nonce, key)
+            self._memcached.pop(key, None)
+            callback(True)
+
+        the_mock = mock.Mock()
+        the_mock.add.side_effect = patched_add
+        the_mock.delete.side_effect = patched_delete
+        return the_mock
 
     def test_all_good(self):
 
         self._mac_key_identifier = mac.MACKeyIdentifier.generate()
         self._nonce = mac.Nonce.generate()
-        self._nonce_store = {}
+        self._memcached = {}
 
-        self._mock = None
+        name_of_class_to_patch = "tornadoasyncmemcache.ClientPool"
+        with mock.patch(name_of_class_to_patch, self._client_pool_class_patch):
+            with mock.patch.object(async_nonce_checker, "nonce_store_backend", None):
+                def on_fetch_done(is_ok):
+                    self.assertIsNotNone(is_ok)
+                    self.assertTrue(is_ok)
+
+                aasf = async_nonce_checker.AsyncNonceChecker(
+                    self._mac_key_identifier,
+                    self._nonce)
+                aasf.fetch(on_fetch_done)
+
+                def on_fetch_done(is_ok):
+                    self.assertIsNotNone(is_ok)
+                    self.assertFalse(is_ok)
 
-        def client_pool_class_patch(nonce_store, maxclients):
-            self.assertIsNotNone(nonce_store)
-            self.assertEqual(nonce_store, self.__class__._nonce_store)
-            self.assertIsNotNone(maxclients)
+                aasf = async_nonce_checker.AsyncNonceChecker(
+                    self._mac_key_identifier,
+                    self._nonce)
+                aasf.fetch(on_fetch_done)
 
-            def patched_get(key, callback):
-                self._assertKey(self._mac_key_identifier, self._nonce, key)
-                callback(self._nonce_store.get(key, None))
+                self.assertEqual(len(self._memcached), 1)
 
-            def patched_set(key, value, callback):
-                self._assertKey(self._mac_key_identifier, self._nonce, key)
-                self.assertIsNotNone(value)
-                self.assertEqual(value, 1)
-                self._nonce_store[key] = value
-                callback(None)
+    def test_release(self):
+        """Confirm that ```AsyncNonceChecker.release()``` removes
+        the nonce reservation made by ```AsyncNonceChecker.fetch()```."""
 
-            self.assertIsNone(self._mock)
-            self._mock = mock.Mock()
-            self._mock.get.side_effect = patched_get
-            self._mock.set.side_effect = patched_set
-            return self._mock
+        self._mac_key_identifier = mac.MACKeyIdentifier.generate()
+        self._nonce = mac.Nonce.generate()
+        self._memcached = {}
 
         name_of_class_to_patch = "tornadoasyncmemcache.ClientPool"
-        with mock.patch(name_of_class_to_patch, client_pool_class_patch):
-            def on_fetch_done(is_ok):
-                self.assertIsNotNone(is_ok)
-                self.assertTrue(is_ok)
+        with mock.patch(name_of_class_to_patch, self._client_pool_class_patch):
+            with mock.patch.object(async_nonce_checker, "nonce_store_backend", None):
+                on_fetch_done = mock.Mock()
+
+                anc = async_nonce_checker.AsyncNonceChecker(
+                    self._mac_key_identifier,
+                    self._nonce)
+                anc.fetch(on_fetch_done)
+                on_fetch_done.assert_called_once_with(True)
+                self.assertEqual(len(self._memcached), 1)
+
+                anc.release()
+                self.assertEqual(len(self._memcached), 0)
+
+                on_fetch_done = mock.Mock()
+                anc = async_nonce_checker.AsyncNonceChecker(
+                    self._mac_key_identifier,
+                    self._nonce)
+                anc.fetch(on_fetch_done)
+                on_fetch_done.assert_called_once_with(True)
+
+    def test_pluggable_backend(self):
+        """Confirm that ```AsyncNonceChecker``` uses
+        ```async_nonce_checker.nonce_store_backend``` when it's set."""
+
+        self._mac_key_identifier = mac.MACKeyIdentifier.generate()
+        self._nonce = mac.Nonce.generate()
+
+        def reserve_patch(key, callback):
+            self._assertKey(self._mac_key_identifier, self._nonce, key)
+            callback(False)
 
-            aasf = async_nonce_checker.AsyncNonceChecker(
+        the_backend = mock.Mock()
+        the_backend.reserve.side_effect = reserve_patch
+
+        with mock.patch.object(async_nonce_checker, "nonce_store_backend", the_backend):
+            on_fetch_done = mock.Mock()
+            anc = async_nonce_checker.AsyncNonceChecker(
                 self._mac_key_identifier,
                 self._nonce)
-            aasf.fetch(on_fetch_done)
+            anc.fetch(on_fetch_done)
+            on_fetch_done.assert_called_once_with(False)
+
+            anc.release()
+            the_backend.release.assert_called_once_with(anc._key)
 
-            def on_fetch_done(is_ok):
-                self.assertIsNotNone(is_ok)
-                self.assertFalse(is_ok)
+    def test_nonce_reserved_after_deadline_is_released(self):
+        """Confirm that when the nonce store reserves a nonce after the
+        deadline, and so after the caller has been told the nonce isn't
+        ok, ```AsyncNonceChecker``` releases the reservation itself."""
 
-            aasf = async_nonce_checker.AsyncNonceChecker(
+        self._mac_key_identifier = mac.MACKeyIdentifier.generate()
+        self._nonce = mac.Nonce.generate()
+
+        the_backend = mock.Mock()
+
+        with mock.patch.object(async_nonce_checker, "nonce_store_backend", the_backend):
+            on_fetch_done = mock.Mock()
+            anc = async_nonce_checker.AsyncNonceChecker(
                 self._mac_key_identifier,
-                self._nonce)
-            aasf.fetch(on_fetch_done)
+                self._nonce,
+                deadline.Deadline(0))
+            anc.fetch(on_fetch_done)
+
+            (key, on_reserve_done) = the_backend.reserve.call_args[0]
+            on_reserve_done(True)
+            on_fetch_done.assert_called_once_with(False)
+            the_backend.release.assert_called_once_with(key)
+
+    def test_nonce_reserved_in_time_is_not_released(self):
+        self._mac_key_identifier = mac.MACKeyIdentifier.generate()
+        self._nonce = mac.Nonce.generate()
+
+        the_backend = mock.Mock()
+
+        with mock.patch.object(async_nonce_checker, "nonce_store_backend", the_backend):
+            on_fetch_done = mock.Mock()
+            anc = async_nonce_checker.AsyncNonceChecker(
+                self._mac_key_identifier,
+                self._nonce,
+                deadline.Deadline(60))
+            anc.fetch(on_fetch_done)
+
+            the_backend.reserve.call_args[0][1](True)
+            on_fetch_done.assert_called_once_with(True)
+            self.assertEqual(the_backend.release.call_count, 0)
+
+    def test_nonce_key(self):
+        """Confirm ```async_nonce_checker.nonce_key()``` generates
+        compact, fixed length keys that differ for different
+        mac key identifier and nonce pairs."""
+        keys = set()
+        for i in range(100):
+            key = async_nonce_checker.nonce_key(
+                mac.MACKeyIdentifier.generate(),
+                mac.Nonce.generate())
+            self.assertEqual(len(key), 22)
+            self.assertIsNotNone(re.match(r"^[A-Za-z0-9_\-]+$", key))
+            keys.add(key)
+        self.assertEqual(len(keys), 100)
@@ -0,0 +1,489 @@
+"""This module implements the unit tests for the auth service's
+nonce_store module."""
+
+import mock
+
+from yar.auth_service.mac import nonce_store
+from yar.util import metrics
+from yar.tests import yar_test_util
+
+
+class TestMemcachedNonceStore(yar_test_util.TestCase):
+
+    def _test_reserve(self, add_result, expected_is_fresh):
+        the_key = self.random_non_none_non_zero_length_str()
+
+        def patched_add(key, value, time, callback):
+            self.assertEqual(key, the_key)
+            self.assertEqual(time, 35)
+            callback(add_result)
+
+        the_ccs = mock.Mock()
+        the_ccs.add.side_effect = patched_add
+
+        name_of_class_to_patch = "tornadoasyncmemcache.ClientPool"
+        with mock.patch(name_of_class_to_patch, return_value=the_ccs):
+            ns = nonce_store.MemcachedNonceStore(["127.0.0.1:11211"], 35)
+            callback = mock.Mock()
+            ns.reserve(the_key, callback)
+            callback.assert_called_once_with(expected_is_fresh)
+
+        # reserving is a single round trip to memcached
+        self.assertEqual(the_ccs.add.call_count, 1)
+        self.assertEqual(the_ccs.get.call_count, 0)
+        self.assertEqual(the_ccs.set.call_count, 0)
+
+    # tornadoasyncmemcache's add answers with memcached's response line
+
+    def test_reserve_fresh(self):
+        self._test_reserve("STORED", True)
+
+    def test_reserve_reused(self):
+        self._test_reserve("NOT_STORED", False)
+
+    def _test_pipelined_reserve(self, add_result, expected_is_fresh):
+        def patched_add(key, value, time, callback):
+            callback(add_result)
+
+        name_of_class_to_patch = "yar.auth_service.mac.nonce_store.PipelinedClient"
+        with mock.patch(name_of_class_to_patch) as pipelined_client_class:
+            pipelined_client_class.return_value.add.side_effect = patched_add
+            ns = nonce_store.MemcachedNonceStore(["127.0.0.1:11211"], 35, pipelined=True)
+            callback = mock.Mock()
+            ns.reserve("dave", callback)
+            callback.assert_called_once_with(expected_is_fresh)
+
+    # PipelinedClient's add answers with a boolean
+
+    def test_pipelined_reserve_fresh(self):
+        self._test_pipelined_reserve(True, True)
+
+    def test_pipelined_reserve_reused(self):
+        self._test_pipelined_reserve(False, False)
+
+    def test_write_rate_and_estimated_bytes(self):
+        metrics.reset()
+
+        def patched_add(key, value, time, callback):
+            callback("STORED")
+
+        the_ccs = mock.Mock()
+        the_ccs.add.side_effect = patched_add
+
+        name_of_class_to_patch = "tornadoasyncmemcache.ClientPool"
+        with mock.patch(name_of_class_to_patch, return_value=the_ccs):
+            ns = nonce_store.MemcachedNonceStore(["127.0.0.1:11211"], 10)
+            with mock.patch("time.time", return_value=1000):
+                for i in range(10):
+                    ns.reserve("%022d" % i, mock.Mock())
+            with mock.patch("time.time", return_value=1005):
+                for i in range(10):
+                    ns.reserve("%022d" % i, mock.Mock())
+
+            self.assertEqual(metrics.counter("memcached_nonce_store.writes"), 20)
+            self.assertEqual(metrics.get_gauge("memcached_nonce_store.writes_per_second"), 2.0)
+            item_size = 56 + 22 + 1 + 2
+            self.assertEqual(metrics.get_gauge("memcached_nonce_store.estimated_bytes"), 20 * item_size)
+
+            # writes @ 1000 have expired by 1010
+            with mock.patch("time.time", return_value=1010):
+                ns.reserve("%022d" % 0, mock.Mock())
+            self.assertEqual(metrics.get_gauge("memcached_nonce_store.estimated_bytes"), 11 * item_size)
+
+    def test_release(self):
+        the_key = self.random_non_none_non_zero_length_str()
+        the_ccs = mock.Mock()
+
+        name_of_class_to_patch = "tornadoasyncmemcache.ClientPool"
+        with mock.patch(name_of_class_to_patch, return_value=the_ccs):
+            ns = nonce_store.MemcachedNonceStore(["127.0.0.1:11211"])
+            ns.release(the_key)
+
+        self.assertEqual(the_ccs.delete.call_count, 1)
+        self.assertEqual(the_ccs.delete.call_args[0][0], the_key)
+
+    def test_pipelined(self):
+        """Confirm ```MemcachedNonceStore``` uses a
+        ```PipelinedClient``` when asked to pipeline."""
+        name_of_class_to_patch = "yar.auth_service.mac.nonce_store.PipelinedClient"
+        with mock.patch(name_of_class_to_patch) as pipelined_client_class:
+            ns = nonce_store.MemcachedNonceStore(["127.0.0.1:11211"], 35, pipelined=True)
+            ns.release("dave")
+            pipelined_client_class.assert_called_once_with("127.0.0.1:11211")
+            pipelined_client_class.return_value.delete.assert_called_once()
+
+    def test_unix_domain_socket_node_is_pipelined(self):
+        """Confirm ```MemcachedNonceStore``` uses a ```PipelinedClient```
+        for a node listening on a unix domain socket even when not asked
+        to pipeline - ```tornadoasyncmemcache``` only speaks TCP."""
+        name_of_class_to_patch = "yar.auth_service.mac.nonce_store.PipelinedClient"
+        with mock.patch(name_of_class_to_patch) as pipelined_client_class:
+            with mock.patch("tornadoasyncmemcache.ClientPool") as client_pool_class:
+                ns = nonce_store.MemcachedNonceStore(["/var/run/memcached.sock"], 35)
+                ns.release("dave")
+                pipelined_client_class.assert_called_once_with("/var/run/memcached.sock")
+                self.assertEqual(client_pool_class.call_count, 0)
+
+
+class TestHashRing(yar_test_util.TestCase):
+
+    def test_empty(self):
+        ring = nonce_store.HashRing([])
+        self.assertEqual(ring.nodes_for("dave"), [])
+
+    def test_nodes_for(self):
+        nodes = ["10.0.0.%d:11211" % i for i in range(3)]
+        ring = nonce_store.HashRing(nodes + nodes[:1])
+        self.assertEqual(ring.nodes, nodes)
+        for i in range(100):
+            nodes_for_key = ring.nodes_for("%022d" % i)
+            self.assertEqual(sorted(nodes_for_key), sorted(nodes))
+            self.assertEqual(nodes_for_key, ring.nodes_for("%022d" % i))
+
+    def test_distribution_and_remapping(self):
+        """Confirm keys are spread reasonably evenly across nodes and
+        that adding a node only moves keys to the new node."""
+        nodes = ["10.0.0.%d:11211" % i for i in range(4)]
+        ring = nonce_store.HashRing(nodes)
+        keys = ["%022d" % i for i in range(4000)]
+        owners = {key: ring.nodes_for(key)[0] for key in keys}
+
+        for node in nodes:
+            number_owned = len([key for key in keys if owners[key] == node])
+            self.assertTrue(500 < number_owned < 1500)
+
+        new_node = "10.0.0.4:11211"
+        ring = nonce_store.HashRing(nodes + [new_node])
+        number_moved = 0
+        for key in keys:
+            owner = ring.nodes_for(key)[0]
+            if owner != owners[key]:
+                self.assertEqual(owner, new_node)
+                number_moved += 1
+        self.assertTrue(number_moved < len(keys) / 2)
+
+
+class TestMemcachedNonceStoreCluster(yar_test_util.TestCase):
+    """Confirm ```MemcachedNonceStore``` fails over to the next node on
+    the hash ring when a node times out, ejects nodes that repeatedly
+    time out and returns ejected nodes to service once they answer."""
+
+    def setUp(self):
+        metrics.reset()
+
+        self._timeouts = []
+        self._io_loop = mock.Mock()
+        self._io_loop.time.return_value = 1000
+        self._io_loop.add_timeout.side_effect = \
+            lambda deadline, callback: self._timeouts.append(callback) or callback
+        self._io_loop.remove_timeout.side_effect = self._timeouts.remove
+
+        self._nodes = ["10.0.0.%d:11211" % i for i in range(2)]
+        self._dead_nodes = set()
+        self._ccss = {}
+
+    def _client_pool_class_patch(self, servers, maxclients):
+        self.assertEqual(len(servers), 1)
+        node = servers[0]
+
+        def patched_add(key, value, time, callback):
+            if node not in self._dead_nodes:
+                callback("STORED")
+
+        def patched_get(key, callback):
+            if node not in self._dead_nodes:
+                callback(None)
+
+        the_ccs = mock.Mock()
+        the_ccs.add.side_effect = patched_add
+        the_ccs.get.side_effect = patched_get
+        self._ccss[node] = the_ccs
+        return the_ccs
+
+    def _fire_timeouts(self):
+        timeouts = list(self._timeouts)
+        del self._timeouts[:]
+        for timeout in timeouts:
+            timeout()
+
+    def test_failover_ejection_and_probe(self):
+        name_of_class_to_patch = "tornadoasyncmemcache.ClientPool"
+        with mock.patch(name_of_class_to_patch, self._client_pool_class_patch):
+            with mock.patch("tornado.ioloop.IOLoop.current", return_value=self._io_loop):
+                ns = nonce_store.MemcachedNonceStore(self._nodes, 35, max_failures=2)
+                key = "%022d" % 0
+                home_node = ns._ring.nodes_for(key)[0]
+                other_node = ns._ring.nodes_for(key)[1]
+                self._dead_nodes.add(home_node)
+
+                # until the home node is ejected its keys don't fail over
+                callback = mock.Mock()
+                ns.reserve(key, callback)
+                self.assertEqual(callback.call_count, 0)
+                self._fire_timeouts()
+                callback.assert_called_once_with(False)
+                self.assertNotIn(other_node, self._ccss)
+                self.assertEqual(metrics.counter("memcached_nonce_store.unavailable"), 1)
+
+                callback = mock.Mock()
+                ns.reserve(key, callback)
+                self.assertEqual(callback.call_count, 0)
+                self._fire_timeouts()
+                callback.assert_called_once_with(True)
+
+                home_metric = "memcached_nonce_store.%s.%%s" % home_node
+                self.assertEqual(metrics.counter(home_metric % "errors"), 2)
+                self.assertEqual(metrics.counter(home_metric % "ejections"), 1)
+                self.assertEqual(metrics.get_gauge(home_metric % "is_ejected"), 1)
+                self.assertEqual(len(self._timeouts), 1)
+
+                # ejected nodes aren't used
+                callback = mock.Mock()
+                ns.reserve(key, callback)
+                callback.assert_called_once_with(True)
+                self.assertEqual(self._ccss[home_node].add.call_count, 2)
+                self.assertEqual(self._ccss[other_node].add.call_count, 2)
+
+                # probe fails so another probe is scheduled
+                self._fire_timeouts()
+                self.assertEqual(self._ccss[home_node].get.call_count, 1)
+                self._fire_timeouts()
+                self.assertEqual(len(self._timeouts), 1)
+
+                # node recovers so the next probe returns it to service
+                self._dead_nodes.remove(home_node)
+                self._fire_timeouts()
+                self.assertEqual(self._ccss[home_node].get.call_count, 2)
+                self.assertEqual(metrics.get_gauge(home_metric % "is_ejected"), 0)
+
+                callback = mock.Mock()
+                ns.reserve(key, callback)
+                callback.assert_called_once_with(True)
+                self.assertEqual(self._ccss[home_node].add.call_count, 3)
+
+    def test_unreachable_pipelined_node_fails_over_without_waiting(self):
+        def pipelined_client_class_patch(address):
+            def patched_add(key, value, time, callback):
+                if address in self._dead_nodes:
+                    callback(nonce_store.PipelinedClientError())
+                else:
+                    callback(True)
+
+            the_ccs = mock.Mock()
+            the_ccs.add.side_effect = patched_add
+            return the_ccs
+
+        name_of_class_to_patch = "yar.auth_service.mac.nonce_store.PipelinedClient"
+        with mock.patch(name_of_class_to_patch, pipelined_client_class_patch):
+            with mock.patch("tornado.ioloop.IOLoop.current", return_value=self._io_loop):
+                ns = nonce_store.MemcachedNonceStore(self._nodes, 35, max_failures=1, pipelined=True)
+                key = "%022d" % 0
+                home_node = ns._ring.nodes_for(key)[0]
+                self._dead_nodes.add(home_node)
+
+                callback = mock.Mock()
+                ns.reserve(key, callback)
+                callback.assert_called_once_with(True)
+                # the only timeout is the ejected node's probe
+                self.assertEqual(len(self._timeouts), 1)
+                home_metric = "memcached_nonce_store.%s.errors" % home_node
+                self.assertEqual(metrics.counter(home_metric), 1)
+
+    def test_release_after_failover(self):
+        name_of_class_to_patch = "tornadoasyncmemcache.ClientPool"
+        with mock.patch(name_of_class_to_patch, self._client_pool_class_patch):
+            with mock.patch("tornado.ioloop.IOLoop.current", return_value=self._io_loop):
+                ns = nonce_store.MemcachedNonceStore(self._nodes, 35, max_failures=1)
+                key = "%022d" % 0
+                home_node = ns._ring.nodes_for(key)[0]
+                other_node = ns._ring.nodes_for(key)[1]
+
+                # home node times out so the key is reserved on the other node
+                self._dead_nodes.add(home_node)
+                callback = mock.Mock()
+                ns.reserve(key, callback)
+                self._fire_timeouts()
+                callback.assert_called_once_with(True)
+
+                # home node is healthy again when the key is released
+                self._dead_nodes.remove(home_node)
+                ns.release(key)
+                self.assertEqual(self._ccss[home_node].delete.call_count, 0)
+                self.assertEqual(self._ccss[other_node].delete.call_count, 1)
+                self.assertEqual(self._ccss[other_node].delete.call_args[0], (key,))
+
+                # keys reserved on their home node are released there
+                # once a probe has returned the home node to service
+                self._fire_timeouts()
+                callback = mock.Mock()
+                ns.reserve(key, callback)
+                ns.release(key)
+                self.assertEqual(self._ccss[home_node].delete.call_count, 1)
+                self.assertEqual(self._ccss[other_node].delete.call_count, 1)
+
+    def test_all_nodes_unavailable(self):
+        name_of_class_to_patch = "tornadoasyncmemcache.ClientPool"
+        with mock.patch(name_of_class_to_patch, self._client_pool_class_patch):
+            with mock.patch("tornado.ioloop.IOLoop.current", return_value=self._io_loop):
+                ns = nonce_store.MemcachedNonceStore(self._nodes, 35, max_failures=1)
+                self._dead_nodes.update(self._nodes)
+
+                callback = mock.Mock()
+                ns.reserve("%022d" % 0, callback)
+                self._fire_timeouts()
+                self.assertEqual(callback.call_count, 0)
+                self._fire_timeouts()
+                callback.assert_called_once_with(False)
+                self.assertEqual(metrics.counter("memcached_nonce_store.unavailable"), 1)
+
+    def _test_unavailable(self, unavailable_policy, expected_is_fresh):
+        name_of_class_to_patch = "tornadoasyncmemcache.ClientPool"
+        with mock.patch(name_of_class_to_patch, self._client_pool_class_patch):
+            with mock.patch("tornado.ioloop.IOLoop.current", return_value=self._io_loop):
+                ns = nonce_store.MemcachedNonceStore(
+                    self._nodes,
+                    35,
+                    max_failures=1,
+                    unavailable_policy=unavailable_policy)
+                self._dead_nodes.update(self._nodes)
+
+                # first reservation waits for both nodes to time out
+                callback = mock.Mock()
+                ns.reserve("%022d" % 0, callback)
+                self._fire_timeouts()
+                self._fire_timeouts()
+                callback.assert_called_once_with(expected_is_fresh)
+
+                # with all nodes ejected the second reservation doesn't wait
+                callback = mock.Mock()
+                ns.reserve("%022d" % 0, callback)
+                callback.assert_called_once_with(False if unavailable_policy == "local" else expected_is_fresh)
+
+                self.assertEqual(metrics.counter("memcached_nonce_store.unavailable"), 2)
+                return ns
+
+    def test_unavailable_reject(self):
+        self._test_unavailable(nonce_store.UNAVAILABLE_POLICY_REJECT, False)
+        self.assertIsNone(metrics.get_gauge("memcached_nonce_store.is_degraded"))
+
+    def test_unavailable_accept(self):
+        self._test_unavailable(nonce_store.UNAVAILABLE_POLICY_ACCEPT, True)
+
+    def test_unavailable_local(self):
+        ns = self._test_unavailable(nonce_store.UNAVAILABLE_POLICY_LOCAL, True)
+        self.assertEqual(metrics.get_gauge("memcached_nonce_store.is_degraded"), 1)
+
+        ns.release("%022d" % 0)
+        callback = mock.Mock()
+        ns.reserve("%022d" % 0, callback)
+        callback.assert_called_once_with(True)
+
+        # once memcached is back the store is no longer degraded
+        self._dead_nodes.clear()
+        with mock.patch("tornado.ioloop.IOLoop.current", return_value=self._io_loop):
+            self._fire_timeouts()
+            callback = mock.Mock()
+            ns.reserve("%022d" % 1, callback)
+            callback.assert_called_once_with(True)
+        self.assertEqual(metrics.get_gauge("memcached_nonce_store.is_degraded"), 0)
+
+
+class TestInProcessNonceStore(yar_test_util.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+
+    def _reserve(self, ns, key):
+        callback = mock.Mock()
+        ns.reserve(key, callback)
+        self.assertEqual(callback.call_count, 1)
+        return callback.call_args[0][0]
+
+    def test_reserve_and_reuse(self):
+        ns = nonce_store.InProcessNonceStore(maxage=30)
+        with mock.patch("time.time", return_value=1000):
+            self.assertTrue(self._reserve(ns, "a"))
+            self.assertFalse(self._reserve(ns, "a"))
+            self.assertTrue(self._reserve(ns, "b"))
+        self.assertEqual(len(ns), 2)
+
+    def test_release(self):
+        ns = nonce_store.InProcessNonceStore(maxage=30)
+        with mock.patch("time.time", return_value=1000):
+            self.assertTrue(self._reserve(ns, "a"))
+            ns.release("a")
+            self.assertEqual(len(ns), 0)
+            self.assertTrue(self._reserve(ns, "a"))
+            # releasing an unknown key is harmless
+            ns.release("b")
+
+    def test_buckets_expire_after_maxage(self):
+        ns = nonce_store.InProcessNonceStore(maxage=30)
+        with mock.patch("time.time", return_value=1000):
+            self.assertTrue(self._reserve(ns, "a"))
+        with mock.patch("time.time", return_value=1010):
+            self.assertTrue(self._reserve(ns, "b"))
+        with mock.patch("time.time", return_value=1030):
+            self.assertFalse(self._reserve(ns, "a"))
+        self.assertEqual(metrics.get_gauge("inprocess_nonce_store.buckets"), 2)
+        with mock.patch("time.time", return_value=1031):
+            self.assertTrue(self._reserve(ns, "a"))
+            self.assertFalse(self._reserve(ns, "b"))
+        self.assertEqual(len(ns), 2)
+        self.assertEqual(metrics.get_gauge("inprocess_nonce_store.fingerprints"), 1)
+        self.assertTrue(0 < metrics.get_gauge("inprocess_nonce_store.bytes"))
+
+    def test_full(self):
+        ns = nonce_store.InProcessNonceStore(maxage=30, max_fingerprints=2)
+        with mock.patch("time.time", return_value=1000):
+            self.assertTrue(self._reserve(ns, "a"))
+            self.assertTrue(self._reserve(ns, "b"))
+            self.assertFalse(self._reserve(ns, "c"))
+        self.assertEqual(metrics.counter("inprocess_nonce_store.full"), 1)
+        with mock.patch("time.time", return_value=1031):
+            self.assertTrue(self._reserve(ns, "c"))
+
+
+class TestInFlightNonceStore(yar_test_util.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+
+    def test_reserve_waits_for_nonce_store(self):
+        backend = mock.Mock()
+        ns = nonce_store.InFlightNonceStore(backend)
+        callback = mock.Mock()
+        ns.reserve("a", callback)
+        self.assertEqual(callback.call_count, 0)
+
+        (key, on_reserve_done) = backend.reserve.call_args[0]
+        self.assertEqual(key, "a")
+        on_reserve_done(False)
+        callback.assert_called_once_with(False)
+
+    def test_in_flight_replay(self):
+        backend = mock.Mock()
+        ns = nonce_store.InFlightNonceStore(backend)
+        ns.reserve("a", mock.Mock())
+
+        callback = mock.Mock()
+        ns.reserve("a", callback)
+        callback.assert_called_once_with(False)
+        self.assertEqual(backend.reserve.call_count, 1)
+        self.assertEqual(metrics.counter("nonce_store.in_flight_replays"), 1)
+
+        # once the first reservation is answered the key goes to the store again
+        backend.reserve.call_args[0][1](True)
+        ns.reserve("a", mock.Mock())
+        self.assertEqual(backend.reserve.call_count, 2)
+
+    def test_release(self):
+        backend = nonce_store.InProcessNonceStore(maxage=30)
+        ns = nonce_store.InFlightNonceStore(backend)
+        callback = mock.Mock()
+        ns.reserve("a", callback)
+        callback.assert_called_once_with(True)
+        ns.release("a")
+        callback = mock.Mock()
+        ns.reserve("a", callback)
+        callback.assert_called_once_with(True)
@@ -0,0 +1,190 @@
+"""This module implements the unit tests for the auth service's
+pipelined_memcached module."""
+
+import mock
+
+from yar.auth_service.mac import pipelined_memcached
+from yar.util import metrics
+from yar.tests import yar_test_util
+
+
+class FakeStream(object):
+    """Stands in for the ```tornado.iostream.IOStream``` connected
+    to memcached. Everything written to the stream is recorded in
+    ```writes``` and data passed to ```feed()``` is used to satisfy
+    reads."""
+
+    def __init__(self):
+        object.__init__(self)
+
+        self.writes = []
+
+        self._buffer = ""
+        self._read = None
+
+    def set_close_callback(self, callback):
+        pass
+
+    def write(self, data):
+        self.writes.append(data)
+
+    def read_until(self, delimiter, callback):
+        self._read = ("until", delimiter, callback)
+        self._satisfy_read()
+
+    def read_bytes(self, number_bytes, callback):
+        self._read = ("bytes", number_bytes, callback)
+        self._satisfy_read()
+
+    def feed(self, data):
+        self._buffer += data
+        self._satisfy_read()
+
+    def _satisfy_read(self):
+        if self._read is None:
+            return
+
+        (kind, arg, callback) = self._read
+        if kind == "until":
+            index = self._buffer.find(arg)
+            if index < 0:
+                return
+            number_bytes = index + len(arg)
+        else:
+            if len(self._buffer) < arg:
+                return
+            number_bytes = arg
+
+        data = self._buffer[:number_bytes]
+        self._buffer = self._buffer[number_bytes:]
+        self._read = None
+        callback(data)
+
+
+class TestPipelinedClient(yar_test_util.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+
+        self._callbacks = []
+        self._io_loop = mock.Mock()
+        self._io_loop.add_callback.side_effect = self._callbacks.append
+
+        self._stream = FakeStream()
+
+        self._patcher = mock.patch("tornado.ioloop.IOLoop.current", return_value=self._io_loop)
+        self._patcher.start()
+
+        self._client = pipelined_memcached.PipelinedClient("127.0.0.1:11211")
+        self._client._stream = self._stream
+
+    def tearDown(self):
+        self._patcher.stop()
+
+    def _run_io_loop_iteration(self):
+        callbacks = list(self._callbacks)
+        del self._callbacks[:]
+        for callback in callbacks:
+            callback()
+
+    def test_operations_are_batched_per_io_loop_iteration(self):
+        callbacks = [mock.Mock() for i in range(3)]
+        self._client.add("k1", 1, 35, callbacks[0])
+        self._client.add("k2", 1, 35, callbacks[1])
+        self._client.delete("k3", callbacks[2])
+
+        # nothing is written until the next IOLoop iteration
+        self.assertEqual(self._stream.writes, [])
+        self.assertEqual(len(self._callbacks), 1)
+
+        self._run_io_loop_iteration()
+        self.assertEqual(
+            self._stream.writes,
+            ["add k1 0 35 1\r\n1\r\nadd k2 0 35 1\r\n1\r\ndelete k3\r\n"])
+        self.assertEqual(metrics.get_gauge("pipelined_memcached.batch_size"), 3)
+
+        self._stream.feed("STORED\r\nNOT_")
+        callbacks[0].assert_called_once_with(True)
+        self.assertEqual(callbacks[1].call_count, 0)
+
+        self._stream.feed("STORED\r\nNOT_FOUND\r\n")
+        callbacks[1].assert_called_once_with(False)
+        callbacks[2].assert_called_once_with(False)
+
+    def test_get(self):
+        callbacks = [mock.Mock() for i in range(2)]
+        self._client.get("k1", callbacks[0])
+        self._client.get("k2", callbacks[1])
+        self._run_io_loop_iteration()
+        # consecutive gets are coalesced into a single multi-key get
+        self.assertEqual(self._stream.writes, ["get k1 k2\r\n"])
+
+        self._stream.feed("VALUE k1 0 5\r\nda\r\nv\r\nEND\r\n")
+        callbacks[0].assert_called_once_with("da\r\nv")
+        callbacks[1].assert_called_once_with(None)
+
+    def test_gets_are_only_coalesced_when_consecutive(self):
+        callbacks = [mock.Mock() for i in range(4)]
+        self._client.get("k1", callbacks[0])
+        self._client.add("k2", 1, 35, callbacks[1])
+        self._client.get("k2", callbacks[2])
+        self._client.get("k3", callbacks[3])
+        self._run_io_loop_iteration()
+        self.assertEqual(
+            self._stream.writes,
+            ["get k1\r\nadd k2 0 35 1\r\n1\r\nget k2 k3\r\n"])
+
+        self._stream.feed("END\r\nSTORED\r\nVALUE k3 0 1\r\nc\r\nVALUE k2 0 1\r\n1\r\nEND\r\n")
+        callbacks[0].assert_called_once_with(None)
+        callbacks[1].assert_called_once_with(True)
+        callbacks[2].assert_called_once_with("1")
+        callbacks[3].assert_called_once_with("c")
+
+    def test_lost_connection_fails_in_flight_operations(self):
+        callbacks = [mock.Mock() for i in range(2)]
+        self._client.add("k1", 1, 35, callbacks[0])
+        self._client.get("k2", callbacks[1])
+        self._run_io_loop_iteration()
+
+        self._client._on_close()
+        for callback in callbacks:
+            self.assertEqual(callback.call_count, 1)
+            self.assertIsInstance(callback.call_args[0][0], pipelined_memcached.PipelinedClientError)
+        self.assertEqual(len(self._client._in_flight), 0)
+
+    def test_connect(self):
+        self._client._stream = None
+
+        with mock.patch("tornado.tcpclient.TCPClient") as tcp_client_class:
+            callback = mock.Mock()
+            self._client.add("k1", 1, 35, callback)
+            self._client.add("k2", 1, 35, callback)
+            self._run_io_loop_iteration()
+
+            tcp_client_class.return_value.connect.assert_called_once_with("127.0.0.1", 11211)
+            (future, on_connect) = self._io_loop.add_future.call_args[0]
+
+        future = mock.Mock()
+        future.result.return_value = self._stream
+        on_connect(future)
+
+        self.assertEqual(
+            self._stream.writes,
+            ["add k1 0 35 1\r\n1\r\nadd k2 0 35 1\r\n1\r\n"])
+
+    def test_connect_failure(self):
+        self._client._stream = None
+
+        with mock.patch("tornado.tcpclient.TCPClient"):
+            callback = mock.Mock()
+            self._client.add("k1", 1, 35, callback)
+            self._run_io_loop_iteration()
+            (future, on_connect) = self._io_loop.add_future.call_args[0]
+
+        future = mock.Mock()
+        future.result.side_effect = IOError("connection refused")
+        on_connect(future)
+
+        self.assertEqual(self._client._pending, [])
+        self.assertEqual(callback.call_count, 1)
+        self.assertIsInstance(callback.call_args[0][0], pipelined_memcached.PipelinedClientError)
@@ -0,0 +1,196 @@
+"""This module is a benchmark which measures the latency of small
+requests to the auth service while large uploads are in flight,
+first with request body hashing done on the IOLoop's thread and
+then with large request bodies hashed on ```worker_pool```'s threads.
+The auth service, with authentication always succeeding, and a
+trivial app service run in this process. Uploads and small requests
+are issued from separate processes so they don't compete with the
+auth service for the GIL. Run it using something like:
+
+    python -m yar.auth_service.offload_benchmark --uploaders=4 --uploadsize=8
+"""
+
+import multiprocessing
+import optparse
+import threading
+import time
+
+import requests
+import tornado.httpserver
+import tornado.ioloop
+import tornado.testing
+import tornado.web
+
+from yar.auth_service import async_app_service_forwarder
+from yar.auth_service import auth_service_request_handler
+from yar.auth_service import request_body
+
+
+class _AppServiceRequestHandler(tornado.web.RequestHandler):
+
+    def get(self):
+        self.write("ok")
+
+    def post(self):
+        self.write("ok")
+
+
+class _Authenticator(object):
+    """Authentication always succeeds so all that's measured
+    is accepting and forwarding requests."""
+
+    def __init__(self, request, request_body=None):
+        object.__init__(self)
+
+    def authenticate(self, on_auth_done):
+        on_auth_done(True, principal="benchmark")
+
+
+def _upload(url, upload_size, stop_event):
+    body = "x" * upload_size
+    session = requests.Session()
+    while not stop_event.is_set():
+        session.post(url, data=body, headers={"Authorization": "MAC benchmark"})
+
+
+def _measure(url, number_requests, latencies):
+    session = requests.Session()
+    # give the uploaders a head start
+    time.sleep(1)
+    for i in xrange(number_requests):
+        start_time = time.time()
+        session.get(url, headers={"Authorization": "MAC benchmark"})
+        latencies.put((time.time() - start_time) * 1000)
+    latencies.put(None)
+
+
+def _percentile(values, percentile):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percentile / 100.0))]
+
+
+def _run(url, number_uploaders, upload_size, number_requests):
+    """Returns a list of latencies (in ms) of ```number_requests```
+    small requests made while ```number_uploaders``` processes
+    continuously upload ```upload_size``` byte bodies."""
+    stop_event = multiprocessing.Event()
+    uploaders = [
+        multiprocessing.Process(target=_upload, args=(url, upload_size, stop_event))
+        for i in range(number_uploaders)
+    ]
+    for uploader in uploaders:
+        uploader.start()
+
+    latencies = multiprocessing.Queue()
+    measurer = multiprocessing.Process(target=_measure, args=(url, number_requests, latencies))
+    measurer.start()
+
+    rv = []
+    while True:
+        latency = latencies.get()
+        if latency is None:
+            break
+        rv.append(latency)
+
+    stop_event.set()
+    measurer.join()
+    for uploader in uploaders:
+        uploader.terminate()
+        uploader.join()
+
+    return rv
+
+
+def _serve(io_loop):
+    io_loop.make_current()
+    io_loop.start()
+
+
+class _CommandLineParser(optparse.OptionParser):
+
+    def __init__(self):
+        optparse.OptionParser.__init__(self, "usage: %prog [options]")
+
+        default = 4
+        help = "# of concurrent uploaders - default = %d" % default
+        self.add_option(
+            "--uploaders",
+            action="store",
+            dest="number_uploaders",
+            default=default,
+            type=int,
+            help=help)
+
+        default = 8
+        help = "size (in MB) of each upload - default = %d" % default
+        self.add_option(
+            "--uploadsize",
+            action="store",
+            dest="upload_size",
+            default=default,
+            type=int,
+            help=help)
+
+        default = 1000
+        help = "# of small requests - default = %d" % default
+        self.add_option(
+            "--requests",
+            action="store",
+            dest="number_requests",
+            default=default,
+            type=int,
+            help=help)
+
+        default = 1024 * 1024
+        help = "offload threshold (in bytes) - default = %d" % default
+        self.add_option(
+            "--offloadthreshold",
+            action="store",
+            dest="offload_threshold",
+            default=default,
+            type=int,
+            help=help)
+
+
+if __name__ == "__main__":
+    clp = _CommandLineParser()
+    (clo, cla) = clp.parse_args()
+
+    # the auth service runs on its own thread so the main
+    # thread is free to coordinate the benchmark
+    io_loop = tornado.ioloop.IOLoop(make_current=False)
+
+    (app_service_socket, app_service_port) = tornado.testing.bind_unused_port()
+    app_service = tornado.web.Application(handlers=[(r".*", _AppServiceRequestHandler)])
+    tornado.httpserver.HTTPServer(app_service, io_loop=io_loop).add_sockets([app_service_socket])
+
+    (auth_service_socket, auth_service_port) = tornado.testing.bind_unused_port()
+    auth_service = tornado.web.Application(handlers=[
+        (auth_service_request_handler.url_spec, auth_service_request_handler.RequestHandler),
+    ])
+    tornado.httpserver.HTTPServer(auth_service, io_loop=io_loop).add_sockets([auth_service_socket])
+
+    auth_service_request_handler._auth_scheme_to_auth_class["MAC"] = _Authenticator
+    async_app_service_forwarder.app_service = "127.0.0.1:%d" % app_service_port
+    upload_size = clo.upload_size * 1024 * 1024
+    request_body.max_size = upload_size
+
+    url = "http://127.0.0.1:%d/" % auth_service_port
+
+    io_loop_thread = threading.Thread(target=_serve, args=(io_loop,))
+    io_loop_thread.daemon = True
+    io_loop_thread.start()
+
+    print "%-12s %10s %10s %10s" % ("hashing", "p50 ms", "p99 ms", "max ms")
+    for (name, offload_threshold) in [("io loop", 0), ("offloaded", clo.offload_threshold)]:
+        request_body.offload_threshold = offload_threshold
+        latencies = _run(
+            url,
+            clo.number_uploaders,
+            upload_size,
+            clo.number_requests)
+        print "%-12s %10.1f %10.1f %10.1f" % (
+            name,
+            _percentile(latencies, 50),
+            _percentile(latencies, 99),
+            max(latencies))
@@ -0,0 +1,253 @@
+"""This module contains the logic for accepting request bodies
+incrementally. As each chunk of a request's body arrives it's
+added to the hash used to generate the request's MAC ext and
+written to a spool. The spool is what holds the body back until
+the authentication verdict is known and is then streamed to the
+app service."""
+
+import hashlib
+import logging
+import tempfile
+import threading
+
+import tornado.gen
+import tornado.ioloop
+
+from yar.util import mac
+from yar.util import metrics
+
+_logger = logging.getLogger("AUTHSERVICE.%s" % __name__)
+
+"""Request bodies larger than ```max_size``` bytes are rejected.
+This bounds both memory and disk used by a single request."""
+max_size = 100 * 1024 * 1024
+
+"""Request bodies are held in memory until they grow larger than
+```max_in_memory_size``` bytes at which point they spill to a
+temporary file on disk."""
+max_in_memory_size = 64 * 1024
+
+"""The total size of all request bodies which have spilled to disk
+is limited to ```max_spilled_size``` bytes. A body which would take
+the total over the limit is rejected. This bounds the disk used by
+all requests. 0 means no limit."""
+max_spilled_size = 1024 * 1024 * 1024
+
+"""```_spilled_size``` is the total size of all request bodies which
+have spilled to disk. Bodies are appended to on ```worker_pool```'s
+threads so ```_spilled_size``` is only updated while holding
+```_spilled_size_lock```."""
+_spilled_size = 0
+_spilled_size_lock = threading.Lock()
+
+"""Chunks of request bodies larger than ```offload_threshold``` bytes
+are hashed and spooled on ```worker_pool```'s threads rather than on
+the IOLoop's thread. 0 means never offload."""
+offload_threshold = 1024 * 1024
+
+"""When a request body is streamed to the app service it's read
+from the spool and written ```chunk_size``` bytes at a time."""
+chunk_size = 64 * 1024
+
+
+class RequestBody(object):
+    """Accumulates the body of ```request``` one chunk at a time
+    while computing the body's MAC ext. Authentication starts before
+    the body has been received - see ```when_complete()```."""
+
+    def __init__(self, request, on_waiting=None):
+        """```on_waiting``` is called the first time something
+        waits for the body to be completely received."""
+        object.__init__(self)
+
+        self.is_complete = False
+        self._on_waiting = on_waiting
+
+        # chunks can be appended on ```worker_pool```'s threads so
+        # metrics are reported on the IOLoop's thread and ```_lock```
+        # stops the body being closed while a chunk is being appended
+        self._io_loop = tornado.ioloop.IOLoop.current()
+        self._io_loop_thread = threading.current_thread()
+        self._lock = threading.Lock()
+        self._is_closed = False
+        self._on_complete_callbacks = []
+
+        content_type = request.headers.get("Content-type", None)
+        self._ext_hash = mac.ExtHash(content_type)
+
+        # mirrors yar.util.trhutil.get_request_body_if_exists()
+        # a request has a body if it has either a Content-Length
+        # or a Transfer-Encoding header
+        self.is_present = \
+            "Content-Length" in request.headers or \
+            "Transfer-Encoding" in request.headers
+        if self.is_present:
+            self._ext_hash.update("")
+
+        try:
+            self.expected_size = int(request.headers.get("Content-Length", 0))
+        except ValueError:
+            self.expected_size = 0
+
+        self.size = 0
+        self._spool = tempfile.SpooledTemporaryFile(max_size=max_in_memory_size)
+
+        # the # of bytes this body contributes to _spilled_size
+        self._spilled_size = 0
+        self.is_spill_budget_exceeded = False
+
+    def is_too_large(self, size):
+        """Returns True if a body of ```size``` bytes is larger
+        than the auth service is willing to accept."""
+        return max_size < size
+
+    @property
+    def is_large(self):
+        """True if the body is, or is declared to be, larger than
+        ```offload_threshold``` bytes and so should only be hashed
+        on one of ```worker_pool```'s threads."""
+        return self._is_larger_than_offload_threshold(self.size)
+
+    def is_offloaded(self, chunk):
+        """Returns True if ```chunk``` should be appended to the body
+        on one of ```worker_pool```'s threads. Once a body is known to
+        be larger than ```offload_threshold``` all subsequent chunks
+        are offloaded."""
+        return self._is_larger_than_offload_threshold(self.size + len(chunk))
+
+    def _is_larger_than_offload_threshold(self, size):
+        if offload_threshold <= 0:
+            return False
+        return offload_threshold < max(self.expected_size, size)
+
+    def append(self, chunk):
+        """Add ```chunk``` to the body. Returns False if doing so
+        would make the body larger than ```max_size```, or would spill
+        more than ```max_spilled_size``` bytes of bodies to disk (in
+        which case ```is_spill_budget_exceeded``` is True), or the body
+        has been closed, and the chunk is discarded. Safe to call on
+        one of ```worker_pool```'s threads."""
+        with self._lock:
+            if self._is_closed:
+                return False
+
+            if self.is_too_large(self.size + len(chunk)):
+                self._report(metrics.increment, "request_body.too_large")
+                return False
+
+            if not self._reserve_spilled_size(self.size + len(chunk)):
+                self._report(metrics.increment, "request_body.spill_budget_exceeded")
+                self.is_spill_budget_exceeded = True
+                return False
+
+            self._ext_hash.update(chunk)
+            self._spool.write(chunk)
+
+            if self.size <= max_in_memory_size < self.size + len(chunk):
+                self._report(metrics.increment, "request_body.spilled")
+
+            self.size += len(chunk)
+
+        return True
+
+    def _report(self, function, *args):
+        """Call ```function```, one of ```yar.util.metrics```' functions,
+        with ```args``` on the IOLoop's thread. ```yar.util.metrics``` isn't
+        thread safe."""
+        if threading.current_thread() is self._io_loop_thread:
+            function(*args)
+        else:
+            self._io_loop.add_callback(function, *args)
+
+    def _reserve_spilled_size(self, size):
+        """A body of ```size``` bytes is on disk if it's larger than
+        ```max_in_memory_size``` bytes. Returns False if counting
+        the body against ```max_spilled_size``` would exceed the
+        limit otherwise True."""
+        global _spilled_size
+        if size <= max_in_memory_size:
+            return True
+        with _spilled_size_lock:
+            if 0 < max_spilled_size < _spilled_size + size - self._spilled_size:
+                return False
+            _spilled_size += size - self._spilled_size
+            self._spilled_size = size
+            self._report(metrics.gauge, "request_body.spilled_bytes", _spilled_size)
+        return True
+
+    def when_complete(self, callback):
+        """Call ```callback``` once the entire body has been
+        received. This is how an authenticator which has done
+        everything it can without the body waits for the body."""
+        if self.is_complete:
+            callback()
+            return
+
+        self._on_complete_callbacks.append(callback)
+        if self._on_waiting is not None:
+            on_waiting = self._on_waiting
+            self._on_waiting = None
+            on_waiting()
+
+    def complete(self):
+        """Called once the entire body has been received."""
+        self.is_complete = True
+        callbacks = self._on_complete_callbacks
+        self._on_complete_callbacks = []
+        for callback in callbacks:
+            callback()
+
+    def ext(self):
+        """Returns the MAC ext for the request's content type
+        and body received so far."""
+        return self._ext_hash.ext()
+
+    def sha1(self):
+        """Returns the hex encoded SHA-1 of the body (not including the
+        content type) or None if the request has no body. Like ```read()```
+        this is only intended for generating authentication failure debug
+        details."""
+        if not self.is_present:
+            return None
+        sha1 = hashlib.sha1()
+        self._spool.seek(0)
+        while True:
+            chunk = self._spool.read(chunk_size)
+            if not chunk:
+                break
+            sha1.update(chunk)
+        return sha1.hexdigest()
+
+    def read(self):
+        """Returns the entire body as a string. This defeats the
+        purpose of spooling so is only intended for generating
+        authentication failure debug details."""
+        if not self.is_present:
+            return None
+        self._spool.seek(0)
+        return self._spool.read()
+
+    @tornado.gen.coroutine
+    def body_producer(self, write):
+        """Streams the body from the spool using ```write```. Suitable
+        for use as a ```tornado.httpclient.HTTPRequest``` body producer."""
+        self._spool.seek(0)
+        while True:
+            chunk = self._spool.read(chunk_size)
+            if not chunk:
+                break
+            yield write(chunk)
+
+    def close(self):
+        """Discard the body and release any disk space it was using.
+        If a chunk is being appended on one of ```worker_pool```'s
+        threads the body is closed once the append is done."""
+        global _spilled_size
+        with self._lock:
+            self._is_closed = True
+            self._spool.close()
+            with _spilled_size_lock:
+                if self._spilled_size:
+                    _spilled_size -= self._spilled_size
+                    self._spilled_size = 0
+                    self._report(metrics.gauge, "request_body.spilled_bytes", _spilled_size)
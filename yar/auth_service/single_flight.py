@@ -0,0 +1,80 @@
+"""This module implements request coalescing (aka single flight)
+for the auth service's async requests to the key service. When a
+burst of requests for the same credentials arrives only the first
+request is sent to the key service and all other requests wait
+for the first request's answer."""
+
+import logging
+
+from yar.util import deadline
+from yar.util import metrics
+
+_logger = logging.getLogger("AUTHSERVICE.%s" % __name__)
+
+
+class SingleFlight(object):
+    """Tracks in-flight async operations by key. The number of
+    operations that were collapsed into an already in-flight operation
+    is maintained in ```yar.util.metrics``` as a counter called
+    ```name```.collapsed."""
+
+    def __init__(self, name):
+        object.__init__(self)
+
+        self.name = name
+
+        self._callbacks = {}
+        self._deadlines = {}
+
+    def __len__(self):
+        return len(self._callbacks)
+
+    def join(self, key, callback, caller_deadline=None):
+        """Register ```callback``` to be called when the operation
+        identified by ```key``` completes. Returns True if the caller
+        is the first to ask for ```key``` and should therefore start
+        the operation. Returns False if the operation is already in
+        flight in which case the caller should do nothing more.
+        If not None, ```caller_deadline``` is the caller's
+        ```yar.util.deadline.Deadline``` - see ```deadline()```."""
+        callbacks = self._callbacks.get(key, None)
+        if callbacks is not None:
+            callbacks.append(callback)
+            shared_deadline = self._deadlines.get(key, None)
+            if shared_deadline is not None and caller_deadline is not None:
+                shared_deadline.extend(caller_deadline)
+            metrics.increment("%s.collapsed" % self.name)
+            return False
+
+        self._callbacks[key] = [callback]
+        if caller_deadline is not None:
+            shared_deadline = deadline.Deadline(0)
+            shared_deadline.extend(caller_deadline)
+            self._deadlines[key] = shared_deadline
+        return True
+
+    def deadline(self, key):
+        """Returns the ```yar.util.deadline.Deadline``` for the operation
+        identified by ```key``` or None if the operation's first caller
+        had no deadline. The operation is done on behalf of all its callers
+        so its deadline is the latest of their deadlines and moves out as
+        callers join."""
+        return self._deadlines.get(key, None)
+
+    def done(self, key, *args):
+        """The operation identified by ```key``` has completed.
+        Call all waiting callbacks with ```args```. A callback that
+        raises is logged and doesn't stop the other callbacks being
+        called."""
+        callbacks = self._callbacks.pop(key, [])
+        self._deadlines.pop(key, None)
+        if 1 < len(callbacks):
+            _logger.info(
+                "%d requests for '%s' shared a single response",
+                len(callbacks),
+                key)
+        for callback in callbacks:
+            try:
+                callback(*args)
+            except Exception:
+                _logger.exception("Callback for '%s' failed", key)
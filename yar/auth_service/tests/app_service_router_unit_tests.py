@@ -0,0 +1,131 @@
+"""This module implements the unit tests for the auth service's
+app_service_router module."""
+
+import json
+import os
+import shutil
+import tempfile
+
+import mock
+
+from yar.auth_service import app_service_router
+from yar.util import metrics
+from yar.tests import yar_test_util
+
+
+class TestRoutingTable(yar_test_util.TestCase):
+
+    _table = {
+        "upstreams": {
+            "orders": ["127.0.0.1:8081", "127.0.0.1:8082"],
+            "reports": ["/var/run/reports.sock"],
+            "admin": ["127.0.0.1:8083"],
+        },
+        "routes": [
+            {"prefix": "/v1.0/orders", "upstreams": "orders"},
+            {"prefix": "/v1.0/orders/reports/", "upstreams": "reports"},
+            {"prefix": "/v1.0/", "principals": ["ops@example.com"], "upstreams": "admin"},
+        ],
+    }
+
+    def test_lookup(self):
+        routing_table = app_service_router.RoutingTable(self._table)
+        self.assertEqual(routing_table.number_routes, 3)
+
+        orders = ("127.0.0.1:8081", "127.0.0.1:8082")
+        reports = ("/var/run/reports.sock",)
+        admin = ("127.0.0.1:8083",)
+        values = [
+            ["/v1.0/orders", None, orders],
+            ["/v1.0/orders/42", "das@example.com", orders],
+            ["/v1.0/orders/reports/42", None, reports],
+            ["/v1.0/orders/reports/42", "ops@example.com", reports],
+            ["/v1.0/orders/reports", None, orders],
+            ["/v1.0/bindle", "ops@example.com", admin],
+            ["/v1.0/orders/42", "ops@example.com", orders],
+            ["/v1.0/bindle", "das@example.com", None],
+            ["/v1.0", "ops@example.com", None],
+            ["/", None, None],
+            ["", None, None],
+        ]
+        for (path, principal, expected_upstreams) in values:
+            msg = "Wrong route for '%s' and '%s'" % (path, principal)
+            self.assertEqual(routing_table.lookup(path, principal), expected_upstreams, msg)
+
+    def test_default_route(self):
+        table = {
+            "upstreams": {"default": ["127.0.0.1:8080"]},
+            "routes": [{"prefix": "/", "upstreams": "default"}],
+        }
+        routing_table = app_service_router.RoutingTable(table)
+        self.assertEqual(routing_table.lookup("/dave"), ("127.0.0.1:8080",))
+
+    def test_invalid_tables(self):
+        tables = [
+            {},
+            {"upstreams": {}, "routes": [{"prefix": "dave", "upstreams": "x"}]},
+            {"upstreams": {"x": []}, "routes": []},
+            {"upstreams": {"x": ["127.0.0.1:8080"]}, "routes": [{"prefix": "/", "upstreams": "y"}]},
+            {
+                "upstreams": {"x": ["127.0.0.1:8080"]},
+                "routes": [
+                    {"prefix": "/", "upstreams": "x"},
+                    {"prefix": "/", "upstreams": "x"},
+                ],
+            },
+            {
+                "upstreams": {"x": ["127.0.0.1:8080"]},
+                "routes": [
+                    {"prefix": "/", "principals": ["das"], "upstreams": "x"},
+                    {"prefix": "/", "principals": ["das"], "upstreams": "x"},
+                ],
+            },
+        ]
+        for table in tables:
+            with self.assertRaises(ValueError):
+                app_service_router.RoutingTable(table)
+
+
+class TestLoad(yar_test_util.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        self._temp_dir = tempfile.mkdtemp()
+        self._filename = os.path.join(self._temp_dir, "routes.json")
+        self._patcher = mock.patch.object(app_service_router, "routing_table", None)
+        self._patcher.start()
+
+    def tearDown(self):
+        self._patcher.stop()
+        shutil.rmtree(self._temp_dir)
+
+    def _write(self, contents):
+        with open(self._filename, "w") as f:
+            f.write(contents)
+
+    def test_load_and_reload(self):
+        table = {
+            "upstreams": {"x": ["127.0.0.1:8080"]},
+            "routes": [{"prefix": "/dave", "upstreams": "x"}],
+        }
+        self._write(json.dumps(table))
+        self.assertTrue(app_service_router.load(self._filename))
+        routing_table = app_service_router.routing_table
+        self.assertEqual(routing_table.lookup("/dave"), ("127.0.0.1:8080",))
+        self.assertEqual(metrics.get_gauge("app_service_router.routes"), 1)
+
+        # a bad routing table leaves the current routing table in place
+        self._write("{")
+        self.assertFalse(app_service_router.load(self._filename))
+        self.assertIs(app_service_router.routing_table, routing_table)
+        self.assertEqual(metrics.counter("app_service_router.load_errors"), 1)
+
+        table["routes"].append({"prefix": "/bindle", "upstreams": "x"})
+        self._write(json.dumps(table))
+        self.assertTrue(app_service_router.load(self._filename))
+        self.assertEqual(app_service_router.routing_table.lookup("/bindle"), ("127.0.0.1:8080",))
+        self.assertEqual(metrics.counter("app_service_router.loads"), 2)
+
+    def test_load_missing_file(self):
+        self.assertFalse(app_service_router.load(self._filename))
+        self.assertIsNone(app_service_router.routing_table)
@@ -6,12 +6,18 @@ import os
 import sys
 
 import mock
+import tornado.concurrent
+import tornado.httpclient
 import tornado.httputil
 
+from yar.util import deadline
 from yar.util import mac
+from yar.util import metrics
 from yar.tests import yar_test_util
 
+from yar.auth_service import app_service_router
 from yar.auth_service import async_app_service_forwarder
+from yar.auth_service import request_body
 
 
 class TestAsyncCredsForwarder(yar_test_util.TestCase):
@@ -249,7 +255,7 @@ class TestAsyncCredsForwarder(yar_test_util.TestCase):
 
             response = mock.Mock()
             response.error = "something"
-            response.code = httplib.NOT_FOUND
+            response.code = 599
             response.request_time = 24
             callback(response)
 
@@ -266,3 +272,246 @@ class TestAsyncCredsForwarder(yar_test_util.TestCase):
                 the_request_body,
                 the_request_principal)
             aasf.forward(on_async_app_service_forward_done)
+
+    def test_error_response_passed_along(self):
+        """Confirm that responses which tornado flags as errors - anything
+        other than a 2xx - are passed along rather than treated as a
+        failure to forward the request."""
+        for the_response_code in [httplib.NOT_MODIFIED, httplib.NOT_FOUND, httplib.SERVICE_UNAVAILABLE]:
+
+            def async_http_client_fetch_patch(http_client, request, callback):
+                response = mock.Mock()
+                response.error = tornado.httpclient.HTTPError(the_response_code)
+                response.code = the_response_code
+                response.headers = tornado.httputil.HTTPHeaders({"X-Dave": "was here"})
+                response.body = "" if the_response_code == httplib.NOT_MODIFIED else "bindle"
+                response.request_time = 24
+                callback(response)
+
+            callback = mock.Mock()
+            name_of_method_to_patch = "tornado.httpclient.AsyncHTTPClient.fetch"
+            with mock.patch(name_of_method_to_patch, async_http_client_fetch_patch):
+                aasf = async_app_service_forwarder.AsyncAppServiceForwarder(
+                    "GET",
+                    "/dave.html",
+                    {},
+                    None,
+                    "das@example.com")
+                aasf.forward(callback)
+
+            expected_body = None if the_response_code == httplib.NOT_MODIFIED else "bindle"
+            callback.assert_called_once_with(
+                True,
+                the_response_code,
+                tornado.httputil.HTTPHeaders({"X-Dave": "was here"}),
+                expected_body)
+
+    def test_streamed_request_body(self):
+        """Verify a ```request_body.RequestBody``` is streamed to the
+        app service using a body producer rather than being read
+        into memory."""
+        the_request_body = request_body.RequestBody(mock.Mock(headers=tornado.httputil.HTTPHeaders({
+            "Content-Length": "13",
+            "Transfer-Encoding": "chunked",
+        })))
+        the_request_body.append("dave was here")
+
+        def async_app_service_forwarder_forward_patch(http_client, request, callback):
+            self.assertIsNone(request.body)
+            chunks = []
+
+            def write(chunk):
+                chunks.append(chunk)
+                future = tornado.concurrent.Future()
+                future.set_result(None)
+                return future
+
+            request.body_producer(write)
+            self.assertEqual("".join(chunks), "dave was here")
+            self.assertEqual(request.headers["Content-Length"], "13")
+            self.assertNotIn("Transfer-Encoding", request.headers)
+
+            response = mock.Mock()
+            response.error = None
+            response.code = httplib.OK
+            response.headers = tornado.httputil.HTTPHeaders()
+            response.body = None
+            response.request_time = 24
+            callback(response)
+
+        on_async_app_service_forward_done = mock.Mock()
+
+        name_of_method_to_patch = "tornado.httpclient.AsyncHTTPClient.fetch"
+        with mock.patch(name_of_method_to_patch, async_app_service_forwarder_forward_patch):
+            aasf = async_app_service_forwarder.AsyncAppServiceForwarder(
+                "POST",
+                "/dave.html",
+                {},
+                the_request_body,
+                "das@example.com")
+            aasf.forward(on_async_app_service_forward_done)
+
+        on_async_app_service_forward_done.assert_called_once_with(True, httplib.OK, {}, None)
+        the_request_body.close()
+
+    def _test_retry(self, the_request_method, expected_urls):
+        """Forward a request to two app services, the first of
+        which never responds."""
+        the_app_services = ["bindle:1", "berry:2"]
+        urls = []
+
+        def async_app_service_forwarder_forward_patch(http_client, request, callback):
+            urls.append(request.url)
+            response = mock.Mock()
+            response.headers = tornado.httputil.HTTPHeaders()
+            response.body = None
+            response.request_time = 0.01
+            if request.url.startswith("http://bindle:1"):
+                response.error = "connection refused"
+                response.code = 599
+            else:
+                response.error = None
+                response.code = httplib.OK
+            callback(response)
+
+        on_async_app_service_forward_done = mock.Mock()
+
+        with mock.patch("random.sample", lambda population, k: population[:k]):
+            with mock.patch.object(async_app_service_forwarder, "app_service", the_app_services), \
+                    mock.patch.object(async_app_service_forwarder, "_load_balancers", {}):
+                name_of_method_to_patch = "tornado.httpclient.AsyncHTTPClient.fetch"
+                with mock.patch(name_of_method_to_patch, async_app_service_forwarder_forward_patch):
+                    aasf = async_app_service_forwarder.AsyncAppServiceForwarder(
+                        the_request_method,
+                        "/dave.html",
+                        {},
+                        None,
+                        "das@example.com")
+                    aasf.forward(on_async_app_service_forward_done)
+
+        self.assertEqual(urls, expected_urls)
+        return on_async_app_service_forward_done
+
+    def test_idempotent_request_retried_on_another_app_service(self):
+        metrics.reset()
+        on_async_app_service_forward_done = self._test_retry(
+            "GET",
+            ["http://bindle:1/dave.html", "http://berry:2/dave.html"])
+        on_async_app_service_forward_done.assert_called_once_with(True, httplib.OK, {}, None)
+        self.assertEqual(metrics.counter("app_service.retries"), 1)
+        self.assertEqual(metrics.counter("app_service.bindle:1.errors"), 1)
+        self.assertEqual(metrics.get_gauge("app_service.bindle:1.in_flight"), 0)
+        self.assertEqual(metrics.get_gauge("app_service.berry:2.in_flight"), 0)
+
+    def test_non_idempotent_request_not_retried(self):
+        metrics.reset()
+        on_async_app_service_forward_done = self._test_retry(
+            "POST",
+            ["http://bindle:1/dave.html"])
+        on_async_app_service_forward_done.assert_called_once_with(False)
+        self.assertEqual(metrics.counter("app_service.retries"), 0)
+
+    def test_routed(self):
+        """Verify requests are forwarded to the app services chosen by
+        the routing table and to ```app_service``` if no route matches."""
+        routing_table = app_service_router.RoutingTable({
+            "upstreams": {"orders": ["orders:8081"]},
+            "routes": [{"prefix": "/orders/", "upstreams": "orders"}],
+        })
+        urls = []
+
+        def async_app_service_forwarder_forward_patch(http_client, request, callback):
+            urls.append(request.url)
+            response = mock.Mock()
+            response.error = None
+            response.code = httplib.OK
+            response.headers = tornado.httputil.HTTPHeaders()
+            response.body = None
+            response.request_time = 0.01
+            callback(response)
+
+        with mock.patch.object(app_service_router, "routing_table", routing_table):
+            name_of_method_to_patch = "tornado.httpclient.AsyncHTTPClient.fetch"
+            with mock.patch(name_of_method_to_patch, async_app_service_forwarder_forward_patch):
+                for uri in ["/orders/42?x=1", "/dave.html"]:
+                    aasf = async_app_service_forwarder.AsyncAppServiceForwarder(
+                        "GET",
+                        uri,
+                        {},
+                        None,
+                        "das@example.com")
+                    aasf.forward(mock.Mock())
+
+        self.assertEqual(
+            urls,
+            ["http://orders:8081/orders/42?x=1", "http://%s/dave.html" % self.__class__._app_service])
+
+    def _test_deadline(self, the_deadline, the_response_code, is_expired_by_response=False):
+        """Forward a request with ```the_deadline``` to two app services
+        both of which respond with ```the_response_code```. If
+        ```is_expired_by_response``` is True the deadline expires
+        while waiting for the app service's response."""
+        requests = []
+
+        def async_app_service_forwarder_forward_patch(http_client, request, callback):
+            requests.append(request)
+            if is_expired_by_response:
+                the_deadline.expires_at = 0
+            response = mock.Mock()
+            response.error = None if the_response_code != 599 else "timeout"
+            response.code = the_response_code
+            response.headers = tornado.httputil.HTTPHeaders()
+            response.body = None
+            response.request_time = 0.01
+            callback(response)
+
+        on_async_app_service_forward_done = mock.Mock()
+
+        with mock.patch.object(async_app_service_forwarder, "app_service", ["bindle:1", "berry:2"]), \
+                mock.patch.object(async_app_service_forwarder, "_load_balancers", {}):
+            name_of_method_to_patch = "tornado.httpclient.AsyncHTTPClient.fetch"
+            with mock.patch(name_of_method_to_patch, async_app_service_forwarder_forward_patch):
+                aasf = async_app_service_forwarder.AsyncAppServiceForwarder(
+                    "GET",
+                    "/dave.html",
+                    {deadline.header_name: "60000"},
+                    None,
+                    "das@example.com",
+                    the_deadline)
+                aasf.forward(on_async_app_service_forward_done)
+
+        return (requests, on_async_app_service_forward_done)
+
+    def test_deadline_passed_to_app_service(self):
+        (requests, on_async_app_service_forward_done) = self._test_deadline(
+            deadline.Deadline(2),
+            httplib.OK)
+        self.assertEqual(len(requests), 1)
+        self.assertTrue(0 < requests[0].request_timeout <= 2)
+        self.assertTrue(0 < int(requests[0].headers[deadline.header_name]) <= 2000)
+
+    def test_client_deadline_header_not_forwarded(self):
+        (requests, on_async_app_service_forward_done) = self._test_deadline(None, httplib.OK)
+        self.assertEqual(len(requests), 1)
+        self.assertIsNone(requests[0].request_timeout)
+        self.assertNotIn(deadline.header_name, requests[0].headers)
+
+    def test_deadline_expired_before_forwarding(self):
+        metrics.reset()
+        the_deadline = deadline.Deadline(0)
+        (requests, on_async_app_service_forward_done) = self._test_deadline(the_deadline, httplib.OK)
+        self.assertEqual(len(requests), 0)
+        on_async_app_service_forward_done.assert_called_once_with(False)
+        self.assertEqual(the_deadline.exceeded_stage, "app_service")
+        self.assertEqual(metrics.counter("deadline_exceeded.app_service"), 1)
+
+    def test_deadline_exceeded(self):
+        metrics.reset()
+        the_deadline = deadline.Deadline(60)
+        (requests, on_async_app_service_forward_done) = self._test_deadline(the_deadline, 599, True)
+        # out of time so the request isn't retried on the other app service
+        self.assertEqual(len(requests), 1)
+        on_async_app_service_forward_done.assert_called_once_with(False)
+        self.assertEqual(the_deadline.exceeded_stage, "app_service")
+        self.assertEqual(metrics.counter("deadline_exceeded.app_service"), 1)
+        self.assertEqual(metrics.counter("app_service.retries"), 0)
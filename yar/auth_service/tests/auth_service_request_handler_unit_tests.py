@@ -9,13 +9,19 @@ import uuid
 
 import httplib2
 import mock
+import tornado.gen
 import tornado.httpserver
 import tornado.httputil
+import tornado.tcpclient
 import tornado.web
 import tornado.testing
 
 from yar.tests import yar_test_util
+from yar.util import concurrency_limiter
+from yar.util import mac
+from yar.util import metrics
 from yar.auth_service import auth_service_request_handler
+from yar.auth_service import request_body
 from yar.auth_service.auth_service_request_handler import auth_failure_detail_header_name
 from yar.auth_service.auth_service_request_handler import debug_header_prefix
 
@@ -198,6 +204,67 @@ class AuthServerRequestHandlerTestCase(tornado.testing.AsyncHTTPTestCase):
                 self.assertNoAuthFailureDetail(response)
                 self.assertNoAuthFailureDebugDetails(response)
 
+    def test_auth_failure_debug_details_generated_on_demand(self):
+        """This test confirms that when an authenticator supplies a
+        function to generate authentication failure debug details the
+        function is only called if the debug details are going to be
+        included in the auth service's HTTP response. It also confirms
+        each authentication failure is counted by failure detail."""
+
+        the_auth_failure_detail = auth_service_request_handler.AUTH_FAILURE_DETAIL_FOR_TESTING
+
+        the_auth_failure_debug_details = {
+            str(uuid.uuid4()).replace("-", ""): str(uuid.uuid4()).replace("-", ""),
+        }
+
+        generate_auth_failure_debug_details = mock.Mock(
+            side_effect=lambda callback: callback(the_auth_failure_debug_details))
+
+        def authenticate_patch(authenticator, callback):
+            callback(
+                is_auth_ok=False,
+                auth_failure_detail=the_auth_failure_detail,
+                auth_failure_debug_details=generate_auth_failure_debug_details)
+
+        metrics.reset()
+
+        name_of_method_to_patch = (
+            "yar.auth_service.mac."
+            "async_mac_auth.AsyncMACAuth.authenticate"
+        )
+        with mock.patch(name_of_method_to_patch, authenticate_patch):
+            with ControlIncludeAuthFailureDebugDetails(False):
+                response = self.fetch(
+                    "/",
+                    method="GET",
+                    headers={"Authorization": "MAC ..."})
+                self.assertEqual(response.code, httplib.UNAUTHORIZED)
+                self.assertNoAuthFailureDebugDetails(response)
+                self.assertFalse(generate_auth_failure_debug_details.called)
+
+            with ControlIncludeAuthFailureDebugDetails(True):
+                response = self.fetch(
+                    "/",
+                    method="GET",
+                    headers={"Authorization": "MAC ..."})
+                self.assertEqual(response.code, httplib.UNAUTHORIZED)
+                self.assertAuthFailureDetail(response, the_auth_failure_detail)
+                self.assertAuthFailureDebugDetails(
+                    response,
+                    the_auth_failure_debug_details)
+                self.assertEqual(generate_auth_failure_debug_details.call_count, 1)
+
+            response = self.fetch("/", method="GET", headers={})
+            self.assertEqual(response.code, httplib.UNAUTHORIZED)
+
+        self.assertEqual(
+            metrics.counter("auth_failure.0x{:04x}".format(the_auth_failure_detail)),
+            2)
+        self.assertEqual(
+            metrics.counter("auth_failure.0x{:04x}".format(
+                auth_service_request_handler.AUTH_FAILURE_DETAIL_NO_AUTH_HEADER)),
+            1)
+
     def test_forward_to_app_service_failed(self):
         """Verify that when async the foward to the app service fails,
         that the response is ```httplib.INTERNAL_SERVER_ERROR```."""
@@ -229,6 +296,216 @@ class AuthServerRequestHandlerTestCase(tornado.testing.AsyncHTTPTestCase):
                 self.assertIsNotNone(response)
                 self.assertEqual(response.code, httplib.INTERNAL_SERVER_ERROR)
 
+    def test_deadline_exceeded_during_authentication(self):
+        """Verify that when authentication runs out of time the
+        response is ```httplib.GATEWAY_TIMEOUT``` rather than
+        ```httplib.UNAUTHORIZED```."""
+        metrics.reset()
+
+        def authenticate_patch(authenticator, callback):
+            self.assertIsNotNone(authenticator._deadline)
+            authenticator._deadline.exceeded("creds_retrieval")
+            callback(is_auth_ok=False)
+
+        name_of_method_to_patch = (
+            "yar.auth_service.mac."
+            "async_mac_auth.AsyncMACAuth.authenticate"
+        )
+        with mock.patch(name_of_method_to_patch, authenticate_patch):
+            response = self.fetch(
+                "/",
+                method="GET",
+                headers={"Authorization": "MAC ..."})
+
+            self.assertIsNotNone(response)
+            self.assertEqual(response.code, httplib.GATEWAY_TIMEOUT)
+            self.assertEqual(metrics.counter("deadline_exceeded.creds_retrieval"), 1)
+            self.assertEqual(metrics.counter("auth_failure.0x0000"), 0)
+
+    def test_deadline_exceeded_forwarding_to_app_service(self):
+        """Verify that when the forward to the app service runs out
+        of time the response is ```httplib.GATEWAY_TIMEOUT```."""
+        the_principal = str(uuid.uuid4()).replace("-", "")
+
+        def authenticate_patch(authenticator, callback):
+            callback(is_auth_ok=True, principal=the_principal)
+
+        name_of_method_to_patch = (
+            "yar.auth_service.mac."
+            "async_mac_auth.AsyncMACAuth.authenticate"
+        )
+        with mock.patch(name_of_method_to_patch, authenticate_patch):
+
+            def forward_patch(async_app_service_forwarder, callback):
+                self.assertTrue(0 < async_app_service_forwarder._deadline.remaining() <= 5)
+                async_app_service_forwarder._deadline.exceeded("app_service")
+                callback(is_ok=False)
+
+            name_of_method_to_patch = (
+                "yar.auth_service.async_app_service_forwarder."
+                "AsyncAppServiceForwarder.forward"
+            )
+            with mock.patch(name_of_method_to_patch, forward_patch):
+                with mock.patch.object(auth_service_request_handler, "deadline_budget", 5):
+
+                    response = self.fetch(
+                        "/",
+                        method="GET",
+                        headers={"Authorization": "MAC ..."})
+
+                    self.assertIsNotNone(response)
+                    self.assertEqual(response.code, httplib.GATEWAY_TIMEOUT)
+
+    def test_deadline_excludes_receiving_request_body(self):
+        """Verify that the time spent receiving a slowly uploaded
+        request body doesn't count against the request's deadline."""
+        the_principal = str(uuid.uuid4()).replace("-", "")
+
+        @tornado.gen.coroutine
+        def body_producer(write):
+            for _ in range(3):
+                yield write("dave" * 100)
+                yield tornado.gen.sleep(0.2)
+
+        def authenticate_patch(async_mac_auth, callback):
+            def on_request_body_complete():
+                callback(is_auth_ok=True, principal=the_principal)
+
+            async_mac_auth._request_body.when_complete(on_request_body_complete)
+
+        def forward_patch(async_app_service_forwarder, callback):
+            self.assertFalse(async_app_service_forwarder._deadline.is_expired())
+            callback(is_ok=True, http_status_code=httplib.OK, headers={}, body=None)
+
+        name_of_method_to_patch = (
+            "yar.auth_service.mac."
+            "async_mac_auth.AsyncMACAuth.authenticate"
+        )
+        with mock.patch(name_of_method_to_patch, authenticate_patch):
+            name_of_method_to_patch = (
+                "yar.auth_service.async_app_service_forwarder."
+                "AsyncAppServiceForwarder.forward"
+            )
+            with mock.patch(name_of_method_to_patch, forward_patch), \
+                    mock.patch.object(auth_service_request_handler, "deadline_budget", 0.3):
+                response = self.fetch(
+                    "/",
+                    method="POST",
+                    body_producer=body_producer,
+                    headers={"Authorization": "MAC ..."})
+
+                self.assertEqual(response.code, httplib.OK)
+
+    def test_authentication_shed(self):
+        """Verify that when too many requests are being authenticated
+        new requests are shed with a ```httplib.SERVICE_UNAVAILABLE```
+        response that includes a Retry-After header."""
+        metrics.reset()
+        limiter = concurrency_limiter.ConcurrencyLimiter("dave", initial_limit=1)
+        limiter.in_flight = 1
+
+        authenticate_patch = mock.Mock()
+        name_of_method_to_patch = (
+            "yar.auth_service.mac."
+            "async_mac_auth.AsyncMACAuth.authenticate"
+        )
+        with mock.patch(name_of_method_to_patch, authenticate_patch):
+            with mock.patch.object(auth_service_request_handler, "auth_concurrency_limiter", limiter), \
+                    mock.patch.object(auth_service_request_handler, "retry_after", 3):
+                response = self.fetch(
+                    "/",
+                    method="GET",
+                    headers={"Authorization": "MAC ..."})
+
+                self.assertIsNotNone(response)
+                self.assertEqual(response.code, httplib.SERVICE_UNAVAILABLE)
+                self.assertEqual(response.headers.get("Retry-After"), "3")
+                self.assertFalse(authenticate_patch.called)
+                self.assertEqual(metrics.counter("dave.shed"), 1)
+
+    def test_app_service_shed(self):
+        """Verify that when too many requests are being forwarded to
+        app services new requests are shed with a
+        ```httplib.SERVICE_UNAVAILABLE``` response and that requests
+        which are admitted are released when they finish."""
+        the_principal = str(uuid.uuid4()).replace("-", "")
+
+        def authenticate_patch(authenticator, callback):
+            callback(is_auth_ok=True, principal=the_principal)
+
+        def forward_patch(async_app_service_forwarder, callback):
+            callback(is_ok=True, http_status_code=httplib.OK, headers=tornado.httputil.HTTPHeaders())
+
+        auth_limiter = concurrency_limiter.ConcurrencyLimiter("auth")
+        app_service_limiter = concurrency_limiter.ConcurrencyLimiter("app_service", initial_limit=1)
+
+        name_of_method_to_patch = (
+            "yar.auth_service.mac."
+            "async_mac_auth.AsyncMACAuth.authenticate"
+        )
+        with mock.patch(name_of_method_to_patch, authenticate_patch):
+            name_of_method_to_patch = (
+                "yar.auth_service.async_app_service_forwarder."
+                "AsyncAppServiceForwarder.forward"
+            )
+            with mock.patch(name_of_method_to_patch, forward_patch), \
+                    mock.patch.object(auth_service_request_handler, "auth_concurrency_limiter", auth_limiter), \
+                    mock.patch.object(
+                        auth_service_request_handler,
+                        "app_service_concurrency_limiter",
+                        app_service_limiter):
+
+                response = self.fetch("/", method="GET", headers={"Authorization": "MAC ..."})
+                self.assertEqual(response.code, httplib.OK)
+                self.assertEqual(auth_limiter.in_flight, 0)
+                self.assertEqual(app_service_limiter.in_flight, 0)
+
+                app_service_limiter.in_flight = 1
+                response = self.fetch("/", method="GET", headers={"Authorization": "MAC ..."})
+                self.assertEqual(response.code, httplib.SERVICE_UNAVAILABLE)
+                self.assertIsNotNone(response.headers.get("Retry-After"))
+                self.assertEqual(auth_limiter.in_flight, 0)
+
+    def test_authentication_concurrency_released_while_waiting_for_body(self):
+        """Verify that a request stops counting against the auth
+        concurrency limit when authentication starts waiting for the
+        request's body rather than holding on to it for the upload."""
+        the_request_body = str(uuid.uuid4()).replace("-", "") * 1000
+        auth_limiter = concurrency_limiter.ConcurrencyLimiter("auth")
+
+        def authenticate_patch(async_mac_auth, callback):
+            self.assertEqual(auth_limiter.in_flight, 1)
+
+            def on_request_body_complete():
+                self.assertEqual(auth_limiter.in_flight, 0)
+                callback(is_auth_ok=True, principal="dave")
+
+            async_mac_auth._request_body.when_complete(on_request_body_complete)
+            self.assertEqual(auth_limiter.in_flight, 0)
+
+        def forward_patch(async_app_service_forwarder, callback):
+            callback(is_ok=True, http_status_code=httplib.OK, headers={}, body=None)
+
+        name_of_method_to_patch = (
+            "yar.auth_service.mac."
+            "async_mac_auth.AsyncMACAuth.authenticate"
+        )
+        with mock.patch(name_of_method_to_patch, authenticate_patch):
+            name_of_method_to_patch = (
+                "yar.auth_service.async_app_service_forwarder."
+                "AsyncAppServiceForwarder.forward"
+            )
+            with mock.patch(name_of_method_to_patch, forward_patch), \
+                    mock.patch.object(auth_service_request_handler, "auth_concurrency_limiter", auth_limiter):
+                response = self.fetch(
+                    "/",
+                    method="POST",
+                    body=the_request_body,
+                    headers={"Authorization": "MAC ..."})
+
+                self.assertEqual(response.code, httplib.OK)
+                self.assertEqual(auth_limiter.in_flight, 0)
+
     def _test_forward_all_good(self, the_method, the_request_body, the_response_body):
         """Happy path verification of forwarding request to app service
         after authentication is successful."""
@@ -324,5 +601,377 @@ class AuthServerRequestHandlerTestCase(tornado.testing.AsyncHTTPTestCase):
             None,
             None)
 
+    def test_request_body_streamed_to_authenticator_and_app_service(self):
+        """Verify the request's body is accepted incrementally, the
+        authenticator is given the body's ext and the body is
+        forwarded to the app service."""
+        the_content_type = "text/plain"
+        the_request_body = str(uuid.uuid4()).replace("-", "") * 1000
+        the_principal = str(uuid.uuid4()).replace("-", "")
+
+        def authenticate_patch(async_mac_auth, callback):
+            # authentication starts before the body has been received
+            self.assertFalse(async_mac_auth._request_body.is_complete)
+
+            def on_request_body_complete():
+                self.assertEqual(
+                    async_mac_auth._request_body.ext(),
+                    mac.Ext.generate(the_content_type, the_request_body))
+                callback(is_auth_ok=True, principal=the_principal)
+
+            async_mac_auth._request_body.when_complete(on_request_body_complete)
+
+        name_of_method_to_patch = (
+            "yar.auth_service.mac."
+            "async_mac_auth.AsyncMACAuth.authenticate"
+        )
+        with mock.patch(name_of_method_to_patch, authenticate_patch):
+
+            def forward_patch(async_app_service_forwarder, callback):
+                self.assertEqual(async_app_service_forwarder._body.read(), the_request_body)
+                callback(
+                    is_ok=True,
+                    http_status_code=httplib.OK,
+                    headers={},
+                    body=None)
+
+            name_of_method_to_patch = (
+                "yar.auth_service.async_app_service_forwarder."
+                "AsyncAppServiceForwarder.forward"
+            )
+            with mock.patch(name_of_method_to_patch, forward_patch):
+                with mock.patch.object(request_body, "max_in_memory_size", 1024):
+                    response = self.fetch(
+                        "/",
+                        method="POST",
+                        body=the_request_body,
+                        headers={
+                            "Authorization": "MAC ...",
+                            "Content-Type": the_content_type,
+                        })
+
+                self.assertEqual(response.code, httplib.OK)
+
+    def test_large_request_body_offloaded(self):
+        """Verify request bodies larger than ```request_body.offload_threshold```
+        are hashed and spooled on ```worker_pool```'s threads."""
+        metrics.reset()
+
+        the_content_type = "text/plain"
+        the_request_body = str(uuid.uuid4()).replace("-", "") * 10000
+
+        def authenticate_patch(async_mac_auth, callback):
+            def on_request_body_complete():
+                self.assertEqual(
+                    async_mac_auth._request_body.ext(),
+                    mac.Ext.generate(the_content_type, the_request_body))
+                callback(is_auth_ok=True, principal="das")
+
+            async_mac_auth._request_body.when_complete(on_request_body_complete)
+
+        def forward_patch(async_app_service_forwarder, callback):
+            self.assertEqual(async_app_service_forwarder._body.read(), the_request_body)
+            callback(is_ok=True, http_status_code=httplib.OK, headers={}, body=None)
+
+        name_of_method_to_patch = (
+            "yar.auth_service.mac."
+            "async_mac_auth.AsyncMACAuth.authenticate"
+        )
+        with mock.patch(name_of_method_to_patch, authenticate_patch):
+            name_of_method_to_patch = (
+                "yar.auth_service.async_app_service_forwarder."
+                "AsyncAppServiceForwarder.forward"
+            )
+            with mock.patch(name_of_method_to_patch, forward_patch):
+                with mock.patch.object(request_body, "offload_threshold", 1024):
+                    response = self.fetch(
+                        "/",
+                        method="POST",
+                        body=the_request_body,
+                        headers={
+                            "Authorization": "MAC ...",
+                            "Content-Type": the_content_type,
+                        })
+
+        self.assertEqual(response.code, httplib.OK)
+        self.assertTrue(0 < metrics.counter("worker_pool.submitted"))
+
+    @tornado.testing.gen_test
+    def test_expect_100_continue_auth_failure(self):
+        """Verify that when a request includes an "Expect: 100-continue"
+        header and authentication fails without needing the request's
+        body, the auth service responds with a 401 rather than telling
+        the client to send the body."""
+        def authenticate_patch(async_mac_auth, callback):
+            callback(is_auth_ok=False)
+
+        name_of_method_to_patch = (
+            "yar.auth_service.mac."
+            "async_mac_auth.AsyncMACAuth.authenticate"
+        )
+        with mock.patch(name_of_method_to_patch, authenticate_patch):
+            stream = yield tornado.tcpclient.TCPClient().connect("127.0.0.1", self.get_http_port())
+            yield stream.write(
+                "POST / HTTP/1.1\r\n"
+                "Host: 127.0.0.1\r\n"
+                "Authorization: MAC ...\r\n"
+                "Content-Length: 1048576\r\n"
+                "Expect: 100-continue\r\n"
+                "\r\n")
+            status_line = yield stream.read_until("\r\n")
+            stream.close()
+
+        self.assertTrue(status_line.startswith("HTTP/1.1 401 "))
+
+    def test_expect_100_continue_auth_ok(self):
+        """Verify that when a request includes an "Expect: 100-continue"
+        header and authentication needs the request's body, the client
+        is told to continue and the request is forwarded."""
+        the_request_body = str(uuid.uuid4()).replace("-", "") * 1000
+
+        def authenticate_patch(async_mac_auth, callback):
+            def on_request_body_complete():
+                callback(is_auth_ok=True, principal="das")
+
+            async_mac_auth._request_body.when_complete(on_request_body_complete)
+
+        def forward_patch(async_app_service_forwarder, callback):
+            self.assertEqual(async_app_service_forwarder._body.read(), the_request_body)
+            callback(is_ok=True, http_status_code=httplib.OK, headers={}, body=None)
+
+        name_of_method_to_patch = (
+            "yar.auth_service.mac."
+            "async_mac_auth.AsyncMACAuth.authenticate"
+        )
+        with mock.patch(name_of_method_to_patch, authenticate_patch):
+            name_of_method_to_patch = (
+                "yar.auth_service.async_app_service_forwarder."
+                "AsyncAppServiceForwarder.forward"
+            )
+            with mock.patch(name_of_method_to_patch, forward_patch):
+                response = self.fetch(
+                    "/",
+                    method="POST",
+                    body=the_request_body,
+                    expect_100_continue=True,
+                    headers={"Authorization": "MAC ..."})
+
+        self.assertEqual(response.code, httplib.OK)
+
+    def test_request_body_too_large(self):
+        """Verify requests with bodies larger than
+        ```request_body.max_size``` are rejected before
+        authentication is attempted."""
+        authenticate_patch = mock.Mock()
+        name_of_method_to_patch = (
+            "yar.auth_service.mac."
+            "async_mac_auth.AsyncMACAuth.authenticate"
+        )
+        with mock.patch(name_of_method_to_patch, authenticate_patch):
+            with mock.patch.object(request_body, "max_size", 16):
+                response = self.fetch(
+                    "/",
+                    method="POST",
+                    body="x" * 17,
+                    headers={"Authorization": "MAC ..."})
+
+                self.assertEqual(response.code, httplib.REQUEST_ENTITY_TOO_LARGE)
+                self.assertFalse(authenticate_patch.called)
+
+    def test_request_body_spill_budget_exceeded(self):
+        """Verify requests whose bodies would take the request bodies
+        spilled to disk over ```request_body.max_spilled_size``` are
+        shed with a ```httplib.SERVICE_UNAVAILABLE``` response."""
+
+        def authenticate_patch(async_mac_auth, callback):
+            async_mac_auth._request_body.when_complete(
+                lambda: callback(is_auth_ok=True, principal="dave"))
+
+        name_of_method_to_patch = (
+            "yar.auth_service.mac."
+            "async_mac_auth.AsyncMACAuth.authenticate"
+        )
+        with mock.patch(name_of_method_to_patch, authenticate_patch):
+            with mock.patch.object(request_body, "max_in_memory_size", 16), \
+                    mock.patch.object(request_body, "max_spilled_size", 32), \
+                    mock.patch.object(request_body, "_spilled_size", 0), \
+                    mock.patch.object(auth_service_request_handler, "retry_after", 3):
+                response = self.fetch(
+                    "/",
+                    method="POST",
+                    body="x" * 33,
+                    headers={"Authorization": "MAC ..."})
+
+                self.assertEqual(response.code, httplib.SERVICE_UNAVAILABLE)
+                self.assertEqual(response.headers.get("Retry-After"), "3")
+                self.assertEqual(request_body._spilled_size, 0)
+
     # :TODO: need test to verify MAC Authorization header uses MAC Authenticator
     # :TODO: need test to verify BASIC Authorization header uses Basic Authenticator
+
+
+class _AppServiceRequestHandler(tornado.web.RequestHandler):
+    """A fake app service used to test streaming responses
+    from the app service through the auth service."""
+
+    def get(self):
+        self.set_header("X-Dave", "was here")
+        self.set_header("Connection", "X-Hop")
+        self.set_header("X-Hop", "hop")
+        self.set_header("Keep-Alive", "timeout=5")
+        for i in range(64):
+            self.write("%04d" % i * 1024)
+            self.flush()
+
+    def post(self):
+        self.set_status(httplib.CREATED)
+        self.write(self.request.body)
+
+
+class StreamingAuthServerRequestHandlerTestCase(tornado.testing.AsyncHTTPTestCase):
+    """Unit tests for ```auth_service_request_handler.RequestHandler```
+    streaming responses from the app service."""
+
+    def get_app(self):
+        handlers = [
+            (
+                auth_service_request_handler.url_spec,
+                auth_service_request_handler.RequestHandler
+            ),
+        ]
+        return tornado.web.Application(handlers=handlers)
+
+    def setUp(self):
+        tornado.testing.AsyncHTTPTestCase.setUp(self)
+
+        metrics.reset()
+
+        (app_service_socket, app_service_port) = tornado.testing.bind_unused_port()
+        self._app_service_port = app_service_port
+        app_service = tornado.web.Application(handlers=[(r".*", _AppServiceRequestHandler)])
+        self._app_service_http_server = tornado.httpserver.HTTPServer(app_service, io_loop=self.io_loop)
+        self._app_service_http_server.add_sockets([app_service_socket])
+
+        aasf = "yar.auth_service.async_app_service_forwarder"
+        self._patchers = [
+            mock.patch("%s.stream_responses" % aasf, True),
+            mock.patch("%s.app_service" % aasf, "127.0.0.1:%d" % app_service_port),
+            mock.patch("%s.max_buffer_size" % aasf, 8 * 1024),
+            mock.patch("%s.chunk_size" % aasf, 4 * 1024),
+            mock.patch(
+                "yar.auth_service.mac.async_mac_auth.AsyncMACAuth.authenticate",
+                lambda authenticator, callback: callback(is_auth_ok=True, principal="das")),
+        ]
+        for patcher in self._patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self._patchers:
+            patcher.stop()
+        self._app_service_http_server.stop()
+        tornado.testing.AsyncHTTPTestCase.tearDown(self)
+
+    def test_streamed_response(self):
+        response = self.fetch(
+            "/",
+            method="GET",
+            headers={"Authorization": "MAC ..."})
+
+        self.assertEqual(response.code, httplib.OK)
+        self.assertEqual(response.body, "".join(["%04d" % i * 1024 for i in range(64)]))
+        self.assertEqual(response.headers["X-Dave"], "was here")
+        self.assertNotIn("X-Hop", response.headers)
+        self.assertNotIn("Keep-Alive", response.headers)
+
+        peak_buffer_bytes = metrics.get_gauge("app_service_response.peak_buffer_bytes")
+        self.assertTrue(0 < peak_buffer_bytes <= (8 + 4) * 1024)
+        self.assertEqual(
+            metrics.get_gauge("app_service_response.max_peak_buffer_bytes"),
+            peak_buffer_bytes)
+
+    def test_streamed_request_and_response_bodies(self):
+        the_body = str(uuid.uuid4()).replace("-", "") * 1000
+        response = self.fetch(
+            "/",
+            method="POST",
+            body=the_body,
+            headers={"Authorization": "MAC ..."})
+
+        self.assertEqual(response.code, httplib.CREATED)
+        self.assertEqual(response.body, the_body)
+
+    def test_app_service_connections_kept_alive(self):
+        for method in ["GET", "POST", "GET"]:
+            response = self.fetch(
+                "/",
+                method=method,
+                body="dave was here" if method == "POST" else None,
+                headers={"Authorization": "MAC ..."})
+            self.assertIn(response.code, [httplib.OK, httplib.CREATED])
+
+        metric_name = "http_connection_pool.127.0.0.1:%d.%%s" % self._app_service_port
+        self.assertEqual(metrics.counter(metric_name % "connects"), 1)
+        self.assertEqual(metrics.counter(metric_name % "reuses"), 2)
+        self.assertEqual(metrics.get_gauge(metric_name % "in_use"), 0)
+
+    def test_multiple_app_services(self):
+        (app_service_socket, app_service_port) = tornado.testing.bind_unused_port()
+        app_service_socket.close()
+        unavailable_app_service = "127.0.0.1:%d" % app_service_port
+        app_service = "127.0.0.1:%d" % self._app_service_port
+
+        # with 2 app services both are always sampled and, since neither
+        # has outstanding requests, the unavailable app service is chosen
+        name = "yar.auth_service.async_app_service_forwarder.app_service"
+        with mock.patch(name, [unavailable_app_service, app_service]):
+            with mock.patch("random.sample", lambda population, k: population[:k]):
+                response = self.fetch(
+                    "/",
+                    method="GET",
+                    headers={"Authorization": "MAC ..."})
+                self.assertEqual(response.code, httplib.OK)
+                self.assertEqual(metrics.counter("app_service.retries"), 1)
+
+                # POSTs are not idempotent so aren't retried
+                response = self.fetch(
+                    "/",
+                    method="POST",
+                    body="dave was here",
+                    headers={"Authorization": "MAC ..."})
+                self.assertEqual(response.code, httplib.INTERNAL_SERVER_ERROR)
+                self.assertEqual(metrics.counter("app_service.retries"), 1)
+
+        self.assertEqual(metrics.counter("app_service.%s.errors" % unavailable_app_service), 2)
+        self.assertEqual(metrics.get_gauge("app_service.%s.in_flight" % unavailable_app_service), 0)
+        self.assertEqual(metrics.get_gauge("app_service.%s.in_flight" % app_service), 0)
+        self.assertIsNotNone(metrics.get_gauge("app_service.%s.latency_ms" % app_service))
+
+    def test_deadline_expired_before_forwarding(self):
+        def authenticate_patch(authenticator, callback):
+            authenticator._deadline.expires_at = 0
+            callback(is_auth_ok=True, principal="das")
+
+        name = "yar.auth_service.mac.async_mac_auth.AsyncMACAuth.authenticate"
+        with mock.patch(name, authenticate_patch):
+            response = self.fetch(
+                "/",
+                method="GET",
+                headers={"Authorization": "MAC ..."})
+
+        self.assertEqual(response.code, httplib.GATEWAY_TIMEOUT)
+        self.assertEqual(metrics.counter("deadline_exceeded.app_service"), 1)
+        metric_name = "http_connection_pool.127.0.0.1:%d.connects" % self._app_service_port
+        self.assertEqual(metrics.counter(metric_name), 0)
+
+    def test_app_service_unavailable(self):
+        (app_service_socket, app_service_port) = tornado.testing.bind_unused_port()
+        app_service_socket.close()
+
+        name = "yar.auth_service.async_app_service_forwarder.app_service"
+        with mock.patch(name, "127.0.0.1:%d" % app_service_port):
+            response = self.fetch(
+                "/",
+                method="GET",
+                headers={"Authorization": "MAC ..."})
+
+        self.assertEqual(response.code, httplib.INTERNAL_SERVER_ERROR)
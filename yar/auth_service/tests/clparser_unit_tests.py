@@ -23,12 +23,49 @@ class CommandLineParserUnitTase(unittest.TestCase):
         self.assertEqual(clo.logging_level, logging.ERROR)
         self.assertEqual(clo.listen_on, ("127.0.0.1", 8000))
         self.assertEqual(clo.app_service_auth_method, "YAR")
-        self.assertEqual(clo.key_service, "127.0.0.1:8070")
-        self.assertEqual(clo.app_service, "127.0.0.1:8080")
+        self.assertEqual(clo.key_service, ["127.0.0.1:8070"])
+        self.assertEqual(clo.app_service, ["127.0.0.1:8080"])
         self.assertEqual(clo.maxage, 30)
         self.assertEqual(clo.nonce_store, ["127.0.0.1:11211"])
         self.assertIsNone(clo.logging_file)
         self.assertIsNone(clo.syslog)
+        self.assertEqual(clo.creds_cache_size, 1000)
+        self.assertEqual(clo.creds_cache_ttl, 30)
+        self.assertEqual(clo.creds_cache_not_found_ttl, 5)
+        self.assertEqual(clo.metrics_interval, 60)
+        self.assertEqual(clo.nonce_store_timeout, 0.25)
+        self.assertEqual(clo.nonce_store_unavailable_policy, "reject")
+        self.assertFalse(clo.pipelined_nonce_store)
+        self.assertFalse(clo.reject_in_flight_nonces)
+        self.assertFalse(clo.in_process_nonce_store)
+        self.assertEqual(clo.in_process_nonce_store_size, 1000000)
+        self.assertEqual(clo.max_request_body_size, 100 * 1024 * 1024)
+        self.assertEqual(clo.max_in_memory_request_body_size, 64 * 1024)
+        self.assertEqual(clo.max_spilled_request_body_size, 1024 * 1024 * 1024)
+        self.assertEqual(clo.offload_threshold, 1024 * 1024)
+        self.assertEqual(clo.worker_threads, 4)
+        self.assertFalse(clo.stream_app_service_responses)
+        self.assertEqual(clo.max_response_buffer_size, 256 * 1024)
+        self.assertEqual(clo.max_upstream_connections, 10)
+        self.assertEqual(clo.upstream_connect_timeout, 20.0)
+        self.assertEqual(clo.upstream_request_timeout, 20.0)
+        self.assertEqual(clo.upstream_idle_timeout, 30)
+        self.assertEqual(clo.deadline_budget, 30.0)
+        self.assertEqual(clo.concurrency_policy, "none")
+        self.assertEqual(clo.max_concurrency, 1000)
+        self.assertEqual(clo.concurrency_queue_size, 50)
+        self.assertEqual(clo.concurrency_queue_time, 0.05)
+        self.assertEqual(clo.concurrency_latency_threshold, 0.0)
+        self.assertEqual(clo.retry_after, 1)
+        self.assertEqual(clo.app_service_balancing_policy, "p2c")
+        self.assertEqual(clo.max_app_service_failures, 3)
+        self.assertEqual(clo.app_service_ejection_time, 30)
+        self.assertEqual(clo.app_service_slow_threshold, 0.0)
+        self.assertIsNone(clo.app_service_routes)
+        self.assertEqual(clo.key_service_timeout, 5.0)
+        self.assertEqual(clo.key_service_hedge_percentile, 0)
+        self.assertEqual(clo.key_service_breaker_threshold, 5)
+        self.assertEqual(clo.key_service_breaker_reset_timeout, 10)
 
     def test_logging_level(self):
         """Verify the command line parser correctly parses
@@ -43,8 +80,8 @@ class CommandLineParserUnitTase(unittest.TestCase):
         self.assertEqual(clo.logging_level, logging.INFO)
         self.assertEqual(clo.listen_on, ("127.0.0.1", 8000))
         self.assertEqual(clo.app_service_auth_method, "YAR")
-        self.assertEqual(clo.key_service, "127.0.0.1:8070")
-        self.assertEqual(clo.app_service, "127.0.0.1:8080")
+        self.assertEqual(clo.key_service, ["127.0.0.1:8070"])
+        self.assertEqual(clo.app_service, ["127.0.0.1:8080"])
         self.assertEqual(clo.maxage, 30)
         self.assertEqual(clo.nonce_store, ["127.0.0.1:11211"])
         self.assertIsNone(clo.logging_file)
@@ -63,8 +100,8 @@ class CommandLineParserUnitTase(unittest.TestCase):
         self.assertEqual(clo.logging_level, logging.ERROR)
         self.assertEqual(clo.listen_on, ("1.1.1.1", 7878))
         self.assertEqual(clo.app_service_auth_method, "YAR")
-        self.assertEqual(clo.key_service, "127.0.0.1:8070")
-        self.assertEqual(clo.app_service, "127.0.0.1:8080")
+        self.assertEqual(clo.key_service, ["127.0.0.1:8070"])
+        self.assertEqual(clo.app_service, ["127.0.0.1:8080"])
         self.assertEqual(clo.maxage, 30)
         self.assertEqual(clo.nonce_store, ["127.0.0.1:11211"])
         self.assertIsNone(clo.logging_file)
@@ -83,8 +120,8 @@ class CommandLineParserUnitTase(unittest.TestCase):
         self.assertEqual(clo.logging_level, logging.ERROR)
         self.assertEqual(clo.listen_on, ("127.0.0.1", 8000))
         self.assertEqual(clo.app_service_auth_method, "DAS")
-        self.assertEqual(clo.key_service, "127.0.0.1:8070")
-        self.assertEqual(clo.app_service, "127.0.0.1:8080")
+        self.assertEqual(clo.key_service, ["127.0.0.1:8070"])
+        self.assertEqual(clo.app_service, ["127.0.0.1:8080"])
         self.assertEqual(clo.maxage, 30)
         self.assertEqual(clo.nonce_store, ["127.0.0.1:11211"])
         self.assertIsNone(clo.logging_file)
@@ -103,8 +140,8 @@ class CommandLineParserUnitTase(unittest.TestCase):
         self.assertEqual(clo.logging_level, logging.ERROR)
         self.assertEqual(clo.listen_on, ("127.0.0.1", 8000))
         self.assertEqual(clo.app_service_auth_method, "YAR")
-        self.assertEqual(clo.app_service, "1.1.1.1:6666")
-        self.assertEqual(clo.key_service, "127.0.0.1:8070")
+        self.assertEqual(clo.app_service, ["1.1.1.1:6666"])
+        self.assertEqual(clo.key_service, ["127.0.0.1:8070"])
         self.assertEqual(clo.maxage, 30)
         self.assertEqual(clo.nonce_store, ["127.0.0.1:11211"])
         self.assertIsNone(clo.logging_file)
@@ -123,9 +160,9 @@ class CommandLineParserUnitTase(unittest.TestCase):
         self.assertEqual(clo.logging_level, logging.ERROR)
         self.assertEqual(clo.listen_on, ("127.0.0.1", 8000))
         self.assertEqual(clo.app_service_auth_method, "YAR")
-        self.assertEqual(clo.app_service, "127.0.0.1:8080")
+        self.assertEqual(clo.app_service, ["127.0.0.1:8080"])
         self.assertEqual(clo.maxage, int(args[-1]))
-        self.assertEqual(clo.key_service, "127.0.0.1:8070")
+        self.assertEqual(clo.key_service, ["127.0.0.1:8070"])
         self.assertEqual(clo.nonce_store, ["127.0.0.1:11211"])
         self.assertIsNone(clo.logging_file)
         self.assertIsNone(clo.syslog)
@@ -143,9 +180,9 @@ class CommandLineParserUnitTase(unittest.TestCase):
         self.assertEqual(clo.logging_level, logging.ERROR)
         self.assertEqual(clo.listen_on, ("127.0.0.1", 8000))
         self.assertEqual(clo.app_service_auth_method, "YAR")
-        self.assertEqual(clo.app_service, "127.0.0.1:8080")
+        self.assertEqual(clo.app_service, ["127.0.0.1:8080"])
         self.assertEqual(clo.maxage, 30)
-        self.assertEqual(clo.key_service, args[-1])
+        self.assertEqual(clo.key_service, [args[-1]])
         self.assertEqual(clo.nonce_store, ["127.0.0.1:11211"])
         self.assertIsNone(clo.logging_file)
         self.assertIsNone(clo.syslog)
@@ -163,9 +200,9 @@ class CommandLineParserUnitTase(unittest.TestCase):
         self.assertEqual(clo.logging_level, logging.ERROR)
         self.assertEqual(clo.listen_on, ("127.0.0.1", 8000))
         self.assertEqual(clo.app_service_auth_method, "YAR")
-        self.assertEqual(clo.app_service, "127.0.0.1:8080")
+        self.assertEqual(clo.app_service, ["127.0.0.1:8080"])
         self.assertEqual(clo.maxage, 30)
-        self.assertEqual(clo.key_service, "127.0.0.1:8070")
+        self.assertEqual(clo.key_service, ["127.0.0.1:8070"])
         self.assertEqual(clo.nonce_store, [args[-1]])
         self.assertIsNone(clo.logging_file)
         self.assertIsNone(clo.syslog)
@@ -183,9 +220,9 @@ class CommandLineParserUnitTase(unittest.TestCase):
         self.assertEqual(clo.logging_level, logging.ERROR)
         self.assertEqual(clo.listen_on, ("127.0.0.1", 8000))
         self.assertEqual(clo.app_service_auth_method, "YAR")
-        self.assertEqual(clo.app_service, "127.0.0.1:8080")
+        self.assertEqual(clo.app_service, ["127.0.0.1:8080"])
         self.assertEqual(clo.maxage, 30)
-        self.assertEqual(clo.key_service, "127.0.0.1:8070")
+        self.assertEqual(clo.key_service, ["127.0.0.1:8070"])
         self.assertEqual(clo.nonce_store, ["127.0.0.1:11211"])
         self.assertEqual(clo.logging_file, args[-1])
         self.assertIsNone(clo.syslog)
@@ -203,9 +240,252 @@ class CommandLineParserUnitTase(unittest.TestCase):
         self.assertEqual(clo.logging_level, logging.ERROR)
         self.assertEqual(clo.listen_on, ("127.0.0.1", 8000))
         self.assertEqual(clo.app_service_auth_method, "YAR")
-        self.assertEqual(clo.app_service, "127.0.0.1:8080")
+        self.assertEqual(clo.app_service, ["127.0.0.1:8080"])
         self.assertEqual(clo.maxage, 30)
-        self.assertEqual(clo.key_service, "127.0.0.1:8070")
+        self.assertEqual(clo.key_service, ["127.0.0.1:8070"])
         self.assertEqual(clo.nonce_store, ["127.0.0.1:11211"])
         self.assertIsNone(clo.logging_file)
         self.assertEqual(clo.syslog, args[-1])
+
+    def test_creds_cache(self):
+        """Verify the command line parser correctly parses
+        the --credscachesize, --credscachettl and --credscachenotfoundttl
+        command line args."""
+        args = [
+            "--credscachesize", "42",
+            "--credscachettl", "43",
+            "--credscachenotfoundttl", "44",
+        ]
+
+        clp = CommandLineParser()
+        (clo, cla) = clp.parse_args(args)
+
+        self.assertEqual(clo.key_service, ["127.0.0.1:8070"])
+        self.assertEqual(clo.creds_cache_size, 42)
+        self.assertEqual(clo.creds_cache_ttl, 43)
+        self.assertEqual(clo.creds_cache_not_found_ttl, 44)
+
+    def test_metrics_interval(self):
+        """Verify the command line parser correctly parses
+        the --metricsinterval command line arg."""
+        args = [
+            "--metricsinterval", "0",
+        ]
+
+        clp = CommandLineParser()
+        (clo, cla) = clp.parse_args(args)
+
+        self.assertEqual(clo.metrics_interval, 0)
+
+    def test_in_process_nonce_store(self):
+        """Verify the command line parser correctly parses
+        the --inprocessnoncestore and --inprocessnoncestoresize
+        command line args."""
+        args = [
+            "--inprocessnoncestore", "true",
+            "--inprocessnoncestoresize", "42",
+        ]
+
+        clp = CommandLineParser()
+        (clo, cla) = clp.parse_args(args)
+
+        self.assertEqual(clo.nonce_store, ["127.0.0.1:11211"])
+        self.assertTrue(clo.in_process_nonce_store)
+        self.assertEqual(clo.in_process_nonce_store_size, 42)
+
+    def test_pipelined_nonce_store(self):
+        """Verify the command line parser correctly parses
+        the --pipelinednoncestore command line arg."""
+        args = [
+            "--pipelinednoncestore", "true",
+        ]
+
+        clp = CommandLineParser()
+        (clo, cla) = clp.parse_args(args)
+
+        self.assertTrue(clo.pipelined_nonce_store)
+
+    def test_nonce_store_unavailable(self):
+        """Verify the command line parser correctly parses
+        the --noncestoretimeout and --noncestoreunavailablepolicy
+        command line args."""
+        args = [
+            "--noncestoretimeout", "0.5",
+            "--noncestoreunavailablepolicy", "local",
+        ]
+
+        clp = CommandLineParser()
+        (clo, cla) = clp.parse_args(args)
+
+        self.assertEqual(clo.nonce_store_timeout, 0.5)
+        self.assertEqual(clo.nonce_store_unavailable_policy, "local")
+
+    def test_reject_in_flight_nonces(self):
+        """Verify the command line parser correctly parses
+        the --rejectinflightnonces command line arg."""
+        args = [
+            "--rejectinflightnonces", "true",
+        ]
+
+        clp = CommandLineParser()
+        (clo, cla) = clp.parse_args(args)
+
+        self.assertTrue(clo.reject_in_flight_nonces)
+
+    def test_request_body_sizes(self):
+        """Verify the command line parser correctly parses
+        the --maxrequestbodysize, --maxinmemoryrequestbodysize and
+        --maxspilledrequestbodysize command line args."""
+        args = [
+            "--maxrequestbodysize", "1048576",
+            "--maxinmemoryrequestbodysize", "4096",
+            "--maxspilledrequestbodysize", "0",
+        ]
+
+        clp = CommandLineParser()
+        (clo, cla) = clp.parse_args(args)
+
+        self.assertEqual(clo.max_request_body_size, 1048576)
+        self.assertEqual(clo.max_in_memory_request_body_size, 4096)
+        self.assertEqual(clo.max_spilled_request_body_size, 0)
+
+    def test_stream_app_service_responses(self):
+        """Verify the command line parser correctly parses
+        the --streamappserviceresponses and --maxresponsebuffersize
+        command line args."""
+        args = [
+            "--streamappserviceresponses", "true",
+            "--maxresponsebuffersize", "65536",
+        ]
+
+        clp = CommandLineParser()
+        (clo, cla) = clp.parse_args(args)
+
+        self.assertTrue(clo.stream_app_service_responses)
+        self.assertEqual(clo.max_response_buffer_size, 65536)
+
+    def test_offload(self):
+        """Verify the command line parser correctly parses
+        the --offloadthreshold and --workerthreads command line args."""
+        args = [
+            "--offloadthreshold", "0",
+            "--workerthreads", "8",
+        ]
+
+        clp = CommandLineParser()
+        (clo, cla) = clp.parse_args(args)
+
+        self.assertEqual(clo.offload_threshold, 0)
+        self.assertEqual(clo.worker_threads, 8)
+
+    def test_upstream_connections(self):
+        """Verify the command line parser correctly parses
+        the --maxupstreamconnections, --upstreamconnecttimeout,
+        --upstreamrequesttimeout and --upstreamidletimeout
+        command line args."""
+        args = [
+            "--maxupstreamconnections", "50",
+            "--upstreamconnecttimeout", "0.5",
+            "--upstreamrequesttimeout", "2.5",
+            "--upstreamidletimeout", "5",
+        ]
+
+        clp = CommandLineParser()
+        (clo, cla) = clp.parse_args(args)
+
+        self.assertEqual(clo.max_upstream_connections, 50)
+        self.assertEqual(clo.upstream_connect_timeout, 0.5)
+        self.assertEqual(clo.upstream_request_timeout, 2.5)
+        self.assertEqual(clo.upstream_idle_timeout, 5)
+
+    def test_multiple_app_services(self):
+        """Verify the command line parser correctly parses
+        the --appserver, --appserverpolicy, --appservermaxfailures,
+        --appserverejectiontime and --appserverslowthreshold
+        command line args."""
+        args = [
+            "--appserver", "1.1.1.1:6666, 2.2.2.2:7777,/tmp/app.sock",
+            "--appserverpolicy", "leastoutstanding",
+            "--appservermaxfailures", "5",
+            "--appserverejectiontime", "10",
+            "--appserverslowthreshold", "0.5",
+        ]
+
+        clp = CommandLineParser()
+        (clo, cla) = clp.parse_args(args)
+
+        self.assertEqual(clo.app_service, ["1.1.1.1:6666", "2.2.2.2:7777", "/tmp/app.sock"])
+        self.assertEqual(clo.app_service_balancing_policy, "leastoutstanding")
+        self.assertEqual(clo.max_app_service_failures, 5)
+        self.assertEqual(clo.app_service_ejection_time, 10)
+        self.assertEqual(clo.app_service_slow_threshold, 0.5)
+
+    def test_app_service_routes(self):
+        """Verify the command line parser correctly parses
+        the --appserverroutes command line arg."""
+        args = [
+            "--appserverroutes", "/etc/yar/routes.json",
+        ]
+
+        clp = CommandLineParser()
+        (clo, cla) = clp.parse_args(args)
+
+        self.assertEqual(clo.app_service_routes, "/etc/yar/routes.json")
+
+    def test_multiple_key_services(self):
+        """Verify the command line parser correctly parses
+        the --keyservice, --keyservicetimeout, --keyservicehedgepercentile,
+        --keyservicebreakerthreshold and --keyservicebreakerresettimeout
+        command line args."""
+        args = [
+            "--keyservice", "1.1.1.1:8070,2.2.2.2:8070",
+            "--keyservicetimeout", "0.5",
+            "--keyservicehedgepercentile", "95",
+            "--keyservicebreakerthreshold", "3",
+            "--keyservicebreakerresettimeout", "20",
+        ]
+
+        clp = CommandLineParser()
+        (clo, cla) = clp.parse_args(args)
+
+        self.assertEqual(clo.key_service, ["1.1.1.1:8070", "2.2.2.2:8070"])
+        self.assertEqual(clo.key_service_timeout, 0.5)
+        self.assertEqual(clo.key_service_hedge_percentile, 95)
+        self.assertEqual(clo.key_service_breaker_threshold, 3)
+        self.assertEqual(clo.key_service_breaker_reset_timeout, 20)
+
+    def test_deadline(self):
+        """Verify the command line parser correctly parses
+        the --deadline command line arg."""
+        args = [
+            "--deadline", "2.5",
+        ]
+
+        clp = CommandLineParser()
+        (clo, cla) = clp.parse_args(args)
+
+        self.assertEqual(clo.deadline_budget, 2.5)
+
+    def test_concurrency(self):
+        """Verify the command line parser correctly parses
+        the --concurrencypolicy, --maxconcurrency, --concurrencyqueuesize,
+        --concurrencyqueuetime, --concurrencylatencythreshold and
+        --retryafter command line args."""
+        args = [
+            "--concurrencypolicy", "aimd",
+            "--maxconcurrency", "200",
+            "--concurrencyqueuesize", "10",
+            "--concurrencyqueuetime", "0.1",
+            "--concurrencylatencythreshold", "0.25",
+            "--retryafter", "5",
+        ]
+
+        clp = CommandLineParser()
+        (clo, cla) = clp.parse_args(args)
+
+        self.assertEqual(clo.concurrency_policy, "aimd")
+        self.assertEqual(clo.max_concurrency, 200)
+        self.assertEqual(clo.concurrency_queue_size, 10)
+        self.assertEqual(clo.concurrency_queue_time, 0.1)
+        self.assertEqual(clo.concurrency_latency_threshold, 0.25)
+        self.assertEqual(clo.retry_after, 5)
@@ -0,0 +1,69 @@
+"""This module implements the unit tests for the auth service's
+creds_cache module."""
+
+import mock
+
+from yar.auth_service import creds_cache
+from yar.util import metrics
+from yar.tests import yar_test_util
+
+
+class TestCredsCache(yar_test_util.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+
+    def test_miss_then_hit(self):
+        cc = creds_cache.CredsCache("cc", max_entries=10, ttl=30)
+        the_key = self.random_non_none_non_zero_length_str()
+        the_value = (True, self.random_non_none_non_zero_length_str())
+
+        self.assertIsNone(cc.get(the_key))
+        cc.put(the_key, the_value)
+        self.assertEqual(cc.get(the_key), the_value)
+
+        self.assertEqual(metrics.counter("cc.misses"), 1)
+        self.assertEqual(metrics.counter("cc.hits"), 1)
+
+    def test_ttl_expiry(self):
+        cc = creds_cache.CredsCache("cc", max_entries=10, ttl=30, not_found_ttl=5)
+        the_key = self.random_non_none_non_zero_length_str()
+        the_not_found_key = self.random_non_none_non_zero_length_str()
+
+        with mock.patch("time.time", return_value=1000):
+            cc.put(the_key, (True, "das"))
+            cc.put_not_found(the_not_found_key, (False,))
+
+        with mock.patch("time.time", return_value=1004):
+            self.assertIsNotNone(cc.get(the_key))
+            self.assertEqual(cc.get(the_not_found_key), (False,))
+
+        with mock.patch("time.time", return_value=1005):
+            self.assertIsNotNone(cc.get(the_key))
+            self.assertIsNone(cc.get(the_not_found_key))
+
+        with mock.patch("time.time", return_value=1030):
+            self.assertIsNone(cc.get(the_key))
+
+        self.assertEqual(metrics.counter("cc.expirations"), 2)
+        self.assertEqual(len(cc), 0)
+
+    def test_lru_eviction(self):
+        cc = creds_cache.CredsCache("cc", max_entries=2)
+        cc.put("a", 1)
+        cc.put("b", 2)
+        # touching "a" makes "b" the least recently used entry
+        self.assertEqual(cc.get("a"), 1)
+        cc.put("c", 3)
+
+        self.assertEqual(len(cc), 2)
+        self.assertIsNone(cc.get("b"))
+        self.assertEqual(cc.get("a"), 1)
+        self.assertEqual(cc.get("c"), 3)
+        self.assertEqual(metrics.counter("cc.evictions"), 1)
+
+    def test_disabled(self):
+        cc = creds_cache.CredsCache("cc", max_entries=0)
+        cc.put("a", 1)
+        self.assertIsNone(cc.get("a"))
+        self.assertEqual(len(cc), 0)
@@ -0,0 +1,207 @@
+"""This module implements the unit tests for the auth service's
+key_service_client module."""
+
+import httplib
+
+import mock
+import tornado.httpclient
+
+from yar.auth_service import key_service_client
+from yar.util import circuit_breaker
+from yar.util import deadline
+from yar.util import metrics
+from yar.tests import yar_test_util
+
+
+class TestFetch(yar_test_util.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        self._patchers = [
+            mock.patch.object(key_service_client, "_clusters", {}),
+            mock.patch("random.shuffle", lambda x: None),
+        ]
+        for patcher in self._patchers:
+            patcher.start()
+
+        # requests are recorded rather than sent so each test
+        # decides when and how each request completes
+        self.requests = []
+
+        def fetch_patch(http_client, request, callback):
+            self.requests.append((request, callback))
+
+        self._patchers.append(mock.patch("tornado.httpclient.AsyncHTTPClient.fetch", fetch_patch))
+        self._patchers[-1].start()
+
+        self.responses = []
+
+    def tearDown(self):
+        for patcher in self._patchers:
+            patcher.stop()
+
+    def _on_fetch_done(self, response):
+        self.responses.append(response)
+
+    def _respond(self, index, code):
+        (request, callback) = self.requests[index]
+        callback(tornado.httpclient.HTTPResponse(request, code))
+
+    def test_single_address(self):
+        key_service_client.fetch("1.1.1.1:8070", "/v1.0/creds/dave", self._on_fetch_done)
+        self.assertEqual(len(self.requests), 1)
+        self.assertEqual(self.requests[0][0].url, "http://1.1.1.1:8070/v1.0/creds/dave")
+        self.assertEqual(self.requests[0][0].request_timeout, key_service_client.timeout)
+
+        self._respond(0, httplib.OK)
+        self.assertEqual([response.code for response in self.responses], [httplib.OK])
+
+    def test_not_found_is_not_a_failure(self):
+        key_service_client.fetch(["1.1.1.1:8070", "2.2.2.2:8070"], "/v1.0/creds/dave", self._on_fetch_done)
+        self._respond(0, httplib.NOT_FOUND)
+        self.assertEqual(len(self.requests), 1)
+        self.assertEqual([response.code for response in self.responses], [httplib.NOT_FOUND])
+
+    def test_failover(self):
+        addresses = ["1.1.1.1:8070", "2.2.2.2:8070"]
+        key_service_client.fetch(addresses, "/v1.0/creds/dave", self._on_fetch_done)
+        self._respond(0, 599)
+        self.assertEqual(len(self.requests), 2)
+        self.assertEqual(self.requests[1][0].url, "http://2.2.2.2:8070/v1.0/creds/dave")
+        self.assertEqual(self.responses, [])
+
+        self._respond(1, httplib.OK)
+        self.assertEqual([response.code for response in self.responses], [httplib.OK])
+        self.assertEqual(metrics.counter("key_service.failovers"), 1)
+
+    def test_every_endpoint_fails(self):
+        addresses = ["1.1.1.1:8070", "2.2.2.2:8070"]
+        key_service_client.fetch(addresses, "/v1.0/creds/dave", self._on_fetch_done)
+        self._respond(0, httplib.INTERNAL_SERVER_ERROR)
+        self._respond(1, 599)
+        self.assertEqual(len(self.requests), 2)
+        self.assertEqual([response.code for response in self.responses], [599])
+
+    def test_fast_failure_when_breakers_open(self):
+        addresses = ["1.1.1.1:8070", "2.2.2.2:8070"]
+        with mock.patch.object(key_service_client, "breaker_failure_threshold", 1):
+            key_service_client.fetch(addresses, "/v1.0/creds/dave", self._on_fetch_done)
+            self._respond(0, 599)
+            self._respond(1, 599)
+
+            cluster = key_service_client._clusters[tuple(addresses)]
+            for endpoint in cluster.endpoints:
+                self.assertEqual(endpoint.breaker.state, circuit_breaker.STATE_OPEN)
+
+            key_service_client.fetch(addresses, "/v1.0/creds/dave", self._on_fetch_done)
+            self.assertEqual(len(self.requests), 2)
+            self.assertEqual([response.code for response in self.responses], [599, 599])
+            self.assertEqual(metrics.counter("key_service.fast_failures"), 1)
+
+    def test_hedge(self):
+        addresses = ["1.1.1.1:8070", "2.2.2.2:8070"]
+        io_loop = mock.Mock()
+        io_loop.time.return_value = 0
+        with mock.patch.object(key_service_client, "hedge_percentile", 90), \
+                mock.patch("tornado.ioloop.IOLoop.current", return_value=io_loop):
+            # no hedging until enough latencies have been recorded
+            key_service_client.fetch(addresses, "/v1.0/creds/dave", self._on_fetch_done)
+            self.assertFalse(io_loop.add_timeout.called)
+            self._respond(0, httplib.OK)
+
+            cluster = key_service_client._clusters[tuple(addresses)]
+            for i in range(key_service_client._min_latency_samples):
+                cluster.record_latency(i / 1000.0)
+
+            key_service_client.fetch(addresses, "/v1.0/creds/dave", self._on_fetch_done)
+            self.assertEqual(io_loop.add_timeout.call_count, 1)
+            (deadline, on_hedge_timeout) = io_loop.add_timeout.call_args[0]
+            # 90th percentile of the recorded latencies
+            self.assertTrue(0.015 <= deadline <= 0.019)
+
+            # the hedged request goes to the other endpoint and wins
+            on_hedge_timeout()
+            self.assertEqual(len(self.requests), 3)
+            self.assertNotEqual(self.requests[1][0].url, self.requests[2][0].url)
+            self._respond(2, httplib.OK)
+            self.assertEqual(len(self.responses), 2)
+
+            # the original request's response arrives too late to matter
+            self._respond(1, httplib.OK)
+            self.assertEqual(len(self.responses), 2)
+
+            self.assertEqual(metrics.counter("key_service.hedges"), 1)
+            self.assertEqual(metrics.counter("key_service.hedge_wins"), 1)
+            self.assertEqual(metrics.get_gauge("key_service.hedge_win_rate"), 1.0)
+
+    def test_hedge_not_sent_after_response(self):
+        addresses = ["1.1.1.1:8070", "2.2.2.2:8070"]
+        io_loop = mock.Mock()
+        io_loop.time.return_value = 0
+        with mock.patch.object(key_service_client, "hedge_percentile", 50), \
+                mock.patch("tornado.ioloop.IOLoop.current", return_value=io_loop):
+            key_service_client.fetch(addresses, "/v1.0/creds/dave", self._on_fetch_done)
+            self._respond(0, httplib.OK)
+            cluster = key_service_client._clusters[tuple(addresses)]
+            for i in range(key_service_client._min_latency_samples):
+                cluster.record_latency(0.01)
+
+            key_service_client.fetch(addresses, "/v1.0/creds/dave", self._on_fetch_done)
+            self._respond(1, httplib.OK)
+            self.assertTrue(io_loop.remove_timeout.called)
+            self.assertEqual(len(self.requests), 2)
+            self.assertEqual(metrics.counter("key_service.hedges"), 0)
+
+    def test_deadline(self):
+        addresses = ["1.1.1.1:8070", "2.2.2.2:8070"]
+        the_deadline = deadline.Deadline(1)
+        key_service_client.fetch(addresses, "/v1.0/creds/dave", self._on_fetch_done, the_deadline)
+        request = self.requests[0][0]
+        self.assertTrue(0 < request.request_timeout <= 1)
+        self.assertTrue(0 < int(request.headers[deadline.header_name]) <= 1000)
+
+        # a key service which dropped the request because its deadline
+        # passed isn't a failure so there's no failover
+        self._respond(0, httplib.GATEWAY_TIMEOUT)
+        self.assertEqual(len(self.requests), 1)
+        self.assertEqual([response.code for response in self.responses], [httplib.GATEWAY_TIMEOUT])
+        cluster = key_service_client._clusters[tuple(addresses)]
+        self.assertEqual(cluster.endpoints[0].breaker.consecutive_failures, 0)
+
+    def test_no_failover_after_deadline(self):
+        addresses = ["1.1.1.1:8070", "2.2.2.2:8070"]
+        with mock.patch("time.time", return_value=100.0) as time_patch:
+            key_service_client.fetch(
+                addresses,
+                "/v1.0/creds/dave",
+                self._on_fetch_done,
+                deadline.Deadline(1))
+            time_patch.return_value = 101.0
+            self._respond(0, 599)
+        self.assertEqual(len(self.requests), 1)
+        self.assertEqual([response.code for response in self.responses], [599])
+        self.assertEqual(metrics.counter("key_service.failovers"), 0)
+
+
+class TestIsTimeout(yar_test_util.TestCase):
+
+    def _response(self, code, error=None):
+        request = tornado.httpclient.HTTPRequest("http://1.1.1.1:8070/v1.0/creds/dave")
+        return tornado.httpclient.HTTPResponse(request, code, error=error)
+
+    def test_is_timeout(self):
+        error = tornado.httpclient.HTTPError(599, "Timeout")
+        self.assertTrue(key_service_client.is_timeout(self._response(599, error)))
+        error = tornado.httpclient.HTTPError(599, "Timeout while connecting")
+        self.assertTrue(key_service_client.is_timeout(self._response(599, error)))
+        self.assertTrue(key_service_client.is_timeout(self._response(httplib.GATEWAY_TIMEOUT)))
+        error = tornado.httpclient.HTTPError(599, "Deadline exceeded")
+        self.assertTrue(key_service_client.is_timeout(self._response(599, error)))
+
+    def test_is_not_timeout(self):
+        self.assertFalse(key_service_client.is_timeout(self._response(httplib.OK)))
+        self.assertFalse(key_service_client.is_timeout(self._response(httplib.NOT_FOUND)))
+        self.assertFalse(key_service_client.is_timeout(self._response(httplib.INTERNAL_SERVER_ERROR)))
+        error = tornado.httpclient.HTTPError(599, "All key service circuit breakers open")
+        self.assertFalse(key_service_client.is_timeout(self._response(599, error)))
+        self.assertFalse(key_service_client.is_timeout(self._response(599, IOError("refused"))))
@@ -0,0 +1,223 @@
+"""This module implements the unit tests for the auth service's
+request_body module."""
+
+import hashlib
+import threading
+
+import mock
+import tornado.concurrent
+import tornado.httputil
+
+from yar.auth_service import request_body
+from yar.util import mac
+from yar.util import metrics
+from yar.tests import yar_test_util
+
+
+class TestRequestBody(yar_test_util.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+
+    def _request(self, headers):
+        request = mock.Mock()
+        request.headers = tornado.httputil.HTTPHeaders(headers)
+        return request
+
+    def _request_body(self, body, content_type="application/json"):
+        headers = {"Content-Length": str(len(body))}
+        if content_type is not None:
+            headers["Content-Type"] = content_type
+        rb = request_body.RequestBody(self._request(headers))
+        for i in range(0, len(body), 3):
+            self.assertTrue(rb.append(body[i:i + 3]))
+        return rb
+
+    def test_no_body(self):
+        rb = request_body.RequestBody(self._request({}))
+        self.assertFalse(rb.is_present)
+        self.assertEqual(rb.ext(), "")
+        self.assertIsNone(rb.read())
+        rb.close()
+
+    def test_when_complete(self):
+        on_waiting = mock.Mock()
+        rb = request_body.RequestBody(self._request({"Content-Length": "4"}), on_waiting)
+        self.assertFalse(rb.is_complete)
+
+        callbacks = [mock.Mock(), mock.Mock()]
+        for callback in callbacks:
+            rb.when_complete(callback)
+            self.assertFalse(callback.called)
+        on_waiting.assert_called_once_with()
+
+        rb.append("dave")
+        rb.complete()
+        self.assertTrue(rb.is_complete)
+        for callback in callbacks:
+            callback.assert_called_once_with()
+
+        # once complete callbacks are called immediately
+        callback = mock.Mock()
+        rb.when_complete(callback)
+        callback.assert_called_once_with()
+        self.assertEqual(on_waiting.call_count, 1)
+
+        rb.close()
+
+    def test_ext(self):
+        for content_type in [None, "application/json"]:
+            for body in ["", "dave was here"]:
+                rb = self._request_body(body, content_type)
+                self.assertTrue(rb.is_present)
+                self.assertEqual(rb.ext(), mac.Ext.generate(content_type, body))
+                self.assertEqual(rb.size, len(body))
+                self.assertEqual(rb.read(), body)
+                rb.close()
+
+    def test_spill(self):
+        the_body = self.random_non_none_non_zero_length_str() * 10
+        with mock.patch.object(request_body, "max_in_memory_size", 8):
+            rb = self._request_body(the_body)
+            self.assertEqual(metrics.counter("request_body.spilled"), 1)
+            self.assertEqual(rb.read(), the_body)
+            rb.close()
+
+    def test_too_large(self):
+        with mock.patch.object(request_body, "max_size", 8):
+            rb = request_body.RequestBody(self._request({"Content-Length": "9"}))
+            self.assertFalse(rb.is_too_large(8))
+            self.assertTrue(rb.is_too_large(9))
+            self.assertTrue(rb.append("12345678"))
+            self.assertFalse(rb.append("9"))
+            self.assertEqual(rb.size, 8)
+            self.assertEqual(rb.read(), "12345678")
+            self.assertEqual(metrics.counter("request_body.too_large"), 1)
+            rb.close()
+
+    def test_spill_budget(self):
+        with mock.patch.object(request_body, "max_in_memory_size", 4), \
+                mock.patch.object(request_body, "max_spilled_size", 10), \
+                mock.patch.object(request_body, "_spilled_size", 0):
+            rb1 = request_body.RequestBody(self._request({"Content-Length": "6"}))
+            self.assertTrue(rb1.append("1234"))
+            self.assertEqual(request_body._spilled_size, 0)
+            self.assertTrue(rb1.append("56"))
+            self.assertEqual(request_body._spilled_size, 6)
+            self.assertEqual(metrics.get_gauge("request_body.spilled_bytes"), 6)
+
+            rb2 = request_body.RequestBody(self._request({"Content-Length": "6"}))
+            self.assertTrue(rb2.append("1234"))
+            self.assertFalse(rb2.append("56"))
+            self.assertTrue(rb2.is_spill_budget_exceeded)
+            self.assertEqual(rb2.size, 4)
+            self.assertEqual(request_body._spilled_size, 6)
+            self.assertEqual(metrics.counter("request_body.spill_budget_exceeded"), 1)
+            rb2.close()
+
+            # closing a spilled body frees up its share of the budget
+            rb1.close()
+            rb1.close()
+            self.assertEqual(request_body._spilled_size, 0)
+            self.assertEqual(metrics.get_gauge("request_body.spilled_bytes"), 0)
+
+            rb3 = request_body.RequestBody(self._request({"Content-Length": "6"}))
+            self.assertTrue(rb3.append("123456"))
+            self.assertFalse(rb3.is_spill_budget_exceeded)
+            rb3.close()
+
+        with mock.patch.object(request_body, "max_in_memory_size", 4), \
+                mock.patch.object(request_body, "max_spilled_size", 0), \
+                mock.patch.object(request_body, "_spilled_size", 0):
+            rb = request_body.RequestBody(self._request({"Content-Length": "100"}))
+            self.assertTrue(rb.append("x" * 100))
+            rb.close()
+
+    def test_append_on_another_thread(self):
+        """Confirm metrics for chunks appended on another thread are
+        reported on the IOLoop's thread."""
+        io_loop = mock.Mock()
+        with mock.patch("tornado.ioloop.IOLoop.current", return_value=io_loop), \
+                mock.patch.object(request_body, "max_size", 4):
+            rb = request_body.RequestBody(self._request({"Content-Length": "5"}))
+
+            thread = threading.Thread(target=lambda: rb.append("12345"))
+            thread.start()
+            thread.join()
+        self.assertEqual(metrics.counter("request_body.too_large"), 0)
+        io_loop.add_callback.assert_called_once_with(metrics.increment, "request_body.too_large")
+        rb.close()
+
+    def test_append_after_close(self):
+        rb = request_body.RequestBody(self._request({"Content-Length": "4"}))
+        rb.close()
+        self.assertFalse(rb.append("dave"))
+        self.assertEqual(rb.size, 0)
+
+    def test_is_offloaded(self):
+        with mock.patch.object(request_body, "offload_threshold", 8):
+            rb = request_body.RequestBody(self._request({"Content-Length": "9"}))
+            self.assertTrue(rb.is_offloaded("1"))
+            rb.close()
+
+            rb = request_body.RequestBody(self._request({"Transfer-Encoding": "chunked"}))
+            self.assertFalse(rb.is_offloaded("12345678"))
+            self.assertTrue(rb.append("12345678"))
+            self.assertTrue(rb.is_offloaded("9"))
+            rb.close()
+
+        with mock.patch.object(request_body, "offload_threshold", 0):
+            rb = request_body.RequestBody(self._request({"Content-Length": "9"}))
+            self.assertFalse(rb.is_offloaded("1"))
+            rb.close()
+
+    def test_is_large(self):
+        with mock.patch.object(request_body, "offload_threshold", 8):
+            rb = request_body.RequestBody(self._request({"Content-Length": "9"}))
+            self.assertTrue(rb.is_large)
+            rb.close()
+
+            rb = request_body.RequestBody(self._request({"Transfer-Encoding": "chunked"}))
+            self.assertTrue(rb.append("12345678"))
+            self.assertFalse(rb.is_large)
+            self.assertTrue(rb.append("9"))
+            self.assertTrue(rb.is_large)
+            rb.close()
+
+        with mock.patch.object(request_body, "offload_threshold", 0):
+            rb = request_body.RequestBody(self._request({"Content-Length": "9"}))
+            self.assertFalse(rb.is_large)
+            rb.close()
+
+    def test_sha1(self):
+        rb = request_body.RequestBody(self._request({}))
+        self.assertIsNone(rb.sha1())
+        rb.close()
+
+        the_body = self.random_non_none_non_zero_length_str() * 10
+        with mock.patch.object(request_body, "chunk_size", 7):
+            rb = self._request_body(the_body)
+            self.assertEqual(rb.sha1(), hashlib.sha1(the_body).hexdigest())
+            rb.close()
+
+    def test_body_producer(self):
+        the_body = self.random_non_none_non_zero_length_str() * 10
+        chunks = []
+
+        def write(chunk):
+            chunks.append(chunk)
+            future = tornado.concurrent.Future()
+            future.set_result(None)
+            return future
+
+        with mock.patch.object(request_body, "chunk_size", 7):
+            rb = self._request_body(the_body)
+            # every write completes immediately so the body
+            # producer runs to completion without an io loop
+            future = rb.body_producer(write)
+            self.assertTrue(future.done())
+            self.assertIsNone(future.result())
+            rb.close()
+
+        self.assertEqual("".join(chunks), the_body)
+        self.assertTrue(all([len(chunk) <= 7 for chunk in chunks]))
@@ -0,0 +1,76 @@
+"""This module implements the unit tests for the auth service's
+single_flight module."""
+
+import mock
+
+from yar.auth_service import single_flight
+from yar.util import deadline
+from yar.util import metrics
+from yar.tests import yar_test_util
+
+
+class TestSingleFlight(yar_test_util.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+
+    def test_collapsing(self):
+        sf = single_flight.SingleFlight("sf")
+        the_key = self.random_non_none_non_zero_length_str()
+        answers = []
+
+        def callback(is_ok, value):
+            answers.append((is_ok, value))
+
+        self.assertTrue(sf.join(the_key, callback))
+        self.assertFalse(sf.join(the_key, callback))
+        self.assertFalse(sf.join(the_key, callback))
+        self.assertEqual(len(sf), 1)
+        self.assertEqual(metrics.counter("sf.collapsed"), 2)
+
+        sf.done(the_key, True, "das")
+        self.assertEqual(answers, [(True, "das")] * 3)
+        self.assertEqual(len(sf), 0)
+
+        # once done the next join starts a new operation
+        self.assertTrue(sf.join(the_key, callback))
+
+    def test_failed_callback_doesnt_stop_other_callbacks(self):
+        sf = single_flight.SingleFlight("sf")
+        answers = []
+
+        def failing_callback(value):
+            raise Exception(value)
+
+        self.assertTrue(sf.join("a", answers.append))
+        self.assertFalse(sf.join("a", failing_callback))
+        self.assertFalse(sf.join("a", answers.append))
+
+        sf.done("a", "das")
+        self.assertEqual(answers, ["das"] * 2)
+        self.assertEqual(len(sf), 0)
+
+    def test_different_keys_are_not_collapsed(self):
+        sf = single_flight.SingleFlight("sf")
+        self.assertTrue(sf.join("a", lambda: None))
+        self.assertTrue(sf.join("b", lambda: None))
+        self.assertEqual(len(sf), 2)
+        self.assertEqual(metrics.counter("sf.collapsed"), 0)
+
+    def test_deadline(self):
+        sf = single_flight.SingleFlight("sf")
+        with mock.patch("time.time", return_value=100.0):
+            self.assertTrue(sf.join("a", lambda: None, deadline.Deadline(5)))
+            self.assertEqual(sf.deadline("a").remaining(), 5)
+
+            # the operation's deadline is the latest of its callers'
+            self.assertFalse(sf.join("a", lambda: None, deadline.Deadline(10)))
+            self.assertEqual(sf.deadline("a").remaining(), 10)
+            self.assertFalse(sf.join("a", lambda: None, deadline.Deadline(1)))
+            self.assertEqual(sf.deadline("a").remaining(), 10)
+
+        sf.done("a")
+        self.assertIsNone(sf.deadline("a"))
+
+        self.assertTrue(sf.join("b", lambda: None))
+        self.assertIsNone(sf.deadline("b"))
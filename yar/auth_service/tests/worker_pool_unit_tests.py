@@ -0,0 +1,45 @@
+"""This module implements the unit tests for the auth service's
+worker_pool module."""
+
+import threading
+
+import tornado.gen
+import tornado.testing
+
+from yar.auth_service import worker_pool
+from yar.util import metrics
+
+
+class TestWorkerPool(tornado.testing.AsyncTestCase):
+
+    def setUp(self):
+        tornado.testing.AsyncTestCase.setUp(self)
+        metrics.reset()
+
+    @tornado.testing.gen_test
+    def test_submit(self):
+        """Verify work runs on a thread other than the IOLoop's
+        and the result is delivered back to the IOLoop."""
+        def work(value):
+            return (value, threading.current_thread())
+
+        future = worker_pool.submit(work, "dave")
+        self.assertEqual(metrics.get_gauge("worker_pool.in_flight"), 1)
+
+        (value, thread) = yield future
+        self.assertEqual(value, "dave")
+        self.assertIsNot(thread, threading.current_thread())
+
+        # the in flight gauge is updated on the IOLoop after
+        # the result has been delivered
+        yield tornado.gen.moment
+        self.assertEqual(metrics.get_gauge("worker_pool.in_flight"), 0)
+        self.assertEqual(metrics.counter("worker_pool.submitted"), 1)
+
+    @tornado.testing.gen_test
+    def test_exception(self):
+        def work():
+            raise ValueError("dave")
+
+        with self.assertRaises(ValueError):
+            yield worker_pool.submit(work)
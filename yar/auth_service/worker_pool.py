@@ -0,0 +1,52 @@
+"""This module contains a bounded pool of worker threads used to
+move CPU heavy work, like hashing large request bodies, off the
+IOLoop's thread so that it doesn't stall every other in-flight
+request. ```hashlib``` releases the GIL when hashing large inputs
+so the work genuinely runs concurrently with the IOLoop."""
+
+import logging
+
+import concurrent.futures
+import tornado.ioloop
+
+from yar.util import metrics
+
+_logger = logging.getLogger("AUTHSERVICE.%s" % __name__)
+
+"""```max_workers``` is the # of threads in the pool."""
+max_workers = 4
+
+"""```_executor``` is created the first time work is submitted
+so ```max_workers``` can be configured first."""
+_executor = None
+
+"""```_number_in_flight``` is the # of submitted work items
+that haven't yet completed."""
+_number_in_flight = 0
+
+
+def submit(fn, *args, **kwargs):
+    """Run ```fn``` on one of the pool's threads. Must be called
+    from the IOLoop's thread. Returns a
+    ```concurrent.futures.Future``` which can be yielded from a
+    coroutine or passed to ```tornado.ioloop.IOLoop.add_future()```
+    to have the result delivered back on the IOLoop."""
+    global _executor
+    if _executor is None:
+        _executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+
+    global _number_in_flight
+    _number_in_flight += 1
+    metrics.increment("worker_pool.submitted")
+    metrics.gauge("worker_pool.in_flight", _number_in_flight)
+
+    future = _executor.submit(fn, *args, **kwargs)
+    tornado.ioloop.IOLoop.current().add_future(future, _on_done)
+    return future
+
+
+def _on_done(future):
+    """Called on the IOLoop's thread when work completes."""
+    global _number_in_flight
+    _number_in_flight -= 1
+    metrics.gauge("worker_pool.in_flight", _number_in_flight)
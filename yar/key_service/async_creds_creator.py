@@ -17,15 +17,16 @@ class AsyncCredsCreator(AsyncAction):
     """```AsyncCredsCreator``` implements the async action
     pattern for creating credentials."""
 
-    def create(self, principal, auth_scheme, callback):
+    def create(self, principal, auth_scheme, callback, mac_algorithm=mac.MAC.algorithm):
         """Create a set of credentials for ```principal```,
         save the credentials to the key store and when all
         of that is done call ```callback``` with a single
         argument = the newly created credentials.
 
         If ```auth_scheme``` equals 'mac' credentials
-        for an MAC authentication scheme are created otherwise
-        credentials for basic authentication are created."""
+        for an MAC authentication scheme using ```mac_algorithm```
+        are created otherwise credentials for basic authentication
+        are created."""
 
         self._callback = callback
 
@@ -37,7 +38,7 @@ class AsyncCredsCreator(AsyncAction):
             self._creds["mac"] = {
                 "mac_key_identifier": mac.MACKeyIdentifier.generate(),
                 "mac_key": mac.MACKey.generate(),
-                "mac_algorithm": mac.MAC.algorithm,
+                "mac_algorithm": mac_algorithm,
             }
         else:
             self._creds["basic"] = {
@@ -32,19 +32,19 @@ class CommandLineParser(optparse.OptionParser):
             help=help)
 
         default = "127.0.0.1:8070"
-        help = "address:port to listen on - default = %s" % default
+        help = "address:port or unix domain socket to listen on - default = %s" % default
         self.add_option(
             "--lon",
             action="store",
             dest="listen_on",
             default=default,
-            type="hostcolonportparsed",
+            type="addressparsed",
             help=help)
 
         default = "127.0.0.1:5984/creds"
         fmt = (
             "key store - "
-            "host:port/database"
+            "host:port/database or /path/to/socket:database"
             " - default = %s"
         )
         help = fmt % default
@@ -56,6 +56,62 @@ class CommandLineParser(optparse.OptionParser):
             type="couchdb",
             help=help)
 
+        default = 10
+        help = (
+            "max # of concurrent connections to each upstream "
+            "server - default = %d"
+        )
+        help = help % default
+        self.add_option(
+            "--maxupstreamconnections",
+            action="store",
+            dest="max_upstream_connections",
+            default=default,
+            type=int,
+            help=help)
+
+        default = 20.0
+        help = (
+            "timeout (in seconds) for establishing connections "
+            "to upstream servers - default = %.2f"
+        )
+        help = help % default
+        self.add_option(
+            "--upstreamconnecttimeout",
+            action="store",
+            dest="upstream_connect_timeout",
+            default=default,
+            type="float",
+            help=help)
+
+        default = 20.0
+        help = (
+            "timeout (in seconds) for requests to upstream "
+            "servers - default = %.2f"
+        )
+        help = help % default
+        self.add_option(
+            "--upstreamrequesttimeout",
+            action="store",
+            dest="upstream_request_timeout",
+            default=default,
+            type="float",
+            help=help)
+
+        default = 30
+        help = (
+            "seconds connections to upstream servers are kept "
+            "alive while idle - default = %d"
+        )
+        help = help % default
+        self.add_option(
+            "--upstreamidletimeout",
+            action="store",
+            dest="upstream_idle_timeout",
+            default=default,
+            type=int,
+            help=help)
+
         default = None
         help = "syslog unix domain socket - default = %s" % default
         self.add_option(
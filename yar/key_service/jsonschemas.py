@@ -18,6 +18,14 @@ create_creds_request = {
                 "basic",
             ],
         },
+        "mac_algorithm": {
+            "type": "string",
+            "enum": [
+                "hmac-sha-1",
+                "hmac-sha-256",
+                "hmac-sha-512",
+            ],
+        },
     },
     "required": [
         "principal",
@@ -87,6 +95,7 @@ get_creds_response = {
                             "enum": [
                                 "hmac-sha-1",
                                 "hmac-sha-256",
+                                "hmac-sha-512",
                             ],
                         },
                         "mac_key": {
@@ -11,6 +11,9 @@ from async_creds_creator import AsyncCredsCreator
 from async_creds_retriever import AsyncCredsRetriever
 from async_creds_deleter import AsyncCredsDeleter
 from yar.key_service import jsonschemas
+from yar.util import deadline
+from yar.util import mac
+from yar.util import metrics
 from yar.util import trhutil
 
 _logger = logging.getLogger("KEYSERVICE.%s" % __name__)
@@ -27,6 +30,17 @@ url_spec = r"/v1.0/creds(?:/([^/]+))?"
 
 class RequestHandler(trhutil.RequestHandler):
 
+    def prepare(self):
+        """If the request has a deadline (see ```yar.util.deadline```)
+        and the deadline has already passed whoever sent the request
+        has given up waiting for the response so the request is
+        dropped rather than doing work nobody will use."""
+        self._deadline = deadline.from_headers(self.request.headers)
+        if self._deadline is not None and self._deadline.is_expired():
+            metrics.increment("deadline_exceeded.key_service")
+            self.set_status(httplib.GATEWAY_TIMEOUT)
+            self.finish()
+
     @tornado.web.asynchronous
     def get(self, key=None):
         principal = self.get_argument("principal", None)
@@ -41,7 +55,7 @@ class RequestHandler(trhutil.RequestHandler):
             self.finish()
             return
 
-        acr = AsyncCredsRetriever(_key_store)
+        acr = AsyncCredsRetriever(_key_store, self._deadline)
         acr.fetch(
             self._on_async_creds_retrieve_done,
             key=key,
@@ -49,6 +63,11 @@ class RequestHandler(trhutil.RequestHandler):
             is_filter_out_non_model_properties=True)
 
     def _on_async_creds_retrieve_done(self, creds, is_creds_collection):
+        if creds is None and self._deadline is not None and self._deadline.is_expired():
+            self.set_status(httplib.GATEWAY_TIMEOUT)
+            self.finish()
+            return
+
         if creds is None:
             self.set_status(httplib.NOT_FOUND)
             self.finish()
@@ -83,7 +102,8 @@ class RequestHandler(trhutil.RequestHandler):
         acc.create(
             body["principal"],
             body.get("auth_scheme", "basic"),
-            self._on_async_creds_create_done)
+            self._on_async_creds_create_done,
+            body.get("mac_algorithm", mac.MAC.algorithm))
 
     def _on_async_creds_create_done(self, creds):
         if creds is None:
@@ -5,6 +5,8 @@ import logging
 
 import tornado.httpclient
 
+from yar.util import pooled_http_client
+from yar.util import transport
 from yar.util import trhutil
 
 _logger = logging.getLogger("KEYSERVICE.%s" % __name__)
@@ -27,6 +29,17 @@ def filter_out_non_model_creds_properties(creds):
     return {k: v for k, v in creds.iteritems() if k in model_creds_properties}
 
 
+def key_store_url(key_store, path):
+    """Returns the url for ```path``` in ```key_store``` which is
+    either of the form 'host:port/database' or, when the key store
+    is on the same host as the key service, '/path/to/socket:database'
+    (see the 'couchdb' command line parser type)."""
+    if transport.is_unix_domain_socket(key_store):
+        (address, database) = key_store.rsplit(":", 1)
+        return pooled_http_client.url(address, "/%s/%s" % (database, path))
+    return pooled_http_client.url(key_store, "/%s" % path)
+
+
 class AsyncAction(object):
     """```AsyncAction``` is an abstract base class for all key
     service classes which encapsulate async interaction between
@@ -36,12 +49,16 @@ class AsyncAction(object):
     a single spot. This isolation makes mock creation in unit
     tests super easy."""
 
-    def __init__(self, key_store):
+    def __init__(self, key_store, deadline=None):
         """```AsyncAction```'s constructor.
         ```key_store``` is expected to convert to a string
-        of the form 'host:port'."""
+        of the form 'host:port/database' or '/path/to/socket:database'.
+        If not None, ```deadline``` is the ```yar.util.deadline.Deadline```
+        of the request being serviced and requests to the key store
+        time out at the deadline."""
         object.__init__(self)
         self.key_store = key_store
+        self.deadline = deadline
 
     def async_req_to_key_store(self,
                                path,
@@ -51,7 +68,13 @@ class AsyncAction(object):
 
         self._my_callback = callback
 
-        url = "http://%s/%s" % (self.key_store, path)
+        # the request's already out of time so there's no point
+        # asking the key store - the caller answers with a 504
+        if self.deadline is not None and self.deadline.is_expired():
+            self._my_callback(False)
+            return
+
+        url = key_store_url(self.key_store, path)
 
         json_encoded_body = json.dumps(body) if body else None
 
@@ -67,6 +90,8 @@ class AsyncAction(object):
             method=method,
             headers=headers,
             body=json_encoded_body)
+        if self.deadline is not None:
+            request.request_timeout = self.deadline.remaining()
 
         http_client = tornado.httpclient.AsyncHTTPClient()
         http_client.fetch(
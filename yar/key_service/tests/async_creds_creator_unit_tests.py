@@ -105,7 +105,7 @@ class TestCaseAsyncCredsCreator(yar_test_util.TestCase):
             the_auth_scheme="basic",
             the_http_status_code=httplib.BAD_REQUEST)
 
-    def _test_ok(self, the_auth_scheme):
+    def _test_ok(self, the_auth_scheme, the_mac_algorithm=mac.MAC.algorithm):
 
         self.the_principal = uuid.uuid4().hex
         self.the_creds = None
@@ -144,7 +144,7 @@ class TestCaseAsyncCredsCreator(yar_test_util.TestCase):
                 self.assertIn("mac_algorithm", mac_section_of_body)
                 self.assertEqual(
                     mac_section_of_body["mac_algorithm"],
-                    mac.MAC.algorithm)
+                    the_mac_algorithm)
             else:
                 self.assertIn("basic", body)
                 basic_section_of_body = body["basic"]
@@ -170,10 +170,17 @@ class TestCaseAsyncCredsCreator(yar_test_util.TestCase):
             acc.create(
                 self.the_principal,
                 the_auth_scheme,
-                on_async_create_done)
+                on_async_create_done,
+                the_mac_algorithm)
 
     def test_mac_ok(self):
         self._test_ok("mac")
 
+    def test_mac_hmac_sha_256_ok(self):
+        self._test_ok("mac", "hmac-sha-256")
+
+    def test_mac_hmac_sha_512_ok(self):
+        self._test_ok("mac", "hmac-sha-512")
+
     def test_basic_ok(self):
         self._test_ok("basic")
@@ -25,6 +25,10 @@ class CommandLineParserUnitTase(unittest.TestCase):
         self.assertEqual(clo.key_store, "127.0.0.1:5984/creds")
         self.assertIsNone(clo.logging_file)
         self.assertIsNone(clo.syslog)
+        self.assertEqual(clo.max_upstream_connections, 10)
+        self.assertEqual(clo.upstream_connect_timeout, 20.0)
+        self.assertEqual(clo.upstream_request_timeout, 20.0)
+        self.assertEqual(clo.upstream_idle_timeout, 30)
 
     def test_logging_level(self):
         """Verify the command line parser correctly parses
@@ -105,3 +109,23 @@ class CommandLineParserUnitTase(unittest.TestCase):
         self.assertEqual(clo.key_store, "127.0.0.1:5984/creds")
         self.assertEqual(clo.logging_file, args[-1])
         self.assertIsNone(clo.syslog)
+
+    def test_upstream_connections(self):
+        """Verify the command line parser correctly parses
+        the --maxupstreamconnections, --upstreamconnecttimeout,
+        --upstreamrequesttimeout and --upstreamidletimeout
+        command line args."""
+        args = [
+            "--maxupstreamconnections", "50",
+            "--upstreamconnecttimeout", "0.5",
+            "--upstreamrequesttimeout", "2.5",
+            "--upstreamidletimeout", "5",
+        ]
+
+        clp = CommandLineParser()
+        (clo, cla) = clp.parse_args(args)
+
+        self.assertEqual(clo.max_upstream_connections, 50)
+        self.assertEqual(clo.upstream_connect_timeout, 0.5)
+        self.assertEqual(clo.upstream_request_timeout, 2.5)
+        self.assertEqual(clo.upstream_idle_timeout, 5)
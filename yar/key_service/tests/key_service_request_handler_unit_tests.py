@@ -22,6 +22,7 @@ import tornado.web
 
 from yar.key_service import jsonschemas
 from yar.key_service import key_service_request_handler
+from yar.util import deadline
 from yar.util import mac
 from yar.util import basic
 from yar.tests import yar_test_util
@@ -77,15 +78,16 @@ class TestCase(yar_test_util.TestCase):
             key = creds["basic"].get("api_key", None)
         return key
 
-    def _create_creds(self, the_principal, the_auth_scheme="mac"):
+    def _create_creds(self, the_principal, the_auth_scheme="mac", the_mac_algorithm=None):
         self.assertIsNotNone(the_principal)
         self.assertTrue(0 < len(the_principal))
 
-        def create_patch(acc, principal, auth_scheme, callback):
+        def create_patch(acc, principal, auth_scheme, callback, mac_algorithm):
             self.assertIsNotNone(acc)
             self.assertEqual(principal, the_principal)
             self.assertEqual(auth_scheme, the_auth_scheme)
             self.assertIsNotNone(callback)
+            self.assertEqual(mac_algorithm, the_mac_algorithm or mac.MAC.algorithm)
 
             creds = {
                 "principal": principal,
@@ -94,7 +96,7 @@ class TestCase(yar_test_util.TestCase):
                 creds["mac"] = {
                     "mac_key_identifier": mac.MACKeyIdentifier.generate(),
                     "mac_key": mac.MACKey.generate(),
-                    "mac_algorithm": mac.MAC.algorithm,
+                    "mac_algorithm": mac_algorithm,
                 }
             else:
                 creds["basic"] = {
@@ -113,6 +115,8 @@ class TestCase(yar_test_util.TestCase):
                 "principal": the_principal,
                 "auth_scheme": the_auth_scheme,
             }
+            if the_mac_algorithm is not None:
+                body["mac_algorithm"] = the_mac_algorithm
             body_as_json = json.dumps(body)
             headers = {
                 "Content-type": "application/json; charset=utf8",
@@ -323,6 +327,23 @@ class TestCase(yar_test_util.TestCase):
             self.assertIsNotNone(response)
             self.assertTrue(httplib.NOT_FOUND == response.status)
 
+    def test_get_after_deadline(self):
+        """Verify a request whose deadline has already passed
+        is dropped without going to the key store."""
+        fetch_patch = mock.Mock()
+        name_of_method_to_patch = (
+            "yar.key_service.async_creds_retriever."
+            "AsyncCredsRetriever.fetch"
+        )
+        with mock.patch(name_of_method_to_patch, fetch_patch):
+            url = "%s/%s" % (self.url(), uuid.uuid4().hex)
+            http_client = httplib2.Http()
+            headers = {deadline.header_name: "0"}
+            response, content = http_client.request(url, "GET", headers=headers)
+            self.assertIsNotNone(response)
+            self.assertEqual(response.status, httplib.GATEWAY_TIMEOUT)
+            self.assertFalse(fetch_patch.called)
+
     def test_get_with_no_principal_and_no_key(self):
         http_client = httplib2.Http()
         response, content = http_client.request(self.url(), "GET")
@@ -492,6 +513,27 @@ class TestCase(yar_test_util.TestCase):
     def test_all_good_for_simple_create_and_delete_basic(self):
         self._test_all_good_for_simple_create_and_delete("basic")
 
+    def test_create_mac_with_mac_algorithm(self):
+        for mac_algorithm in ["hmac-sha-256", "hmac-sha-512"]:
+            principal = uuid.uuid4().hex
+            (creds, location) = self._create_creds(principal, "mac", mac_algorithm)
+            self.assertEqual(creds["mac"]["mac_algorithm"], mac_algorithm)
+
+    def test_create_mac_with_unsupported_mac_algorithm(self):
+        http_client = httplib2.Http()
+        body = {
+            "principal": uuid.uuid4().hex,
+            "auth_scheme": "mac",
+            "mac_algorithm": "hmac-md5",
+        }
+        response, content = http_client.request(
+            self.url(),
+            "POST",
+            body=json.dumps(body),
+            headers={"Content-Type": "application/json; charset=utf8"})
+        self.assertIsNotNone(response)
+        self.assertEqual(httplib.BAD_REQUEST, response.status)
+
     def test_deleted_creds_not_returned_by_default_on_get(self):
         principal = uuid.uuid4().hex
         (creds_on_create, location_on_create) = self._create_creds(principal)
@@ -505,7 +547,7 @@ class TestCase(yar_test_util.TestCase):
         """Verify that when credentials creation fails (for whatever reason)
         that the key service returns an INTERNAL_SERVER_ERROR status code."""
 
-        def create_patch(acc, principal, auth_scheme, callback):
+        def create_patch(acc, principal, auth_scheme, callback, mac_algorithm):
             # the "None" below indicates a failure has occured
             callback(None)
 
@@ -11,6 +11,7 @@ import tornado.httputil
 
 from yar.tests import yar_test_util
 from yar.key_service import ks_util
+from yar.util import deadline
 
 
 class TestCaseFilterOutNonModelCredProperties(yar_test_util.TestCase):
@@ -46,6 +47,20 @@ class TestCaseFilterOutNonModelCredProperties(yar_test_util.TestCase):
         self.assertEqual(creds, filtered_creds)
 
 
+class TestCaseKeyStoreUrl(yar_test_util.TestCase):
+    """A collection of unit tests for ks_util's key_store_url()."""
+
+    def test_host_colon_port(self):
+        self.assertEqual(
+            ks_util.key_store_url("dave:5984/creds", "bindle"),
+            "http://dave:5984/creds/bindle")
+
+    def test_unix_domain_socket(self):
+        self.assertEqual(
+            ks_util.key_store_url("/var/run/couchdb.sock:creds", "bindle"),
+            "http+unix://%2Fvar%2Frun%2Fcouchdb.sock/creds/bindle")
+
+
 class TestCaseAsyncAction(yar_test_util.TestCase):
     """A collection of unit tests for ks_util's AsyncAction class."""
 
@@ -207,3 +222,17 @@ class TestCaseAsyncAction(yar_test_util.TestCase):
                 "GET",
                 None,
                 on_async_req_to_key_store_done)
+
+    def test_deadline_expired(self):
+        """Confirm ```ks_util.AsyncAction.async_req_to_key_store```
+        doesn't ask the key store anything once the request's
+        deadline has passed."""
+        callback = mock.Mock()
+
+        name_of_method_to_patch = "tornado.httpclient.AsyncHTTPClient.fetch"
+        with mock.patch(name_of_method_to_patch) as fetch_patch:
+            aa = ks_util.AsyncAction(type(self)._key_store, deadline.Deadline(0))
+            aa.async_req_to_key_store("dave", "GET", None, callback)
+            self.assertEqual(fetch_patch.call_count, 0)
+
+        callback.assert_called_once_with(False)
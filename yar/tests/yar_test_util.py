@@ -113,6 +113,6 @@ class TestCase(unittest.TestCase):
         is valid for specifying utf8 json content in an http header. """
         self.assertIsNotNone(content_type)
         json_utf8_content_type_reg_ex = re.compile(
-            "^\s*application/json;\s+charset\=utf-{0,1}8\s*$",
+            r"^\s*application/json;\s+charset\=utf-{0,1}8\s*$",
             re.IGNORECASE)
         self.assertIsNotNone(json_utf8_content_type_reg_ex.match(content_type))
@@ -1,10 +1,15 @@
 """This module is ..."""
 
 import logging
+import re
 import uuid
 
 _logger = logging.getLogger("UTIL.%s" % __name__)
 
+"""```_api_key_reg_ex``` matches the shape of the values
+generated by ```APIKey.generate()```."""
+_api_key_reg_ex = re.compile("^[0-9a-f]{32}$")
+
 
 class APIKey(str):
     """This class generates a 32 character random string intend
@@ -13,6 +18,13 @@ class APIKey(str):
     def __new__(cls, api_key):
         return str.__new__(cls, api_key)
 
+    @classmethod
+    def is_well_formed(cls, value):
+        """Returns True if ```value``` has the shape of an api key
+        generated by ```generate()```. Anything else can't possibly
+        identify a set of credentials."""
+        return value is not None and _api_key_reg_ex.match(value) is not None
+
     @classmethod
     def generate(cls):
         """Generate an api key. Returns an instance
@@ -0,0 +1,86 @@
+"""This module contains a circuit breaker used to stop sending
+requests to an upstream which is failing. Rather than every request
+waiting for a failing upstream to time out, requests fail fast until
+the upstream has had a chance to recover."""
+
+import logging
+import time
+
+from yar.util import metrics
+
+_logger = logging.getLogger("UTIL.%s" % __name__)
+
+"""A ```CircuitBreaker``` is in one of these states. Requests are allowed
+when the breaker is ```STATE_CLOSED```, rejected when ```STATE_OPEN```
+and a single trial request is allowed when ```STATE_HALF_OPEN```. The
+values are what's reported in the breaker's state gauge."""
+STATE_CLOSED = 0
+STATE_OPEN = 1
+STATE_HALF_OPEN = 2
+
+
+class CircuitBreaker(object):
+    """A circuit breaker which opens (trips) after ```failure_threshold```
+    consecutive failures. After ```reset_timeout``` seconds the breaker
+    is half open and allows a single trial request - if the trial
+    succeeds the breaker closes and if it fails the breaker opens again.
+
+    The breaker's state is reported as the ```<name>.breaker_state```
+    gauge and the # of times it has tripped as the ```<name>.breaker_trips```
+    counter in ```yar.util.metrics```."""
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=10):
+        object.__init__(self)
+
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.consecutive_failures = 0
+        self._state = STATE_CLOSED
+        self._opened_at = None
+        self._is_trial_in_flight = False
+
+    @property
+    def state(self):
+        if self._state == STATE_OPEN and self._opened_at + self.reset_timeout <= time.time():
+            self._set_state(STATE_HALF_OPEN)
+        return self._state
+
+    def _set_state(self, state):
+        if self._state == state:
+            return
+        self._state = state
+        self._is_trial_in_flight = False
+        metrics.gauge("%s.breaker_state" % self.name, state)
+
+    def allow_request(self):
+        """Returns True if a request can be sent. When half open only
+        the first caller is allowed to send a (trial) request."""
+        state = self.state
+        if state == STATE_CLOSED:
+            return True
+        if state == STATE_HALF_OPEN and not self._is_trial_in_flight:
+            self._is_trial_in_flight = True
+            return True
+        return False
+
+    def on_success(self):
+        self.consecutive_failures = 0
+        if self._state != STATE_CLOSED:
+            _logger.info("Closing circuit breaker '%s'", self.name)
+            self._set_state(STATE_CLOSED)
+
+    def on_failure(self):
+        self.consecutive_failures += 1
+        is_trip = \
+            self._state == STATE_HALF_OPEN or \
+            (self._state == STATE_CLOSED and self.failure_threshold <= self.consecutive_failures)
+        if is_trip:
+            _logger.error(
+                "Opening circuit breaker '%s' after %d consecutive failures",
+                self.name,
+                self.consecutive_failures)
+            metrics.increment("%s.breaker_trips" % self.name)
+            self._opened_at = time.time()
+            self._set_state(STATE_OPEN)
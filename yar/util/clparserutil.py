@@ -9,13 +9,20 @@ import optparse
 _logger = logging.getLogger("UTIL.%s" % __name__)
 
 
+"""```_unix_domain_socket_reg_ex_pattern``` matches the (absolute)
+path of a unix domain socket."""
+_unix_domain_socket_reg_ex_pattern = r"(?:/[A-Za-z0-9\.\_\-]+)+"
+
+
 def _check_couchdb(option, opt, value):
-    """Type checking function for command line parser's 'couchdb' type."""
-    reg_ex_pattern = "^[^\s]+\:\d+\/[^\s]+$"
+    """Type checking function for command line parser's 'couchdb' type.
+    The database is either accessed using TCP (host:port/database) or
+    a unix domain socket (/path/to/socket:database)."""
+    reg_ex_pattern = r"^(?:[^\s]+\:\d+\/|%s\:)[^\s]+$" % _unix_domain_socket_reg_ex_pattern
     reg_ex = re.compile(reg_ex_pattern)
     if reg_ex.match(value):
         return value
-    msg = "option %s: required format is host:port/database" % opt
+    msg = "option %s: required format is host:port/database or /path/to/socket:database" % opt
     raise optparse.OptionValueError(msg)
 
 
@@ -82,7 +89,7 @@ def _parse_host_colon_ports(option, opt, value, return_parsed_pairs):
     parses the string and returns a list of host, port tuples.
     If ```value``` is not in the expected format a
     optparse.OptionValueError exception is raised."""
-    split_reg_ex = re.compile("\s*\,\s*")
+    split_reg_ex = re.compile(r"\s*\,\s*")
 
     rv = []
     for server in split_reg_ex.split(value.strip()):
@@ -107,9 +114,9 @@ def _parse_host_colon_port(server, must_have_host):
     the expected form None is returned."""
 
     if must_have_host:
-        pattern = "^\s*(?P<host>[^\:]+)\:(?P<port>\d+)\s*$"
+        pattern = r"^\s*(?P<host>[^\:]+)\:(?P<port>\d+)\s*$"
     else:
-        pattern = "^\s*(?:(?P<host>[^\:]+)\:)?(?P<port>\d+)\s*$"
+        pattern = r"^\s*(?:(?P<host>[^\:]+)\:)?(?P<port>\d+)\s*$"
     reg_ex = re.compile(pattern)
 
     match = reg_ex.match(server)
@@ -120,6 +127,60 @@ def _parse_host_colon_port(server, must_have_host):
     return (host, int(port))
 
 
+def _is_unix_domain_socket(value):
+    """Returns True if ```value``` is the path of a unix domain socket."""
+    reg_ex = re.compile(r"^\s*%s\s*$" % _unix_domain_socket_reg_ex_pattern)
+    return reg_ex.match(value) is not None
+
+
+def _check_address(option, opt, value):
+    """Type checking function for command line parser's
+    'address' type."""
+    return __check_address(opt, value, False)
+
+
+def _check_address_parsed(option, opt, value):
+    """Type checking function for command line parser's
+    'addressparsed' type."""
+    return __check_address(opt, value, True)
+
+
+def __check_address(opt, value, return_parsed_value):
+    """Encapsulates 98% of the details for implementing the command line
+    parser's 'address' and 'addressparsed' types. An address is either
+    host:port or the path of a unix domain socket. The parsed form of
+    host:port is a (host, port) tuple and the parsed form of a unix
+    domain socket is its path."""
+    if _is_unix_domain_socket(value):
+        return value.strip()
+    parsed_value = _parse_host_colon_port(value, must_have_host=True)
+    if not parsed_value:
+        msg = "option %s: should be host:port or /path/to/socket format" % opt
+        raise optparse.OptionValueError(msg)
+    return parsed_value if return_parsed_value else value
+
+
+def _check_addresses(option, opt, value):
+    """Type checking function for command line parser's 'addresses'
+    type - a series of addresses separated by commas. Unlike the
+    'hostcolonports' type the host is required - an address is used
+    as is to connect to a server so a port on its own isn't enough."""
+    split_reg_ex = re.compile(r"\s*\,\s*")
+
+    rv = []
+    for server in split_reg_ex.split(value.strip()):
+        if not _is_unix_domain_socket(server):
+            if not _parse_host_colon_port(server, must_have_host=True):
+                fmt = (
+                    "option %s: should be 'address, address, ... "
+                    "address' format where each address is host:port "
+                    "or /path/to/socket"
+                )
+                raise optparse.OptionValueError(fmt % opt)
+        rv.append(server)
+    return rv
+
+
 def _check_boolean(option, opt, value):
     """Type checking function for command line parser's 'boolean' type."""
     true_reg_ex_pattern = "^(true|t|y|yes|1)$"
@@ -137,7 +198,7 @@ def _check_boolean(option, opt, value):
 def _check_unix_domain_socket(option, opt, value):
     """Type checking function for command line
     parser's 'unixdomaintype' type."""
-    reg_ex_pattern = "^(?:/[A-Za-z0-9]+)+$"
+    reg_ex_pattern = "^%s$" % _unix_domain_socket_reg_ex_pattern
     reg_ex = re.compile(reg_ex_pattern, re.IGNORECASE)
     if reg_ex.match(value):
         return value
@@ -147,13 +208,17 @@ def _check_unix_domain_socket(option, opt, value):
 
 
 class Option(optparse.Option):
-    """Adds couchdb, hostcolonport, hostcolonports, boolean & logginglevel
-    types to the command line parser's list of available types."""
+    """Adds couchdb, hostcolonport, hostcolonports, address, addresses,
+    boolean & logginglevel types to the command line parser's list of
+    available types."""
     new_types = (
         "hostcolonport",
         "hostcolonportparsed",
         "hostcolonports",
         "hostcolonportsparsed",
+        "address",
+        "addressparsed",
+        "addresses",
         "logginglevel",
         "boolean",
         "couchdb",
@@ -165,6 +230,9 @@ class Option(optparse.Option):
     TYPE_CHECKER["hostcolonportparsed"] = _check_host_colon_port_parsed
     TYPE_CHECKER["hostcolonports"] = _check_host_colon_ports
     TYPE_CHECKER["hostcolonportsparsed"] = _check_host_colon_ports_parsed
+    TYPE_CHECKER["address"] = _check_address
+    TYPE_CHECKER["addressparsed"] = _check_address_parsed
+    TYPE_CHECKER["addresses"] = _check_addresses
     TYPE_CHECKER["logginglevel"] = _check_logging_level
     TYPE_CHECKER["boolean"] = _check_boolean
     TYPE_CHECKER["couchdb"] = _check_couchdb
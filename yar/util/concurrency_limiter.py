@@ -0,0 +1,204 @@
+"""This module contains an adaptive concurrency limiter used to shed
+load when a server is overloaded. Rather than accepting every request
+and queuing the work until latency grows without bound and everything
+times out, the # of requests in flight is limited and requests beyond
+the limit are rejected (shed) straight away. The limit isn't configured
+but discovered - it's continuously adjusted using the outcome and
+latency of each request so it tracks what upstreams can actually handle."""
+
+import collections
+import logging
+import time
+
+import tornado.ioloop
+
+from yar.util import metrics
+
+_logger = logging.getLogger("UTIL.%s" % __name__)
+
+"""```ConcurrencyLimiter```'s policy determines how the limit is adjusted.
+```POLICY_AIMD``` (additive increase, multiplicative decrease) grows the
+limit by 1 for each request that succeeds quickly and backs off by
+```ConcurrencyLimiter._backoff_ratio``` for each request that fails or
+is slower than ```latency_threshold```. ```POLICY_GRADIENT``` compares
+recent latency to long term latency and shrinks the limit as queuing
+delay builds up."""
+POLICY_AIMD = "aimd"
+POLICY_GRADIENT = "gradient"
+POLICIES = [
+    POLICY_AIMD,
+    POLICY_GRADIENT,
+]
+
+
+class ConcurrencyLimiter(object):
+    """Limits the # of requests in flight to an adaptive limit between
+    ```min_limit``` and ```max_limit``` which is adjusted according to
+    ```policy``` (one of ```POLICIES```). When the limit is reached up to
+    ```max_queue_size``` requests wait, for at most ```max_queue_time```
+    seconds, for a request to finish. Everything else is shed.
+
+    The limit (```<name>.limit```), # of requests in flight
+    (```<name>.in_flight```) and most recent queue time
+    (```<name>.queue_time_ms```) gauges and queued (```<name>.queued```)
+    and shed (```<name>.shed```) counters are maintained in
+    ```yar.util.metrics```."""
+
+    """Multiplicative decrease applied for each failed request."""
+    _backoff_ratio = 0.9
+
+    """Weights given to the latest request's latency when updating
+    ```POLICY_GRADIENT```'s short term and long term exponentially
+    weighted latencies."""
+    _short_latency_alpha = 0.1
+    _long_latency_alpha = 1.0 / 600
+
+    """```POLICY_GRADIENT``` tolerates short term latency this much worse
+    than long term latency before shrinking the limit, always allows
+    ```_queue_allowance``` requests more than the gradient suggests so
+    the limit can probe for more capacity and moves ```_smoothing``` of
+    the way to the new limit on each request."""
+    _tolerance = 1.5
+    _queue_allowance = 4
+    _smoothing = 0.2
+
+    def __init__(self,
+                 name,
+                 policy=POLICY_GRADIENT,
+                 initial_limit=20,
+                 min_limit=1,
+                 max_limit=1000,
+                 max_queue_size=0,
+                 max_queue_time=0.05,
+                 latency_threshold=0):
+        object.__init__(self)
+
+        self.name = name
+        self.policy = policy
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.max_queue_size = max_queue_size
+        self.max_queue_time = max_queue_time
+        self.latency_threshold = latency_threshold
+
+        self.in_flight = 0
+        self._limit = float(max(min_limit, min(max_limit, initial_limit)))
+        self._queue = collections.deque()
+        self._short_latency = None
+        self._long_latency = None
+
+        metrics.gauge(self.metric_name("limit"), self.limit)
+
+    def metric_name(self, name):
+        return "%s.%s" % (self.name, name)
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    def acquire(self, callback):
+        """Admit a request. ```callback``` is called with True once the
+        request has been admitted or with False if the request has been
+        shed. Every admitted request must be followed by a call to
+        ```release()```."""
+        if self.in_flight < self.limit:
+            self._admit()
+            callback(True)
+            return
+
+        if len(self._queue) < self.max_queue_size:
+            metrics.increment(self.metric_name("queued"))
+            io_loop = tornado.ioloop.IOLoop.current()
+            entry = [callback, time.time(), None]
+            entry[2] = io_loop.add_timeout(
+                io_loop.time() + self.max_queue_time,
+                lambda: self._on_queue_timeout(entry))
+            self._queue.append(entry)
+            return
+
+        metrics.increment(self.metric_name("shed"))
+        callback(False)
+
+    def release(self, is_ok, duration=None):
+        """An admitted request has finished. ```is_ok``` is False if the
+        request failed in a way that suggests overload (for example, a
+        timeout) and ```duration``` is the request's latency in seconds.
+        A ```duration``` of None releases the request without it
+        affecting the limit."""
+        # the limit is updated before the request stops being counted
+        # as in flight so the update sees the load the request saw
+        if duration is not None:
+            if self.policy == POLICY_AIMD:
+                self._update_aimd_limit(is_ok, duration)
+            else:
+                self._update_gradient_limit(is_ok, duration)
+
+        self.in_flight -= 1
+        metrics.gauge(self.metric_name("in_flight"), self.in_flight)
+
+        while self._queue and self.in_flight < self.limit:
+            (callback, enqueue_time, timeout) = self._queue.popleft()
+            tornado.ioloop.IOLoop.current().remove_timeout(timeout)
+            metrics.gauge(self.metric_name("queue_time_ms"), int((time.time() - enqueue_time) * 1000))
+            self._admit()
+            callback(True)
+
+    def _admit(self):
+        self.in_flight += 1
+        metrics.gauge(self.metric_name("in_flight"), self.in_flight)
+
+    def _on_queue_timeout(self, entry):
+        try:
+            self._queue.remove(entry)
+        except ValueError:
+            return
+        metrics.gauge(self.metric_name("queue_time_ms"), int(self.max_queue_time * 1000))
+        metrics.increment(self.metric_name("shed"))
+        entry[0](False)
+
+    def _is_limit_used(self):
+        """The limit is only grown when it's being used - otherwise
+        a lightly loaded server would grow its limit without bound
+        and have no protection when load arrives."""
+        return self.limit <= self.in_flight * 2
+
+    def _update_aimd_limit(self, is_ok, duration):
+        is_slow = 0 < self.latency_threshold and self.latency_threshold < duration
+        if not is_ok or is_slow:
+            self._set_limit(self._limit * self._backoff_ratio)
+        elif self._is_limit_used():
+            self._set_limit(self._limit + 1)
+
+    def _update_gradient_limit(self, is_ok, duration):
+        if not is_ok:
+            self._set_limit(self._limit * self._backoff_ratio)
+            return
+
+        if self._short_latency is None:
+            self._short_latency = duration
+            self._long_latency = duration
+        else:
+            self._short_latency += self._short_latency_alpha * (duration - self._short_latency)
+            self._long_latency += self._long_latency_alpha * (duration - self._long_latency)
+            # after a sustained period of high latency the long term
+            # latency is pulled back down once latency recovers
+            if self._short_latency * 2 < self._long_latency:
+                self._long_latency *= 0.95
+
+        if self._short_latency <= 0 or not self._is_limit_used():
+            return
+
+        gradient = max(0.5, min(1.0, self._tolerance * self._long_latency / self._short_latency))
+        new_limit = self._limit * gradient + self._queue_allowance
+        self._set_limit((1 - self._smoothing) * self._limit + self._smoothing * new_limit)
+
+    def _set_limit(self, limit):
+        old_limit = self.limit
+        self._limit = max(self.min_limit, min(self.max_limit, limit))
+        if self.limit != old_limit:
+            _logger.info(
+                "Concurrency limit '%s' changed from %d to %d",
+                self.name,
+                old_limit,
+                self.limit)
+            metrics.gauge(self.metric_name("limit"), self.limit)
@@ -0,0 +1,184 @@
+"""This module is a benchmark which shows what ```concurrency_limiter```
+does for goodput (requests answered before their client gives up) as
+offered load goes past an upstream's capacity. The upstream is simulated,
+rather than real, so the results are repeatable - it has a fixed # of
+workers and every request beyond those waits in an unbounded queue,
+which is what happens to an auth service whose requests queue in
+tornado's HTTP client. Clients give up after ```--timeout``` seconds but
+the upstream still does the work. Without a limiter goodput collapses
+once the queue's wait exceeds the timeout. With a limiter excess requests
+are shed straight away and goodput holds at about the upstream's
+capacity. Run it using something like:
+
+    python -m yar.util.concurrency_limiter_benchmark --load=0.5,1,2,4
+"""
+
+import collections
+import heapq
+import optparse
+import random
+
+from yar.util import concurrency_limiter
+
+
+class _Upstream(object):
+    """```number_workers``` workers each taking an exponentially
+    distributed time, averaging ```service_time``` seconds, per request."""
+
+    def __init__(self, number_workers, service_time):
+        object.__init__(self)
+        self.number_idle_workers = number_workers
+        self.service_time = service_time
+        self.queue = collections.deque()
+
+
+def _simulate(limiter, upstream, requests_per_second, timeout, duration):
+    """Returns (# of requests per second answered within ```timeout```,
+    fraction of requests shed)."""
+    events = []
+    number_good = 0
+    number_shed = 0
+    number_requests = 0
+
+    def start(now, arrival_time):
+        upstream.number_idle_workers -= 1
+        done_time = now + random.expovariate(1.0 / upstream.service_time)
+        heapq.heappush(events, (done_time, "done", arrival_time))
+
+    now = random.expovariate(requests_per_second)
+    heapq.heappush(events, (now, "arrival", now))
+
+    while events:
+        (now, event, arrival_time) = heapq.heappop(events)
+
+        if event == "arrival":
+            number_requests += 1
+            next_arrival_time = now + random.expovariate(requests_per_second)
+            if next_arrival_time < duration:
+                heapq.heappush(events, (next_arrival_time, "arrival", next_arrival_time))
+
+            admissions = []
+            if limiter is None:
+                admissions.append(True)
+            else:
+                limiter.acquire(admissions.append)
+            if not admissions[0]:
+                number_shed += 1
+                continue
+
+            if upstream.number_idle_workers:
+                start(now, arrival_time)
+            else:
+                upstream.queue.append(arrival_time)
+            continue
+
+        upstream.number_idle_workers += 1
+        if upstream.queue:
+            start(now, upstream.queue.popleft())
+
+        latency = now - arrival_time
+        if latency <= timeout:
+            number_good += 1
+        if limiter is not None:
+            limiter.release(latency <= timeout, latency)
+
+    return (number_good / duration, float(number_shed) / max(1, number_requests))
+
+
+class _CommandLineParser(optparse.OptionParser):
+
+    def __init__(self):
+        optparse.OptionParser.__init__(self, "usage: %prog [options]")
+
+        default = "0.5,0.9,1,1.5,2,4"
+        help = "comma separated offered loads as multiples of capacity - default = %s" % default
+        self.add_option(
+            "--load",
+            action="store",
+            dest="loads",
+            default=default,
+            type="string",
+            help=help)
+
+        default = 10
+        help = "# of upstream workers - default = %d" % default
+        self.add_option(
+            "--workers",
+            action="store",
+            dest="number_workers",
+            default=default,
+            type=int,
+            help=help)
+
+        default = 0.01
+        help = "mean seconds per request per worker - default = %.3f" % default
+        self.add_option(
+            "--servicetime",
+            action="store",
+            dest="service_time",
+            default=default,
+            type=float,
+            help=help)
+
+        default = 0.5
+        help = "seconds before a client gives up - default = %.2f" % default
+        self.add_option(
+            "--timeout",
+            action="store",
+            dest="timeout",
+            default=default,
+            type=float,
+            help=help)
+
+        default = 60
+        help = "simulated seconds per run - default = %d" % default
+        self.add_option(
+            "--duration",
+            action="store",
+            dest="duration",
+            default=default,
+            type=int,
+            help=help)
+
+
+if __name__ == "__main__":
+    clp = _CommandLineParser()
+    (clo, cla) = clp.parse_args()
+
+    capacity = clo.number_workers / clo.service_time
+
+    print "capacity = %.0f requests/sec" % capacity
+    print "%6s %10s %10s %10s %10s %14s" % (
+        "load",
+        "offered",
+        "none",
+        "aimd",
+        "gradient",
+        "gradient shed")
+
+    for load in [float(load) for load in clo.loads.split(",")]:
+        requests_per_second = load * capacity
+        goodputs = []
+        for policy in [None, concurrency_limiter.POLICY_AIMD, concurrency_limiter.POLICY_GRADIENT]:
+            random.seed(0)
+            limiter = None
+            if policy is not None:
+                limiter = concurrency_limiter.ConcurrencyLimiter(
+                    "benchmark",
+                    policy=policy,
+                    latency_threshold=clo.service_time * 5)
+            upstream = _Upstream(clo.number_workers, clo.service_time)
+            (goodput, shed) = _simulate(
+                limiter,
+                upstream,
+                requests_per_second,
+                clo.timeout,
+                clo.duration)
+            goodputs.append(goodput)
+        print "%5.1fx %10.0f %10.0f %10.0f %10.0f %13.1f%%" % (
+            load,
+            requests_per_second,
+            goodputs[0],
+            goodputs[1],
+            goodputs[2],
+            shed * 100)
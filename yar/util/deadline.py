@@ -0,0 +1,136 @@
+"""This module contains the deadline used to bound how long the auth
+service spends on a request. A ```Deadline``` is created when a request
+arrives and each stage of the request's processing (nonce check,
+credentials retrieval, forwarding to the app service) gets whatever is
+left of the deadline's budget as its timeout. This means a single hung
+dependency can't pin a request, and the memory that goes with it,
+indefinitely.
+
+The deadline travels to the key service and app service in the
+```header_name``` HTTP header so they can drop work that can no
+longer finish in time. The header's value is the # of milliseconds
+left before the deadline - a relative value, rather than an absolute
+time, so clock differences between hosts don't matter.
+
+When a stage runs out of time the stage is recorded in the deadline's
+```exceeded_stage``` and the ```deadline_exceeded.<stage>``` counter
+in ```yar.util.metrics``` is incremented."""
+
+import logging
+import time
+
+import tornado.ioloop
+
+from yar.util import metrics
+
+_logger = logging.getLogger("UTIL.%s" % __name__)
+
+"""Name of the HTTP header used to pass a deadline along to upstreams."""
+header_name = "X-Yar-Deadline-Ms"
+
+
+def from_headers(headers):
+    """Returns the ```Deadline``` described by ```headers```' ```header_name```
+    header or None if there's no such header or its value is invalid."""
+    value = headers.get(header_name, None)
+    if value is None:
+        return None
+    try:
+        milliseconds = int(value)
+    except ValueError:
+        _logger.info("Invalid %s header value '%s'", header_name, value)
+        return None
+    if milliseconds < 0:
+        _logger.info("Invalid %s header value '%s'", header_name, value)
+        return None
+    return Deadline(milliseconds / 1000.0)
+
+
+class Deadline(object):
+    """A deadline ```budget``` seconds from now."""
+
+    def __init__(self, budget):
+        object.__init__(self)
+
+        self.expires_at = time.time() + budget
+        self.exceeded_stage = None
+
+    def remaining(self):
+        """Returns the # of seconds left before the deadline."""
+        return max(0, self.expires_at - time.time())
+
+    def is_expired(self):
+        return self.expires_at <= time.time()
+
+    def extend(self, other):
+        """Move the deadline out to ```other```'s, another ```Deadline```,
+        if ```other```'s is later."""
+        self.expires_at = max(self.expires_at, other.expires_at)
+
+    def postpone(self, seconds):
+        """Move the deadline ```seconds``` later."""
+        self.expires_at += seconds
+
+    def timeout(self, timeout):
+        """Returns ```timeout``` or, if it's shorter or ```timeout```
+        is None or 0 (no timeout), the time left before the deadline."""
+        if not timeout:
+            return self.remaining()
+        return min(timeout, self.remaining())
+
+    def header_value(self):
+        return str(int(self.remaining() * 1000))
+
+    def exceeded(self, stage):
+        """Record that ```stage``` ran out of time. Only the first
+        stage to run out of time is recorded."""
+        if self.exceeded_stage is not None:
+            return
+        self.exceeded_stage = stage
+        _logger.info("Deadline exceeded during %s", stage)
+        metrics.increment("deadline_exceeded.%s" % stage)
+
+    def guard(self, stage, callback, *timeout_args):
+        """Returns a callable to use in place of ```callback``` for an
+        async operation that's part of ```stage```. If the operation
+        hasn't completed by the deadline the stage is recorded as
+        exceeded and ```callback``` is called with ```timeout_args```.
+        A result that arrives after the deadline is treated the same way
+        and ```callback``` is only ever called once."""
+        return _Guard(self, stage, callback, timeout_args)
+
+
+class _Guard(object):
+
+    def __init__(self, deadline, stage, callback, timeout_args):
+        object.__init__(self)
+
+        self._deadline = deadline
+        self._stage = stage
+        self._callback = callback
+        self._timeout_args = timeout_args
+
+        io_loop = tornado.ioloop.IOLoop.current()
+        self._timeout = io_loop.add_timeout(
+            io_loop.time() + deadline.remaining(),
+            self._on_timeout)
+
+    def __call__(self, *args, **kwargs):
+        if self._callback is None:
+            return
+        if self._deadline.is_expired():
+            self._on_timeout()
+            return
+        tornado.ioloop.IOLoop.current().remove_timeout(self._timeout)
+        callback = self._callback
+        self._callback = None
+        callback(*args, **kwargs)
+
+    def _on_timeout(self):
+        if self._callback is None:
+            return
+        tornado.ioloop.IOLoop.current().remove_timeout(self._timeout)
+        callback = self._callback
+        self._callback = None
+        self._deadline.exceeded(self._stage)
+        callback(*self._timeout_args)
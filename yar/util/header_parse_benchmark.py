@@ -0,0 +1,195 @@
+"""This module is a benchmark which measures the # of header parsing
+operations per second the auth service does on every request. Each
+operation is run over a corpus of valid and malformed headers using
+both the original implementation (which compiled its regular
+expression on every call and used ```datetime``` arithmetic to
+generate timestamps) and the current implementation. Run it using
+something like:
+
+    python -m yar.util.header_parse_benchmark --iterations=10000
+"""
+
+import datetime
+import optparse
+import re
+import time
+
+from yar.util import mac
+from yar.util import trhutil
+
+
+def _original_auth_scheme(value):
+    reg_ex = re.compile(r"^\s*(?P<auth_scheme>(MAC|BASIC))\s+.*", re.IGNORECASE)
+    match = reg_ex.match(value)
+    return match.group("auth_scheme") if match else None
+
+
+# mirrors yar.auth_service.auth_service_request_handler._auth_scheme_reg_ex
+_auth_scheme_reg_ex = re.compile(r"^\s*(?P<auth_scheme>(MAC|BASIC))\s", re.IGNORECASE)
+
+
+def _auth_scheme(value):
+    match = _auth_scheme_reg_ex.match(value)
+    return match.group("auth_scheme") if match else None
+
+
+def _original_mac_auth_header_parse(value):
+    reg_ex_pattern = (
+        r'^\s*'
+        r'MAC\s+'
+        r'id\s*\=\s*"(?P<mac_key_identifier>[^"]+)"\s*\,\s*'
+        r'ts\s*\=\s*"(?P<ts>[^"]+)"\s*\,\s*'
+        r'nonce\s*\=\s*"(?P<nonce>[^"]+)"\s*\,\s*'
+        r'ext\s*\=\s*"(?P<ext>[^"]*)"\s*\,\s*'
+        r'mac\s*\=\s*"(?P<mac>[^"]+)"\s*'
+        '$'
+    )
+    reg_ex = re.compile(reg_ex_pattern, re.IGNORECASE)
+    match = reg_ex.match(value)
+    if not match:
+        return None
+    try:
+        ts = mac.Timestamp(match.group("ts"))
+    except ValueError:
+        return None
+    return mac.AuthHeaderValue(
+        match.group("mac_key_identifier"),
+        ts,
+        mac.Nonce(match.group("nonce")),
+        mac.Ext(match.group("ext")),
+        mac.MAC(match.group("mac")))
+
+
+def _original_host_and_port(request):
+    value = request.headers.get("Host", None)
+    if value is None:
+        return (None, None)
+    reg_ex_pattern = r"^\s*(?P<host>[^\:]+)(?:\:(?P<port>\d+))?\s*$"
+    reg_ex = re.compile(reg_ex_pattern)
+    match = reg_ex.match(value)
+    if not match:
+        return (None, None)
+    return (match.group("host"), match.group("port"))
+
+
+class _Request(object):
+
+    def __init__(self, host):
+        object.__init__(self)
+        self.headers = {"Host": host}
+
+
+def _original_timestamp_generate(value):
+    epoch = datetime.datetime(1970, 1, 1, 0, 0, 0)
+    ts = int((datetime.datetime.utcnow() - epoch).total_seconds())
+    return mac.Timestamp(ts)
+
+
+def _timestamp_generate(value):
+    return mac.Timestamp.generate()
+
+
+def _auth_header_corpus():
+    rv = []
+    for i in range(10):
+        rv.append(str(mac.AuthHeaderValue(
+            mac.MACKeyIdentifier.generate(),
+            mac.Timestamp.generate(),
+            mac.Nonce.generate(),
+            mac.Ext(""),
+            mac.MAC("a" * 40))))
+    rv.extend([
+        'MAC id="dave", ts="dave", nonce="dave", ext="", mac="dave"',
+        'MAC id="", ts="1", nonce="dave", ext="", mac="dave"',
+        'MAC id="dave", ts="1", nonce="dave", ext=""',
+        'mac   id = "dave" , ts = "1" , nonce = "dave" , ext = "" , mac = "dave"  ',
+        'BASIC ZGF2ZTo=',
+        'DIGEST username="dave"',
+        'MAC',
+        'MAC ' + 'x' * 8192,
+        '',
+    ])
+    return rv
+
+
+def _host_corpus():
+    hosts = [
+        "127.0.0.1",
+        "127.0.0.1:8000",
+        "  www.example.com:443  ",
+        "www.example.com:",
+        ":8000",
+        "www.example.com:port",
+        "",
+        "x" * 1024,
+    ]
+    return [_Request(host) for host in hosts]
+
+
+def _operations_per_second(operation, corpus, number_iterations):
+    start_time = time.time()
+    for i in xrange(number_iterations):
+        for value in corpus:
+            operation(value)
+    return number_iterations * len(corpus) / (time.time() - start_time)
+
+
+class _CommandLineParser(optparse.OptionParser):
+
+    def __init__(self):
+        optparse.OptionParser.__init__(self, "usage: %prog [options]")
+
+        default = 10000
+        help = "# of passes over each corpus - default = %d" % default
+        self.add_option(
+            "--iterations",
+            action="store",
+            dest="number_iterations",
+            default=default,
+            type=int,
+            help=help)
+
+
+if __name__ == "__main__":
+    clp = _CommandLineParser()
+    (clo, cla) = clp.parse_args()
+
+    auth_header_corpus = _auth_header_corpus()
+    host_corpus = _host_corpus()
+
+    benchmarks = [
+        (
+            "auth scheme",
+            _original_auth_scheme,
+            _auth_scheme,
+            auth_header_corpus,
+        ),
+        (
+            "MAC auth header",
+            _original_mac_auth_header_parse,
+            mac.AuthHeaderValue.parse,
+            auth_header_corpus,
+        ),
+        (
+            "host header",
+            _original_host_and_port,
+            trhutil.get_request_host_and_port,
+            host_corpus,
+        ),
+        (
+            "timestamp",
+            _original_timestamp_generate,
+            _timestamp_generate,
+            [None],
+        ),
+    ]
+
+    print "%-16s %14s %14s %8s" % ("operation", "before ops/sec", "after ops/sec", "speedup")
+    for (name, before, after, corpus) in benchmarks:
+        before_ops_per_second = _operations_per_second(before, corpus, clo.number_iterations)
+        after_ops_per_second = _operations_per_second(after, corpus, clo.number_iterations)
+        print "%-16s %14.0f %14.0f %7.1fx" % (
+            name,
+            before_ops_per_second,
+            after_ops_per_second,
+            after_ops_per_second / before_ops_per_second)
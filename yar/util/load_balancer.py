@@ -0,0 +1,152 @@
+"""This module contains the client side load balancer used to spread
+requests across several upstreams (for example, app service instances)
+without needing a proxy between yar and the upstreams. Upstreams are
+passively health checked - the outcome and latency of each request is
+recorded and upstreams that fail or slow down are temporarily ejected."""
+
+import logging
+import random
+import time
+
+from yar.util import metrics
+
+_logger = logging.getLogger("UTIL.%s" % __name__)
+
+"""```LoadBalancer```'s policy determines how an upstream is chosen -
+```POLICY_P2C``` (power of two choices) picks two healthy upstreams at
+random and uses the one with the fewest outstanding requests and
+```POLICY_LEAST_OUTSTANDING``` uses the healthy upstream with the
+fewest outstanding requests."""
+POLICY_P2C = "p2c"
+POLICY_LEAST_OUTSTANDING = "leastoutstanding"
+POLICIES = [
+    POLICY_P2C,
+    POLICY_LEAST_OUTSTANDING,
+]
+
+
+class Upstream(object):
+    """Tracks the load on and health of a single upstream."""
+
+    """Weight given to the latest request's latency when
+    updating an upstream's exponentially weighted latency."""
+    _latency_alpha = 0.3
+
+    def __init__(self, name, address):
+        object.__init__(self)
+
+        self.name = name
+        self.address = address
+        self.number_outstanding = 0
+        self.latency = None
+        self.consecutive_failures = 0
+        self.ejected_until = None
+
+    def metric_name(self, name):
+        return "%s.%s.%s" % (self.name, self.address, name)
+
+    def is_ejected(self, now):
+        return self.ejected_until is not None and now < self.ejected_until
+
+    def update_latency(self, duration):
+        if self.latency is None:
+            self.latency = duration
+        else:
+            self.latency += self._latency_alpha * (duration - self.latency)
+        metrics.gauge(self.metric_name("latency_ms"), int(self.latency * 1000))
+
+
+class LoadBalancer(object):
+    """Spreads requests across ```addresses``` according to ```policy```
+    (one of ```POLICIES```). An upstream is ejected for ```ejection_time```
+    seconds when ```max_failures``` consecutive requests to it fail or,
+    if ```slow_threshold``` isn't 0, its exponentially weighted latency
+    exceeds ```slow_threshold``` seconds. Once its ejection time is up an
+    upstream is returned to service. If every upstream is ejected requests
+    are spread across all upstreams rather than failing outright.
+
+    Per upstream outstanding request (```<name>.<address>.in_flight```) and
+    latency (```<name>.<address>.latency_ms```) gauges and error
+    (```<name>.<address>.errors```) and ejection
+    (```<name>.<address>.ejections```) counters are maintained in
+    ```yar.util.metrics```."""
+
+    def __init__(self,
+                 name,
+                 addresses,
+                 policy=POLICY_P2C,
+                 max_failures=3,
+                 ejection_time=30,
+                 slow_threshold=0):
+        object.__init__(self)
+
+        self.name = name
+        self.policy = policy
+        self.max_failures = max_failures
+        self.ejection_time = ejection_time
+        self.slow_threshold = slow_threshold
+
+        self.upstreams = []
+        for address in addresses:
+            if address not in [upstream.address for upstream in self.upstreams]:
+                self.upstreams.append(Upstream(name, address))
+
+    def acquire(self, exclude=None):
+        """Choose an upstream for a request and record the request as
+        outstanding. Upstreams in ```exclude``` (typically those that
+        have already been tried for the request) are never chosen. Returns
+        None if there's no upstream to choose. Every upstream returned by
+        ```acquire()``` must be passed to ```release()```."""
+        candidates = [upstream for upstream in self.upstreams if upstream not in (exclude or [])]
+        if not candidates:
+            return None
+
+        now = time.time()
+        healthy_candidates = [upstream for upstream in candidates if not upstream.is_ejected(now)]
+        if healthy_candidates:
+            candidates = healthy_candidates
+        else:
+            metrics.increment("%s.all_ejected" % self.name)
+
+        if self.policy == POLICY_LEAST_OUTSTANDING:
+            # shuffle so ties don't always go to the same upstream
+            random.shuffle(candidates)
+            upstream = min(candidates, key=lambda upstream: upstream.number_outstanding)
+        else:
+            upstream = min(
+                random.sample(candidates, min(2, len(candidates))),
+                key=lambda upstream: upstream.number_outstanding)
+
+        upstream.number_outstanding += 1
+        metrics.gauge(upstream.metric_name("in_flight"), upstream.number_outstanding)
+        return upstream
+
+    def release(self, upstream, is_ok, duration):
+        """Record the outcome of a request to ```upstream``` that
+        took ```duration``` seconds."""
+        upstream.number_outstanding -= 1
+        metrics.gauge(upstream.metric_name("in_flight"), upstream.number_outstanding)
+
+        if not is_ok:
+            metrics.increment(upstream.metric_name("errors"))
+            upstream.consecutive_failures += 1
+            if self.max_failures <= upstream.consecutive_failures:
+                self._eject(upstream, "%d consecutive failures" % upstream.consecutive_failures)
+            return
+
+        upstream.consecutive_failures = 0
+        upstream.update_latency(duration)
+        if 0 < self.slow_threshold < upstream.latency:
+            self._eject(upstream, "latency of %d ms" % int(upstream.latency * 1000))
+
+    def _eject(self, upstream, reason):
+        now = time.time()
+        if upstream.is_ejected(now):
+            return
+
+        _logger.error("Ejecting %s upstream '%s' - %s", self.name, upstream.address, reason)
+        metrics.increment(upstream.metric_name("ejections"))
+        upstream.ejected_until = now + self.ejection_time
+        # once returned to service an upstream starts with a clean slate
+        upstream.consecutive_failures = 0
+        upstream.latency = None
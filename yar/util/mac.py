@@ -3,15 +3,15 @@ used in HTTP MAC access authentication scheme. See [1] for details.
 
 [1] http://tools.ietf.org/html/draft-ietf-oauth-v2-http-mac-01"""
 
+import base64
 import binascii
-import datetime
 import hashlib
 import hmac
 import logging
 import os
 import re
 import requests
-import string
+import time
 import urllib2
 import uuid
 
@@ -57,6 +57,12 @@ class Nonce(str):
 class Timestamp(str):
     """Represents the # of seconds since 1st Jan 1970."""
 
+    """Timestamps only have a resolution of one second so ```generate()```
+    caches the most recently generated timestamp (and the second it
+    represents) in ```_coarse_clock``` and returns the cached timestamp
+    until the clock moves on to the next second."""
+    _coarse_clock = (None, None)
+
     def __new__(cls, ts):
         int(ts)
         return str.__new__(cls, ts)
@@ -64,9 +70,12 @@ class Timestamp(str):
     @classmethod
     def generate(cls):
         """Generate a timestamp. Returns an instance of ```Timestamp```"""
-        epoch = datetime.datetime(1970, 1, 1, 0, 0, 0)
-        ts = int((datetime.datetime.utcnow() - epoch).total_seconds())
-        return cls(ts)
+        now = int(time.time())
+        (second, ts) = cls._coarse_clock
+        if second != now or type(ts) is not cls:
+            ts = cls(now)
+            cls._coarse_clock = (now, ts)
+        return ts
 
 
 class Ext(str):
@@ -100,18 +109,35 @@ class Ext(str):
 
         If ```body``` is None it is assumed to mean that no
         body was supplied in the request."""
-        if content_type is None and body is None:
-            ext = ""
-        else:
-            content_type_plus_body = \
-                (content_type if content_type is not None else "") \
-                + \
-                (body if body is not None else "")
-            content_type_plus_body_hash = hashlib.sha1(content_type_plus_body)
-            print content_type_plus_body
-            ext = content_type_plus_body_hash.hexdigest()
+        ext_hash = ExtHash(content_type)
+        if body is not None:
+            ext_hash.update(body)
+        return ext_hash.ext(cls)
+
+
+class ExtHash(object):
+    """```ExtHash``` generates the same value as ```Ext.generate()```
+    but lets the request body be supplied incrementally, one chunk at
+    a time, as it arrives - see ```Ext.generate()``` for a description
+    of the algorithm. The content type and body are never concatenated
+    so hashing a body requires no more memory than a single chunk."""
+
+    def __init__(self, content_type):
+        object.__init__(self)
+        self._is_empty = content_type is None
+        self._hash = hashlib.sha1(content_type if content_type is not None else "")
+
+    def update(self, body_chunk):
+        """Add ```body_chunk``` to the hash. Calling this method
+        even with an empty chunk indicates a body was supplied
+        in the request."""
+        self._is_empty = False
+        self._hash.update(body_chunk)
 
-        return cls(ext)
+    def ext(self, cls=Ext):
+        """Return the ext for the content type and body chunks
+        supplied so far as an instance of ```cls```."""
+        return cls("" if self._is_empty else self._hash.hexdigest())
 
 
 class NormalizedRequestString(str):
@@ -136,6 +162,11 @@ class NormalizedRequestString(str):
         return cls(normalized_request_string)
 
 
+"""```_mac_key_identifier_reg_ex``` matches the shape of the
+values generated by ```MACKeyIdentifier.generate()```."""
+_mac_key_identifier_reg_ex = re.compile("^[0-9a-f]{32}$")
+
+
 class MACKeyIdentifier(str):
     """This class generates a 32 character random string intend
     for use as a MAC key identifier."""
@@ -143,6 +174,13 @@ class MACKeyIdentifier(str):
     def __new__(cls, mac_key_identifier):
         return str.__new__(cls, mac_key_identifier)
 
+    @classmethod
+    def is_well_formed(cls, value):
+        """Returns True if ```value``` has the shape of a mac key
+        identifier generated by ```generate()```. Anything else can't
+        possibly identify a set of credentials."""
+        return value is not None and _mac_key_identifier_reg_ex.match(value) is not None
+
     @classmethod
     def generate(cls):
         """Generate a mac key identifier. Returns an instance
@@ -158,6 +196,10 @@ class MACKeyIdentifier(str):
         return cls(uuid.uuid4().hex)
 
 
+"""```_mac_key_reg_ex``` is used to validate ```MACKey``` values."""
+_mac_key_reg_ex = re.compile(r"^[0-9a-zA-Z\_\-]{43}$")
+
+
 class MACKey(str):
     """This class generates a 32 character random string intend
     for use as a MAC key."""
@@ -170,7 +212,7 @@ class MACKey(str):
         if value is None:
             return False
         # Uses URL-safe alphabet: - replaces +, _ replaces /.
-        if not re.match("^[0-9a-zA-Z\_\-]{43}$", value):
+        if not _mac_key_reg_ex.match(value):
             return False
         return True
 
@@ -182,6 +224,28 @@ class MACKey(str):
             raise ValueError(msg)
         return str.__new__(cls, value)
 
+    def as_hmac(self, mac_algorithm="hmac-sha-1"):
+        """Return a ```hmac.HMAC``` for ```mac_algorithm``` (one of
+        the keys of ```MAC.digestmods```) keyed with self and ready
+        to be updated with a message. Returns None if ```mac_algorithm```
+        isn't supported. Keying an HMAC means hashing the key into inner
+        and outer hash states. This is done the first time this method
+        is called for ```mac_algorithm``` and the precomputed HMAC is then
+        cached on self so every subsequent call just clones the precomputed
+        states - an ```MACKey``` retained alongside credentials in
+        the auth service's creds cache is therefore keyed only once."""
+        precomputed_hmacs = self.__dict__.setdefault("_precomputed_hmacs", {})
+        precomputed_hmac = precomputed_hmacs.get(mac_algorithm, None)
+        if precomputed_hmac is None:
+            digestmod = MAC.digestmods.get(mac_algorithm, None)
+            if digestmod is None:
+                return None
+            # same decoding keyczar.keys.HmacKey uses for its key string
+            key_bytes = base64.urlsafe_b64decode(self + "=" * (-len(self) % 4))
+            precomputed_hmac = hmac.new(key_bytes, digestmod=digestmod)
+            precomputed_hmacs[mac_algorithm] = precomputed_hmac
+        return precomputed_hmac.copy()
+
     def as_keyczar_hmac_key(self):
         """Decode self into a instance of ```keyczar.keys.HmacKey```."""
         keyczar_hmac_key = keyczar.keys.HmacKey(
@@ -200,9 +264,17 @@ class MAC(str):
     """Implements concept of a message authentication code according to
     http://tools.ietf.org/html/draft-ietf-oauth-v2-http-mac-02"""
 
-    """Name of algorithm used to compute the MAC."""
+    """Name of default algorithm used to compute the MAC."""
     algorithm = "hmac-sha-1"
 
+    """Map of supported algorithm names to the ```hashlib```
+    constructor used to compute the algorithm's HMAC."""
+    digestmods = {
+        "hmac-sha-1": hashlib.sha1,
+        "hmac-sha-256": hashlib.sha256,
+        "hmac-sha-512": hashlib.sha512,
+    }
+
     def __new__(cls, mac):
         return str.__new__(cls, mac)
 
@@ -213,22 +285,42 @@ class MAC(str):
 
         To prevent timing attacks this method is should be instead of
         direct MAC comparision."""
-        keyczar_hmac_key = mac_key.as_keyczar_hmac_key()
         dehexified_self = _dehexify(self)
         if not dehexified_self:
             return False
-        rv = keyczar_hmac_key.Verify(
-            normalized_request_string,
-            dehexified_self)
-        return rv
+        the_hmac = mac_key.as_hmac(mac_algorithm)
+        if the_hmac is None:
+            _logger.info("Unsupported MAC algorithm '%s'", mac_algorithm)
+            return False
+        the_hmac.update(normalized_request_string)
+        return hmac.compare_digest(the_hmac.digest(), dehexified_self)
 
     @classmethod
     def generate(cls, mac_key, mac_algorithm, normalized_request_string):
         """Generate a request's MAC given a normalized request sring (aka
         a summary of the key elements of the request, the mac key and
-        the algorithm."""
-        keyczar_hmac_key = mac_key.as_keyczar_hmac_key()
-        return cls(_hexify(keyczar_hmac_key.Sign(normalized_request_string)))
+        the algorithm. Raises ```ValueError``` if ```mac_algorithm```
+        isn't one of the keys of ```MAC.digestmods```."""
+        the_hmac = mac_key.as_hmac(mac_algorithm)
+        if the_hmac is None:
+            msg = "'mac_algorithm' error: unsupported algorithm '%s'" % mac_algorithm
+            raise ValueError(msg)
+        the_hmac.update(normalized_request_string)
+        return cls(the_hmac.hexdigest())
+
+
+"""```_auth_hdr_val_reg_ex``` is used to parse the value of the
+Authorization HTTP header for the MAC authentication scheme."""
+_auth_hdr_val_reg_ex = re.compile(
+    r'^\s*'
+    r'MAC\s+'
+    r'id\s*\=\s*"(?P<mac_key_identifier>[^"]+)"\s*\,\s*'
+    r'ts\s*\=\s*"(?P<ts>[^"]+)"\s*\,\s*'
+    r'nonce\s*\=\s*"(?P<nonce>[^"]+)"\s*\,\s*'
+    r'ext\s*\=\s*"(?P<ext>[^"]*)"\s*\,\s*'
+    r'mac\s*\=\s*"(?P<mac>[^"]+)"\s*'
+    '$',
+    re.IGNORECASE)
 
 
 class AuthHeaderValue(object):
@@ -262,56 +354,23 @@ class AuthHeaderValue(object):
         if value is None:
             return None
 
-        reg_ex_pattern = (
-            '^\s*'
-            'MAC\s+'
-            'id\s*\=\s*"(?P<mac_key_identifier>[^"]+)"\s*\,\s*'
-            'ts\s*\=\s*"(?P<ts>[^"]+)"\s*\,\s*'
-            'nonce\s*\=\s*"(?P<nonce>[^"]+)"\s*\,\s*'
-            'ext\s*\=\s*"(?P<ext>[^"]*)"\s*\,\s*'
-            'mac\s*\=\s*"(?P<mac>[^"]+)"\s*'
-            '$'
-        )
-        reg_ex = re.compile(reg_ex_pattern, re.IGNORECASE)
-        match = reg_ex.match(value)
+        match = _auth_hdr_val_reg_ex.match(value)
         if not match:
-            _logger.info(
-                "Invalid format for authorization header '%s'",
-                value)
+            _logger.debug("Invalid format for authorization header '%s'", value)
+            return None
+
+        try:
+            ts = Timestamp(match.group("ts"))
+        except ValueError:
+            _logger.debug("Invalid timestamp in authorization header '%s'", value)
             return None
-        _logger.info(
-            "Valid format for authorization header '%s'",
-            value)
-
-        assert 0 == match.start()
-        assert len(value) == match.end()
-        assert 5 == len(match.groups())
-
-        mac_key_identifier = match.group("mac_key_identifier")
-        assert mac_key_identifier
-        assert 0 < len(mac_key_identifier)
-
-        ts = match.group("ts")
-        assert ts
-        assert 0 < len(ts)
-        ts = Timestamp(ts)
-
-        nonce = match.group("nonce")
-        assert nonce
-        assert 0 < len(nonce)
-        nonce = Nonce(nonce)
-
-        ext = match.group("ext")
-        assert ext is not None
-        assert 0 <= len(ext)
-        ext = Ext(ext)
-
-        mac = match.group("mac")
-        assert mac
-        assert 0 < len(mac)
-        mac = MAC(mac)
-
-        return cls(mac_key_identifier, ts, nonce, ext, mac)
+
+        return cls(
+            match.group("mac_key_identifier"),
+            ts,
+            Nonce(match.group("nonce")),
+            Ext(match.group("ext")),
+            MAC(match.group("mac")))
 
 
 class RequestsAuth(requests.auth.AuthBase):
@@ -0,0 +1,136 @@
+"""This module is a microbenchmark which compares the # of MAC
+verifications per second using the original keyczar based
+verification (a ```keyczar.keys.HmacKey``` is created and keyed
+for every verification) with ```yar.util.mac.MAC.verify()```
+which clones a per key precomputed HMAC. It then reports the
+throughput of each of ```yar.util.mac.MAC.digestmods```'s
+algorithms signing and verifying messages the size of a typical
+normalized request string (header) and of typical request bodies.
+Run it using something like:
+
+    python -m yar.util.mac_benchmark --verifications=100000
+"""
+
+import optparse
+import time
+
+from yar.util import mac
+
+
+def _keyczar_verify(the_mac, mac_key, normalized_request_string):
+    """The keyczar based implementation of ```MAC.verify()```."""
+    keyczar_hmac_key = mac_key.as_keyczar_hmac_key()
+    dehexified_mac = mac._dehexify(the_mac)
+    if not dehexified_mac:
+        return False
+    return keyczar_hmac_key.Verify(normalized_request_string, dehexified_mac)
+
+
+def _precomputed_verify(the_mac, mac_key, normalized_request_string):
+    return the_mac.verify(mac_key, mac.MAC.algorithm, normalized_request_string)
+
+
+def _verifications_per_second(verify, number_verifications, number_keys):
+    """Time ```number_verifications``` calls to ```verify```. Requests
+    are spread across ```number_keys``` different mac keys to mimic a
+    creds cache holding ```number_keys``` sets of credentials."""
+    requests = []
+    for i in range(number_keys):
+        mac_key = mac.MACKey.generate()
+        normalized_request_string = mac.NormalizedRequestString.generate(
+            mac.Timestamp.generate(),
+            mac.Nonce.generate(),
+            "GET",
+            "/dave.html",
+            "127.0.0.1",
+            8000,
+            mac.Ext.generate(None, None))
+        the_mac = mac.MAC.generate(mac_key, mac.MAC.algorithm, normalized_request_string)
+        requests.append((the_mac, mac_key, normalized_request_string))
+
+    start_time = time.time()
+    for i in xrange(number_verifications):
+        (the_mac, mac_key, normalized_request_string) = requests[i % number_keys]
+        assert verify(the_mac, mac_key, normalized_request_string)
+    return number_verifications / (time.time() - start_time)
+
+
+def _algorithm_throughput(mac_algorithm, message_size, number_operations):
+    """Time ```number_operations``` generate + verify pairs for
+    ```mac_algorithm``` on a message of ```message_size``` bytes.
+    Returns a (operations per second, MB per second) tuple."""
+    mac_key = mac.MACKey.generate()
+    message = "x" * message_size
+
+    start_time = time.time()
+    for i in xrange(number_operations):
+        the_mac = mac.MAC.generate(mac_key, mac_algorithm, message)
+        assert the_mac.verify(mac_key, mac_algorithm, message)
+    duration = time.time() - start_time
+
+    operations_per_second = number_operations / duration
+    mb_per_second = 2 * operations_per_second * message_size / (1024.0 * 1024.0)
+    return (operations_per_second, mb_per_second)
+
+
+class _CommandLineParser(optparse.OptionParser):
+
+    def __init__(self):
+        optparse.OptionParser.__init__(self, "usage: %prog [options]")
+
+        default = 100000
+        help = "# of verifications - default = %d" % default
+        self.add_option(
+            "--verifications",
+            action="store",
+            dest="number_verifications",
+            default=default,
+            type=int,
+            help=help)
+
+        default = 100
+        help = "# of different mac keys - default = %d" % default
+        self.add_option(
+            "--keys",
+            action="store",
+            dest="number_keys",
+            default=default,
+            type=int,
+            help=help)
+
+        default = "150,1024,65536"
+        help = "comma separated message sizes (bytes) - default = %s" % default
+        self.add_option(
+            "--sizes",
+            action="store",
+            dest="sizes",
+            default=default,
+            type="string",
+            help=help)
+
+
+if __name__ == "__main__":
+    clp = _CommandLineParser()
+    (clo, cla) = clp.parse_args()
+
+    for (name, verify) in [("keyczar", _keyczar_verify), ("precomputed", _precomputed_verify)]:
+        verifications_per_second = _verifications_per_second(
+            verify,
+            clo.number_verifications,
+            clo.number_keys)
+        print "%-12s %10.0f verifications/sec" % (name, verifications_per_second)
+
+    print ""
+    print "%-14s %10s %12s %10s" % ("algorithm", "bytes", "ops/sec", "MB/sec")
+    for mac_algorithm in sorted(mac.MAC.digestmods.keys()):
+        for message_size in [int(size) for size in clo.sizes.split(",")]:
+            number_operations = max(clo.number_verifications * 150 / max(message_size, 150), 100)
+            (operations_per_second, mb_per_second) = _algorithm_throughput(
+                mac_algorithm,
+                message_size,
+                number_operations)
+            print "%-14s %10d %12.0f %10.1f" % (
+                mac_algorithm,
+                message_size,
+                operations_per_second,
+                mb_per_second)
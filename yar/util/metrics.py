@@ -0,0 +1,64 @@
+"""This module implements a super simple, in-process registry of
+counters and gauges. yar servers record operational metrics (cache
+hit rates, error counts, etc) here and the server's mainline
+periodically writes a snapshot of all metrics to the logging
+infrastructure. Using the logging infrastructure is consistent with
+how the load testing infrastructure already scrapes timing information
+from yar's logs."""
+
+import logging
+
+_logger = logging.getLogger("UTIL.%s" % __name__)
+
+"""```_counters``` maps a counter's name to the counter's current
+value. Counters only ever go up (until ```reset()``` is called)."""
+_counters = {}
+
+"""```_gauges``` maps a gauge's name to the gauge's most recently
+reported value."""
+_gauges = {}
+
+
+def increment(name, amount=1):
+    """Add ```amount``` to the counter called ```name```."""
+    _counters[name] = _counters.get(name, 0) + amount
+
+
+def gauge(name, value):
+    """Set the gauge called ```name``` to ```value```."""
+    _gauges[name] = value
+
+
+def counter(name):
+    """Return the current value of the counter called ```name```."""
+    return _counters.get(name, 0)
+
+
+def get_gauge(name, value_if_not_found=None):
+    """Return the current value of the gauge called ```name```."""
+    return _gauges.get(name, value_if_not_found)
+
+
+def snapshot():
+    """Return a dict containing the current value of every
+    counter and gauge."""
+    rv = dict(_counters)
+    rv.update(_gauges)
+    return rv
+
+
+def reset():
+    """Forget about all counters and gauges. Really only useful
+    for unit tests."""
+    _counters.clear()
+    _gauges.clear()
+
+
+def log_snapshot():
+    """Write the current value of every counter and gauge to the
+    logging infrastructure.
+
+    :TRICKY: Need to be careful about changing this message format
+    because it is intended to be scraped by tools that process logs."""
+    for (name, value) in sorted(snapshot().items()):
+        _logger.info("Metric '%s' = %s", name, value)
@@ -0,0 +1,456 @@
+"""This module contains the HTTP client used for all of yar's
+outbound HTTP requests - auth service to key service, auth service
+to app service and key service to key store. Unlike tornado's default
+client, connections to each upstream (an address - see
+```yar.util.transport```) are pooled and kept alive between requests
+so, once a pool is warm, establishing a connection disappears from
+the per-request latency profile. Each pool also caps the # of
+concurrent requests to its upstream.
+
+To have every ```tornado.httpclient.AsyncHTTPClient()``` use this
+client a server's mainline does something like:
+
+    tornado.httpclient.AsyncHTTPClient.configure(
+        pooled_http_client.PooledAsyncHTTPClient)
+
+Upstreams listening on unix domain sockets are reached using
+"http+unix" urls - see ```url()```.
+
+Only the plain HTTP that yar's hops use is supported. Requests for
+any other kind of url (https for example) fail with a 599 response
+whose error is a ```ValueError``` and redirects are never followed -
+a request which allows redirects and gets one also fails that way.
+"""
+
+import collections
+import cStringIO
+import functools
+import logging
+import time
+import urllib
+import urlparse
+import weakref
+
+import tornado.concurrent
+import tornado.gen
+import tornado.http1connection
+import tornado.httpclient
+import tornado.httputil
+import tornado.ioloop
+import tornado.iostream
+
+from yar.util import metrics
+from yar.util import transport
+
+_logger = logging.getLogger("UTIL.%s" % __name__)
+
+"""Each upstream has at most ```max_connections_per_upstream```
+connections. Once they're all in use new requests to the upstream
+wait until a connection is released."""
+max_connections_per_upstream = 10
+
+"""Connections which have been idle for more than ```idle_timeout```
+seconds are closed rather than reused. This should be shorter than
+the upstreams' own keep-alive timeouts."""
+idle_timeout = 30
+
+"""# of seconds to wait for a connection to an upstream to be
+established. Used when a request doesn't specify its own."""
+connect_timeout = 20
+
+"""# of seconds to wait for an entire request to complete, including
+time spent waiting for a connection from the pool. Used when a request
+doesn't specify its own. 0 means no timeout."""
+request_timeout = 20
+
+"""Requests using these methods can be safely resent on a new
+connection if a kept alive connection turns out to have been closed
+by the upstream before the request's response has started to arrive -
+see RFC 7230 section 6.3.1."""
+_idempotent_methods = frozenset(["GET", "HEAD", "OPTIONS", "PUT", "DELETE"])
+
+"""Responses with these status codes are redirects which tornado's
+default client would follow if the request allows it."""
+_redirect_codes = frozenset([301, 302, 303, 307, 308])
+
+"""```_connection_pools``` maps an IOLoop to a dict which maps
+addresses to ```ConnectionPool``` instances."""
+_connection_pools = weakref.WeakKeyDictionary()
+
+
+def url(address, path):
+    """Returns the url for ```path``` (which must start with a "/")
+    on the upstream at ```address``` - either host:port or the path
+    of a unix domain socket. A unix domain socket's path is percent
+    encoded to form the url's netloc - "http+unix://%2Ftmp%2Fks.sock/"."""
+    if transport.is_unix_domain_socket(address):
+        return "http+unix://%s%s" % (urllib.quote(address, safe=""), path)
+    return "http://%s%s" % (address, path)
+
+
+def get_connection_pool(address, io_loop=None):
+    """Returns the ```ConnectionPool``` for ```address``` creating
+    the pool if it doesn't already exist."""
+    io_loop = io_loop or tornado.ioloop.IOLoop.current()
+    connection_pools = _connection_pools.setdefault(io_loop, {})
+    connection_pool = connection_pools.get(address, None)
+    if connection_pool is None:
+        connection_pool = ConnectionPool(address, io_loop)
+        connection_pools[address] = connection_pool
+    return connection_pool
+
+
+def is_idempotent(method):
+    """Returns True if requests using ```method``` can be resent."""
+    return method in _idempotent_methods
+
+
+def _error_response(request, error):
+    """Returns the 599 response for ```request``` failing with ```error```."""
+    return tornado.httpclient.HTTPResponse(
+        getattr(request, "original_request", request),
+        599,
+        error=error,
+        request_time=time.time() - request.start_time)
+
+
+class ConnectionPool(object):
+    """A pool of kept alive connections to a single upstream. A
+    connection is either in use, idle or being established - the
+    total is never more than ```max_connections_per_upstream```."""
+
+    def __init__(self, address, io_loop):
+        object.__init__(self)
+
+        self.address = address
+        self._io_loop = io_loop
+
+        # most recently released connections are at the end of
+        # ```_idle``` and are reused first - they're the least
+        # likely to have been closed by the upstream
+        self._idle = []
+        self._number_in_use = 0
+        self._waiters = collections.deque()
+
+    def metric_name(self, name):
+        return "http_connection_pool.%s.%s" % (self.address, name)
+
+    def _update_occupancy_metrics(self):
+        metrics.gauge(self.metric_name("in_use"), self._number_in_use)
+        metrics.gauge(self.metric_name("idle"), len(self._idle))
+        metrics.gauge(self.metric_name("waiting"), len(self._waiters))
+
+    @tornado.gen.coroutine
+    def acquire(self, connect_timeout, deadline=None):
+        """Async'ly returns a (```tornado.iostream.IOStream```, is reused)
+        tuple. The stream must be returned to the pool using ```release()```.
+        ```deadline``` is an IOLoop time after which waiting for a
+        connection fails with a ```tornado.gen.TimeoutError```."""
+        if max_connections_per_upstream <= self._number_in_use:
+            yield self._wait(deadline)
+        else:
+            self._number_in_use += 1
+
+        stream = self._pop_idle()
+        if stream is not None:
+            metrics.increment(self.metric_name("reuses"))
+            self._update_occupancy_metrics()
+            raise tornado.gen.Return((stream, True))
+
+        timeout = self._io_loop.time() + connect_timeout
+        if deadline is not None:
+            timeout = min(timeout, deadline)
+        try:
+            stream = yield tornado.gen.with_timeout(
+                timeout,
+                transport.connect(self.address, self._io_loop),
+                io_loop=self._io_loop,
+                quiet_exceptions=(tornado.iostream.StreamClosedError,))
+        except Exception:
+            metrics.increment(self.metric_name("connect_errors"))
+            self._release_slot()
+            raise
+
+        metrics.increment(self.metric_name("connects"))
+        self._update_occupancy_metrics()
+        raise tornado.gen.Return((stream, False))
+
+    @tornado.gen.coroutine
+    def _wait(self, deadline):
+        """Wait for another request to release its connection. A
+        released connection's slot is handed directly to the waiter
+        so ```_number_in_use``` doesn't change."""
+        start_time = time.time()
+        waiter = tornado.concurrent.Future()
+        self._waiters.append(waiter)
+        metrics.increment(self.metric_name("waits"))
+        self._update_occupancy_metrics()
+
+        try:
+            if deadline is None:
+                yield waiter
+            else:
+                yield tornado.gen.with_timeout(deadline, waiter, io_loop=self._io_loop)
+        except tornado.gen.TimeoutError:
+            metrics.increment(self.metric_name("wait_timeouts"))
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            else:
+                # the slot was handed over just as the wait timed out
+                self._release_slot()
+            self._update_occupancy_metrics()
+            raise
+        finally:
+            metrics.gauge(self.metric_name("wait_ms"), int((time.time() - start_time) * 1000))
+
+    def _pop_idle(self):
+        """Returns the most recently released idle connection which is
+        still open and hasn't been idle for too long or None if there's
+        no such connection."""
+        now = self._io_loop.time()
+        while self._idle:
+            (stream, idle_since) = self._idle.pop()
+            stream.set_close_callback(None)
+            if stream.closed():
+                continue
+            if idle_timeout < now - idle_since:
+                stream.close()
+                continue
+            return stream
+        return None
+
+    def release(self, stream, is_reusable):
+        """Return ```stream``` to the pool. If ```is_reusable``` is
+        False the stream is closed rather than being kept alive."""
+        now = self._io_loop.time()
+
+        # the least recently released connections are the
+        # first to have been idle for too long
+        while self._idle and idle_timeout < now - self._idle[0][1]:
+            (idle_stream, idle_since) = self._idle.pop(0)
+            idle_stream.set_close_callback(None)
+            idle_stream.close()
+
+        if is_reusable and not stream.closed():
+            self._idle.append((stream, now))
+            # the upstream is free to close an idle connection
+            # so get rid of the connection as soon as it does
+            stream.set_close_callback(lambda: self._on_idle_closed(stream))
+        else:
+            stream.close()
+        self._release_slot()
+
+    def _on_idle_closed(self, stream):
+        self._idle = [(s, idle_since) for (s, idle_since) in self._idle if s is not stream]
+        self._update_occupancy_metrics()
+
+    def _release_slot(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                self._update_occupancy_metrics()
+                return
+        self._number_in_use -= 1
+        self._update_occupancy_metrics()
+
+
+class ResponseDelegate(tornado.httputil.HTTPMessageDelegate):
+    """Wraps another ```tornado.httputil.HTTPMessageDelegate```
+    recording the response's start line and headers so it's possible
+    to determine if the connection can be kept alive. 1xx responses
+    are informational, only ever precede the real response and are
+    not passed along."""
+
+    def __init__(self, delegate):
+        tornado.httputil.HTTPMessageDelegate.__init__(self)
+        self._delegate = delegate
+        self.start_line = None
+        self.headers = None
+        self.is_finished = False
+
+    def headers_received(self, start_line, headers):
+        if 100 <= start_line.code < 200:
+            return None
+        self.start_line = start_line
+        self.headers = headers
+        return self._delegate.headers_received(start_line, headers)
+
+    def data_received(self, chunk):
+        return self._delegate.data_received(chunk)
+
+    def finish(self):
+        self.is_finished = True
+        self._delegate.finish()
+
+    def on_connection_close(self):
+        self._delegate.on_connection_close()
+
+    def is_keep_alive(self):
+        """Returns True if the response said the connection
+        it arrived on can be used for another request."""
+        if not self.is_finished:
+            return False
+        connection_header = self.headers.get("Connection", "").lower()
+        if self.start_line.version == "HTTP/1.1":
+            return connection_header != "close"
+        return connection_header == "keep-alive"
+
+
+@tornado.gen.coroutine
+def exchange(connection, start_line, headers, body, body_producer, delegate):
+    """Write a request to ```connection``` (a client side
+    ```tornado.http1connection.HTTP1Connection```) and then read the
+    response using ```delegate``` (a ```ResponseDelegate```). Async'ly
+    returns True if the connection's stream can be reused."""
+    connection.write_headers(start_line, headers)
+    if body_producer is not None:
+        yield body_producer(connection.write)
+    elif body:
+        yield connection.write(body)
+    connection.finish()
+
+    is_ok = yield connection.read_response(delegate)
+    if not is_ok or not delegate.is_finished:
+        raise tornado.httputil.HTTPInputError("Incomplete response")
+
+    stream = connection.stream
+    raise tornado.gen.Return(
+        stream is not None and not stream.closed() and delegate.is_keep_alive())
+
+
+class _BufferingDelegate(tornado.httputil.HTTPMessageDelegate):
+    """Reads an entire response into memory."""
+
+    def __init__(self):
+        tornado.httputil.HTTPMessageDelegate.__init__(self)
+        self.chunks = []
+
+    def data_received(self, chunk):
+        self.chunks.append(chunk)
+
+
+class PooledAsyncHTTPClient(tornado.httpclient.AsyncHTTPClient):
+    """An ```tornado.httpclient.AsyncHTTPClient``` which sends requests
+    on connections from per upstream ```ConnectionPool```s. Only plain
+    HTTP, over TCP or a unix domain socket, is supported and redirects
+    are never followed."""
+
+    def initialize(self, io_loop, defaults=None):
+        all_defaults = {
+            "connect_timeout": connect_timeout,
+            "request_timeout": request_timeout or None,
+        }
+        all_defaults.update(defaults or {})
+        tornado.httpclient.AsyncHTTPClient.initialize(self, io_loop, defaults=all_defaults)
+
+    def fetch_impl(self, request, callback):
+        future = self._fetch(request)
+        self.io_loop.add_future(future, functools.partial(self._on_fetch_done, request, callback))
+
+    def _on_fetch_done(self, request, callback, future):
+        """```_fetch()``` turns all the errors it expects into responses
+        but, whatever happens, ```callback``` must be called with a
+        response or the caller waits forever."""
+        if future.exception() is not None:
+            _logger.error("Unexpected error fetching '%s' - %s", request.url, future.exception())
+            callback(_error_response(request, future.exception()))
+            return
+        callback(future.result())
+
+    @tornado.gen.coroutine
+    def _fetch(self, request):
+        original_request = getattr(request, "original_request", request)
+
+        error_response = functools.partial(_error_response, request)
+
+        url = urlparse.urlsplit(request.url)
+        if url.scheme == "http" and url.hostname:
+            address = "%s:%d" % (url.hostname, url.port or 80)
+            host = url.netloc
+        elif url.scheme == "http+unix" and transport.is_unix_domain_socket(urllib.unquote(url.netloc)):
+            address = urllib.unquote(url.netloc)
+            host = "localhost"
+        else:
+            msg = "Unsupported url '%s' - only http and http+unix urls are supported" % request.url
+            raise tornado.gen.Return(error_response(ValueError(msg)))
+        connection_pool = get_connection_pool(address, self.io_loop)
+
+        headers = tornado.httputil.HTTPHeaders(request.headers)
+        if "Host" not in headers:
+            headers["Host"] = host
+        if request.user_agent:
+            headers["User-Agent"] = request.user_agent
+        if request.decompress_response and "Accept-Encoding" not in headers:
+            headers["Accept-Encoding"] = "gzip"
+        body = request.body
+        if request.body_producer is None:
+            headers["Content-Length"] = str(len(body or ""))
+
+        path = url.path or "/"
+        if url.query:
+            path = "%s?%s" % (path, url.query)
+        start_line = tornado.httputil.RequestStartLine(request.method, path, "HTTP/1.1")
+
+        params = tornado.http1connection.HTTP1ConnectionParameters(
+            decompress=request.decompress_response)
+
+        # a request's own timeout of 0 or less means it has already run
+        # out of time (typically its deadline has passed) rather than it
+        # has no timeout so it fails without being sent
+        deadline = None
+        if request.request_timeout is not None:
+            if request.request_timeout <= 0:
+                raise tornado.gen.Return(error_response(tornado.httpclient.HTTPError(599, "Timeout")))
+            deadline = self.io_loop.time() + request.request_timeout
+
+        while True:
+            try:
+                (stream, is_reused) = yield connection_pool.acquire(request.connect_timeout, deadline)
+            except tornado.gen.TimeoutError:
+                raise tornado.gen.Return(error_response(tornado.httpclient.HTTPError(599, "Timeout")))
+            except Exception as ex:
+                raise tornado.gen.Return(error_response(ex))
+
+            connection = tornado.http1connection.HTTP1Connection(stream, True, params)
+            buffering_delegate = _BufferingDelegate()
+            delegate = ResponseDelegate(buffering_delegate)
+            try:
+                future = exchange(connection, start_line, headers, body, request.body_producer, delegate)
+                if deadline is not None:
+                    future = tornado.gen.with_timeout(
+                        deadline,
+                        future,
+                        io_loop=self.io_loop,
+                        quiet_exceptions=(tornado.iostream.StreamClosedError, tornado.httputil.HTTPInputError))
+                is_reusable = yield future
+            except tornado.gen.TimeoutError:
+                connection.close()
+                connection_pool.release(stream, False)
+                raise tornado.gen.Return(error_response(tornado.httpclient.HTTPError(599, "Timeout")))
+            except tornado.iostream.StreamClosedError as ex:
+                connection_pool.release(stream, False)
+                if is_reused and delegate.start_line is None and is_idempotent(request.method):
+                    _logger.info("Kept alive connection to '%s' closed - resending request", address)
+                    continue
+                raise tornado.gen.Return(error_response(ex))
+            except Exception as ex:
+                connection.close()
+                connection_pool.release(stream, False)
+                raise tornado.gen.Return(error_response(ex))
+
+            connection_pool.release(stream, is_reusable)
+
+            if request.follow_redirects and delegate.start_line.code in _redirect_codes:
+                msg = "Redirect from '%s' not followed - redirects aren't supported" % request.url
+                raise tornado.gen.Return(error_response(ValueError(msg)))
+
+            response = tornado.httpclient.HTTPResponse(
+                original_request,
+                delegate.start_line.code,
+                reason=delegate.start_line.reason,
+                headers=delegate.headers,
+                buffer=cStringIO.StringIO("".join(buffering_delegate.chunks)),
+                effective_url=request.url,
+                request_time=time.time() - request.start_time)
+            raise tornado.gen.Return(response)
@@ -19,3 +19,11 @@ class APIKeyTestCase(unittest.TestCase):
         api_key = APIKey(content)
         self.assertIsNotNone(api_key)
         self.assertEqual(api_key, content)
+
+    def test_is_well_formed(self):
+        self.assertTrue(APIKey.is_well_formed(APIKey.generate()))
+        self.assertFalse(APIKey.is_well_formed(None))
+        self.assertFalse(APIKey.is_well_formed(""))
+        self.assertFalse(APIKey.is_well_formed("dave was here"))
+        self.assertFalse(APIKey.is_well_formed(APIKey.generate().upper()))
+        self.assertFalse(APIKey.is_well_formed(APIKey.generate()[1:]))
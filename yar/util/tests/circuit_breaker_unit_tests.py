@@ -0,0 +1,68 @@
+"""This module contains unit tests for the util's circuit_breaker module."""
+
+import unittest
+
+import mock
+
+from yar.util import circuit_breaker
+from yar.util import metrics
+
+
+class CircuitBreakerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+
+    def test_trips_after_consecutive_failures(self):
+        breaker = circuit_breaker.CircuitBreaker("dave", failure_threshold=3, reset_timeout=10)
+        self.assertEqual(breaker.state, circuit_breaker.STATE_CLOSED)
+
+        breaker.on_failure()
+        breaker.on_failure()
+        breaker.on_success()
+        breaker.on_failure()
+        breaker.on_failure()
+        self.assertEqual(breaker.state, circuit_breaker.STATE_CLOSED)
+        self.assertTrue(breaker.allow_request())
+
+        breaker.on_failure()
+        self.assertEqual(breaker.state, circuit_breaker.STATE_OPEN)
+        self.assertFalse(breaker.allow_request())
+        self.assertEqual(metrics.counter("dave.breaker_trips"), 1)
+        self.assertEqual(metrics.get_gauge("dave.breaker_state"), circuit_breaker.STATE_OPEN)
+
+    def test_half_open_trial_succeeds(self):
+        with mock.patch("time.time", return_value=100.0) as time_patch:
+            breaker = circuit_breaker.CircuitBreaker("dave", failure_threshold=1, reset_timeout=10)
+            breaker.on_failure()
+            self.assertFalse(breaker.allow_request())
+
+            time_patch.return_value = 110.0
+            self.assertEqual(breaker.state, circuit_breaker.STATE_HALF_OPEN)
+            # only a single trial request is allowed
+            self.assertTrue(breaker.allow_request())
+            self.assertFalse(breaker.allow_request())
+
+            breaker.on_success()
+            self.assertEqual(breaker.state, circuit_breaker.STATE_CLOSED)
+            self.assertTrue(breaker.allow_request())
+            self.assertTrue(breaker.allow_request())
+            self.assertEqual(metrics.get_gauge("dave.breaker_state"), circuit_breaker.STATE_CLOSED)
+
+    def test_half_open_trial_fails(self):
+        with mock.patch("time.time", return_value=100.0) as time_patch:
+            breaker = circuit_breaker.CircuitBreaker("dave", failure_threshold=2, reset_timeout=10)
+            breaker.on_failure()
+            breaker.on_failure()
+
+            time_patch.return_value = 115.0
+            self.assertTrue(breaker.allow_request())
+            breaker.on_failure()
+            self.assertEqual(breaker.state, circuit_breaker.STATE_OPEN)
+            self.assertEqual(metrics.counter("dave.breaker_trips"), 2)
+
+            # the reset timeout starts again from the failed trial
+            time_patch.return_value = 120.0
+            self.assertFalse(breaker.allow_request())
+            time_patch.return_value = 125.0
+            self.assertTrue(breaker.allow_request())
@@ -20,12 +20,16 @@ class TestCase(unittest.TestCase):
         values = [
             ["bindle:8909/berry", "bindle:8909/berry"],
             ["b:8/y", "b:8/y"],
+            ["/var/run/couchdb.sock:creds", "/var/run/couchdb.sock:creds"],
 
             ["dave", None],
             ["dave:89", None],
             ["89/", None],
             ["dave:89/", None],
             ["89/y", None],
+            ["/var/run/couchdb.sock", None],
+            ["/var/run/couchdb.sock:", None],
+            ["var/run/couchdb.sock:creds", None],
         ]
         type_checker = clparserutil.Option.TYPE_CHECKER["couchdb"]
         self.assertIsNotNone(type_checker)
@@ -249,6 +253,7 @@ class TestCase(unittest.TestCase):
         values = [
             ["/dev/log", "/dev/log"],
             ["/var/run/syslog", "/var/run/syslog"],
+            ["/var/run/yar/key_service-1.sock", "/var/run/yar/key_service-1.sock"],
 
             ["dev/log", None],
             ["", None],
@@ -264,3 +269,89 @@ class TestCase(unittest.TestCase):
             else:
                 with self.assertRaises(optparse.OptionValueError):
                     type_checker(option, opt_string, value[0])
+
+    def test_check_address(self):
+        option = clparserutil.Option(
+            "--keyservice",
+            action="store",
+            dest="key_service",
+            default="127.0.0.1:8070",
+            type="address",
+            help="whatever")
+        values = [
+            ["bindle:8909", "bindle:8909"],
+            ["/var/run/key_service.sock", "/var/run/key_service.sock"],
+            [" /var/run/key_service.sock ", "/var/run/key_service.sock"],
+
+            ["dave", None],
+            ["89", None],
+            [":89", None],
+            ["var/run/key_service.sock", None],
+        ]
+        type_checker = clparserutil.Option.TYPE_CHECKER["address"]
+        opt_string = option.get_opt_string()
+        for value in values:
+            if value[1] is not None:
+                msg = "Failed to parse '%s' correctly." % value[0]
+                result = type_checker(option, opt_string, value[0])
+                self.assertEqual(result, value[1], msg)
+            else:
+                with self.assertRaises(optparse.OptionValueError):
+                    type_checker(option, opt_string, value[0])
+
+    def test_check_address_parsed(self):
+        option = clparserutil.Option(
+            "--lon",
+            action="store",
+            dest="listen_on",
+            default="127.0.0.1:8000",
+            type="addressparsed",
+            help="whatever")
+        values = [
+            ["bindle:8909", ("bindle", 8909)],
+            ["/var/run/auth_service.sock", "/var/run/auth_service.sock"],
+
+            ["dave", None],
+            ["89", None],
+        ]
+        type_checker = clparserutil.Option.TYPE_CHECKER["addressparsed"]
+        opt_string = option.get_opt_string()
+        for value in values:
+            if value[1] is not None:
+                msg = "Failed to parse '%s' correctly." % value[0]
+                result = type_checker(option, opt_string, value[0])
+                self.assertEqual(result, value[1], msg)
+            else:
+                with self.assertRaises(optparse.OptionValueError):
+                    type_checker(option, opt_string, value[0])
+
+    def test_check_addresses(self):
+        option = clparserutil.Option(
+            "--noncestore",
+            action="store",
+            dest="nonce_store",
+            default="127.0.0.1:11211",
+            type="addresses",
+            help="whatever")
+        values = [
+            ["bindle:8909", ["bindle:8909"]],
+            ["b:8, c:89, /tmp/m.sock", ["b:8", "c:89", "/tmp/m.sock"]],
+            ["/tmp/m1.sock ,/tmp/m2.sock", ["/tmp/m1.sock", "/tmp/m2.sock"]],
+
+            ["dave", None],
+            [":89", None],
+            ["89", None],
+            ["b:8, 89", None],
+            ["dave:89, ", None],
+            ["dave:89, tmp/m.sock", None],
+        ]
+        type_checker = clparserutil.Option.TYPE_CHECKER["addresses"]
+        opt_string = option.get_opt_string()
+        for value in values:
+            if value[1] is not None:
+                msg = "Failed to parse '%s' correctly." % value[0]
+                result = type_checker(option, opt_string, value[0])
+                self.assertEqual(result, value[1], msg)
+            else:
+                with self.assertRaises(optparse.OptionValueError):
+                    type_checker(option, opt_string, value[0])
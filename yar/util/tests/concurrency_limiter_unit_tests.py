@@ -0,0 +1,149 @@
+"""This module contains unit tests for the util's concurrency_limiter module."""
+
+import unittest
+
+import mock
+import tornado.testing
+
+from yar.util import concurrency_limiter
+from yar.util import metrics
+
+
+class ConcurrencyLimiterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        self.admissions = []
+
+    def _on_admitted(self, is_admitted):
+        self.admissions.append(is_admitted)
+
+    def test_shed_over_limit(self):
+        limiter = concurrency_limiter.ConcurrencyLimiter("dave", initial_limit=2)
+        for i in range(3):
+            limiter.acquire(self._on_admitted)
+        self.assertEqual(self.admissions, [True, True, False])
+        self.assertEqual(limiter.in_flight, 2)
+        self.assertEqual(metrics.counter("dave.shed"), 1)
+        self.assertEqual(metrics.get_gauge("dave.in_flight"), 2)
+        self.assertEqual(metrics.get_gauge("dave.limit"), 2)
+
+        limiter.release(True)
+        limiter.acquire(self._on_admitted)
+        self.assertEqual(self.admissions, [True, True, False, True])
+
+    def test_queued_until_release(self):
+        io_loop = mock.Mock()
+        io_loop.time.return_value = 0
+        with mock.patch("tornado.ioloop.IOLoop.current", return_value=io_loop):
+            limiter = concurrency_limiter.ConcurrencyLimiter(
+                "dave",
+                initial_limit=1,
+                max_queue_size=1)
+            limiter.acquire(self._on_admitted)
+            limiter.acquire(self._on_admitted)
+            limiter.acquire(self._on_admitted)
+            self.assertEqual(self.admissions, [True, False])
+            self.assertEqual(metrics.counter("dave.queued"), 1)
+
+            limiter.release(True)
+            self.assertEqual(self.admissions, [True, False, True])
+            self.assertEqual(limiter.in_flight, 1)
+            self.assertTrue(io_loop.remove_timeout.called)
+            self.assertIsNotNone(metrics.get_gauge("dave.queue_time_ms"))
+
+    def test_aimd(self):
+        limiter = concurrency_limiter.ConcurrencyLimiter(
+            "dave",
+            policy=concurrency_limiter.POLICY_AIMD,
+            initial_limit=10,
+            max_limit=11,
+            latency_threshold=0.5)
+
+        # the limit only grows when it's being used
+        limiter.acquire(self._on_admitted)
+        limiter.release(True, 0.01)
+        self.assertEqual(limiter.limit, 10)
+
+        for i in range(5):
+            limiter.acquire(self._on_admitted)
+        for i in range(3):
+            limiter.release(True, 0.01)
+        self.assertEqual(limiter.limit, 11)
+
+        limiter.release(True, 1.0)
+        self.assertEqual(limiter.limit, 9)
+        limiter.release(False, 0.01)
+        self.assertEqual(limiter.limit, 8)
+        self.assertEqual(metrics.get_gauge("dave.limit"), 8)
+
+    def test_gradient(self):
+        limiter = concurrency_limiter.ConcurrencyLimiter(
+            "dave",
+            policy=concurrency_limiter.POLICY_GRADIENT,
+            initial_limit=20)
+
+        # steady latency with the limit in use grows the limit
+        for i in range(50):
+            limiter.acquire(self._on_admitted)
+            limiter.in_flight = limiter.limit
+            limiter.release(True, 0.01)
+        grown_limit = limiter.limit
+        self.assertTrue(20 < grown_limit)
+
+        # latency climbing well above the no load latency shrinks it
+        for i in range(50):
+            limiter.acquire(self._on_admitted)
+            limiter.release(True, 0.1)
+        self.assertTrue(limiter.limit < grown_limit)
+
+        limit = limiter.limit
+        limiter.acquire(self._on_admitted)
+        limiter.release(False, 0.1)
+        self.assertTrue(limiter.limit < limit)
+
+    def test_limit_bounds(self):
+        limiter = concurrency_limiter.ConcurrencyLimiter(
+            "dave",
+            policy=concurrency_limiter.POLICY_AIMD,
+            initial_limit=5,
+            min_limit=4,
+            max_limit=6)
+        for i in range(10):
+            limiter.acquire(self._on_admitted)
+            limiter.release(False, 0.01)
+        self.assertEqual(limiter.limit, 4)
+        for i in range(10):
+            limiter.acquire(self._on_admitted)
+            limiter.in_flight = limiter.limit
+            limiter.release(True, 0.01)
+        self.assertEqual(limiter.limit, 6)
+
+
+class ConcurrencyLimiterQueueTimeoutTestCase(tornado.testing.AsyncTestCase):
+
+    def test_queue_timeout(self):
+        metrics.reset()
+        admissions = []
+
+        def on_admitted(is_admitted):
+            admissions.append(is_admitted)
+            if not is_admitted:
+                self.stop()
+
+        limiter = concurrency_limiter.ConcurrencyLimiter(
+            "dave",
+            initial_limit=1,
+            max_queue_size=10,
+            max_queue_time=0.01)
+        limiter.acquire(on_admitted)
+        limiter.acquire(on_admitted)
+        self.wait()
+
+        self.assertEqual(admissions, [True, False])
+        self.assertEqual(metrics.counter("dave.shed"), 1)
+        self.assertEqual(metrics.get_gauge("dave.queue_time_ms"), 10)
+
+        # the timed out request is no longer waiting
+        limiter.release(True)
+        self.assertEqual(admissions, [True, False])
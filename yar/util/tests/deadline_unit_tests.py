@@ -0,0 +1,112 @@
+"""This module contains unit tests for the util's deadline module."""
+
+import unittest
+
+import mock
+import tornado.httputil
+import tornado.testing
+
+from yar.util import deadline
+from yar.util import metrics
+
+
+class DeadlineTestCase(unittest.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+
+    def test_remaining(self):
+        with mock.patch("time.time", return_value=100.0) as time_patch:
+            d = deadline.Deadline(2.5)
+            self.assertEqual(d.remaining(), 2.5)
+            self.assertEqual(d.timeout(1), 1)
+            self.assertEqual(d.timeout(5), 2.5)
+            # no timeout means only the deadline applies
+            self.assertEqual(d.timeout(0), 2.5)
+            self.assertEqual(d.timeout(None), 2.5)
+            self.assertEqual(d.header_value(), "2500")
+            self.assertFalse(d.is_expired())
+
+            time_patch.return_value = 103.0
+            self.assertEqual(d.remaining(), 0)
+            self.assertEqual(d.timeout(5), 0)
+            self.assertEqual(d.header_value(), "0")
+            self.assertTrue(d.is_expired())
+
+    def test_extend(self):
+        with mock.patch("time.time", return_value=100.0):
+            d = deadline.Deadline(5)
+            d.extend(deadline.Deadline(1))
+            self.assertEqual(d.remaining(), 5)
+            d.extend(deadline.Deadline(10))
+            self.assertEqual(d.remaining(), 10)
+
+    def test_postpone(self):
+        with mock.patch("time.time", return_value=100.0):
+            d = deadline.Deadline(5)
+            d.postpone(2.5)
+            self.assertEqual(d.remaining(), 7.5)
+
+    def test_exceeded(self):
+        d = deadline.Deadline(1)
+        self.assertIsNone(d.exceeded_stage)
+        d.exceeded("nonce_check")
+        d.exceeded("creds_retrieval")
+        self.assertEqual(d.exceeded_stage, "nonce_check")
+        self.assertEqual(metrics.counter("deadline_exceeded.nonce_check"), 1)
+        self.assertEqual(metrics.counter("deadline_exceeded.creds_retrieval"), 0)
+
+    def test_from_headers(self):
+        headers = tornado.httputil.HTTPHeaders()
+        self.assertIsNone(deadline.from_headers(headers))
+
+        for value in ["dave", "-1", "1.5", ""]:
+            headers[deadline.header_name] = value
+            self.assertIsNone(deadline.from_headers(headers), value)
+
+        with mock.patch("time.time", return_value=100.0):
+            headers[deadline.header_name] = "1500"
+            d = deadline.from_headers(headers)
+            self.assertIsNotNone(d)
+            self.assertEqual(d.remaining(), 1.5)
+
+
+class GuardTestCase(tornado.testing.AsyncTestCase):
+
+    def setUp(self):
+        tornado.testing.AsyncTestCase.setUp(self)
+        metrics.reset()
+        self._calls = []
+
+    def _callback(self, *args):
+        self._calls.append(args)
+        self.stop()
+
+    def test_completes_in_time(self):
+        d = deadline.Deadline(5)
+        guard = d.guard("dave", self._callback, False)
+        self.io_loop.add_callback(guard, True)
+        self.wait()
+        self.assertEqual(self._calls, [(True,)])
+        self.assertIsNone(d.exceeded_stage)
+
+    def test_timeout(self):
+        d = deadline.Deadline(0.01)
+        guard = d.guard("dave", self._callback, False, "bindle")
+        self.wait()
+        self.assertEqual(self._calls, [(False, "bindle")])
+        self.assertEqual(d.exceeded_stage, "dave")
+        self.assertEqual(metrics.counter("deadline_exceeded.dave"), 1)
+
+        # the real result arriving after the timeout is ignored
+        guard(True)
+        self.assertEqual(len(self._calls), 1)
+
+    def test_late_result_treated_as_timeout(self):
+        with mock.patch("time.time", return_value=100.0) as time_patch:
+            d = deadline.Deadline(5)
+            guard = d.guard("dave", self._callback, False)
+            time_patch.return_value = 106.0
+            guard(True)
+        self.assertEqual(self._calls, [(False,)])
+        self.assertEqual(d.exceeded_stage, "dave")
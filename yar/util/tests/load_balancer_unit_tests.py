@@ -0,0 +1,102 @@
+"""This module contains unit tests for the util's load_balancer module."""
+
+import unittest
+
+import mock
+
+from yar.util import load_balancer
+from yar.util import metrics
+
+
+class LoadBalancerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+
+    def test_duplicate_addresses(self):
+        lb = load_balancer.LoadBalancer("dave", ["a:1", "b:2", "a:1"])
+        self.assertEqual([upstream.address for upstream in lb.upstreams], ["a:1", "b:2"])
+
+    def test_least_outstanding(self):
+        lb = load_balancer.LoadBalancer(
+            "dave",
+            ["a:1", "b:2", "c:3"],
+            policy=load_balancer.POLICY_LEAST_OUTSTANDING)
+        upstreams = [lb.acquire() for i in range(6)]
+        self.assertEqual(
+            sorted([upstream.address for upstream in upstreams]),
+            ["a:1", "a:1", "b:2", "b:2", "c:3", "c:3"])
+        self.assertEqual(metrics.get_gauge("dave.a:1.in_flight"), 2)
+
+        lb.release(upstreams[0], True, 0.01)
+        self.assertIs(lb.acquire(), upstreams[0])
+
+    def test_p2c(self):
+        lb = load_balancer.LoadBalancer("dave", ["a:1", "b:2"])
+        (a, b) = lb.upstreams
+        a.number_outstanding = 5
+        # with 2 upstreams both are always sampled
+        for i in range(10):
+            self.assertIs(lb.acquire(), b)
+            lb.release(b, True, 0.01)
+
+    def test_exclude(self):
+        lb = load_balancer.LoadBalancer("dave", ["a:1", "b:2"])
+        (a, b) = lb.upstreams
+        self.assertIs(lb.acquire(exclude=[a]), b)
+        self.assertIsNone(lb.acquire(exclude=[a, b]))
+
+    def test_ejection_after_consecutive_failures(self):
+        lb = load_balancer.LoadBalancer("dave", ["a:1", "b:2"], max_failures=2, ejection_time=30)
+        (a, b) = lb.upstreams
+
+        with mock.patch("time.time", return_value=1000):
+            lb.acquire(exclude=[b])
+            lb.release(a, False, 0.01)
+            lb.acquire(exclude=[b])
+            lb.release(a, True, 0.01)
+            lb.acquire(exclude=[b])
+            lb.release(a, False, 0.01)
+            self.assertFalse(a.is_ejected(1000))
+
+            lb.acquire(exclude=[b])
+            lb.release(a, False, 0.01)
+            self.assertTrue(a.is_ejected(1000))
+            self.assertEqual(metrics.counter("dave.a:1.errors"), 3)
+            self.assertEqual(metrics.counter("dave.a:1.ejections"), 1)
+
+            for i in range(10):
+                upstream = lb.acquire()
+                self.assertIs(upstream, b)
+                lb.release(upstream, True, 0.01)
+
+        # ejection time is up so a is back in service
+        with mock.patch("time.time", return_value=1031):
+            self.assertFalse(a.is_ejected(1031))
+            self.assertIs(lb.acquire(exclude=[b]), a)
+
+    def test_ejection_when_slow(self):
+        lb = load_balancer.LoadBalancer("dave", ["a:1", "b:2"], slow_threshold=0.5)
+        (a, b) = lb.upstreams
+
+        lb.acquire(exclude=[b])
+        lb.release(a, True, 0.1)
+        self.assertEqual(metrics.get_gauge("dave.a:1.latency_ms"), 100)
+        self.assertFalse(a.is_ejected(0))
+
+        for i in range(5):
+            if a.is_ejected(0):
+                break
+            lb.acquire(exclude=[b])
+            lb.release(a, True, 2.0)
+        self.assertEqual(metrics.counter("dave.a:1.ejections"), 1)
+
+    def test_all_ejected(self):
+        lb = load_balancer.LoadBalancer("dave", ["a:1", "b:2"], max_failures=1)
+        for upstream in list(lb.upstreams):
+            lb.acquire(exclude=[other for other in lb.upstreams if other is not upstream])
+            lb.release(upstream, False, 0.01)
+
+        # requests are spread across all upstreams rather than failing
+        self.assertIsNotNone(lb.acquire())
+        self.assertEqual(metrics.counter("dave.all_ejected"), 1)
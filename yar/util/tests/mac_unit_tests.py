@@ -7,6 +7,7 @@ import string
 import time
 import uuid
 import hashlib
+import hmac
 import base64
 import json
 import os
@@ -80,6 +81,14 @@ class MACKeyIdentifierTestCase(unittest.TestCase):
         self.assertIsNotNone(mac_key_identifier)
         self.assertEqual(mac_key_identifier, content)
 
+    def test_is_well_formed(self):
+        self.assertTrue(mac.MACKeyIdentifier.is_well_formed(mac.MACKeyIdentifier.generate()))
+        self.assertFalse(mac.MACKeyIdentifier.is_well_formed(None))
+        self.assertFalse(mac.MACKeyIdentifier.is_well_formed(""))
+        self.assertFalse(mac.MACKeyIdentifier.is_well_formed("dave was here"))
+        self.assertFalse(mac.MACKeyIdentifier.is_well_formed(mac.MACKeyIdentifier.generate().upper()))
+        self.assertFalse(mac.MACKeyIdentifier.is_well_formed(mac.MACKeyIdentifier.generate()[1:]))
+
 
 class NonceTestCase(unittest.TestCase):
 
@@ -111,6 +120,17 @@ class TimestampTestCase(unittest.TestCase):
         self.assertIsNotNone(ts)
         self.assertEqual(ts, content)
 
+    def test_generate_uses_coarse_clock(self):
+        with mock.patch("time.time", return_value=1000.1):
+            ts1 = mac.Timestamp.generate()
+        with mock.patch("time.time", return_value=1000.9):
+            ts2 = mac.Timestamp.generate()
+        with mock.patch("time.time", return_value=1001.0):
+            ts3 = mac.Timestamp.generate()
+        self.assertEqual(ts1, "1000")
+        self.assertIs(ts1, ts2)
+        self.assertEqual(ts3, "1001")
+
     def test_conversion_to_int(self):
         value = 45
         ts = mac.Timestamp(value)
@@ -180,6 +200,26 @@ class ExtTestCase(unittest.TestCase):
         self.assertEqual(ext, content)
 
 
+class ExtHashTestCase(unittest.TestCase):
+
+    def test_matches_ext_generate(self):
+        """Verify ```mac.ExtHash``` generates the same ext as
+        ```mac.Ext.generate()``` regardless of how the body is
+        split into chunks."""
+        bodies = [None, "", "dave was here", "x" * 100000]
+        for content_type in [None, "", "application/json"]:
+            for body in bodies:
+                for chunk_size in [1, 7, 65536]:
+                    ext_hash = mac.ExtHash(content_type)
+                    if body is not None:
+                        ext_hash.update("")
+                        for i in range(0, len(body), chunk_size):
+                            ext_hash.update(body[i:i + chunk_size])
+                    ext = ext_hash.ext()
+                    self.assertTrue(isinstance(ext, mac.Ext))
+                    self.assertEqual(ext, mac.Ext.generate(content_type, body))
+
+
 class AuthHeaderValueTestCase(unittest.TestCase):
 
     def _uuid(self):
@@ -336,6 +376,10 @@ class AuthHeaderValueTestCase(unittest.TestCase):
             my_mac)
         self.assertIsNone(mac.AuthHeaderValue.parse(ahv_str))
 
+    def test_parse_with_non_int_timestamp(self):
+        value = 'MAC id="dave", ts="dave", nonce="dave", ext="", mac="dave"'
+        self.assertIsNone(mac.AuthHeaderValue.parse(value))
+
     def test_parse_none(self):
         self.assertIsNone(mac.AuthHeaderValue.parse(None))
 
@@ -393,6 +437,71 @@ class MACTestCase(unittest.TestCase):
             normalized_request_string)
         self.assertFalse(verify_rv)
 
+    def test_compatible_with_keyczar(self):
+        """Confirm MACs generated and verified using ```MACKey.as_hmac()```
+        are the same as MACs generated and verified by keyczar."""
+        mac_key = mac.MACKey.generate()
+        normalized_request_string = "dave was here"
+
+        keyczar_hmac_key = mac_key.as_keyczar_hmac_key()
+        keyczar_mac = mac.MAC(mac._hexify(keyczar_hmac_key.Sign(normalized_request_string)))
+
+        my_mac = mac.MAC.generate(mac_key, mac.MAC.algorithm, normalized_request_string)
+        self.assertEqual(my_mac, keyczar_mac)
+        self.assertTrue(keyczar_mac.verify(mac_key, mac.MAC.algorithm, normalized_request_string))
+        self.assertTrue(keyczar_hmac_key.Verify(normalized_request_string, mac._dehexify(my_mac)))
+
+    def test_precomputed_hmac(self):
+        """Confirm ```MACKey.as_hmac()``` keys the HMAC once
+        and returns independent copies."""
+        mac_key = mac.MACKey.generate()
+        with mock.patch("hmac.new", side_effect=hmac.new) as patched_hmac_new:
+            hmac1 = mac_key.as_hmac()
+            hmac1.update("dave")
+            hmac2 = mac_key.as_hmac()
+            self.assertEqual(patched_hmac_new.call_count, 1)
+        self.assertNotEqual(hmac1.digest(), hmac2.digest())
+        self.assertEqual(mac_key.as_hmac().digest(), hmac2.digest())
+
+    def test_verify_uses_constant_time_compare(self):
+        mac_key = mac.MACKey.generate()
+        my_mac = mac.MAC.generate(mac_key, mac.MAC.algorithm, "dave")
+        with mock.patch("hmac.compare_digest", return_value=True) as patched_compare_digest:
+            self.assertTrue(my_mac.verify(mac_key, mac.MAC.algorithm, "dave"))
+            self.assertEqual(patched_compare_digest.call_count, 1)
+
+    def test_mac_algorithms(self):
+        """Confirm each supported MAC algorithm generates MACs
+        which are verified by the same algorithm and match
+        the standard library's HMAC."""
+        mac_key = mac.MACKey.generate()
+        key_bytes = base64.urlsafe_b64decode(mac_key + "=")
+        normalized_request_string = "dave was here"
+        macs = set()
+        for (mac_algorithm, digestmod) in mac.MAC.digestmods.items():
+            my_mac = mac.MAC.generate(mac_key, mac_algorithm, normalized_request_string)
+            expected_mac = hmac.new(key_bytes, normalized_request_string, digestmod).hexdigest()
+            self.assertEqual(my_mac, expected_mac)
+            self.assertTrue(my_mac.verify(mac_key, mac_algorithm, normalized_request_string))
+            macs.add(my_mac)
+            for other_mac_algorithm in mac.MAC.digestmods:
+                if other_mac_algorithm != mac_algorithm:
+                    self.assertFalse(my_mac.verify(mac_key, other_mac_algorithm, normalized_request_string))
+        self.assertEqual(len(macs), 3)
+        self.assertEqual(len(mac.MAC.generate(mac_key, "hmac-sha-256", "")), 64)
+        self.assertEqual(len(mac.MAC.generate(mac_key, "hmac-sha-512", "")), 128)
+
+    def test_unsupported_mac_algorithm(self):
+        mac_key = mac.MACKey.generate()
+        my_mac = mac.MAC.generate(mac_key, mac.MAC.algorithm, "dave")
+        self.assertFalse(my_mac.verify(mac_key, "hmac-md5", "dave"))
+        with self.assertRaises(ValueError):
+            mac.MAC.generate(mac_key, "hmac-md5", "dave")
+
+    def test_verify_mac_not_hex(self):
+        mac_key = mac.MACKey.generate()
+        self.assertFalse(mac.MAC("dave").verify(mac_key, mac.MAC.algorithm, "dave"))
+
     def test_it(self):
         content_type = "application/json;charset=utf-8"
         body = json.dumps({"dave": "was", "there": "you", "are": 42})
@@ -499,3 +608,37 @@ class TestRequestsAuth(unittest.TestCase):
         self.assertIsNotNone(ahv)
         self.assertEqual(ahv.mac_key_identifier, mac_key_identifier)
         self.assertNotEqual(ahv.ext, "")
+
+    def test_all_good_hmac_sha_256(self):
+        """Verify yar.util.mac.RequestsAuth signs
+        requests using the requested MAC algorithm."""
+
+        mac_key_identifier = mac.MACKeyIdentifier.generate()
+        mac_key = mac.MACKey.generate()
+        mac_algorithm = "hmac-sha-256"
+
+        auth = mac.RequestsAuth(
+            mac_key_identifier,
+            mac_key,
+            mac_algorithm)
+
+        mock_request = mock.Mock()
+        mock_request.headers = {}
+        mock_request.body = None
+        mock_request.method = "GET"
+        mock_request.url = "http://localhost:8000/dave.html"
+
+        auth(mock_request)
+
+        ahv = mac.AuthHeaderValue.parse(mock_request.headers["Authorization"])
+        self.assertIsNotNone(ahv)
+        self.assertEqual(len(ahv.mac), 64)
+        normalized_request_string = mac.NormalizedRequestString.generate(
+            ahv.ts,
+            ahv.nonce,
+            "GET",
+            "/dave.html",
+            "localhost",
+            "8000",
+            ahv.ext)
+        self.assertTrue(ahv.mac.verify(mac_key, mac_algorithm, normalized_request_string))
@@ -0,0 +1,40 @@
+"""This module contains a series of unit tests which
+validate yar/util/metrics.py"""
+
+import unittest
+
+import mock
+
+from yar.util import metrics
+
+
+class MetricsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+
+    def test_counters(self):
+        self.assertEqual(metrics.counter("dave"), 0)
+        metrics.increment("dave")
+        metrics.increment("dave", 41)
+        self.assertEqual(metrics.counter("dave"), 42)
+
+    def test_gauges(self):
+        self.assertIsNone(metrics.get_gauge("dave"))
+        metrics.gauge("dave", 42)
+        metrics.gauge("dave", 43)
+        self.assertEqual(metrics.get_gauge("dave"), 43)
+
+    def test_snapshot_and_reset(self):
+        metrics.increment("c")
+        metrics.gauge("g", 7)
+        self.assertEqual(metrics.snapshot(), {"c": 1, "g": 7})
+        metrics.reset()
+        self.assertEqual(metrics.snapshot(), {})
+
+    def test_log_snapshot(self):
+        metrics.increment("c")
+        metrics.gauge("g", 7)
+        with mock.patch("yar.util.metrics._logger") as logger:
+            metrics.log_snapshot()
+            self.assertEqual(logger.info.call_count, 2)
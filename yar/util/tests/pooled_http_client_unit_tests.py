@@ -0,0 +1,306 @@
+"""This module contains unit tests for the util's pooled_http_client module."""
+
+import gzip
+import httplib
+import os
+import shutil
+import StringIO
+import tempfile
+
+import mock
+import tornado.concurrent
+import tornado.gen
+import tornado.httpclient
+import tornado.httpserver
+import tornado.testing
+import tornado.web
+
+from yar.util import metrics
+from yar.util import pooled_http_client
+from yar.util import transport
+
+
+class _RequestHandler(tornado.web.RequestHandler):
+
+    def get(self):
+        self.write("dave was here")
+
+    def post(self):
+        self.write(self.request.body)
+
+
+class _SlowRequestHandler(tornado.web.RequestHandler):
+    """Doesn't respond until the test says so."""
+
+    @tornado.web.asynchronous
+    def get(self):
+        self.application.slow_request_handlers.append(self)
+
+
+class _CloseRequestHandler(tornado.web.RequestHandler):
+
+    def get(self):
+        self.set_header("Connection", "close")
+        self.write("dave was here")
+
+
+class _GzipRequestHandler(tornado.web.RequestHandler):
+
+    def get(self):
+        buffer = StringIO.StringIO()
+        with gzip.GzipFile(mode="wb", fileobj=buffer) as f:
+            f.write("dave was here")
+        self.set_header("Content-Encoding", "gzip")
+        self.write(buffer.getvalue())
+
+
+class _RedirectRequestHandler(tornado.web.RequestHandler):
+
+    def get(self):
+        self.redirect("/dave")
+
+
+class PooledAsyncHTTPClientTestCase(tornado.testing.AsyncHTTPTestCase):
+
+    def setUp(self):
+        metrics.reset()
+        tornado.testing.AsyncHTTPTestCase.setUp(self)
+        self.client = pooled_http_client.PooledAsyncHTTPClient(self.io_loop, force_instance=True)
+
+    def tearDown(self):
+        self.client.close()
+        tornado.testing.AsyncHTTPTestCase.tearDown(self)
+
+    def get_app(self):
+        handlers = [
+            (r"/slow", _SlowRequestHandler),
+            (r"/close", _CloseRequestHandler),
+            (r"/gzip", _GzipRequestHandler),
+            (r"/redirect", _RedirectRequestHandler),
+            (r".*", _RequestHandler),
+        ]
+        app = tornado.web.Application(handlers=handlers)
+        app.slow_request_handlers = []
+        return app
+
+    def _metric_name(self, name):
+        return "http_connection_pool.localhost:%d.%s" % (self.get_http_port(), name)
+
+    def _fetch(self, path, **kwargs):
+        self.client.fetch(self.get_url(path), self.stop, **kwargs)
+        return self.wait()
+
+    def test_connections_kept_alive(self):
+        for i in range(3):
+            response = self._fetch("/dave")
+            self.assertEqual(response.code, httplib.OK)
+            self.assertEqual(response.body, "dave was here")
+            self.assertIsNone(response.error)
+
+        self.assertEqual(metrics.counter(self._metric_name("connects")), 1)
+        self.assertEqual(metrics.counter(self._metric_name("reuses")), 2)
+        self.assertEqual(metrics.get_gauge(self._metric_name("in_use")), 0)
+        self.assertEqual(metrics.get_gauge(self._metric_name("idle")), 1)
+
+    def test_connection_close(self):
+        for i in range(2):
+            response = self._fetch("/close")
+            self.assertEqual(response.code, httplib.OK)
+            self.assertEqual(response.body, "dave was here")
+
+        self.assertEqual(metrics.counter(self._metric_name("connects")), 2)
+        self.assertEqual(metrics.counter(self._metric_name("reuses")), 0)
+        self.assertEqual(metrics.get_gauge(self._metric_name("idle")), 0)
+
+    def test_idle_timeout(self):
+        with mock.patch.object(pooled_http_client, "idle_timeout", -1):
+            for i in range(2):
+                response = self._fetch("/dave")
+                self.assertEqual(response.code, httplib.OK)
+
+        self.assertEqual(metrics.counter(self._metric_name("connects")), 2)
+        self.assertEqual(metrics.counter(self._metric_name("reuses")), 0)
+
+    def test_post(self):
+        response = self._fetch("/dave", method="POST", body="bindle berry")
+        self.assertEqual(response.code, httplib.OK)
+        self.assertEqual(response.body, "bindle berry")
+
+        @tornado.gen.coroutine
+        def body_producer(write):
+            yield write("bindle ")
+            yield write("berry")
+
+        response = self._fetch("/dave", method="POST", body_producer=body_producer)
+        self.assertEqual(response.code, httplib.OK)
+        self.assertEqual(response.body, "bindle berry")
+
+        self.assertEqual(metrics.counter(self._metric_name("connects")), 1)
+
+    def test_error_response(self):
+        response = self._fetch("/slow", method="POST", body="")
+        self.assertEqual(response.code, httplib.METHOD_NOT_ALLOWED)
+        self.assertIsNotNone(response.error)
+
+        # an error response doesn't stop the connection being reused
+        response = self._fetch("/dave")
+        self.assertEqual(response.code, httplib.OK)
+        self.assertEqual(metrics.counter(self._metric_name("connects")), 1)
+
+    def test_decompress(self):
+        response = self._fetch("/gzip")
+        self.assertEqual(response.code, httplib.OK)
+        self.assertEqual(response.body, "dave was here")
+
+    def test_max_connections_per_upstream(self):
+        with mock.patch.object(pooled_http_client, "max_connections_per_upstream", 1):
+            responses = []
+
+            def on_response(response):
+                responses.append(response)
+                if len(responses) == 2:
+                    self.stop()
+
+            self.client.fetch(self.get_url("/slow"), on_response)
+            self.client.fetch(self.get_url("/dave"), on_response)
+
+            # the 2nd request waits for the 1st request's connection
+            self.io_loop.call_later(0.1, self.stop)
+            self.wait()
+            self.assertEqual(len(responses), 0)
+            self.assertEqual(metrics.counter(self._metric_name("waits")), 1)
+            self.assertEqual(metrics.get_gauge(self._metric_name("in_use")), 1)
+            self.assertEqual(metrics.get_gauge(self._metric_name("waiting")), 1)
+
+            self._app.slow_request_handlers[0].finish("slow")
+            self.wait()
+
+        self.assertEqual([response.body for response in responses], ["slow", "dave was here"])
+        self.assertEqual(metrics.counter(self._metric_name("connects")), 1)
+        self.assertEqual(metrics.get_gauge(self._metric_name("in_use")), 0)
+        self.assertIsNotNone(metrics.get_gauge(self._metric_name("wait_ms")))
+
+    def test_wait_timeout(self):
+        with mock.patch.object(pooled_http_client, "max_connections_per_upstream", 1):
+            responses = []
+
+            def on_response(response):
+                responses.append(response)
+                self.stop()
+
+            self.client.fetch(self.get_url("/slow"), on_response)
+            self.client.fetch(self.get_url("/dave"), on_response, request_timeout=0.1)
+            self.wait()
+
+            self.assertEqual(len(responses), 1)
+            self.assertEqual(responses[0].code, 599)
+            self.assertEqual(metrics.counter(self._metric_name("wait_timeouts")), 1)
+            self.assertEqual(metrics.get_gauge(self._metric_name("waiting")), 0)
+
+            self._app.slow_request_handlers[0].finish("slow")
+            self.wait()
+
+        self.assertEqual(responses[1].body, "slow")
+        self.assertEqual(metrics.get_gauge(self._metric_name("in_use")), 0)
+
+    def test_request_timeout(self):
+        response = self._fetch("/slow", request_timeout=0.1)
+        self.assertEqual(response.code, 599)
+        self.assertEqual(metrics.get_gauge(self._metric_name("in_use")), 0)
+        self.assertEqual(metrics.get_gauge(self._metric_name("idle")), 0)
+
+    def test_expired_request_timeout(self):
+        """A request timeout of 0 or less means the request has
+        already run out of time - not that it has no timeout."""
+        for request_timeout in [0, -1]:
+            response = self._fetch("/dave", request_timeout=request_timeout)
+            self.assertEqual(response.code, 599)
+        self.assertEqual(metrics.counter(self._metric_name("connects")), 0)
+
+    def test_no_default_request_timeout(self):
+        with mock.patch.object(pooled_http_client, "request_timeout", 0):
+            client = pooled_http_client.PooledAsyncHTTPClient(self.io_loop, force_instance=True)
+            client.fetch(self.get_url("/dave"), self.stop)
+            response = self.wait()
+            client.close()
+        self.assertEqual(response.code, httplib.OK)
+
+    def test_kept_alive_connection_closed_by_upstream(self):
+        response = self._fetch("/dave")
+        self.assertEqual(response.code, httplib.OK)
+
+        # simulate the upstream closing the kept alive connection
+        # at the same time as it's reused
+        connection_pool = pooled_http_client.get_connection_pool(
+            "localhost:%d" % self.get_http_port(),
+            self.io_loop)
+        (stream, idle_since) = connection_pool._idle[0]
+        stream.set_close_callback(None)
+        stream.socket.shutdown(2)
+
+        response = self._fetch("/dave")
+        self.assertEqual(response.code, httplib.OK)
+        self.assertEqual(response.body, "dave was here")
+        self.assertEqual(metrics.counter(self._metric_name("connects")), 2)
+
+    def test_connect_error(self):
+        (host, port) = ("127.0.0.1", tornado.testing.bind_unused_port()[1])
+        self.client.fetch("http://%s:%d/dave" % (host, port), self.stop)
+        response = self.wait()
+        self.assertEqual(response.code, 599)
+        metric_name = "http_connection_pool.%s:%d.connect_errors" % (host, port)
+        self.assertEqual(metrics.counter(metric_name), 1)
+
+    def test_unsupported_url(self):
+        self.client.fetch("https://127.0.0.1/dave", self.stop)
+        response = self.wait()
+        self.assertEqual(response.code, 599)
+        self.assertIsInstance(response.error, ValueError)
+
+    def test_redirect_not_followed(self):
+        response = self._fetch("/redirect", follow_redirects=True)
+        self.assertEqual(response.code, 599)
+        self.assertIsInstance(response.error, ValueError)
+
+        response = self._fetch("/redirect", follow_redirects=False)
+        self.assertEqual(response.code, httplib.FOUND)
+        self.assertEqual(response.headers["Location"], "/dave")
+
+    def test_unexpected_error(self):
+        """Confirm the caller's callback is still called, with a 599
+        response, if sending a request fails unexpectedly."""
+        get_connection_pool_patch = mock.Mock(side_effect=RuntimeError("dave"))
+        with mock.patch.object(pooled_http_client, "get_connection_pool", get_connection_pool_patch):
+            response = self._fetch("/dave")
+        self.assertEqual(response.code, 599)
+        self.assertIsInstance(response.error, RuntimeError)
+
+    def test_unix_domain_socket(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            address = os.path.join(temp_dir, "upstream.sock")
+            http_server = tornado.httpserver.HTTPServer(self._app, io_loop=self.io_loop)
+            http_server.add_sockets(transport.bind_sockets(address))
+
+            url = pooled_http_client.url(address, "/dave")
+            self.assertTrue(url.startswith("http+unix://%2F"))
+            for i in range(2):
+                self.client.fetch(url, self.stop)
+                response = self.wait()
+                self.assertEqual(response.code, httplib.OK)
+                self.assertEqual(response.body, "dave was here")
+
+            metric_name = "http_connection_pool.%s.%s" % (address, "connects")
+            self.assertEqual(metrics.counter(metric_name), 1)
+
+            http_server.stop()
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_url(self):
+        self.assertEqual(
+            pooled_http_client.url("127.0.0.1:8070", "/v1.0/creds"),
+            "http://127.0.0.1:8070/v1.0/creds")
+        self.assertEqual(
+            pooled_http_client.url("/var/run/ks.sock", "/v1.0/creds"),
+            "http+unix://%2Fvar%2Frun%2Fks.sock/v1.0/creds")
@@ -0,0 +1,67 @@
+"""This module contains unit tests for the util's transport module."""
+
+import os
+import shutil
+import socket
+import tempfile
+
+import tornado.iostream
+import tornado.tcpserver
+import tornado.testing
+
+from yar.util import transport
+
+
+class _EchoServer(tornado.tcpserver.TCPServer):
+
+    def handle_stream(self, stream, address):
+        stream.read_until("\n", stream.write)
+
+
+class TransportTestCase(tornado.testing.AsyncTestCase):
+
+    def setUp(self):
+        tornado.testing.AsyncTestCase.setUp(self)
+        self._temp_dir = tempfile.mkdtemp()
+        self._server = _EchoServer(io_loop=self.io_loop)
+
+    def tearDown(self):
+        self._server.stop()
+        shutil.rmtree(self._temp_dir)
+        tornado.testing.AsyncTestCase.tearDown(self)
+
+    def test_is_unix_domain_socket(self):
+        self.assertTrue(transport.is_unix_domain_socket("/var/run/ks.sock"))
+        self.assertFalse(transport.is_unix_domain_socket("127.0.0.1:8070"))
+        self.assertFalse(transport.is_unix_domain_socket(("127.0.0.1", 8070)))
+
+    def _test_echo(self, address):
+        self.io_loop.add_future(transport.connect(address, self.io_loop), self.stop)
+        stream = self.wait().result()
+        self.assertIsInstance(stream, tornado.iostream.IOStream)
+
+        stream.write("dave was here\n")
+        stream.read_until("\n", self.stop)
+        self.assertEqual(self.wait(), "dave was here\n")
+        stream.close()
+
+    def test_tcp(self):
+        sockets = transport.bind_sockets(("127.0.0.1", 0))
+        self._server.add_sockets(sockets)
+        port = sockets[0].getsockname()[1]
+        self._test_echo("127.0.0.1:%d" % port)
+
+    def test_unix_domain_socket(self):
+        address = os.path.join(self._temp_dir, "echo.sock")
+        sockets = transport.bind_sockets(address)
+        self.assertEqual(sockets[0].family, socket.AF_UNIX)
+        self.assertEqual(os.stat(address).st_mode & 0o777, transport.unix_domain_socket_mode)
+        self._server.add_sockets(sockets)
+        self._test_echo(address)
+
+    def test_unix_domain_socket_connect_error(self):
+        address = os.path.join(self._temp_dir, "nobody_home.sock")
+        self.io_loop.add_future(transport.connect(address, self.io_loop), self.stop)
+        future = self.wait()
+        with self.assertRaises(tornado.iostream.StreamClosedError):
+            future.result()
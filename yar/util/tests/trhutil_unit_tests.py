@@ -9,6 +9,7 @@ import unittest
 import uuid
 
 import mock
+import tornado.httputil
 import tornado.web
 import tornado.testing
 
@@ -67,6 +68,36 @@ class IsJSONUTF8ContentTypeTestCase(unittest.TestCase):
         self.assertFalse(trhutil._is_json_utf8_content_type("dave"))
 
 
+class RemoveHopByHopHeadersTestCase(unittest.TestCase):
+
+    def test_no_hop_by_hop_headers(self):
+        headers = {"X-Dave": "was here", "Content-Type": "text/plain"}
+        rv = trhutil.remove_hop_by_hop_headers(headers)
+        self.assertEqual(rv, tornado.httputil.HTTPHeaders(headers))
+
+    def test_hop_by_hop_headers_removed(self):
+        headers = tornado.httputil.HTTPHeaders({
+            "X-Dave": "was here",
+            "Connection": "keep-alive, X-Hop",
+            "Keep-Alive": "timeout=5",
+            "Transfer-Encoding": "chunked",
+            "Proxy-Authorization": "BASIC ZGF2ZTo=",
+            "Te": "trailers",
+            "Upgrade": "websocket",
+            "Expect": "100-continue",
+            "X-Hop": "hop",
+        })
+        headers.add("Set-Cookie", "a=1")
+        headers.add("Set-Cookie", "b=2")
+
+        rv = trhutil.remove_hop_by_hop_headers(headers)
+        self.assertEqual(sorted(rv.keys()), ["Set-Cookie", "X-Dave"])
+        self.assertEqual(rv.get_list("Set-Cookie"), ["a=1", "b=2"])
+
+        # the original headers are left alone
+        self.assertIn("Connection", headers)
+
+
 class GetRequestBodyIfExistsTestCase(unittest.TestCase):
 
     def test_no_content_length_or_transfer_encoding_headers_001(self):
@@ -0,0 +1,50 @@
+"""This module hides the details of the two transports yar uses to
+talk between its servers - TCP and unix domain sockets. When servers
+are co-located on the same host unix domain sockets avoid the TCP/IP
+stack entirely. Throughout yar, an address is either a host:port
+string or the (absolute) path of a unix domain socket. Listeners use
+the parsed form of an address which is either a (host, port) tuple
+or a unix domain socket path."""
+
+import logging
+import socket
+
+import tornado.iostream
+import tornado.netutil
+import tornado.tcpclient
+
+_logger = logging.getLogger("UTIL.%s" % __name__)
+
+"""Permissions of the unix domain sockets servers listen on.
+Any user on the host can connect, just as with loopback TCP."""
+unix_domain_socket_mode = 0o666
+
+
+def is_unix_domain_socket(address):
+    """Returns True if ```address``` is the path of a unix
+    domain socket rather than a host:port string or tuple."""
+    return isinstance(address, basestring) and address.startswith("/")
+
+
+def connect(address, io_loop=None):
+    """Async'ly connect to ```address```. Returns a future
+    whose result is a ```tornado.iostream.IOStream```."""
+    if not is_unix_domain_socket(address):
+        (host, port) = address.rsplit(":", 1)
+        tcp_client = tornado.tcpclient.TCPClient(io_loop=io_loop)
+        return tcp_client.connect(host, int(port))
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stream = tornado.iostream.IOStream(sock, io_loop=io_loop)
+    # IOStream.connect() returns the stream when connected
+    return stream.connect(address)
+
+
+def bind_sockets(listen_on):
+    """Returns a list of listening sockets, suitable for
+    ```tornado.tcpserver.TCPServer.add_sockets()```, for
+    ```listen_on``` - the parsed form of an address."""
+    if is_unix_domain_socket(listen_on):
+        return [tornado.netutil.bind_unix_socket(listen_on, mode=unix_domain_socket_mode)]
+    (host, port) = listen_on
+    return tornado.netutil.bind_sockets(port, address=host)
@@ -0,0 +1,235 @@
+"""This module is a benchmark which compares TCP loopback with unix
+domain sockets for each kind of hop between co-located yar servers.
+The auth service to key service, auth service to app service and key
+service to key store hops are all HTTP through
+```pooled_http_client.PooledAsyncHTTPClient``` and are measured
+against a trivial HTTP server, run in a separate process, listening
+on both a TCP port and a unix domain socket. Each HTTP hop is measured
+with kept alive connections and with a new connection per request.
+The auth service to nonce store hop is memcached through a
+```pipelined_memcached.PipelinedClient``` and is only measured when
+memcached is listening on both transports. Run it using something like:
+
+    memcached -p 11211 -s /tmp/memcached.sock -a 0666 &
+    python -m yar.util.transport_benchmark \\
+        --noncestore=127.0.0.1:11211 \\
+        --noncestoresocket=/tmp/memcached.sock
+
+For each hop ```--requests``` requests are issued ```--concurrency```
+at a time and requests per second and latency percentiles reported."""
+
+import logging
+import multiprocessing
+import optparse
+import os
+import shutil
+import tempfile
+import time
+import uuid
+
+import tornado.httpclient
+import tornado.httpserver
+import tornado.ioloop
+import tornado.testing
+import tornado.web
+
+from yar.auth_service.mac import pipelined_memcached
+from yar.util import clparserutil
+from yar.util import pooled_http_client
+from yar.util import transport
+
+
+class _RequestHandler(tornado.web.RequestHandler):
+
+    def get(self):
+        self.write("dave was here")
+
+
+def _serve(tcp_listen_on, unix_domain_socket, is_ready):
+    app = tornado.web.Application(handlers=[(r".*", _RequestHandler)])
+    http_server = tornado.httpserver.HTTPServer(app)
+    http_server.add_sockets(transport.bind_sockets(tcp_listen_on))
+    http_server.add_sockets(transport.bind_sockets(unix_domain_socket))
+    is_ready.set()
+    tornado.ioloop.IOLoop.current().start()
+
+
+class _Benchmark(object):
+    """Keeps ```concurrency``` calls to ```operation``` outstanding
+    until ```number_requests``` have completed. ```operation``` is
+    called with a single callback argument."""
+
+    def __init__(self, operation, concurrency, number_requests):
+        object.__init__(self)
+
+        self._operation = operation
+        self._concurrency = concurrency
+        self._number_requests = number_requests
+
+        self._number_started = 0
+        self._latencies = []
+
+    def run(self):
+        io_loop = tornado.ioloop.IOLoop.current()
+
+        start_time = time.time()
+        for i in range(self._concurrency):
+            self._request()
+        io_loop.start()
+        duration = time.time() - start_time
+
+        self._latencies.sort()
+
+        def percentile(p):
+            return self._latencies[int(len(self._latencies) * p / 100.0)] * 1000.0
+
+        return (
+            len(self._latencies) / duration,
+            percentile(50),
+            percentile(99),
+        )
+
+    def _request(self):
+        if self._number_requests <= self._number_started:
+            return
+        self._number_started += 1
+
+        start_time = time.time()
+
+        def on_done(*args):
+            self._latencies.append(time.time() - start_time)
+            if len(self._latencies) == self._number_requests:
+                tornado.ioloop.IOLoop.current().stop()
+                return
+            self._request()
+
+        self._operation(on_done)
+
+
+def _http_operation(address):
+    url = pooled_http_client.url(address, "/dave")
+    http_client = tornado.httpclient.AsyncHTTPClient()
+
+    def operation(callback):
+        http_client.fetch(url, callback)
+
+    return operation
+
+
+def _memcached_operation(address):
+    client = pipelined_memcached.PipelinedClient(address)
+
+    def operation(callback):
+        client.get(uuid.uuid4().hex, callback)
+
+    return operation
+
+
+class _CommandLineParser(optparse.OptionParser):
+
+    def __init__(self):
+        optparse.OptionParser.__init__(
+            self,
+            "usage: %prog [options]",
+            option_class=clparserutil.Option)
+
+        default = 10000
+        help = "requests per hop - default = %d" % default
+        self.add_option(
+            "--requests",
+            action="store",
+            dest="number_requests",
+            default=default,
+            type=int,
+            help=help)
+
+        default = 1
+        help = "# of concurrent requests - default = %d" % default
+        self.add_option(
+            "--concurrency",
+            action="store",
+            dest="concurrency",
+            default=default,
+            type=int,
+            help=help)
+
+        default = None
+        help = "memcached's host:port - default = %s" % default
+        self.add_option(
+            "--noncestore",
+            action="store",
+            dest="nonce_store",
+            default=default,
+            type="hostcolonport",
+            help=help)
+
+        default = None
+        help = "memcached's unix domain socket - default = %s" % default
+        self.add_option(
+            "--noncestoresocket",
+            action="store",
+            dest="nonce_store_socket",
+            default=default,
+            type="unixdomainsocket",
+            help=help)
+
+
+if __name__ == "__main__":
+    clp = _CommandLineParser()
+    (clo, cla) = clp.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+
+    tornado.httpclient.AsyncHTTPClient.configure(pooled_http_client.PooledAsyncHTTPClient)
+    pooled_http_client.max_connections_per_upstream = clo.concurrency
+
+    temp_dir = tempfile.mkdtemp()
+    unix_domain_socket = os.path.join(temp_dir, "http.sock")
+    (sock, port) = tornado.testing.bind_unused_port()
+    sock.close()
+    tcp_address = "127.0.0.1:%d" % port
+
+    is_ready = multiprocessing.Event()
+    server = multiprocessing.Process(
+        target=_serve,
+        args=(("127.0.0.1", port), unix_domain_socket, is_ready))
+    server.start()
+    is_ready.wait()
+
+    hops = [
+        ("http keep-alive", "tcp", _http_operation(tcp_address), 30),
+        ("http keep-alive", "uds", _http_operation(unix_domain_socket), 30),
+        # an idle timeout < 0 means every request gets a new connection
+        ("http new conn", "tcp", _http_operation(tcp_address), -1),
+        ("http new conn", "uds", _http_operation(unix_domain_socket), -1),
+    ]
+    if clo.nonce_store and clo.nonce_store_socket:
+        hops.extend([
+            ("memcached", "tcp", _memcached_operation(clo.nonce_store), 30),
+            ("memcached", "uds", _memcached_operation(clo.nonce_store_socket), 30),
+        ])
+
+    print "%-16s %9s %10s %10s %10s" % (
+        "hop",
+        "transport",
+        "req/sec",
+        "p50 ms",
+        "p99 ms")
+
+    try:
+        for (name, transport_name, operation, idle_timeout) in hops:
+            pooled_http_client.idle_timeout = idle_timeout
+            # warm up connections so they're not part of the measurement
+            _Benchmark(operation, clo.concurrency, clo.concurrency).run()
+            benchmark = _Benchmark(operation, clo.concurrency, clo.number_requests)
+            (requests_per_second, p50, p99) = benchmark.run()
+            print "%-16s %9s %10.0f %10.3f %10.3f" % (
+                name,
+                transport_name,
+                requests_per_second,
+                p50,
+                p99)
+    finally:
+        server.terminate()
+        server.join()
+        shutil.rmtree(temp_dir)
@@ -7,19 +7,48 @@ import json
 import uuid
 import logging
 
+import tornado.httputil
 import tornado.web
 import jsonschema
 
+"""```_json_content_type_reg_ex``` is used to recognize json content types."""
+_json_content_type_reg_ex = re.compile(
+    r"^\s*application/json\s*$",
+    re.IGNORECASE)
+
+"""```_json_utf8_content_type_reg_ex``` is used to recognize
+utf8 json content types."""
+_json_utf8_content_type_reg_ex = re.compile(
+    r"^\s*application/json;\s+charset\=utf-{0,1}8\s*$",
+    re.IGNORECASE)
+
+"""```_host_reg_ex``` is used to parse the value of the Host HTTP header."""
+_host_reg_ex = re.compile(r"^\s*(?P<host>[^\:]+)(?:\:(?P<port>\d+))?\s*$")
+
+
+"""```_hop_by_hop_header_names``` are the HTTP headers which describe a
+single connection (see http://tools.ietf.org/html/rfc7230#section-6.1)
+and must therefore not be passed along by a proxy. Expect is included
+because a proxy answers it on behalf of the next hop."""
+_hop_by_hop_header_names = [
+    "Connection",
+    "Expect",
+    "Keep-Alive",
+    "Proxy-Authenticate",
+    "Proxy-Authorization",
+    "TE",
+    "Trailer",
+    "Transfer-Encoding",
+    "Upgrade",
+]
+
 
 def _is_json_content_type(content_type):
     """Returns True if ```content_type``` is a valid json
     content type otherwise returns False."""
     if content_type is None:
         return False
-    json_content_type_reg_ex = re.compile(
-        "^\s*application/json\s*$",
-        re.IGNORECASE)
-    if not json_content_type_reg_ex.match(content_type):
+    if not _json_content_type_reg_ex.match(content_type):
         return False
     return True
 
@@ -29,10 +58,7 @@ def _is_json_utf8_content_type(content_type):
     content type otherwise returns False."""
     if content_type is None:
         return False
-    json_utf8_content_type_reg_ex = re.compile(
-        "^\s*application/json;\s+charset\=utf-{0,1}8\s*$",
-        re.IGNORECASE)
-    if not json_utf8_content_type_reg_ex.match(content_type):
+    if not _json_utf8_content_type_reg_ex.match(content_type):
         return False
     return True
 
@@ -46,20 +72,11 @@ def get_request_host_and_port(request,
     if value is None:
         return (host_if_not_found, port_if_not_found)
 
-    reg_ex_pattern = r"^\s*(?P<host>[^\:]+)(?:\:(?P<port>\d+))?\s*$"
-    reg_ex = re.compile(reg_ex_pattern)
-    match = reg_ex.match(value)
+    match = _host_reg_ex.match(value)
     if not match:
         return (host_if_not_found, port_if_not_found)
 
-    assert 0 == match.start()
-    assert len(value) == match.end()
-    num_matches = len(match.groups())
-    assert (1 == num_matches) or (2 == num_matches)
-
     host = match.group("host")
-    assert host
-    assert 0 < len(host)
 
     port = match.group("port")
     if port is None:
@@ -68,6 +85,23 @@ def get_request_host_and_port(request,
     return (host, port)
 
 
+def remove_hop_by_hop_headers(headers):
+    """Return a copy of ```headers``` without any of the hop-by-hop
+    headers in ```_hop_by_hop_header_names``` or any of the headers
+    named in the Connection header."""
+    rv = tornado.httputil.HTTPHeaders(headers)
+
+    names = list(_hop_by_hop_header_names)
+    for value in rv.get_list("Connection"):
+        names.extend([name.strip() for name in value.split(",") if name.strip()])
+
+    for name in names:
+        if name in rv:
+            del rv[name]
+
+    return rv
+
+
 def get_request_body_if_exists(request, value_if_not_found=None):
     """Return the request's body if one exists otherwise
     return ```value_if_not_found```."""